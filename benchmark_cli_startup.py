@@ -0,0 +1,185 @@
+"""
+Measures the startup time of each msp_cli.py subcommand with 'python -X importtime'.
+
+Each subcommand is started with --help, which imports its module and exits once its arguments
+are parsed, so the run measures only what a subcommand pays before doing any work: interpreter
+startup plus imports. The importtime report on stderr is parsed into the total import time,
+the heaviest top-level imports and whether the HTTP stack (requests) was imported. Wall time
+is measured around the subprocess. Times are the best of --repeat runs.
+
+Compare mode flags subcommands whose import time grew by more than --threshold (and by more
+than a small absolute floor) against a stored baseline, and subcommands that started importing
+the HTTP stack. The exit code is 1 if a regression was flagged.
+
+Example usage:
+  python benchmark_cli_startup.py
+  python benchmark_cli_startup.py --repeat 5 --output benchmarks/cli_startup.json
+  python benchmark_cli_startup.py --compare benchmarks/cli_startup.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import msp_cli
+
+
+# Modules that only network subcommands should import
+NETWORK_MODULES = ('requests', 'urllib3')
+
+# Regressions below these absolute deltas are treated as noise
+DEFAULT_THRESHOLD = 0.25
+MIN_IMPORT_MS_DELTA = 20.0
+
+# Number of heaviest top-level imports recorded per subcommand
+DEFAULT_TOP = 5
+
+
+def parse_importtime(stderr):
+    """
+    Return list of (module, self_us, cumulative_us, depth) tuples parsed from the stderr of
+    'python -X importtime', in import order. Top-level imports have depth 0.
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|', 2)
+        depth = (len(module) - len(module.lstrip()) - 1) // 2
+        imports.append((module.strip(), int(self_us), int(cumulative_us), depth))
+    return imports
+
+
+def time_command(args, cwd):
+    """ Run a command with -X importtime and return its wall seconds and parsed imports """
+    start_time = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime'] + args, cwd=cwd,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    wall_seconds = time.perf_counter() - start_time
+    if process.returncode:
+        raise Exception('Command failed (%s): %s\n%s' % (
+            process.returncode, ' '.join(args), process.stderr[-2000:]))
+    return wall_seconds, parse_importtime(process.stderr)
+
+
+def measure_command(name, args, cwd, repeat=1, top=DEFAULT_TOP):
+    """ Return the startup measurements of a command, best of repeat runs """
+    runs = [time_command(args, cwd) for _ in range(repeat)]
+    wall_seconds = min(run[0] for run in runs)
+    imports = min((run[1] for run in runs),
+                  key=lambda run_imports: sum(imp[2] for imp in run_imports if not imp[3]))
+    top_level = [imp for imp in imports if not imp[3]]
+    modules = set(imp[0] for imp in imports)
+    return {
+        'name': name,
+        'wall_ms': round(wall_seconds * 1000, 1),
+        'import_ms': round(sum(imp[2] for imp in top_level) / 1000.0, 1),
+        'num_modules': len(modules),
+        'network': sorted(module for module in NETWORK_MODULES if module in modules),
+        'top_imports': [
+            {'module': imp[0], 'cumulative_ms': round(imp[2] / 1000.0, 1)}
+            for imp in sorted(top_level, key=lambda imp: -imp[2])[:top]],
+    }
+
+
+def run_benchmark(repeat=1, top=DEFAULT_TOP, subcommands=None):
+    """ Return benchmark results dictionary for the bare interpreter, the CLI and subcommands """
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    commands = [('python', ['-c', 'pass']), ('msp_cli', ['msp_cli.py', '--help'])]
+    for name, _, _ in msp_cli.SUBCOMMANDS:
+        if not subcommands or name in subcommands:
+            commands.append((name, ['msp_cli.py', name, '--help']))
+    return {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'commands': [measure_command(name, args, cwd, repeat=repeat, top=top)
+                     for name, args in commands],
+    }
+
+
+def compare_results(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """ Return list of regression messages for results compared to a baseline """
+    regressions = []
+    baseline_commands = {command['name']: command for command in baseline['commands']}
+    for command in results['commands']:
+        baseline_command = baseline_commands.get(command['name'])
+        if baseline_command is None:
+            continue
+        delta = command['import_ms'] - baseline_command['import_ms']
+        if delta > MIN_IMPORT_MS_DELTA and delta > baseline_command['import_ms'] * threshold:
+            regressions.append('%s: import_ms %s -> %s (+%.0f%%)' % (
+                command['name'], baseline_command['import_ms'], command['import_ms'],
+                100.0 * delta / baseline_command['import_ms']
+                if baseline_command['import_ms'] else 100.0))
+        new_network = set(command['network']) - set(baseline_command['network'])
+        if new_network:
+            regressions.append('%s: now imports %s' % (
+                command['name'], ', '.join(sorted(new_network))))
+    return regressions
+
+
+def display_results(results, baseline=None):
+    """ Print a table of startup results, with baseline values when provided """
+    baseline_commands = {}
+    if baseline:
+        baseline_commands = {command['name']: command for command in baseline['commands']}
+    print('%-16s %9s %10s %9s %8s %-9s  %s' % (
+        'command', 'wall_ms', 'import_ms', 'baseline', 'modules', 'network', 'heaviest imports'))
+    for command in results['commands']:
+        baseline_import_ms = baseline_commands.get(command['name'], {}).get('import_ms', '')
+        print('%-16s %9.1f %10.1f %9s %8d %-9s  %s' % (
+            command['name'], command['wall_ms'], command['import_ms'], baseline_import_ms,
+            command['num_modules'], ','.join(command['network']) or '-',
+            ', '.join('%s %.1f' % (imp['module'], imp['cumulative_ms'])
+                      for imp in command['top_imports'])))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the startup of the msp_cli.py '
+                                                 'subcommands with python -X importtime')
+    parser.add_argument('--subcommand', action='append', dest='subcommands',
+                        choices=[name for name, _, _ in msp_cli.SUBCOMMANDS],
+                        help='Only measure this subcommand (repeatable, default: all)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of runs, best time is kept (default: %(default)s)')
+    parser.add_argument('--top', type=int, default=DEFAULT_TOP,
+                        help='Number of heaviest top-level imports to record '
+                             '(default: %(default)s)')
+    parser.add_argument('--output', help='Write results JSON to this file')
+    parser.add_argument('--compare', help='Baseline results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Relative increase flagged as a regression (default: %(default)s)')
+    args = parser.parse_args(argv[1:])
+
+    results = run_benchmark(
+        repeat=max(args.repeat, 1), top=args.top, subcommands=args.subcommands)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+    display_results(results, baseline=baseline)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+            output_file.write('\n')
+
+    if baseline:
+        regressions = compare_results(results, baseline, threshold=args.threshold)
+        if regressions:
+            print('\nREGRESSIONS (threshold: %s):' % args.threshold)
+            for regression in regressions:
+                print('  %s' % regression)
+            return 1
+        print('\nNo regressions (threshold: %s)' % args.threshold)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
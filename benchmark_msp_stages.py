@@ -0,0 +1,245 @@
+"""
+Times each stage of the MSP build (the msp_pipeline stages used by build_ocl_import.py, in build
+order) and records wall time, peak memory and resource counts to JSON.
+
+The suite runs offline: inputs are generated from the bundled fixtures in data/ by
+generate_msp_inputs.py into a temporary directory before the run, at the size of the fixtures or
+at a larger --scale (eg 10 or 100 for scaling curves). Pass --inputs-dir to reuse inputs that
+generate_msp_inputs.py already wrote to a directory.
+
+Each stage is timed in one pass without tracing. A second pass measures each stage with
+tracemalloc (peak KB while the stage runs and KB retained by its result); skip it with --no-memory.
+Shared caches (URL factories, concept registries, categoryCombo COCs) are cleared before each pass.
+
+Compare mode flags stages whose time or peak memory grew by more than --threshold (and by more
+than a small absolute floor, to ignore noise) against a stored baseline, and stages whose resource
+counts changed. The exit code is 1 if a regression was flagged.
+
+Example usage:
+  python benchmark_msp_stages.py --output benchmarks/baseline.json
+  python benchmark_msp_stages.py --compare benchmarks/baseline.json --threshold 0.25
+  python benchmark_msp_stages.py --scale 10 --no-memory --output benchmarks/scale_x10.json
+"""
+import argparse
+import datetime
+import functools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+import msp_graph
+import msp_pipeline
+import msp_records
+import msp_urls
+import generate_msp_inputs
+
+
+# Benchmark configuration
+ORG_ID = 'PEPFAR-MER-BENCHMARK'
+SOURCE_ID = 'MER'
+CANONICAL_URL = 'https://datim.org'
+IHUB_NUM_RUN_SEQUENCES = 3
+IHUB_RULE_PERIOD_END_YEAR = '2021'
+
+# Regressions below these absolute deltas are treated as noise
+DEFAULT_THRESHOLD = 0.2
+MIN_SECONDS_DELTA = 0.05
+MIN_PEAK_KB_DELTA = 1024
+
+
+def count_resources(result):
+    """ Return a resource count for a stage result, eg number of resources or map sources """
+    if result is None:
+        return 0
+    if isinstance(result, msp_graph.CsrRelation):
+        return {'sources': len(result), 'edges': result.num_edges}
+    if isinstance(result, int):
+        return result
+    if isinstance(result, dict) and result and all(
+            isinstance(value, msp_graph.CsrRelation) for value in result.values()):
+        return {'relations': len(result),
+                'edges': sum(relation.num_edges for relation in result.values())}
+    return len(result)
+
+
+def get_config(inputs):
+    """ Return a settings-like configuration for an inputs manifest (see generate_msp_inputs.py) """
+    config = types.SimpleNamespace(
+        MSP_ORG_ID=ORG_ID, MSP_SOURCE_ID=SOURCE_ID, CANONICAL_URL=CANONICAL_URL,
+        IHUB_NUM_RUN_SEQUENCES=IHUB_NUM_RUN_SEQUENCES,
+        IHUB_RULE_PERIOD_END_YEAR=IHUB_RULE_PERIOD_END_YEAR,
+        MSP_INPUT_PERIODS=inputs['MSP_INPUT_PERIODS'], OUTPUT_PERIODS=inputs['MSP_INPUT_PERIODS'])
+    for (key, value) in inputs.items():
+        if key.startswith('FILENAME_'):
+            setattr(config, key, value)
+    return config
+
+
+def get_stages(output_filename):
+    """
+    Return list of (stage name, function) in build order: the msp_pipeline stages followed by
+    writing the import list to output_filename. Each function takes the MspPipeline and
+    returns the stage result.
+    """
+    stages = [(stage_name, functools.partial(msp_pipeline.MspPipeline.get, name=stage_name))
+              for stage_name in msp_pipeline.STAGES]
+    stages.append(('output', lambda pipeline: pipeline.write_import_list(output_filename)))
+    return stages
+
+
+def clear_shared_caches():
+    """ Release the module-level caches shared between stages """
+    msp_urls.clear_url_factories()
+    msp_graph.clear_concept_registries()
+    msp_records.clear_category_combo_cocs()
+
+
+def run_stages(config, stages, trace_memory=False):
+    """ Run all stages once and return dictionary of stage name to measurements """
+    clear_shared_caches()
+    pipeline = msp_pipeline.MspPipeline(config)
+    measurements = {}
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        for stage_name, stage_function in stages:
+            if trace_memory:
+                tracemalloc.reset_peak()
+                start_kb = tracemalloc.get_traced_memory()[0] // 1024
+            start_time = time.perf_counter()
+            result = stage_function(pipeline)
+            stage_measurements = {'seconds': time.perf_counter() - start_time}
+            if trace_memory:
+                current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+                stage_measurements['peak_kb'] = peak_bytes // 1024 - start_kb
+                stage_measurements['retained_kb'] = current_bytes // 1024 - start_kb
+            stage_measurements['count'] = count_resources(result)
+            measurements[stage_name] = stage_measurements
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return measurements
+
+
+def run_benchmark(inputs, repeat=1, trace_memory=True):
+    """
+    Return benchmark results dictionary. Stage time is the best of repeat untraced passes;
+    memory is measured in one extra traced pass.
+    """
+    with tempfile.TemporaryDirectory() as output_dir:
+        config = get_config(inputs)
+        stages = get_stages(os.path.join(output_dir, 'msp_import.json'))
+        timing_passes = [run_stages(config, stages) for _ in range(repeat)]
+        memory_pass = run_stages(config, stages, trace_memory=True) if trace_memory else {}
+    stage_results = []
+    for stage_name, _ in stages:
+        stage_result = {
+            'name': stage_name,
+            'seconds': round(min(timing_pass[stage_name]['seconds']
+                                 for timing_pass in timing_passes), 4),
+            'count': timing_passes[0][stage_name]['count'],
+        }
+        if stage_name in memory_pass:
+            stage_result['peak_kb'] = memory_pass[stage_name]['peak_kb']
+            stage_result['retained_kb'] = memory_pass[stage_name]['retained_kb']
+        stage_results.append(stage_result)
+    return {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'scale': inputs['scale'],
+        'input_counts': inputs['counts'],
+        'total_seconds': round(sum(stage['seconds'] for stage in stage_results), 4),
+        'stages': stage_results,
+    }
+
+
+def compare_results(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """ Return list of regression messages for results compared to a baseline """
+    regressions = []
+    baseline_stages = {stage['name']: stage for stage in baseline['stages']}
+    for stage in results['stages']:
+        baseline_stage = baseline_stages.get(stage['name'])
+        if baseline_stage is None:
+            continue
+        for key, min_delta in [('seconds', MIN_SECONDS_DELTA), ('peak_kb', MIN_PEAK_KB_DELTA)]:
+            if key not in stage or key not in baseline_stage:
+                continue
+            delta = stage[key] - baseline_stage[key]
+            if delta > min_delta and delta > baseline_stage[key] * threshold:
+                regressions.append('%s: %s %s -> %s (+%.0f%%)' % (
+                    stage['name'], key, baseline_stage[key], stage[key],
+                    100.0 * delta / baseline_stage[key] if baseline_stage[key] else 100.0))
+        if stage['count'] != baseline_stage['count']:
+            regressions.append('%s: count %s -> %s' % (
+                stage['name'], baseline_stage['count'], stage['count']))
+    return regressions
+
+
+def display_results(results, baseline=None):
+    """ Print a table of stage results, with baseline values when provided """
+    baseline_stages = {}
+    if baseline:
+        baseline_stages = {stage['name']: stage for stage in baseline['stages']}
+    print('%-50s %9s %9s %11s %11s  %s' % (
+        'stage', 'seconds', 'baseline', 'peak_kb', 'retained_kb', 'count'))
+    for stage in results['stages']:
+        baseline_seconds = baseline_stages.get(stage['name'], {}).get('seconds', '')
+        print('%-50s %9.3f %9s %11s %11s  %s' % (
+            stage['name'], stage['seconds'], baseline_seconds, stage.get('peak_kb', ''),
+            stage.get('retained_kb', ''), stage['count']))
+    print('%-50s %9.3f' % ('TOTAL', results['total_seconds']))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the stages of the MSP build')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='Scale of the generated inputs (default: %(default)s)')
+    parser.add_argument('--inputs-dir',
+                        help='Directory of inputs written by generate_msp_inputs.py')
+    parser.add_argument('--output', help='Write results JSON to this file')
+    parser.add_argument('--compare', help='Baseline results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Relative increase flagged as a regression (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Number of timing passes, best time is kept (default: %(default)s)')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='Skip the tracemalloc pass')
+    args = parser.parse_args(argv[1:])
+
+    with tempfile.TemporaryDirectory() as inputs_dir:
+        if args.inputs_dir:
+            inputs = generate_msp_inputs.load_manifest(args.inputs_dir)
+        else:
+            inputs = generate_msp_inputs.generate_inputs(inputs_dir, scale=args.scale)
+        results = run_benchmark(
+            inputs, repeat=max(args.repeat, 1), trace_memory=not args.no_memory)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+    display_results(results, baseline=baseline)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+            output_file.write('\n')
+
+    if baseline:
+        regressions = compare_results(results, baseline, threshold=args.threshold)
+        if regressions:
+            print('\nREGRESSIONS (threshold: %s):' % args.threshold)
+            for regression in regressions:
+                print('  %s' % regression)
+            return 1
+        print('\nNo regressions (threshold: %s)' % args.threshold)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
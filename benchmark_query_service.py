@@ -0,0 +1,248 @@
+"""
+Load test of the query service (serve_msp.py).
+
+A mix of requests is generated from the query index itself: the COCs of data elements (with and
+without a period), the codelists of data elements, the members of reference indicators for each
+of their periods, concepts and collections. The mix is first timed in this process against the
+index (lookup latency without HTTP) and then sent to the service by --concurrency client
+threads, each keeping its connection open, for --requests requests in total. Latency
+percentiles are reported by endpoint, with the throughput and the number of failed requests.
+
+Without --url, the service is started in this process on a free port from the same index.
+The exit code is 1 if a request failed.
+
+Example usage:
+  python benchmark_query_service.py --import-file output/msp_PEPFAR-MER-FY22_20220131.json
+  python benchmark_query_service.py --index output/msp_PEPFAR-MER-FY22_20220131.index.json.gz \\
+      --url http://127.0.0.1:8765 --concurrency 16 --requests 50000
+  python benchmark_query_service.py --index output/query_index.json.gz --output bench.json
+"""
+import argparse
+import concurrent.futures
+import datetime
+import http.client
+import json
+import platform
+import random
+import sys
+import threading
+import time
+import urllib.parse
+import msp_query
+import serve_msp
+
+
+# Default load
+DEFAULT_REQUESTS = 10000
+DEFAULT_CONCURRENCY = 8
+
+# Maximum number of keys of each kind sampled for the request mix
+MAX_KEYS_PER_KIND = 200
+
+# Latency percentiles reported
+PERCENTILES = (50, 90, 99)
+
+
+def get_request_paths(query_index, seed=0):
+    """ Return list of (endpoint, path) requests sampled from the concepts of the index """
+    rng = random.Random(seed)
+    data_elements = []
+    ref_indicators = []
+    for concept in query_index.concepts.values():
+        if concept['concept_class'] == msp_query.CONCEPT_CLASS_DATA_ELEMENT:
+            data_elements.append(concept)
+        elif concept['concept_class'] == msp_query.CONCEPT_CLASS_REF_INDICATOR:
+            ref_indicators.append(concept)
+    data_elements = rng.sample(data_elements, min(len(data_elements), MAX_KEYS_PER_KIND))
+    ref_indicators = rng.sample(ref_indicators, min(len(ref_indicators), MAX_KEYS_PER_KIND))
+    periods = sorted(set(period for concept in ref_indicators for period in concept['periods']))
+
+    requests = [('stats', '/stats')]
+    for concept in data_elements:
+        key = urllib.parse.quote(concept['id'], safe='')
+        requests.append(('concept', '/concepts/%s' % key))
+        requests.append(('de_cocs', '/data-elements/%s/cocs' % key))
+        requests.append(('concept_codelists', '/concepts/%s/codelists' % key))
+        if periods:
+            period = rng.choice(periods)
+            requests.append(('de_cocs', '/data-elements/%s/cocs?period=%s' % (key, period)))
+            requests.append(('concept_codelists', '/concepts/%s/codelists?period=%s' % (
+                key, period)))
+    for concept in ref_indicators:
+        key = urllib.parse.quote(concept['id'], safe='')
+        requests.append(('ref_indicator_members', '/reference-indicators/%s/members' % key))
+        for period in concept['periods']:
+            requests.append(('ref_indicator_members',
+                             '/reference-indicators/%s/members?period=%s' % (key, period)))
+    for collection_id in sorted(query_index.collections)[:MAX_KEYS_PER_KIND]:
+        requests.append(('collection', '/collections/%s' % urllib.parse.quote(
+            collection_id, safe='')))
+    return requests
+
+
+def get_percentiles(latencies):
+    """ Return dictionary of latency percentiles in milliseconds of a list of seconds """
+    if not latencies:
+        return {}
+    latencies = sorted(latencies)
+    percentiles = {}
+    for percentile in PERCENTILES:
+        index = min(len(latencies) - 1, int(len(latencies) * percentile / 100.0))
+        percentiles['p%s_ms' % percentile] = round(latencies[index] * 1000, 3)
+    percentiles['max_ms'] = round(latencies[-1] * 1000, 3)
+    return percentiles
+
+
+def time_lookups(query_index, requests):
+    """ Return the latencies of answering each request from the index, without HTTP """
+    latencies = {}
+    for endpoint, path in requests:
+        start_time = time.perf_counter()
+        status, _ = serve_msp.route_request(query_index, path)
+        latencies.setdefault(endpoint, []).append(time.perf_counter() - start_time)
+        if status != 200:
+            raise Exception('Lookup failed (%s): %s' % (status, path))
+    return latencies
+
+
+def run_client(host, port, requests, num_requests, offset):
+    """ Send num_requests requests of the mix over one connection, return latencies, failures """
+    latencies = {}
+    failures = 0
+    connection = http.client.HTTPConnection(host, port)
+    try:
+        for request_number in range(num_requests):
+            endpoint, path = requests[(offset + request_number) % len(requests)]
+            start_time = time.perf_counter()
+            try:
+                connection.request('GET', path)
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    failures += 1
+            except (http.client.HTTPException, OSError):
+                failures += 1
+                connection.close()
+                connection = http.client.HTTPConnection(host, port)
+                continue
+            latencies.setdefault(endpoint, []).append(time.perf_counter() - start_time)
+    finally:
+        connection.close()
+    return latencies, failures
+
+
+def run_load(host, port, requests, num_requests, concurrency):
+    """ Return (latencies by endpoint, failures, elapsed seconds) of the load """
+    latencies = {}
+    failures = 0
+    requests_per_client = [num_requests // concurrency + (1 if i < num_requests % concurrency
+                                                          else 0)
+                           for i in range(concurrency)]
+    start_time = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(run_client, host, port, requests, client_requests,
+                                   client_number * len(requests) // concurrency)
+                   for client_number, client_requests in enumerate(requests_per_client)]
+        for future in futures:
+            client_latencies, client_failures = future.result()
+            failures += client_failures
+            for endpoint, endpoint_latencies in client_latencies.items():
+                latencies.setdefault(endpoint, []).extend(endpoint_latencies)
+    return latencies, failures, time.perf_counter() - start_time
+
+
+def summarize_latencies(latencies):
+    """ Return list of percentile dictionaries by endpoint and for all requests """
+    summary = [dict(endpoint=endpoint, requests=len(endpoint_latencies),
+                    **get_percentiles(endpoint_latencies))
+               for endpoint, endpoint_latencies in sorted(latencies.items())]
+    all_latencies = [latency for endpoint_latencies in latencies.values()
+                     for latency in endpoint_latencies]
+    summary.append(dict(endpoint='all', requests=len(all_latencies),
+                        **get_percentiles(all_latencies)))
+    return summary
+
+
+def display_summary(title, summary):
+    """ Print a table of latency percentiles by endpoint """
+    print(title)
+    print('  %-22s %9s %9s %9s %9s %9s' % (
+        'endpoint', 'requests', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms'))
+    for row in summary:
+        print('  %-22s %9d %9.3f %9.3f %9.3f %9.3f' % (
+            row['endpoint'], row['requests'], row['p50_ms'], row['p90_ms'], row['p99_ms'],
+            row['max_ms']))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Load test the MSP query service')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--import-file', help='OCL-formatted JSON lines import file')
+    source.add_argument('--index', help='Query index saved with serve_msp.py --save-index')
+    parser.add_argument('--url',
+                        help='URL of a running service, eg http://127.0.0.1:8765 (default: '
+                             'start the service in this process)')
+    parser.add_argument('--requests', type=int, default=DEFAULT_REQUESTS,
+                        help='Number of HTTP requests (default: %(default)s)')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help='Number of client threads (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the request sample (default: %(default)s)')
+    parser.add_argument('--output', help='Write results JSON to this file')
+    args = parser.parse_args(argv[1:])
+
+    start_time = time.perf_counter()
+    if args.index:
+        query_index = msp_query.QueryIndex.load(args.index)
+    else:
+        query_index = msp_query.load_import_file(args.import_file)
+    load_seconds = time.perf_counter() - start_time
+    requests = get_request_paths(query_index, seed=args.seed)
+    print('Index loaded in %.2f seconds, %s distinct requests' % (load_seconds, len(requests)))
+
+    lookup_summary = summarize_latencies(time_lookups(query_index, requests))
+    display_summary('In-process lookups:', lookup_summary)
+
+    server = None
+    if args.url:
+        url = urllib.parse.urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        server = serve_msp.make_server(query_index, port=0)
+        host, port = server.server_address[:2]
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        latencies, failures, elapsed_seconds = run_load(
+            host, port, requests, args.requests, max(args.concurrency, 1))
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+    http_summary = summarize_latencies(latencies)
+    display_summary('HTTP requests (concurrency %s):' % args.concurrency, http_summary)
+    print('%s requests in %.2f seconds: %.0f requests/second, %s failed' % (
+        args.requests, elapsed_seconds, args.requests / elapsed_seconds, failures))
+
+    if args.output:
+        results = {
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'index_load_seconds': round(load_seconds, 3),
+            'num_distinct_requests': len(requests),
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'elapsed_seconds': round(elapsed_seconds, 3),
+            'requests_per_second': round(args.requests / elapsed_seconds, 1),
+            'failures': failures,
+            'lookups': lookup_summary,
+            'http': http_summary,
+        }
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+            output_file.write('\n')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,114 @@
+"""
+Benchmarks msp_urls.OclUrlFactory against formatting concept and mapping URLs inline.
+
+The workload replays the URL traffic of the codelist and fiscal year reference builders using the
+DE and COC UIDs in a bundled codelist export: every (DE, COC) row produces a DE URL, a COC URL
+and a DE-COC mapping URL, once per output period. Results for each approach:
+    * allocated blocks -- number of memory blocks still alive holding the generated URLs
+    * retained KB -- memory held by the generated URLs
+    * peak KB -- tracemalloc peak while generating them
+    * seconds -- wall time (measured separately, without tracemalloc)
+
+Example usage:
+  python benchmark_url_factory.py
+  python benchmark_url_factory.py data/codelist_collections_with_exports_FY16_21_20210309.json 7
+"""
+import sys
+import time
+import tracemalloc
+import msp
+import msp_codelist_store
+import msp_urls
+
+
+DEFAULT_CODELIST_FILENAME = 'data/codelist_collections_with_exports_FY16_21_20210309.json'
+DEFAULT_NUM_PERIODS = 7
+ORG_ID = 'PEPFAR-MER-FY22'
+SOURCE_ID = 'MER'
+
+
+def load_de_coc_pairs(filename):
+    """ Return list of (DE UID, COC UID) for every row of every codelist in the export """
+    codelists = msp.load_codelist_collections_with_exports_from_file(
+        filename=filename, org_id=ORG_ID)
+    pairs = []
+    for codelist in codelists:
+        pairs += list(msp_codelist_store.iter_row_values(
+            msp.get_codelist_rows(codelist), msp.DATIM_CODELIST_COLUMN_DATA_ELEMENT_UID,
+            msp.DATIM_CODELIST_COLUMN_COC_UID))
+    return pairs
+
+
+def generate_urls_inline(pairs, num_periods):
+    """ Build URLs the way msp.py did before the URL factory: formatted on every use """
+    urls = []
+    for _ in range(num_periods):
+        for de_uid, coc_uid in pairs:
+            de_url = '/orgs/%s/sources/%s/concepts/%s/' % (ORG_ID, SOURCE_ID, de_uid)
+            coc_url = '/orgs/%s/sources/%s/concepts/%s/' % (ORG_ID, SOURCE_ID, coc_uid)
+            mapping_id = msp.MSP_MAP_ID_FORMAT_DE_COC % (
+                de_url[de_url[:-1].rfind('/') + 1:-1], coc_url[coc_url[:-1].rfind('/') + 1:-1])
+            urls.append(de_url)
+            urls.append(coc_url)
+            urls.append('/orgs/%s/sources/%s/mappings/%s/' % (ORG_ID, SOURCE_ID, mapping_id))
+    return urls
+
+
+def generate_urls_with_factory(pairs, num_periods):
+    """ Build the same URLs using the shared, interning URL factory """
+    url_factory = msp_urls.get_url_factory(ORG_ID, SOURCE_ID)
+    urls = []
+    for _ in range(num_periods):
+        for de_uid, coc_uid in pairs:
+            de_url = url_factory.concept_url(de_uid)
+            coc_url = url_factory.concept_url(coc_uid)
+            urls.append(de_url)
+            urls.append(coc_url)
+            urls.append(url_factory.mapping_url_for_concepts(
+                msp.MSP_MAP_ID_FORMAT_DE_COC, de_url, coc_url))
+    return urls
+
+
+def run_benchmark(generate_urls, pairs, num_periods):
+    """ Return dictionary of allocation, memory and timing results for one approach """
+    msp_urls.clear_url_factories()
+    start_time = time.perf_counter()
+    generate_urls(pairs, num_periods)
+    elapsed_seconds = time.perf_counter() - start_time
+
+    msp_urls.clear_url_factories()
+    tracemalloc.start()
+    baseline = tracemalloc.take_snapshot()
+    urls = generate_urls(pairs, num_periods)
+    snapshot = tracemalloc.take_snapshot()
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    stats = snapshot.compare_to(baseline, 'filename')
+    return {
+        'urls': len(urls),
+        'unique_urls': len(set(urls)),
+        'allocated_blocks': sum(stat.count_diff for stat in stats),
+        'retained_kb': sum(stat.size_diff for stat in stats) // 1024,
+        'peak_kb': peak_bytes // 1024,
+        'seconds': round(elapsed_seconds, 3),
+    }
+
+
+def main(argv):
+    filename = argv[1] if len(argv) > 1 else DEFAULT_CODELIST_FILENAME
+    num_periods = int(argv[2]) if len(argv) > 2 else DEFAULT_NUM_PERIODS
+    pairs = load_de_coc_pairs(filename)
+    print('URL benchmark: %s codelist rows x %s periods (%s)' % (len(pairs), num_periods, filename))
+    print('  %-10s %10s %12s %17s %12s %10s %9s' % (
+        'approach', 'urls', 'unique_urls', 'allocated_blocks', 'retained_kb', 'peak_kb',
+        'seconds'))
+    for approach, generate_urls in [('inline', generate_urls_inline),
+                                    ('factory', generate_urls_with_factory)]:
+        result = run_benchmark(generate_urls, pairs, num_periods)
+        print('  %-10s %10s %12s %17s %12s %10s %9s' % (
+            approach, result['urls'], result['unique_urls'], result['allocated_blocks'],
+            result['retained_kb'], result['peak_kb'], result['seconds']))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,39 @@
+"""
+Checks the referential integrity of an OCL-formatted JSON lines import file before it is
+uploaded: every owner, repository, mapping from/to concept URL and reference expression must
+be defined earlier in the file (see msp_integrity.py). Issues are reported by category and the
+exit code is 1 if there are any.
+
+Example usage:
+  python check_import_integrity.py output/msp_PEPFAR-MER-FY22_20220131.json
+  python msp_cli.py check output/msp_PEPFAR-MER-FY22_20220131.json.gz --external-prefix /orgs/CIEL/
+"""
+import argparse
+import json
+import sys
+import msp_integrity
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Check the referential integrity of an OCL-formatted JSON lines file')
+    parser.add_argument('filename', help='OCL-formatted JSON lines file, optionally compressed')
+    parser.add_argument('--external-prefix', action='append', dest='external_prefixes',
+                        default=[], help='URLs with this prefix are assumed to exist in OCL, '
+                                         'eg /orgs/CIEL/ (repeatable)')
+    parser.add_argument('--max-issues', type=int, default=10,
+                        help='Issues displayed per category (default: %(default)s)')
+    parser.add_argument('--output', help='Write the full report as JSON to this file')
+    args = parser.parse_args(argv[1:])
+
+    report = msp_integrity.check_integrity(
+        msp_integrity.iter_import_file(args.filename), external_prefixes=args.external_prefixes)
+    msp_integrity.display_report(report, max_issues=args.max_issues)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    return 1 if report['num_issues'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
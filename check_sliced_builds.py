@@ -0,0 +1,144 @@
+"""
+Checks that period-sliced builds are consistent with the full build:
+* the import list of each slice must have no more referential integrity issues (see
+  msp_integrity.py) than the import list of the full build, eg no mappings from reference
+  indicators or to data elements that were left out of the slice
+* the MER_FY## collections of the periods of each slice must have the same members as in the
+  full build. The only members a slice may leave out are mappings from concepts that are not in
+  its import list, ie from the reference indicators of other periods.
+The import lists are built in memory and no file is written. The reference indicators and COCs
+are loaded once and shared by the builds (see msp_pipeline.SHARED_STAGES).
+
+The exit code is 1 if a slice fails one of the checks.
+
+Example usage:
+  python check_sliced_builds.py
+  python msp_cli.py check-slices --period FY21 --period FY22
+  python msp_cli.py check-slices --period FY21,FY22 --structured-dataset MER
+"""
+import argparse
+import sys
+import settings
+import msp
+import msp_integrity
+import msp_pipeline
+import msp_records
+import msp_urls
+
+
+# Members displayed per collection of a failing slice
+MAX_MEMBERS_DISPLAYED = 10
+
+
+def get_collection_members(import_list):
+    """ Return dictionary of collection ID and the set of URLs its references refer to """
+    collection_members = {}
+    for resource in import_list:
+        resource = msp_records.to_ocl_json(resource)
+        if resource.get('type') == 'Reference':
+            collection_members.setdefault(resource['collection'], set()).update(
+                msp_integrity.normalize_expression(expression)
+                for expression in (resource.get('data') or {}).get('expressions', []))
+    return collection_members
+
+
+def get_mapping_from_concept_urls(import_list):
+    """ Return dictionary of mapping URL and from_concept_url of the mappings of an import list """
+    mapping_from_concept_urls = {}
+    for resource in import_list:
+        resource = msp_records.to_ocl_json(resource)
+        if resource.get('type') == 'Mapping':
+            mapping_from_concept_urls[msp_urls.get_resource_url(resource)] = (
+                resource.get('from_concept_url'))
+    return mapping_from_concept_urls
+
+
+def compare_collection_members(pipeline, full_members, full_mapping_from_concept_urls):
+    """
+    Return dictionary of collection ID and (missing URLs, extra URLs) of the MER_FY##
+    collections of a sliced pipeline that differ from the full build. Mappings from concepts
+    that are not in the import list of the slice are not reported as missing.
+    """
+    slice_urls = set(msp_urls.get_resource_url(msp_records.to_ocl_json(resource))
+                     for resource in pipeline.import_list)
+    slice_members = get_collection_members(pipeline.import_list)
+    differences = {}
+    for period in pipeline.output_periods:
+        collection_id = msp.COLLECTION_NAME_MER_FULL % period
+        members = slice_members.get(collection_id, set())
+        expected_members = full_members.get(collection_id, set())
+        missing_urls = sorted(
+            url for url in expected_members - members
+            if not (url in full_mapping_from_concept_urls and
+                    full_mapping_from_concept_urls[url] not in slice_urls))
+        extra_urls = sorted(members - expected_members)
+        if missing_urls or extra_urls:
+            differences[collection_id] = (missing_urls, extra_urls)
+    return differences
+
+
+def display_differences(differences):
+    """ Print the members of collections that differ from the full build """
+    for collection_id, (missing_urls, extra_urls) in sorted(differences.items()):
+        print('  %s: %s members missing, %s extra members' % (
+            collection_id, len(missing_urls), len(extra_urls)))
+        for label, urls in (('missing', missing_urls), ('extra', extra_urls)):
+            for url in urls[:MAX_MEMBERS_DISPLAYED]:
+                print('    %s %s' % (label, url))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Check that period-sliced builds are consistent with the full build')
+    parser.add_argument('--period', action='append', dest='slices',
+                        help='Period slice to check, eg FY22 or FY21,FY22 (repeatable, default: '
+                             'each of OUTPUT_PERIODS)')
+    parser.add_argument('--structured-dataset', action='append', dest='structured_datasets',
+                        help='Only build data elements of this structured dataset, eg MER '
+                             '(repeatable)')
+    parser.add_argument('--max-issues', type=int, default=10,
+                        help='Issues displayed per category of a failing slice '
+                             '(default: %(default)s)')
+    args = parser.parse_args(argv[1:])
+    slices = [[period.strip() for period in periods.split(',') if period.strip()]
+              for periods in args.slices or settings.OUTPUT_PERIODS]
+
+    shared_products = {}
+    full_pipeline = msp_pipeline.MspPipeline(
+        settings, structured_datasets=args.structured_datasets,
+        shared_products=shared_products)
+    full_counts = full_pipeline.integrity_report['counts']
+    full_members = get_collection_members(full_pipeline.import_list)
+    full_mapping_from_concept_urls = get_mapping_from_concept_urls(full_pipeline.import_list)
+    print('Full build: %s resources, %s integrity issues' % (
+        len(full_pipeline.import_list), full_pipeline.integrity_report['num_issues']))
+    del full_pipeline
+
+    num_failed = 0
+    for periods in slices:
+        pipeline = msp_pipeline.MspPipeline(
+            settings, periods=periods, structured_datasets=args.structured_datasets,
+            shared_products=shared_products)
+        report = pipeline.integrity_report
+        new_issues = dict((category, count - full_counts.get(category, 0))
+                          for category, count in report['counts'].items()
+                          if count > full_counts.get(category, 0))
+        differences = compare_collection_members(
+            pipeline, full_members, full_mapping_from_concept_urls)
+        print('Slice %s: %s resources, %s integrity issues%s, %s' % (
+            ','.join(periods), len(pipeline.import_list), report['num_issues'],
+            ' (%s more than the full build)' % sum(new_issues.values()) if new_issues else '',
+            '%s MER_FY## collections differ from the full build' % len(differences)
+            if differences else 'MER_FY## collections match the full build'))
+        if new_issues:
+            msp_integrity.display_report(report, max_issues=args.max_issues)
+        if differences:
+            display_differences(differences)
+        if new_issues or differences:
+            num_failed += 1
+    print('%s of %s slices are inconsistent with the full build' % (num_failed, len(slices)))
+    return 1 if num_failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,77 @@
+"""
+Reports what changed between dated DATIM and codelist snapshots in data/, eg
+codelist_collections_with_exports_FY16_21_20210106.json and ..._20210309.json: the added,
+removed and modified codelists, codelist rows, data elements, COCs, indicators and datasets
+(see msp_snapshots.py). The change set is also written as JSON, including the periods to pass
+to build_ocl_import.py --period for a selective rebuild.
+
+Snapshots are given as old/new filename pairs, or with --dates, which pairs every snapshot in
+--data-dir that has the old date with the one that has the new date.
+
+Example usage:
+  python diff_snapshots.py data/datim_dataSets_20210106.csv data/datim_dataSets_20210309.csv
+  python msp_cli.py diff-snapshots --dates 20210106 20210309 --output output/changes.json
+"""
+import argparse
+import json
+import os
+import sys
+import msp_io
+import msp_snapshots
+
+
+def find_snapshot_pairs(data_dir, old_date, new_date):
+    """
+    Return list of (old filename, new filename) for the snapshots in data_dir whose filename
+    contains old_date and for which the same filename with new_date exists
+    """
+    pairs = []
+    for filename in sorted(os.listdir(data_dir)):
+        if old_date not in filename or msp_snapshots.get_snapshot_kind(filename) is None:
+            continue
+        new_filename = filename.replace(old_date, new_date)
+        if os.path.exists(os.path.join(data_dir, new_filename)):
+            pairs.append((os.path.join(data_dir, filename), os.path.join(data_dir, new_filename)))
+    return pairs
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Diff dated DATIM and codelist snapshots')
+    parser.add_argument('filenames', nargs='*',
+                        help='Old and new snapshot filenames, in pairs')
+    parser.add_argument('--dates', nargs=2, metavar=('OLD_DATE', 'NEW_DATE'),
+                        help='Compare all snapshots in --data-dir with these dates, eg '
+                             '20210106 20210309')
+    parser.add_argument('--data-dir', default='data',
+                        help='Snapshot directory for --dates (default: %(default)s)')
+    parser.add_argument('--output', help='Write the change set as JSON to this file')
+    parser.add_argument('--max-items', type=int, default=10,
+                        help='Changed items displayed per type (default: %(default)s)')
+    args = parser.parse_args(argv[1:])
+
+    if len(args.filenames) % 2:
+        parser.error('Snapshot filenames must be given in old/new pairs')
+    pairs = list(zip(args.filenames[::2], args.filenames[1::2]))
+    if args.dates:
+        pairs += find_snapshot_pairs(args.data_dir, *args.dates)
+    if not pairs:
+        parser.error('No snapshots to compare')
+
+    try:
+        snapshot_diffs = [msp_snapshots.diff_snapshot_files(old_filename, new_filename)
+                          for old_filename, new_filename in pairs]
+    except ValueError as e:
+        print(e)
+        return 1
+    change_set = msp_snapshots.get_change_set(snapshot_diffs)
+    msp_snapshots.display_change_set(change_set, max_items=args.max_items)
+    if args.output:
+        with msp_io.open_file(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(change_set, output_file, indent=2)
+        print('Change set written to: %s' % args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
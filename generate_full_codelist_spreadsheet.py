@@ -3,34 +3,63 @@ Script to convert all codelists saved to an export file (using save_codelists_to
 to a single CSV designed to be more human-readable. The CSV file contains these columns:
 dataset, dataelement, shortname, code, dataelementuid, dataelementdesc, categoryoptioncombo,
 categoryoptioncombocode, categoryoptioncombouid
+
+The codelists are streamed (see msp_codelist_csv.py): rows are written as they are read unless
+--sort or --shard-dir is used. --dedup keeps the first row of each data element/COC pair across
+codelists and --shard-dir writes one CSV per dataset, in parallel, instead of a single CSV.
+
+Example usage:
+  python generate_full_codelist_spreadsheet.py --output all_datim_codelists_20220413.csv.gz
+  python msp_cli.py spreadsheet --dedup --sort --shard-dir output/codelists --compress gzip
 """
-import json
-import unicodecsv as csv
+import argparse
+import sys
 import settings
-import msp
+import msp_codelist_csv
+import msp_io
 
 
 OUTPUT_FILENAME = 'all_datim_codelists_20220413.csv'
 
 
-# Load codelists
-codelists = msp.load_codelist_collections_with_exports_from_file(
-    filename=settings.FILENAME_DATIM_CODELISTS_WITH_EXPORT,
-    org_id=settings.MSP_ORG_ID)
+def main(argv):
+    parser = argparse.ArgumentParser(description='Export all DATIM codelists to a single CSV')
+    parser.add_argument('--input', default=settings.FILENAME_DATIM_CODELISTS_WITH_EXPORT,
+                        help='Codelists with their exports, saved by save_codelists_to_file.py '
+                             '(default: %s)' % settings.FILENAME_DATIM_CODELISTS_WITH_EXPORT)
+    parser.add_argument('--output', default=OUTPUT_FILENAME,
+                        help='CSV filename to write, compressed if it ends with .gz, .xz, '
+                             '.bz2 or .zip (default: %s)' % OUTPUT_FILENAME)
+    parser.add_argument('--dedup', action='store_true',
+                        help='Only keep the first row of each data element/COC pair')
+    parser.add_argument('--sort', action='store_true',
+                        help='Sort the rows by dataset, data element and COC')
+    parser.add_argument('--shard-dir',
+                        help='Write one CSV per dataset to this directory instead of --output')
+    parser.add_argument('--compress', choices=sorted(set(msp_io.COMPRESSION_EXTENSIONS.values())),
+                        help='Compression of the --shard-dir CSVs')
+    parser.add_argument('--workers', type=int, default=msp_codelist_csv.DEFAULT_SHARD_WORKERS,
+                        help='Number of threads writing --shard-dir CSVs (default: %(default)s)')
+    args = parser.parse_args(argv[1:])
 
-# Build the headers array
-csv_headers = []
-for header in codelists[0]['extras']['dhis2_codelist']['listGrid']['headers']:
-    csv_headers.append(header['column'])
+    counts = {}
+    rows = msp_codelist_csv.iter_codelist_rows(args.input, dedup=args.dedup, counts=counts)
+    if args.shard_dir:
+        shards = msp_codelist_csv.write_shards(
+            rows, args.shard_dir, sort=args.sort, compression=args.compress,
+            workers=args.workers)
+        num_rows = sum(num_shard_rows for _, num_shard_rows in shards.values())
+        output_summary = '%s dataset CSVs in %s' % (len(shards), args.shard_dir)
+    else:
+        if args.sort:
+            rows = sorted(rows, key=msp_codelist_csv.get_sort_key)
+        num_rows = msp_codelist_csv.write_csv(args.output, rows)
+        output_summary = args.output
 
-# print json.dumps(csv_headers, indent=4)
+    print('%s rows of %s codelists (%s duplicate rows skipped) saved to: %s' % (
+        num_rows, counts['codelists'], counts['duplicate_rows'], output_summary))
+    return 0
 
-with open(OUTPUT_FILENAME, 'w') as csvfile:
-    writer = csv.writer(csvfile, delimiter=',', quotechar='"')
-    writer.writerow(csv_headers)
-    for codelist in codelists:
-        for codelist_row in codelist['extras']['dhis2_codelist']['listGrid']['rows']:
-            # print json.dumps(codelist_row)
-            writer.writerow(codelist_row)
 
-print("Codelists saved to: %s" % (OUTPUT_FILENAME))
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,367 @@
+"""
+Generates schema-consistent synthetic MSP inputs at a configurable scale factor, for measuring how
+each stage of the build scales beyond the size of the bundled fixtures.
+
+The generator replicates the bundled fixtures in data/ (codelist collections export, reference
+indicator CSVs and DATIM indicator export) "scale" times. Copy 0 is the original data. Every later
+copy gets deterministic 11-character UIDs and prefixed indicator codes (eg "S2_TX_CURR"), applied
+consistently across all files, so codelist rows, DATIM indicator formulas and reference indicator
+lookups of a copy resolve to resources of the same copy. A fractional scale (eg 2.5) adds a
+partial last copy. data/ has no DATIM data element, COC or iHUB exports, so these are derived from
+the generated codelist rows:
+    * dataElements -- one per DE UID in the codelist rows, with a derived categoryCombo per
+      distinct set of COCs
+    * categoryOptionCombos -- one per COC UID in the codelist rows
+    * iHUB -- one derived data element for every Nth data element, summing its source DE
+
+All files are written to output_dir along with msp_inputs.json, a manifest that lists the
+filenames using the same names as settings.py (eg FILENAME_DATIM_DATA_ELEMENTS) plus the input
+periods and resource counts. The outputs load with the existing msp.load_* functions.
+
+Example usage:
+  python generate_msp_inputs.py output/synthetic_x10 10
+  python generate_msp_inputs.py output/synthetic_x100 100
+"""
+import csv
+import hashlib
+import json
+import os
+import re
+import sys
+import msp
+
+
+# Bundled fixtures used as the seed for every copy
+SEED_PERIODS = ['FY16', 'FY17', 'FY18', 'FY19', 'FY20', 'FY21']
+SEED_FILENAME_MER_REFERENCE_INDICATORS = [
+    'data/mer_indicators_%s_20220310.csv' % period for period in SEED_PERIODS]
+SEED_FILENAME_DATIM_CODELISTS_WITH_EXPORT = (
+    'data/codelist_collections_with_exports_FY16_21_20210309.json')
+SEED_FILENAME_DATIM_INDICATORS = 'data/datim_indicators_20210106.json'
+
+# Output filenames
+MANIFEST_FILENAME = 'msp_inputs.json'
+OUTPUT_FILENAME_DATA_ELEMENTS = 'datim_dataElements.json'
+OUTPUT_FILENAME_COCS = 'datim_categoryOptionCombos.json'
+OUTPUT_FILENAME_INDICATORS = 'datim_indicators.json'
+OUTPUT_FILENAME_CODELISTS_WITH_EXPORT = 'codelist_collections_with_exports.json'
+OUTPUT_FILENAME_MER_REFERENCE_INDICATORS = 'mer_indicators_%s.csv'
+OUTPUT_FILENAME_IHUB = 'ihub_mer_metadata.csv'
+
+# Every Nth data element gets an iHUB derived data element
+IHUB_DERIVED_DE_INTERVAL = 10
+
+# Matches the DE.COC(.mechanism) UID term of a DHIS2 indicator formula, eg #{qkV2omqh4Xw.HTuFk...}
+REGEX_FORMULA_TERM = re.compile(r'#\{([^}]*)\}')
+
+
+def get_copy_prefix(copy_index):
+    """ Return the code prefix for the specified copy, eg 'S2_' (copy 0 has no prefix) """
+    return 'S%s_' % copy_index if copy_index else ''
+
+
+def get_synthetic_uid(uid, copy_index):
+    """ Return a deterministic 11-character DHIS2-style UID for uid in the specified copy """
+    if not copy_index or not uid:
+        return uid
+    return get_derived_uid(uid, str(copy_index))
+
+
+def get_derived_uid(*values):
+    """ Return a deterministic 11-character DHIS2-style UID derived from the specified values """
+    return 'S' + hashlib.md5('|'.join(values).encode('utf-8')).hexdigest()[:10]
+
+
+def get_synthetic_text(text, copy_index, indicator_codes):
+    """
+    Return text (a name or code) for the specified copy: the copy prefix is added to the text and
+    to every whitespace-separated token that is a reference indicator code, so that the
+    prefix and embedded code lookups in msp.lookup_reference_indicator_code match the copy's
+    reference indicators.
+    """
+    if not copy_index or not text:
+        return text
+    prefix = get_copy_prefix(copy_index)
+    return prefix + ' '.join(
+        prefix + token if token in indicator_codes else token for token in text.split(' '))
+
+
+def get_synthetic_formula(formula, copy_index):
+    """ Return DHIS2 indicator formula with each UID in its #{...} terms replaced for the copy """
+    if not copy_index or not formula:
+        return formula
+    return REGEX_FORMULA_TERM.sub(lambda match: '#{%s}' % '.'.join(
+        get_synthetic_uid(uid, copy_index) for uid in match.group(1).split('.')), formula)
+
+
+def iter_copies(items, scale):
+    """
+    Yield (copy_index, item) for each copy of items. A fractional scale adds a partial copy with
+    the first (fraction x number of items) items.
+    """
+    num_full_copies = int(scale)
+    for copy_index in range(num_full_copies):
+        for item in items:
+            yield copy_index, item
+    num_partial_items = int(round((scale - num_full_copies) * len(items)))
+    for item in items[:num_partial_items]:
+        yield num_full_copies, item
+
+
+def write_json_list(filename, resources, key=None):
+    """
+    Stream resources to filename as a JSON list, wrapped in an object with the specified key
+    (eg {"dataElements": [...]}) if key is provided. Returns the number of resources written.
+    """
+    count = 0
+    with open(filename, 'w') as output_file:
+        output_file.write('{"%s": [' % key if key else '[')
+        for resource in resources:
+            if count:
+                output_file.write(',\n')
+            output_file.write(json.dumps(resource))
+            count += 1
+        output_file.write(']}' if key else ']')
+    return count
+
+
+def build_synthetic_codelist(codelist, copy_index, indicator_codes):
+    """ Return the copy of a codelist collection, including its DHIS2 codelist export """
+    if not copy_index:
+        return codelist
+    codelist_uid = codelist['external_id']
+    synthetic_codelist_uid = get_synthetic_uid(codelist_uid, copy_index)
+    synthetic_codelist = dict(codelist)
+    synthetic_codelist['external_id'] = synthetic_codelist_uid
+    for key in ['id', 'short_code', 'name', 'full_name']:
+        if key in codelist:
+            synthetic_codelist[key] = get_copy_prefix(copy_index) + codelist[key]
+    extras = dict(codelist['extras'])
+    if 'dhis2_codelist_url' in extras:
+        extras['dhis2_codelist_url'] = extras['dhis2_codelist_url'].replace(
+            codelist_uid, synthetic_codelist_uid)
+    dhis2_codelist = dict(extras['dhis2_codelist'])
+    list_grid = dict(dhis2_codelist['listGrid'])
+    list_grid['rows'] = [
+        build_synthetic_codelist_row(row, copy_index, indicator_codes)
+        for row in list_grid['rows']]
+    dhis2_codelist['listGrid'] = list_grid
+    extras['dhis2_codelist'] = dhis2_codelist
+    synthetic_codelist['extras'] = extras
+    return synthetic_codelist
+
+
+def build_synthetic_codelist_row(row, copy_index, indicator_codes):
+    """ Return the copy of a codelist export row """
+    synthetic_row = list(row)
+    synthetic_row[msp.DATIM_CODELIST_COLUMN_DATASET] = get_copy_prefix(copy_index) + row[
+        msp.DATIM_CODELIST_COLUMN_DATASET]
+    for column_index in [msp.DATIM_CODELIST_COLUMN_DATA_ELEMENT_NAME,
+                         msp.DATIM_CODELIST_COLUMN_DATA_ELEMENT_SHORT_NAME,
+                         msp.DATIM_CODELIST_COLUMN_DATA_ELEMENT_CODE]:
+        synthetic_row[column_index] = get_synthetic_text(
+            row[column_index], copy_index, indicator_codes)
+    for column_index in [msp.DATIM_CODELIST_COLUMN_DATA_ELEMENT_UID,
+                         msp.DATIM_CODELIST_COLUMN_COC_UID]:
+        synthetic_row[column_index] = get_synthetic_uid(row[column_index], copy_index)
+    if row[msp.DATIM_CODELIST_COLUMN_COC_CODE] == row[msp.DATIM_CODELIST_COLUMN_COC_UID]:
+        synthetic_row[msp.DATIM_CODELIST_COLUMN_COC_CODE] = synthetic_row[
+            msp.DATIM_CODELIST_COLUMN_COC_UID]
+    return synthetic_row
+
+
+def build_synthetic_indicator(indicator_raw, copy_index, indicator_codes):
+    """ Return the copy of a raw DHIS2 indicator, with the UIDs in its formulas replaced """
+    if not copy_index:
+        return indicator_raw
+    synthetic_indicator = dict(indicator_raw)
+    synthetic_indicator['id'] = get_synthetic_uid(indicator_raw['id'], copy_index)
+    for key in ['name', 'shortName', 'displayName', 'displayShortName']:
+        if key in indicator_raw:
+            synthetic_indicator[key] = get_synthetic_text(
+                indicator_raw[key], copy_index, indicator_codes)
+    for key in ['numerator', 'denominator']:
+        if key in indicator_raw:
+            synthetic_indicator[key] = get_synthetic_formula(indicator_raw[key], copy_index)
+    return synthetic_indicator
+
+
+def build_raw_data_elements(de_rows, coc_names):
+    """
+    Return list of raw DHIS2 data elements from dictionary of DE UID to DE attributes (with a
+    '__cocs' list of COC UIDs). DEs with the same set of COCs share one derived categoryCombo.
+    """
+    category_combos = {}
+    raw_des = []
+    for de_raw in de_rows.values():
+        coc_uids = tuple(sorted(de_raw.pop('__cocs')))
+        if coc_uids not in category_combos:
+            category_combos[coc_uids] = {
+                'id': get_derived_uid('categoryCombo', *coc_uids),
+                'name': 'Synthetic categoryCombo %s' % (len(category_combos) + 1),
+                'categoryOptionCombos': [
+                    {'id': coc_uid, 'name': coc_names[coc_uid]} for coc_uid in coc_uids],
+            }
+        de_raw['categoryCombo'] = category_combos[coc_uids]
+        raw_des.append(de_raw)
+    return raw_des
+
+
+def iter_ihub_rows(raw_des):
+    """ Yield iHUB rows for a derived data element for every Nth raw DATIM data element """
+    for de_raw in raw_des[::IHUB_DERIVED_DE_INTERVAL]:
+        dde_uid = get_derived_uid('ihub', de_raw['id'])
+        result_target = 'TARGET' if 'target' in de_raw['name'].lower() else 'RESULT'
+        for coc in de_raw['categoryCombo']['categoryOptionCombos']:
+            yield {
+                msp.IHUB_COLUMN_INDICATOR: de_raw['name'].split(' ')[0],
+                msp.IHUB_COLUMN_SOURCE_KEY: msp.IHUB_COLUMN_SOURCE_KEY_IHUB,
+                msp.IHUB_COLUMN_DISAGGREGATE: 'Age/Sex',
+                msp.IHUB_COLUMN_STANDARDIZED_DISAGGREGATE: 'Age/Sex',
+                msp.IHUB_COLUMN_DERIVED_DATA_ELEMENT_UID: dde_uid,
+                msp.IHUB_COLUMN_DERIVED_DATA_ELEMENT_NAME: '%s Derived' % de_raw['name'],
+                msp.IHUB_COLUMN_DERIVED_COC_UID: coc['id'],
+                msp.IHUB_COLUMN_DERIVED_COC_NAME: coc['name'],
+                msp.IHUB_COLUMN_SOURCE_DATA_ELEMENT_UID: de_raw['id'],
+                msp.IHUB_COLUMN_SOURCE_DATA_ELEMENT_NAME: de_raw['name'],
+                msp.IHUB_COLUMN_SOURCE_DISAGGREGATE: 'Age/Sex',
+                msp.IHUB_COLUMN_SOURCE_COC_UID: coc['id'],
+                msp.IHUB_COLUMN_SOURCE_COC_NAME: coc['name'],
+                msp.IHUB_COLUMN_RULE_BEGIN_PERIOD: '20180000',
+                msp.IHUB_COLUMN_RULE_END_PERIOD: '99990400',
+                msp.IHUB_COLUMN_ADD_OR_SUBTRACT: '+',
+                msp.IHUB_COLUMN_RESULT_TARGET: result_target,
+                msp.IHUB_COLUMN_RUN_SEQUENCE: '1',
+                msp.IHUB_COLUMN_RULE_ID: get_derived_uid('rule', dde_uid, coc['id']),
+            }
+
+
+def generate_inputs(output_dir, scale=1.0, verbosity=0):
+    """
+    Write synthetic MSP inputs at the specified scale to output_dir and return the manifest
+    dictionary (also written to output_dir/msp_inputs.json).
+    """
+    if scale <= 0:
+        raise ValueError('Scale must be greater than 0, %s given' % scale)
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    manifest = {
+        'scale': scale,
+        'MSP_INPUT_PERIODS': list(SEED_PERIODS),
+        'FILENAME_MER_REFERENCE_INDICATORS': [],
+        'FILENAME_DATIM_CODELISTS_WITH_EXPORT': os.path.join(
+            output_dir, OUTPUT_FILENAME_CODELISTS_WITH_EXPORT),
+        'FILENAME_DATIM_DATA_ELEMENTS': os.path.join(output_dir, OUTPUT_FILENAME_DATA_ELEMENTS),
+        'FILENAME_DATIM_COCS': os.path.join(output_dir, OUTPUT_FILENAME_COCS),
+        'FILENAME_DATIM_INDICATORS': os.path.join(output_dir, OUTPUT_FILENAME_INDICATORS),
+        'FILENAME_IHUB': os.path.join(output_dir, OUTPUT_FILENAME_IHUB),
+        'counts': {},
+    }
+
+    # Reference indicators, one CSV per period
+    indicator_codes = set()
+    num_ref_indicators = 0
+    for period, seed_filename in zip(SEED_PERIODS, SEED_FILENAME_MER_REFERENCE_INDICATORS):
+        with open(seed_filename) as input_file:
+            reader = csv.DictReader(input_file)
+            fieldnames = reader.fieldnames
+            seed_rows = list(reader)
+        indicator_codes.update(row['id'] for row in seed_rows)
+        filename = os.path.join(output_dir, OUTPUT_FILENAME_MER_REFERENCE_INDICATORS % period)
+        with open(filename, 'w', newline='') as output_file:
+            writer = csv.DictWriter(output_file, fieldnames=fieldnames)
+            writer.writeheader()
+            for copy_index, row in iter_copies(seed_rows, scale):
+                synthetic_row = dict(row)
+                synthetic_row['id'] = get_copy_prefix(copy_index) + row['id']
+                synthetic_row['name'] = get_copy_prefix(copy_index) + row['name']
+                writer.writerow(synthetic_row)
+                num_ref_indicators += 1
+        manifest['FILENAME_MER_REFERENCE_INDICATORS'].append(filename)
+    manifest['counts']['ref_indicators'] = num_ref_indicators
+
+    # Codelist collections with exports -- collect DEs and COCs from the rows as they're written
+    with open(SEED_FILENAME_DATIM_CODELISTS_WITH_EXPORT) as input_file:
+        seed_codelists = json.load(input_file)
+    de_rows = {}
+    coc_names = {}
+
+    def iter_codelists():
+        for copy_index, codelist in iter_copies(seed_codelists, scale):
+            synthetic_codelist = build_synthetic_codelist(codelist, copy_index, indicator_codes)
+            for row in synthetic_codelist['extras']['dhis2_codelist']['listGrid']['rows']:
+                de_uid = row[msp.DATIM_CODELIST_COLUMN_DATA_ELEMENT_UID]
+                coc_uid = row[msp.DATIM_CODELIST_COLUMN_COC_UID]
+                if de_uid not in de_rows:
+                    de_rows[de_uid] = {
+                        'id': de_uid,
+                        'name': row[msp.DATIM_CODELIST_COLUMN_DATA_ELEMENT_NAME],
+                        'shortName': row[msp.DATIM_CODELIST_COLUMN_DATA_ELEMENT_SHORT_NAME],
+                        'code': row[msp.DATIM_CODELIST_COLUMN_DATA_ELEMENT_CODE],
+                        'description': row[msp.DATIM_CODELIST_COLUMN_DATA_ELEMENT_DESCRIPTION],
+                        'domainType': 'AGGREGATE',
+                        'valueType': 'NUMBER',
+                        'aggregationType': 'SUM',
+                        '__cocs': set(),
+                    }
+                de_rows[de_uid]['__cocs'].add(coc_uid)
+                coc_names[coc_uid] = row[msp.DATIM_CODELIST_COLUMN_COC_NAME]
+            yield synthetic_codelist
+
+    manifest['counts']['codelists'] = write_json_list(
+        manifest['FILENAME_DATIM_CODELISTS_WITH_EXPORT'], iter_codelists())
+    del seed_codelists
+
+    # Data elements, COCs and iHUB derived data elements
+    raw_des = build_raw_data_elements(de_rows, coc_names)
+    manifest['counts']['data_elements'] = write_json_list(
+        manifest['FILENAME_DATIM_DATA_ELEMENTS'], raw_des, key='dataElements')
+    manifest['counts']['cocs'] = write_json_list(
+        manifest['FILENAME_DATIM_COCS'],
+        ({'id': coc_uid, 'name': coc_name} for coc_uid, coc_name in coc_names.items()),
+        key='categoryOptionCombos')
+    num_ihub_rows = 0
+    with open(manifest['FILENAME_IHUB'], 'w', newline='') as output_file:
+        writer = csv.DictWriter(output_file, fieldnames=msp.IHUB_COLUMNS)
+        writer.writeheader()
+        for ihub_row in iter_ihub_rows(raw_des):
+            writer.writerow(ihub_row)
+            num_ihub_rows += 1
+    manifest['counts']['ihub_rows'] = num_ihub_rows
+    del raw_des
+
+    # DATIM indicators
+    with open(SEED_FILENAME_DATIM_INDICATORS) as input_file:
+        seed_indicators = json.load(input_file)['indicators']
+    manifest['counts']['indicators'] = write_json_list(
+        manifest['FILENAME_DATIM_INDICATORS'],
+        (build_synthetic_indicator(indicator_raw, copy_index, indicator_codes)
+         for copy_index, indicator_raw in iter_copies(seed_indicators, scale)),
+        key='indicators')
+
+    with open(os.path.join(output_dir, MANIFEST_FILENAME), 'w') as output_file:
+        json.dump(manifest, output_file, indent=2)
+        output_file.write('\n')
+    if verbosity:
+        print('Synthetic MSP inputs at scale %s written to %s:' % (scale, output_dir))
+        for key, count in manifest['counts'].items():
+            print('  %s: %s' % (key, count))
+    return manifest
+
+
+def load_manifest(inputs_dir):
+    """ Return the manifest dictionary of synthetic inputs previously written to inputs_dir """
+    with open(os.path.join(inputs_dir, MANIFEST_FILENAME)) as input_file:
+        return json.load(input_file)
+
+
+def main(argv):
+    if len(argv) < 2:
+        print('Usage: python generate_msp_inputs.py OUTPUT_DIR [SCALE]')
+        return 1
+    generate_inputs(argv[1], scale=float(argv[2]) if len(argv) > 2 else 1.0, verbosity=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -1,23 +1,42 @@
 """
 Retrieves bulk import results and saves to file
+
+Example usage:
+  python get_ocl_bulk_import_results.py <task_id>
+  python msp_cli.py results <task_id> --output logs/import_results.json
 """
+import argparse
+import sys
 import ocldev.oclfleximporter
 import settings
 
 
 # Settings
-results_filename = 'logs/import_results.json'
-api_url_root = 'https://api.staging.openconceptlab.org'
-ocl_api_token = settings.OCL_API_TOKEN
-
-# Bulk Import Task ID
-task_id = ''
-
-# Fetch results and write to file
-results = ocldev.oclfleximporter.OclBulkImporter.get_bulk_import_results(
-    task_id=task_id, api_url_root=api_url_root, api_token=ocl_api_token)
-if results and results_filename:
-    with open(results_filename, 'w') as ofile:
+RESULTS_FILENAME = 'logs/import_results.json'
+API_URL_ROOT = 'https://api.staging.openconceptlab.org'
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Retrieve OCL bulk import results')
+    parser.add_argument('task_id', help='Bulk import task ID')
+    parser.add_argument('--output', default=RESULTS_FILENAME,
+                        help='Results filename (default: %s)' % RESULTS_FILENAME)
+    parser.add_argument('--api-url-root', default=API_URL_ROOT,
+                        help='OCL API URL root (default: %s)' % API_URL_ROOT)
+    args = parser.parse_args(argv[1:])
+
+    # Fetch results and write to file
+    results = ocldev.oclfleximporter.OclBulkImporter.get_bulk_import_results(
+        task_id=args.task_id, api_url_root=args.api_url_root, api_token=settings.OCL_API_TOKEN)
+    if not results:
+        print('No bulk import results for task "%s"' % args.task_id)
+        return 1
+    with open(args.output, 'w') as ofile:
         ofile.write(results.to_json())
-        print 'Bulk import results for task "%s" successfully written to %s' % (
-        	task_id, results_filename)
+    print('Bulk import results for task "%s" successfully written to %s' % (
+        args.task_id, args.output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
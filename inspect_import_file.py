@@ -0,0 +1,60 @@
+"""
+Fetches resources from an OCL-formatted JSON lines file (eg an import file written by
+build_ocl_import.py) by type, ID, owner, repository or URL without loading the whole file.
+Uses the sidecar line index of the file, which is built and saved on first use if the build
+did not write it (see msp_index.py).
+
+Example usage:
+  python inspect_import_file.py output/msp_PEPFAR-MER-FY22_20220131.json --counts
+  python inspect_import_file.py output/msp_PEPFAR-MER-FY22_20220131.json --type Concept --id TX_CURR
+  python msp_cli.py inspect output/msp_PEPFAR-MER-FY22_20220131.json \\
+      --url /orgs/PEPFAR-MER-FY22/collections/MER-R-COMMUNITY-BASED/
+  python msp_cli.py inspect output/msp_PEPFAR-MER-FY22_20220131.json --type Mapping --limit 10
+"""
+import argparse
+import json
+import sys
+import msp_index
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Fetch resources from an OCL-formatted JSON lines file using its line index')
+    parser.add_argument('filename', help='OCL-formatted JSON lines file')
+    parser.add_argument('--type', dest='resource_type', help='Resource type, eg Concept')
+    parser.add_argument('--id', dest='resource_id', help='Resource ID')
+    parser.add_argument('--owner', help='Owner ID')
+    parser.add_argument('--repo', help='Source or collection ID')
+    parser.add_argument('--url', help='Relative OCL URL, eg /orgs/PEPFAR/sources/MER/')
+    parser.add_argument('--offset', type=int, default=0,
+                        help='Skip this many matching resources (default: %(default)s)')
+    parser.add_argument('--limit', type=int, default=0,
+                        help='Output at most this many resources (default: all)')
+    parser.add_argument('--counts', action='store_true',
+                        help='Output the number of resources of each type instead')
+    parser.add_argument('--line-numbers', action='store_true',
+                        help='Prefix each resource with its line number in the file')
+    args = parser.parse_args(argv[1:])
+
+    with msp_index.JsonLinesReader(args.filename) as reader:
+        if args.counts:
+            print(json.dumps(reader.index.count_by_type(), indent=4))
+            return 0
+        if args.url:
+            position = reader.index.get_positions_by_url().get(args.url)
+            positions = [] if position is None else [position]
+        else:
+            positions = reader.index.find(
+                resource_type=args.resource_type, resource_id=args.resource_id,
+                owner=args.owner, repo=args.repo)
+        positions = positions[args.offset:args.offset + args.limit if args.limit else None]
+        for position in positions:
+            line = reader.get_line(position).decode('utf-8')
+            if args.line_numbers:
+                line = '%s: %s' % (reader.get_line_number(position), line)
+            print(line)
+    return 0 if positions else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,81 @@
+"""
+Stores, lists, verifies and restores import files in a content-addressed artifact store (see
+msp_artifacts.py). A build adds its import file to the store with build_ocl_import.py
+--artifact-store; existing import files are added with 'store', after which they can be deleted
+and reconstructed with 'restore' when needed.
+
+Example usage:
+  python manage_artifacts.py --store-dir output/artifacts store output/msp_*.json
+  python msp_cli.py artifacts list
+  python msp_cli.py artifacts verify msp_PEPFAR-MER-FY22_20220131.json
+  python msp_cli.py artifacts restore msp_PEPFAR-MER-FY22_20220131.json --output /tmp/msp.json.gz
+"""
+import argparse
+import os
+import sys
+import msp_artifacts
+
+
+# Settings
+STORE_DIR = 'output/artifacts'
+
+
+def display_header(header):
+    """ Print a one-line summary of a manifest header """
+    print('%s: %s lines, %s bytes, %s new objects (%s bytes), created %s' % (
+        header['name'], header['num_lines'], header['size'], header['num_new_objects'],
+        header['new_size'], header['created']))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Manage the content-addressed store of MSP import files')
+    parser.add_argument('--store-dir', default=STORE_DIR,
+                        help='Artifact store directory (default: %(default)s)')
+    subparsers = parser.add_subparsers(dest='action', required=True)
+    store_parser = subparsers.add_parser('store', help='Add import files to the store')
+    store_parser.add_argument('filenames', nargs='+', help='OCL-formatted JSON lines files')
+    subparsers.add_parser('list', help='List the stored import files')
+    verify_parser = subparsers.add_parser(
+        'verify', help='Check that stored import files can be reconstructed')
+    verify_parser.add_argument('names', nargs='*', help='Manifest names (default: all)')
+    restore_parser = subparsers.add_parser('restore', help='Reconstruct a stored import file')
+    restore_parser.add_argument('name', help='Manifest name, eg msp_PEPFAR-MER-FY22_20220131.json')
+    restore_parser.add_argument('--output',
+                                help='Output filename, compressed based on its extension '
+                                     '(default: the name in the current directory)')
+    args = parser.parse_args(argv[1:])
+
+    with msp_artifacts.ArtifactStore(args.store_dir) as store:
+        if args.action == 'store':
+            for filename in args.filenames:
+                display_header(msp_artifacts.store_file(store, filename))
+        elif args.action == 'list':
+            headers = store.list_manifests()
+            for header in headers:
+                display_header(header)
+            print('%s import files, %s bytes; %s objects stored in %s bytes' % (
+                len(headers), sum(header['size'] for header in headers), len(store),
+                sum(os.path.getsize(os.path.join(store.packs_dir, filename))
+                    for filename in os.listdir(store.packs_dir))))
+        elif args.action == 'verify':
+            names = args.names or [header['name'] for header in store.list_manifests()]
+            num_errors = 0
+            for name in names:
+                try:
+                    num_lines = sum(1 for _ in msp_artifacts.iter_manifest_lines(store, name))
+                except (KeyError, ValueError) as e:
+                    print('%s: ERROR %s' % (name, e))
+                    num_errors += 1
+                    continue
+                print('%s: OK, %s lines' % (name, num_lines))
+            return 1 if num_errors else 0
+        elif args.action == 'restore':
+            output_filename = args.output or args.name
+            msp_artifacts.restore_file(store, args.name, output_filename)
+            print('Restored %s to: %s' % (args.name, output_filename))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
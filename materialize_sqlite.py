@@ -0,0 +1,61 @@
+"""
+Writes the concepts, mappings, collections and reference expressions of an OCL-formatted JSON
+lines import file to an indexed SQLite database (see msp_sqlite.py). Rows are upserted by
+identity, so successive builds can be loaded into the same database; --prune leaves only the
+rows of the loaded file.
+
+Example usage:
+  python materialize_sqlite.py output/msp_PEPFAR-MER-FY22_20220131.json
+  python msp_cli.py sqlite output/msp_PEPFAR-MER-FY22_20220131.json --database output/msp.sqlite
+  sqlite3 output/msp.sqlite "SELECT period, COUNT(*) FROM resource_periods GROUP BY period"
+"""
+import argparse
+import os
+import sys
+import time
+import msp_integrity
+import msp_io
+import msp_sqlite
+
+
+def get_database_filename(import_filename):
+    """ Return the default database filename of an import file, eg msp_X_20220131.sqlite """
+    root, extension = os.path.splitext(msp_io.split_zip_member(import_filename)[0])
+    if extension.lower() in msp_io.COMPRESSION_EXTENSIONS:
+        root = os.path.splitext(root)[0]
+    return root + '.sqlite'
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Write an OCL-formatted JSON lines file to an indexed SQLite database')
+    parser.add_argument('filename', help='OCL-formatted JSON lines import file')
+    parser.add_argument('--database',
+                        help='SQLite database filename (default: import filename with a '
+                             '.sqlite extension)')
+    parser.add_argument('--label', help='Label of the build (default: import filename)')
+    parser.add_argument('--prune', action='store_true',
+                        help='Delete the rows of previous loads that are not in this file')
+    parser.add_argument('--batch-size', type=int, default=msp_sqlite.DEFAULT_BATCH_SIZE,
+                        help='Resources written per batch (default: %(default)s)')
+    args = parser.parse_args(argv[1:])
+
+    database_filename = args.database or get_database_filename(args.filename)
+    start_time = time.time()
+    summary = msp_sqlite.materialize(
+        (resource for _, resource in msp_integrity.iter_import_file(args.filename)),
+        database_filename, label=args.label or os.path.basename(args.filename),
+        prune_rows=args.prune, batch_size=args.batch_size)
+    print('Build %s: %s resources written to %s in %.2f seconds' % (
+        summary['build_id'], summary['num_resources'], database_filename,
+        time.time() - start_time))
+    for table, count in sorted(summary['rows'].items()):
+        print('  %s: %s rows' % (table, count))
+    for table, count in sorted(summary['deleted'].items()):
+        if count:
+            print('  %s: %s rows deleted' % (table, count))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
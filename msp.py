@@ -8,12 +8,15 @@ Update these for each update of MSP:
 """
 import json
 import csv
-import datetime
 import re
-import requests
-import ocldev.oclcsvtojsonconverter
 import ocldev.oclconstants
 import ocldev.oclresourcelist
+import msp_codelist_store
+import msp_graph
+import msp_io
+import msp_profile
+import msp_records
+import msp_urls
 
 
 # Constants for OCL mappings
@@ -96,6 +99,11 @@ DATIM_CODELIST_COLUMNS = [
     DATIM_CODELIST_COLUMN_COC_CODE,
     DATIM_CODELIST_COLUMN_COC_UID,
 ]
+# Names of the DATIM code list columns, as in the listGrid headers
+DATIM_CODELIST_COLUMN_NAMES = [
+    'dataset', 'dataelement', 'shortname', 'code', 'dataelementuid', 'dataelementdesc',
+    'categoryoptioncombo', 'categoryoptioncombocode', 'categoryoptioncombouid',
+]
 
 # Constants for MSP collections -- %s is replaced by period (eg FY19)
 COLLECTION_NAME_MER_REFERENCE_INDICATORS = 'MER_REFERENCE_INDICATORS_%s'
@@ -108,6 +116,9 @@ SUPPORT_TYPE_CODES = {
     'CS': 'Central Support'
 }
 
+# Structured dataset of all iHUB derived data elements
+IHUB_STRUCTURED_DATASET = 'MER'
+
 # Constants for data element custom attributes
 ATTR_APPLICABLE_PERIODS = 'Applicable Periods'
 ATTR_PERIOD = 'Period'
@@ -133,216 +144,6 @@ MAP_PERIOD_TO_INDICATOR_TERMS = {
 }
 
 
-def display_resource_list_summaries(resource_list, summary_dict):
-    """ Outputs a summary of a resource list to stdout """
-    for (custom_attr_key, summary_dict_title) in summary_dict.items():
-        print('    Breakdown by %s:' % summary_dict_title)
-        for (key, count) in resource_list.summarize(custom_attr_key=custom_attr_key).items():
-            print('      %s: %s' % (key, count))
-
-
-def display_input_metadata_summary(verbosity=1, input_periods=None, ref_indicator_concepts=None,
-                                   sorted_ref_indicator_codes=None, coc_concepts=None,
-                                   codelist_collections=None, de_concepts=None,
-                                   map_codelist_to_de_to_coc=None, datim_indicator_concepts=None,
-                                   ihub_dde_concepts=None, map_ref_indicator_to_de=None,
-                                   map_ref_indicator_to_ihub_dde=None,
-                                   map_ref_indicator_to_datim_indicator=None,
-                                   map_de_to_coc=None, map_ihub_dde_to_coc=None,
-                                   de_version_linkages=None, map_de_version_linkages=None,
-                                   map_dde_source_linkages=None,
-                                   ref_indicator_references=None, codelist_references=None):
-    """ Displays summary of the loaded metadata """
-    print('MSP Metadata Statistics %s\n' % datetime.datetime.now().strftime("%Y-%m-%d"))
-    print('METADATA SOURCES:')
-
-    # Input periods
-    print('  Input Periods:', input_periods)
-
-    # Reference Indicators
-    if ref_indicator_concepts and sorted_ref_indicator_codes:
-        print('  MER Reference Indicators (FY16-20):',)
-        print('%s unique reference indicator codes, %s total definitions' % (
-            len(ref_indicator_concepts), len(sorted_ref_indicator_codes)))
-        print('    Breakdown by Indicator Code:')
-        for ref_indicator_code in sorted(sorted_ref_indicator_codes):
-            print('      %s: ' % ref_indicator_code)
-            print('        Periods:', ', '.join(ref_indicator_concepts.get_resources(
-                            core_attrs={'id': ref_indicator_code}).summarize(
-                                custom_attr_key=ATTR_PERIOD).keys()))
-            ref_indicator_concept = ref_indicator_concepts.get_resource(
-                core_attrs={'type': 'Concept', 'id': ref_indicator_code})
-            if ref_indicator_concept:
-                if ref_indicator_concept['__url'] in map_ref_indicator_to_de:
-                    print('        Mapped DATIM data elements: %s' % (
-                        len(map_ref_indicator_to_de[ref_indicator_concept['__url']])))
-                if ref_indicator_concept['__url'] in map_ref_indicator_to_ihub_dde:
-                    print('        Mapped iHUB derived data elements: %s' % (
-                        len(map_ref_indicator_to_ihub_dde[ref_indicator_concept['__url']])))
-                if ref_indicator_concept['__url'] in map_ref_indicator_to_datim_indicator:
-                    print('        Mapped DATIM indicators: %s' % (
-                        len(map_ref_indicator_to_datim_indicator[ref_indicator_concept['__url']])))
-        print('    Breakdown by Period:')
-        for (period, count) in ref_indicator_concepts.summarize(
-                custom_attr_key=ATTR_PERIOD).items():
-            print('      %s: %s' % (period, count))
-        print('    Summary of Reference Indicator Mappings:')
-        print('      Mappings to DATIM Data Elements (DE): ',)
-        print('%s reference indicators with %s unique DE mappings' % (
-                    get_dict_child_counts(map_ref_indicator_to_de)))
-        print('      Mappings to iHUB Derived Data Elements (DDE): ',)
-        print('%s reference indicators with %s unique DDE mappings' % (
-                    get_dict_child_counts(map_ref_indicator_to_ihub_dde)))
-        print('      Mappings to DATIM Indicators: ',)
-        print('%s reference indicators with %s unique DATIM indicator mappings\n' % (
-                    get_dict_child_counts(map_ref_indicator_to_datim_indicator)))
-
-    # Codelist collections
-    if codelist_collections:
-        print('  DATIM Code Lists (FY16-20):', len(codelist_collections))
-        print('    Breakdown by Period: (Note some codelists span multiple periods)')
-        for period in input_periods:
-            period_codelist_collections = ocldev.oclresourcelist.OclJsonResourceList()
-            for codelist in codelist_collections:
-                if period in codelist['extras'][ATTR_APPLICABLE_PERIODS]:
-                    period_codelist_collections.append(codelist)
-            print('      %s Code Lists: %s' % (period, len(period_codelist_collections)))
-            if verbosity >= 2:
-                for result_target_type in ['Result', 'Target']:
-                    filtered_codelists = period_codelist_collections.get_resources(
-                        custom_attrs={ATTR_RESULT_TARGET: result_target_type})
-                    if filtered_codelists:
-                        print('        %s: %s' % (result_target_type, len(filtered_codelists)))
-                    else:
-                        print('        %s: None' % (result_target_type))
-                    for codelist in filtered_codelists:
-                        if codelist['external_id'] in map_codelist_to_de_to_coc:
-                            print('          %s: %s data elements' % (
-                                codelist['name'],
-                                len(map_codelist_to_de_to_coc[codelist['external_id']])))
-                        else:
-                            print('          %s' % codelist['name'])
-
-    # DATIM data element concepts
-    if de_concepts:
-        de_concepts_summary_dict = {
-            ATTR_RESULT_TARGET: 'Result/Target',
-            ATTR_DOMAIN_TYPE: 'Domain Type',
-            ATTR_NUMERATOR_DENOMINATOR_TYPE: 'Numerator/Denominator',
-            ATTR_PEPFAR_SUPPORT_TYPE: 'PEPFAR Support Type',
-            ATTR_REPORTING_FREQUENCY: 'Reporting Frequency'
-        }
-        print('  DATIM Data Elements (All):', len(de_concepts))
-        print('    Breakdown by period (via codelists):')
-        for (period, count) in summarize_applicable_periods_from_concepts(de_concepts).items():
-            print('      %s: %s' % (period, count))
-        display_resource_list_summaries(de_concepts, de_concepts_summary_dict)
-
-    # iHUB derived data element concepts
-    if ihub_dde_concepts:
-        ihub_dde_concepts_summary_dict = {
-            ATTR_RESULT_TARGET: 'Result/Target',
-            'standardized_disaggregate': 'Standardized Disaggregate',
-            ATTR_NUMERATOR_DENOMINATOR_TYPE: 'Numerator/Denominator',
-            ATTR_PEPFAR_SUPPORT_TYPE: 'PEPFAR Support Type',
-            ATTR_REPORTING_FREQUENCY: 'Reporting Frequency'
-        }
-        print('  iHUB Derived Data Element (All):', len(ihub_dde_concepts))
-        print('    Breakdown by period (via derivation rules):')
-        for (period, count) in summarize_applicable_periods_from_concepts(
-                ihub_dde_concepts).items():
-            print('      %s: %s' % (period, count))
-        display_resource_list_summaries(ihub_dde_concepts, ihub_dde_concepts_summary_dict)
-
-    # Summary for DE version linkages
-    print('\nRESULTS OF GENERATING LINKAGES BETWEEN DATA ELEMENTS:')
-    print('  Data Element Version Links (DATIM and iHUB):')
-    print('    %s DEs replaced %s DEs' % get_dict_child_counts(map_de_version_linkages))
-    if verbosity >= 2:
-        for de_code in de_version_linkages:
-            print('      %s' % de_code)
-            for de_version in de_version_linkages[de_code]:
-                print('        %s: %s (%s)' % (
-                    de_version['sort_order'], de_version['code'], de_version['url']))
-
-    # Summary for DE source-derivation linkages
-    print('\n  iHUB Data Element Source-Derivation Linkages:')
-    print('    %s derived data elements linked to %s source data elements' % get_dict_child_counts(
-        map_dde_source_linkages))
-    print('    NOTE: Source-derivation linkages are defined between data elements only, not COCs')
-
-    # COC concepts
-    if coc_concepts:
-        print('  DATIM COC concepts (All):', len(coc_concepts))
-        if map_de_to_coc:
-            print('    %s DATIM data elements with %s unique COC maps' % get_dict_child_counts(
-                map_de_to_coc))
-        if map_ihub_dde_to_coc:
-            print('    %s iHUB DDEs with %s unique COC maps' % get_dict_child_counts(
-                map_ihub_dde_to_coc))
-
-    # DATIM indicator concepts
-    if datim_indicator_concepts:
-        datim_indicator_concepts_summary_dict = {
-            ATTR_RESULT_TARGET: 'Result/Target',
-            'annualized': 'Annualized',
-            'dimensionItemType': 'dimensionItemType',
-        }
-        print('  DATIM Indicators (All):', len(datim_indicator_concepts))
-        print('    Breakdown by period (via keywords in indicator names):')
-        for (period, count) in summarize_applicable_periods_from_concepts(
-                datim_indicator_concepts).items():
-            print('      %s: %s' % (period, count))
-        display_resource_list_summaries(
-            datim_indicator_concepts, datim_indicator_concepts_summary_dict)
-
-    # Display list of overlapping IDs between iHUB and DATIM data elements
-    if ihub_dde_concepts:
-        overlapping_de_concepts = {}
-        for dde_concept in ihub_dde_concepts:
-            de_concept = de_concepts.get_resource(core_attrs={'id': dde_concept['id']})
-            if de_concept:
-                overlapping_de_concepts[dde_concept['id']] = {
-                    'ihub': dde_concept,
-                    'datim': de_concept
-                }
-        if overlapping_de_concepts:
-            print('  Overlapping DATIM/iHUB Data Elements: %s' % len(overlapping_de_concepts))
-            for overlapping_de_concept_id in overlapping_de_concepts:
-                overlapping_concept = overlapping_de_concepts[overlapping_de_concept_id]
-                print('    [%s]\n      DATIM: %s -- %s\n      iHUB: %s -- %s' % (
-                    overlapping_de_concept_id,
-                    overlapping_concept['datim']['names'][0]['name'],
-                    overlapping_concept['datim']['extras'].get(ATTR_APPLICABLE_PERIODS),
-                    overlapping_concept['ihub']['names'][0]['name'],
-                    overlapping_concept['ihub']['extras'].get(ATTR_APPLICABLE_PERIODS)))
-
-
-def summarize_import_list(import_list):
-    """ Output a summary of the final import list """
-    print('\nSUMMARY OF FINAL IMPORT LIST:')
-    print('  Breakdown by resource type:')
-    for (key, count) in import_list.summarize(core_attr_key='type').items():
-        print('    %s: %s' % (key, count))
-        if key == 'Concept':
-            concepts = import_list.get_resources(core_attrs={'type': 'Concept'})
-            for (subresource_key, subresource_count) in concepts.summarize(
-                    core_attr_key='concept_class').items():
-                print('      %s: %s' % (subresource_key, subresource_count))
-                if subresource_key == 'Data Element':
-                    for (concept_key, value) in concepts.get_resources(core_attrs={'concept_class': 'Data Element'}).summarize(custom_attr_key='source').items():
-                        print('        %s: %s' % (concept_key, value))
-                elif subresource_key == 'Reference Indicator':
-                    for (concept_key, value) in concepts.get_resources(core_attrs={'concept_class': 'Reference Indicator'}).summarize(custom_attr_key='Period').items():
-                        print('        %s: %s' % (concept_key, value))
-        elif key == 'Mapping':
-            for (subresource_key, subresource_count) in import_list.get_resources(core_attrs={'type': 'Mapping'}).summarize(core_attr_key='map_type').items():
-                print('      %s: %s' % (subresource_key, subresource_count))
-        elif key == 'Collection':
-            for collection in import_list.get_resources(core_attrs={'type': 'Collection'}):
-                print('      %s' % collection['id'])
-
-
 def count_reference_expressions(references):
     """
     Returns a count of the total number of expressions in the specified references.
@@ -356,9 +157,11 @@ def count_reference_expressions(references):
 
 def get_dict_child_counts(dict_to_be_counted):
     """
-    Returns count of dict and count of all its children as a set.
-    Used by summary display methods.
+    Returns count of dict and count of all its children as a set. Accepts a dictionary of lists
+    or a msp_graph.CsrRelation. Used by summary display methods.
     """
+    if isinstance(dict_to_be_counted, msp_graph.CsrRelation):
+        return msp_graph.get_relation_child_counts(dict_to_be_counted)
     count_of_children = 0
     for dict_key in dict_to_be_counted:
         count_of_children += len(dict_to_be_counted[dict_key])
@@ -408,49 +211,82 @@ def get_new_repo_json(owner_type='Organization', owner_id='', repo_type='Source'
     return repo_json
 
 
+@msp_profile.profiled()
 def load_datim_data_elements(filename='', org_id='', source_id='',
                              sorted_ref_indicator_codes=None, codelist_collections=None,
-                             ref_indicator_concepts=None):
+                             ref_indicator_concepts=None, periods=None, structured_datasets=None):
     """
     Load raw DHIS2-formatted DATIM data elements and return as OCL-formatted JSON resources.
     Note that COCs and datasets are included as attributes of each data element.
+    If periods (eg ['FY22']) is provided, data elements that are not in a codelist for one of
+    the periods are skipped. If structured_datasets (eg ['MER']) is provided, data elements of
+    other structured datasets are skipped. codelist_collections should not be filtered by
+    period, so that the attributes of the data elements are the same as in a full build.
     """
 
     # Load raw DHIS2-formatted DATIM data elements
-    with open(filename, 'rb') as input_file:
+    with msp_io.open_file(filename, 'rb') as input_file:
         raw_datim_de_all = json.load(input_file)
 
+    # UIDs of the data elements applicable to the requested periods
+    period_de_uids = None
+    if periods:
+        period_de_uids = get_data_element_uids_from_codelist_collections(
+            get_filtered_codelist_collections(codelist_collections, period=list(periods)))
+
     # Convert to OCL-formatted JSON
-    de_concepts = ocldev.oclresourcelist.OclJsonResourceList()
+    de_concepts = msp_records.MspResourceList()
     for de_raw in raw_datim_de_all['dataElements']:
+        if period_de_uids is not None and de_raw['id'] not in period_de_uids:
+            continue
+        if structured_datasets and get_data_element_structured_dataset(
+                de_code=get_data_element_code(de_raw)) not in structured_datasets:
+            continue
         de_concepts.append(build_concept_from_datim_de(
             de_raw, org_id, source_id, sorted_ref_indicator_codes, codelist_collections,
             ref_indicator_concepts))
     return de_concepts
 
 
+@msp_profile.profiled()
 def load_datim_coc_concepts(filename='', org_id='', source_id=''):
     """ Load and return DATIM categoryOptionCombos as OCL-formatted JSON concepts """
 
     # Load COCs as raw DHIS2-formatted JSON
-    with open(filename, 'rb') as input_file:
+    with msp_io.open_file(filename, 'rb') as input_file:
         raw_datim_cocs = json.load(input_file)
 
     # Transform COCs to OCL-formatted JSON and return
     coc_concepts = []
     for coc_raw in raw_datim_cocs['categoryOptionCombos']:
         coc_concepts.append(build_concept_from_datim_coc(coc_raw, org_id, source_id))
-    return ocldev.oclresourcelist.OclJsonResourceList(resources=coc_concepts)
+    return msp_records.MspResourceList(resources=coc_concepts)
 
 
-def load_codelist_collections_with_exports_from_file(filename='', org_id=''):
+@msp_profile.profiled()
+def load_codelist_collections_with_exports_from_file(filename='', org_id='', compact_rows=True):
     """
     Load codelist collections with their exports from the specified filename.
-    This returns the same output as msp.load_codelist_collections and is designed to
-    be used in conjunction with save_codelists_to_file.py.
-    """
-    with open(filename) as input_file:
-        resources = ocldev.oclresourcelist.OclJsonResourceList(json.load(input_file))
+    This returns the same output as msp_datim.load_codelist_collections and is designed to
+    be used in conjunction with save_codelists_to_file.py. If compact_rows is True, the
+    listGrid rows of each codelist export are replaced as they are parsed by a read-only
+    msp_codelist_store.CodelistRows view backed by a single shared CodelistRowStore.
+    """
+    object_hook = None
+    if compact_rows:
+        codelist_row_store = msp_codelist_store.CodelistRowStore(
+            num_columns=len(DATIM_CODELIST_COLUMNS))
+
+        def object_hook(json_object):
+            """ Compact each listGrid as soon as the parser completes it """
+            if 'rows' in json_object and 'headers' in json_object:
+                json_object['rows'] = msp_codelist_store.compact_codelist_rows(
+                    json_object['rows'], codelist_row_store)
+            return json_object
+
+    with msp_io.open_file(filename) as input_file:
+        resources = ocldev.oclresourcelist.OclJsonResourceList(
+            json.load(input_file, object_hook=object_hook))
 
     # Modify the owner
     for resource in resources:
@@ -458,59 +294,26 @@ def load_codelist_collections_with_exports_from_file(filename='', org_id=''):
     return resources
 
 
-def load_codelist_collections(filename='', org_id='', canonical_url='', verbosity=0):
-    """
-    Load and return codelist_collections as OCL-formatted JSON collections.
-    This method retrieves all of the full codelist from DATIM directly, which takes
-    a long time to process.
-    """
-
-    # Load the codelist definitions into a resource list
-    csv_codelists = []
-    with open(filename) as ifile:
-        reader = csv.DictReader(ifile)
-        for row in reader:
-            # Skip rows that are not set to be imported
-            if not row['resource_type']:
-                continue
-            if verbosity:
-                print('Retrieving codelist: %s' % row['id'])
-            row['owner_id'] = org_id
-            dhis2_codelist_url = row.pop('ZenDesk: JSON Link')
-            dhis2_codelist_url += '&paging=false'
-            if verbosity:
-                print('  DHIS2 URL: %s' % dhis2_codelist_url)
-                print('  Canonical URL:', "%s/ValueSet/%s" % (canonical_url, row['id']))
-            row['attr:dhis2_codelist_url'] = dhis2_codelist_url
-
-            # Fetch the codelist from DHSI2
-            dhis2_codelist_response = requests.get(dhis2_codelist_url)
-            dhis2_codelist_response.raise_for_status()
-            row['attr:dhis2_codelist'] = dhis2_codelist_response.json()
-            csv_codelists.append(row)
-
-    codelist_csv_resource_list = ocldev.oclresourcelist.OclCsvResourceList(resources=csv_codelists)
-    codelist_json_resource_list = codelist_csv_resource_list.convert_to_ocl_formatted_json()
-
-    # Fields not supported in the CSV format get added here
-    for codelist in codelist_json_resource_list:
-        codelist['canonical_url'] = "%s/ValueSet/%s" % (canonical_url, codelist['id'])
-
-    return codelist_json_resource_list
-
-
+@msp_profile.profiled()
 def load_datim_indicators(filename='', org_id='', source_id='',
                           de_concepts=None, coc_concepts=None,
-                          sorted_ref_indicator_codes=None, ref_indicator_concepts=None):
-    """ Load DHIS2-formatted DATIM indicators and return as OCL-formatted concepts """
+                          sorted_ref_indicator_codes=None, ref_indicator_concepts=None,
+                          periods=None):
+    """
+    Load DHIS2-formatted DATIM indicators and return as OCL-formatted concepts. If periods is
+    provided, indicators whose names do not refer to one of the periods are skipped.
+    """
 
     # Load raw DHIS2-formatted DATIM indicators
-    with open(filename, 'rb') as input_file:
+    with msp_io.open_file(filename, 'rb') as input_file:
         raw_datim_indicators = json.load(input_file)
 
     # Transform indicators to OCL-formatted JSON resources
-    datim_indicator_concepts = ocldev.oclresourcelist.OclJsonResourceList()
+    datim_indicator_concepts = msp_records.MspResourceList()
     for indicator_raw in raw_datim_indicators['indicators']:
+        if periods and not is_applicable_to_periods(
+                get_datim_indicator_periods(indicator_raw['name']), periods):
+            continue
         datim_indicator_concepts.append(build_concept_from_datim_indicator(
             indicator_raw, org_id=org_id, source_id=source_id,
             de_concepts=de_concepts, coc_concepts=coc_concepts,
@@ -519,13 +322,14 @@ def load_datim_indicators(filename='', org_id='', source_id='',
     return datim_indicator_concepts
 
 
+@msp_profile.profiled()
 def load_ref_indicator_concepts(org_id='', source_id='', filenames=None):
     """ Loads reference indicators from MER guidance as OCL-formatted JSON """
     if not filenames:
         return []
     ref_indicator_concepts = []
     for filename in filenames:
-        with open(filename) as ifile:
+        with msp_io.open_file(filename) as ifile:
             reader = csv.DictReader(ifile)
             for row in reader:
                 row['owner_id'] = org_id
@@ -536,22 +340,31 @@ def load_ref_indicator_concepts(org_id='', source_id='', filenames=None):
     ref_indicator_json_list = ref_indicator_csv_list.convert_to_ocl_formatted_json()
 
     # Add throw-away attributes (only used for processing)
+    url_factory = msp_urls.get_url_factory(org_id, source_id)
     for ref_indicator in ref_indicator_json_list:
-        ref_indicator['__url'] = '/orgs/%s/sources/%s/concepts/%s/' % (
-            org_id, source_id, ref_indicator['id'])
+        ref_indicator['__url'] = url_factory.concept_url(ref_indicator['id'])
 
     return ref_indicator_json_list
 
 
+@msp_profile.profiled()
 def load_ihub_dde_concepts(filename='', num_run_sequences=3, org_id='',
                            source_id='', sorted_ref_indicator_codes=None,
                            ref_indicator_concepts=None,
-                           ihub_rule_period_end_year=2020):
-    """ Load iHUB Derived Data Element extract and return as OCL-formatted JSON concepts """
+                           ihub_rule_period_end_year=2020, periods=None,
+                           structured_datasets=None):
+    """
+    Load iHUB Derived Data Element extract and return as OCL-formatted JSON concepts.
+    If periods is provided, derived data elements not applicable to one of the periods are
+    skipped. All derived data elements belong to the IHUB_STRUCTURED_DATASET structured dataset,
+    so nothing is loaded if structured_datasets is provided and does not include it.
+    """
+    if structured_datasets and IHUB_STRUCTURED_DATASET not in structured_datasets:
+        return msp_records.MspResourceList()
 
     # Load raw iHUB extract
     ihub_raw = []
-    with open(filename) as input_csv_file:
+    with msp_io.open_file(filename) as input_csv_file:
         reader = csv.DictReader(input_csv_file)
         for row in reader:
             # JP: Some iHUB exports contain extra unicode characters at the beginning of the
@@ -567,8 +380,8 @@ def load_ihub_dde_concepts(filename='', num_run_sequences=3, org_id='',
         ihub_raw, num_run_sequences=num_run_sequences, org_id=org_id,
         source_id=source_id, sorted_ref_indicator_codes=sorted_ref_indicator_codes,
         ref_indicator_concepts=ref_indicator_concepts,
-        ihub_rule_period_end_year=ihub_rule_period_end_year)
-    return ocldev.oclresourcelist.OclJsonResourceList(list(dde_concept_dict.values()))
+        ihub_rule_period_end_year=ihub_rule_period_end_year, periods=periods)
+    return msp_records.MspResourceList(list(dde_concept_dict.values()))
 
 
 def get_ihub_dde_numerator_or_denominator(de_name):
@@ -606,6 +419,25 @@ def get_data_element_support_type(de_code=''):
     return ''
 
 
+def get_data_element_code(de_raw):
+    """ Returns the code of a raw DATIM data element, or its short name if it has no code """
+    return de_raw['code'] if 'code' in de_raw else de_raw['shortName']
+
+
+def get_datim_indicator_periods(indicator_name):
+    """
+    Returns list of periods that a DATIM indicator applies to, based on the period keywords in
+    its name (see MAP_PERIOD_TO_INDICATOR_TERMS)
+    """
+    indicator_periods = []
+    for period in MAP_PERIOD_TO_INDICATOR_TERMS:
+        for term in MAP_PERIOD_TO_INDICATOR_TERMS[period]:
+            if term.lower() in indicator_name.lower():
+                if period not in indicator_periods:
+                    indicator_periods.append(period)
+    return indicator_periods
+
+
 def get_data_element_structured_dataset(de_code=''):
     """ Returns the structured dataset key for a data element code """
     if de_code.startswith('SIMS'):
@@ -650,6 +482,7 @@ def get_data_element_result_or_target(de_code=''):
     return 'Result'
 
 
+@msp_profile.profiled()
 def lookup_reference_indicator_code(resource_name='', resource_code='',
                                     resource_applicable_periods=None,
                                     sorted_ref_indicator_codes=None, ref_indicator_concepts=None):
@@ -678,6 +511,7 @@ def lookup_reference_indicator_code(resource_name='', resource_code='',
     return ''
 
 
+@msp_profile.profiled()
 def get_sorted_unique_indicator_codes(ref_indicator_concepts=None):
     """
     Returns a list of unique sorted indicator codes given a list of
@@ -710,6 +544,7 @@ def get_data_element_root(de_code=''):
     return de_code
 
 
+@msp_profile.profiled()
 def get_de_periods_from_codelist_collections(de_codelists, codelist_collections):
     """
     Get a list of the periods present in a data element's codelists.
@@ -727,6 +562,11 @@ def get_de_periods_from_codelist_collections(de_codelists, codelist_collections)
     return list(periods.keys())
 
 
+def is_applicable_to_periods(resource_periods, periods):
+    """ Returns True if any of resource_periods is in the periods filter """
+    return any(period in periods for period in resource_periods)
+
+
 def get_concepts_filtered_by_period(concepts=None, period=None):
     """
     Returns a list of concepts filtered by ATTR_PERIOD or ATTR_APPLICABLE_PERIODS
@@ -780,7 +620,7 @@ def get_filtered_cocs(de_concepts=None, map_de_to_coc=None, coc_concepts=None):
     """ Returns list of COCs mapped to the list of data elements """
     cocs = {}
     for de_concept in de_concepts:
-        de_concept_key = '/orgs/%s/sources/%s/concepts/%s/' % (
+        de_concept_key = msp_urls.get_concept_url(
             de_concept['owner'], de_concept['source'], de_concept['id'])
         if de_concept_key in map_de_to_coc:
             for coc_concept_key in map_de_to_coc[de_concept_key]:
@@ -816,11 +656,12 @@ def generate_mapping_id(id_format='MAP_%s_%s', from_concept_code='', to_concept_
         MAP_DE_COC_%s_%s
     """
     if from_concept_url and to_concept_url:
-        from_concept_code = from_concept_url[from_concept_url[:-1].rfind('/') + 1:-1]
-        to_concept_code = to_concept_url[to_concept_url[:-1].rfind('/') + 1:-1]
+        from_concept_code = msp_urls.get_resource_id_from_url(from_concept_url)
+        to_concept_code = msp_urls.get_resource_id_from_url(to_concept_url)
     return id_format % (from_concept_code, to_concept_code)
 
 
+@msp_profile.profiled()
 def build_ocl_mappings(map_dict=None, filtered_from_concepts=None,
                        owner_type='Organization', owner_id='',
                        source_id='', map_type='',
@@ -834,7 +675,7 @@ def build_ocl_mappings(map_dict=None, filtered_from_concepts=None,
     """
     output_mappings = []
     for from_concept_url in map_dict:
-        if filtered_from_concepts and from_concept_url not in filtered_from_concepts:
+        if filtered_from_concepts is not None and from_concept_url not in filtered_from_concepts:
             continue
         for to_concept_url in map_dict[from_concept_url]:
             output_mapping = {
@@ -850,10 +691,12 @@ def build_ocl_mappings(map_dict=None, filtered_from_concepts=None,
     return output_mappings
 
 
-def build_ref_indicator_references(ref_indicator_concepts, org_id=''):
+@msp_profile.profiled()
+def build_ref_indicator_references(ref_indicator_concepts, org_id='', periods=None):
     """
     Return a dictionary with period as key and OCL-formatted reference as value representing the
-    set of reference indicators that are valid for each period. Eg:
+    set of reference indicators that are valid for each period. If periods is provided, only
+    references for those periods are built. Eg:
         {"FY18": {"type": "Reference", "owner": "PEPFAR", "owner_type": "Organization",
                   "collection": "MER_REFERENCE_INDICATORS_FY18",
                   "data": {"expressions": "/orgs/PEPFAR/sources/MER/concepts/HTS_TST/", ...}}}
@@ -861,6 +704,8 @@ def build_ref_indicator_references(ref_indicator_concepts, org_id=''):
     output_references_by_period = {}
     ref_indicator_period_counts = ref_indicator_concepts.summarize(custom_attr_key=ATTR_PERIOD)
     for period in ref_indicator_period_counts.keys():
+        if periods and period not in periods:
+            continue
         expressions = [
             ref_indicator_concept['__url'] for ref_indicator_concept in
             ref_indicator_concepts.get_resources(custom_attrs={ATTR_PERIOD: period})]
@@ -874,18 +719,23 @@ def build_ref_indicator_references(ref_indicator_concepts, org_id=''):
     return output_references_by_period
 
 
+@msp_profile.profiled()
 def build_fiscal_year_references(ref_indicator_concepts, datim_indicator_concepts, de_concepts,
                                  ihub_dde_concepts, coc_concepts, map_ref_indicator_to_de,
                                  map_ref_indicator_to_ihub_dde,
                                  map_ref_indicator_to_datim_indicator,
                                  map_de_to_coc, map_ihub_dde_to_coc,
-                                 org_id='', source_id=''):
+                                 org_id='', source_id='', periods=None, ref_indicator_urls=None):
     """
     Return a dictionary with period as key and OCL-formatted reference as value representing
     all resources that can be associated with that period. Includes everything but reference
     indicators (i.e. date elements, DATIM indicators, and COCs). Reference indicators are
     excluded because they are simply a copy of the MER_REFERENCE_INDICATOR_FY## collections
     and they are processed at a different time than the remaining references defined here.
+    If periods is provided, only references for those periods are built. If ref_indicator_urls
+    is provided, mappings from reference indicators that are not in it are omitted, but the
+    concepts they map to are still cascaded (eg reference indicators of other periods than those
+    of a period-sliced build).
 
     for each ref indicator in the period...
     1.  Cascade each Reference Indicator concept version to Indicator concepts using
@@ -900,13 +750,18 @@ def build_fiscal_year_references(ref_indicator_concepts, datim_indicator_concept
                   "data": {"expressions": "/orgs/PEPFAR/sources/MER/concepts/XHBL1mOwLWb/", ...}}}
     """
     output_references_by_period = {}
+    url_factory = msp_urls.get_url_factory(org_id, source_id)
     ref_indicator_period_counts = ref_indicator_concepts.summarize(custom_attr_key=ATTR_PERIOD)
     for period in ref_indicator_period_counts.keys():
+        if periods and period not in periods:
+            continue
         expressions = []
         ref_indicator_concepts.get_resources(custom_attrs={ATTR_PERIOD: period})
         for ref_indicator_concept in ref_indicator_concepts:
             # datim indicators
             ref_indicator_url = ref_indicator_concept['__url']
+            is_ref_indicator_mapped = (ref_indicator_urls is None or
+                                       ref_indicator_url in ref_indicator_urls)
             if ref_indicator_url in map_ref_indicator_to_datim_indicator:
                 for datim_indicator_url in map_ref_indicator_to_datim_indicator[ref_indicator_url]:
                     datim_indicator_concept = datim_indicator_concepts.get_resource_by_url(
@@ -921,12 +776,9 @@ def build_fiscal_year_references(ref_indicator_concepts, datim_indicator_concept
                             expressions.append(datim_indicator_url)
 
                         # add the mapping
-                        mapping_id = generate_mapping_id(
-                            from_concept_url=ref_indicator_url, to_concept_url=datim_indicator_url,
-                            id_format=MSP_MAP_ID_FORMAT_REFIND_IND)
-                        mapping_url = '/orgs/%s/sources/%s/mappings/%s/' % (
-                            org_id, source_id, mapping_id)
-                        if mapping_url not in expressions:
+                        mapping_url = url_factory.mapping_url_for_concepts(
+                            MSP_MAP_ID_FORMAT_REFIND_IND, ref_indicator_url, datim_indicator_url)
+                        if is_ref_indicator_mapped and mapping_url not in expressions:
                             expressions.append(mapping_url)
 
             # data elements
@@ -943,12 +795,9 @@ def build_fiscal_year_references(ref_indicator_concepts, datim_indicator_concept
                             expressions.append(de_url)
 
                         # add the mapping
-                        mapping_id = generate_mapping_id(
-                            from_concept_url=ref_indicator_url, to_concept_url=de_url,
-                            id_format=MSP_MAP_ID_FORMAT_REFIND_DE)
-                        mapping_url = '/orgs/%s/sources/%s/mappings/%s/' % (
-                            org_id, source_id, mapping_id)
-                        if mapping_url not in expressions:
+                        mapping_url = url_factory.mapping_url_for_concepts(
+                            MSP_MAP_ID_FORMAT_REFIND_DE, ref_indicator_url, de_url)
+                        if is_ref_indicator_mapped and mapping_url not in expressions:
                             expressions.append(mapping_url)
 
                         # cascade the COCs
@@ -959,11 +808,8 @@ def build_fiscal_year_references(ref_indicator_concepts, datim_indicator_concept
                                     expressions.append(coc_url)
 
                                 # add the mapping
-                                mapping_id = generate_mapping_id(
-                                    from_concept_url=de_url, to_concept_url=coc_url,
-                                    id_format=MSP_MAP_ID_FORMAT_DE_COC)
-                                mapping_url = '/orgs/%s/sources/%s/mappings/%s/' % (
-                                    org_id, source_id, mapping_id)
+                                mapping_url = url_factory.mapping_url_for_concepts(
+                                    MSP_MAP_ID_FORMAT_DE_COC, de_url, coc_url)
                                 if mapping_url not in expressions:
                                     expressions.append(mapping_url)
 
@@ -981,12 +827,9 @@ def build_fiscal_year_references(ref_indicator_concepts, datim_indicator_concept
                             expressions.append(ihub_dde_url)
 
                         # add the mapping
-                        mapping_id = generate_mapping_id(
-                            from_concept_url=ref_indicator_url, to_concept_url=ihub_dde_url,
-                            id_format=MSP_MAP_ID_FORMAT_REFIND_DE)
-                        mapping_url = '/orgs/%s/sources/%s/mappings/%s/' % (
-                            org_id, source_id, mapping_id)
-                        if mapping_url not in expressions:
+                        mapping_url = url_factory.mapping_url_for_concepts(
+                            MSP_MAP_ID_FORMAT_REFIND_DE, ref_indicator_url, ihub_dde_url)
+                        if is_ref_indicator_mapped and mapping_url not in expressions:
                             expressions.append(mapping_url)
 
                         # cascade the COCs
@@ -997,11 +840,8 @@ def build_fiscal_year_references(ref_indicator_concepts, datim_indicator_concept
                                     expressions.append(coc_url)
 
                                 # add the mapping
-                                mapping_id = generate_mapping_id(
-                                    from_concept_url=ihub_dde_url, to_concept_url=coc_url,
-                                    id_format=MSP_MAP_ID_FORMAT_DE_COC)
-                                mapping_url = '/orgs/%s/sources/%s/mappings/%s/' % (
-                                    org_id, source_id, mapping_id)
+                                mapping_url = url_factory.mapping_url_for_concepts(
+                                    MSP_MAP_ID_FORMAT_DE_COC, ihub_dde_url, coc_url)
                                 if mapping_url not in expressions:
                                     expressions.append(mapping_url)
 
@@ -1015,6 +855,7 @@ def build_fiscal_year_references(ref_indicator_concepts, datim_indicator_concept
     return output_references_by_period
 
 
+@msp_profile.profiled()
 def build_codelist_references(map_codelist_to_de_to_coc=None, org_id='', source_id='',
                               codelist_collections=None):
     """ Return a list of batched references for DE/COC concepts & mappings for each codelist. """
@@ -1033,6 +874,7 @@ def build_codelist_references(map_codelist_to_de_to_coc=None, org_id='', source_
     return codelist_references
 
 
+@msp_profile.profiled()
 def get_mapped_concept_references(from_concepts=None, from_concept_urls=None, map_dict=None,
                                   org_id='', source_id='', collection_id='',
                                   include_to_concept_refs=True,
@@ -1050,10 +892,12 @@ def get_mapped_concept_references(from_concepts=None, from_concept_urls=None, ma
     ref_from_concept_expressions = []
     ref_to_concept_expressions = []
     ref_mapping_expressions = []
+    url_factory = msp_urls.get_url_factory(org_id, source_id)
+    is_map_dict = isinstance(map_dict, (dict, msp_graph.CsrRelation))
 
     # Iterate thru the from_concepts as a dict or list, the from_concept_urls,
     # or directly iterate the maps
-    if isinstance(from_concepts, dict) and isinstance(map_dict, dict):
+    if isinstance(from_concepts, dict) and is_map_dict:
         for from_concept_url in from_concepts:
             ref_from_concept_expressions.append(from_concept_url)
             if from_concept_url not in map_dict and not ignore_from_concepts_with_no_maps:
@@ -1063,14 +907,11 @@ def get_mapped_concept_references(from_concepts=None, from_concept_urls=None, ma
                     if to_concept_url not in ref_to_concept_expressions:
                         ref_to_concept_expressions.append(to_concept_url)
                     if include_explicit_mapping_reference:
-                        mapping_id = generate_mapping_id(
-                            id_format=mapping_id_format, from_concept_url=from_concept_url,
-                            to_concept_url=to_concept_url)
-                        mapping_url = '/orgs/%s/sources/%s/mappings/%s/' % (
-                            org_id, source_id, mapping_id)
+                        mapping_url = url_factory.mapping_url_for_concepts(
+                            mapping_id_format, from_concept_url, to_concept_url)
                         if mapping_url not in ref_mapping_expressions:
                             ref_mapping_expressions.append(mapping_url)
-    elif isinstance(from_concepts, list) and isinstance(map_dict, dict):
+    elif isinstance(from_concepts, list) and is_map_dict:
         for from_concept in from_concepts:
             from_concept_url = from_concept['__url']
             ref_from_concept_expressions.append(from_concept_url)
@@ -1082,14 +923,11 @@ def get_mapped_concept_references(from_concepts=None, from_concept_urls=None, ma
                     if to_concept_url not in ref_to_concept_expressions:
                         ref_to_concept_expressions.append(to_concept_url)
                     if include_explicit_mapping_reference:
-                        mapping_id = generate_mapping_id(
-                            id_format=mapping_id_format, from_concept_url=from_concept_url,
-                            to_concept_url=to_concept_url)
-                        mapping_url = '/orgs/%s/sources/%s/mappings/%s/' % (
-                            org_id, source_id, mapping_id)
+                        mapping_url = url_factory.mapping_url_for_concepts(
+                            mapping_id_format, from_concept_url, to_concept_url)
                         if mapping_url not in ref_mapping_expressions:
                             ref_mapping_expressions.append(mapping_url)
-    elif isinstance(from_concept_urls, list) and isinstance(map_dict, dict):
+    elif isinstance(from_concept_urls, list) and is_map_dict:
         for from_concept_url in from_concept_urls:
             ref_from_concept_expressions.append(from_concept_url)
             if from_concept_url not in map_dict and not ignore_from_concepts_with_no_maps:
@@ -1099,11 +937,8 @@ def get_mapped_concept_references(from_concepts=None, from_concept_urls=None, ma
                     if to_concept_url not in ref_to_concept_expressions:
                         ref_to_concept_expressions.append(to_concept_url)
                     if include_explicit_mapping_reference:
-                        mapping_id = generate_mapping_id(
-                            id_format=mapping_id_format, from_concept_url=from_concept_url,
-                            to_concept_url=to_concept_url)
-                        mapping_url = '/orgs/%s/sources/%s/mappings/%s/' % (
-                            org_id, source_id, mapping_id)
+                        mapping_url = url_factory.mapping_url_for_concepts(
+                            mapping_id_format, from_concept_url, to_concept_url)
                         if mapping_url not in ref_mapping_expressions:
                             ref_mapping_expressions.append(mapping_url)
     else:
@@ -1285,6 +1120,7 @@ def format_concept_id(unformatted_id):
         unformatted_id=unformatted_id.replace('+', ' plus '), replace_char='_')
 
 
+@msp_profile.profiled()
 def dedup_list_of_dicts(dup_dict):
     """
     Dedup the import list without changing order
@@ -1303,7 +1139,7 @@ def dedup_list_of_dicts(dup_dict):
     """
     dedup_list = []
     dedup_list_jsons = []
-    old_list_jsons = [json.dumps(resource, sort_keys=True) for resource in dup_dict]
+    old_list_jsons = [msp_records.dumps(resource, sort_keys=True) for resource in dup_dict]
     for str_resource in old_list_jsons:
         if str_resource not in dedup_list_jsons:
             dedup_list_jsons.append(str_resource)
@@ -1332,12 +1168,13 @@ def summarize_applicable_periods_from_concepts(resource_list):
     return period_counts
 
 
+@msp_profile.profiled()
 def build_concept_from_datim_indicator(indicator_raw, org_id='', source_id='',
                                        de_concepts=None, coc_concepts=None,
                                        sorted_ref_indicator_codes=None,
                                        ref_indicator_concepts=None):
     """
-    Return an OCL-formatted concept for the specified DATIM indicator.
+    Return a DatimIndicatorRecord for the specified DATIM indicator.
     If de_concepts and coc_concepts arguments are provided, extra attributes are included for the
     numerator/denominator in which the UIDs have been with human-readable codes or names.
     """
@@ -1351,39 +1188,17 @@ def build_concept_from_datim_indicator(indicator_raw, org_id='', source_id='',
         result_target = 'N/A'
 
     # Determine period range for this DATIM indicator
-    indicator_periods = []
-    for period in MAP_PERIOD_TO_INDICATOR_TERMS:
-        for term in MAP_PERIOD_TO_INDICATOR_TERMS[period]:
-            if term.lower() in indicator_raw['name'].lower():
-                if period not in indicator_periods:
-                    indicator_periods.append(period)
+    indicator_periods = get_datim_indicator_periods(indicator_raw['name'])
 
     # Build the DATIM indicator concept
-    indicator_concept = {
-        'type': 'Concept',
-        'id': indicator_raw['id'],
-        'owner': org_id,
-        'owner_type': 'Organization',
-        'source': source_id,
-        'concept_class': 'Indicator',
-        'datatype': indicator_raw['indicatorType']['name'],
-        'names': [
-            {
-                'name': indicator_raw['name'],
-                'name_type': 'Fully Specified',
-                'locale': 'en',
-                'locale_preferred': True,
-                'external_id': None,
-            },
-            {
-                'name': indicator_raw['shortName'],
-                'name_type': 'Short',
-                'locale': 'en',
-                'locale_preferred': False,
-                'external_id': None,
-            }
-        ],
-        'extras': {
+    indicator_concept = msp_records.DatimIndicatorRecord(
+        concept_id=indicator_raw['id'],
+        owner=org_id,
+        source=source_id,
+        indicator_type=indicator_raw['indicatorType']['name'],
+        names=[(indicator_raw['name'], 'Fully Specified'),
+               (indicator_raw['shortName'], 'Short')],
+        extras={
             'annualized': indicator_raw.get('annualized', ''),
             'denominator': indicator_raw.get('denominator', ''),
             'denominatorDescription': indicator_raw.get('denominatorDescription', ''),
@@ -1405,10 +1220,7 @@ def build_concept_from_datim_indicator(indicator_raw, org_id='', source_id='',
             ATTR_RESULT_TARGET: result_target,
             ATTR_APPLICABLE_PERIODS: indicator_periods
         },
-        '__url': ocldev.oclconstants.OclConstants.get_resource_url(
-            owner_id=org_id, repository_id=source_id, resource_id=indicator_raw['id'],
-            include_trailing_slash=True)
-    }
+        url=msp_urls.get_concept_url(org_id, source_id, indicator_raw['id']))
 
     # Determine mapped indicator code
     ref_indicator_code = lookup_reference_indicator_code(
@@ -1425,6 +1237,7 @@ def build_concept_from_datim_indicator(indicator_raw, org_id='', source_id='',
     return indicator_concept
 
 
+@msp_profile.profiled()
 def parse_indicator_formula(formula, org_id, source_id, de_concepts, coc_concepts):
     """
     Return an array of parsed terms that appear in the specified indicator formula.
@@ -1437,6 +1250,7 @@ def parse_indicator_formula(formula, org_id, source_id, de_concepts, coc_concept
     """
     regex = r'(#\{(?P<deuid>(?:\S|\d){11})(?:\}|(?:.(?P<cocuid>(?:\S|\d){11}))(?:\}|(?:.(?P<mechanismuid>(?:\S|\d){11}))\})))'
     matches = re.findall(regex, formula)
+    url_factory = msp_urls.get_url_factory(org_id, source_id)
     parsed_formula = []
     has_mechanism = False
     for (full_match, de_uid, coc_uid, mechanism_uid) in matches:
@@ -1445,9 +1259,7 @@ def parse_indicator_formula(formula, org_id, source_id, de_concepts, coc_concept
         mechanism_name = ''
 
         # Get the DE name
-        de_url = ocldev.oclconstants.OclConstants.get_resource_url(
-            owner_id=org_id, repository_id=source_id, resource_id=de_uid,
-            include_trailing_slash=True)
+        de_url = url_factory.concept_url(de_uid)
         de_concept = de_concepts.get_resource_by_url(de_url)
         if de_concept:
             de_concept_name = ocldev.oclresourcelist.OclResourceList.get_concept_name_by_type(
@@ -1457,9 +1269,7 @@ def parse_indicator_formula(formula, org_id, source_id, de_concepts, coc_concept
 
         # Get the COC name, if present
         if coc_uid:
-            coc_url = ocldev.oclconstants.OclConstants.get_resource_url(
-                owner_id=org_id, repository_id=source_id, resource_id=coc_uid,
-                include_trailing_slash=True)
+            coc_url = url_factory.concept_url(coc_uid)
             coc_concept = coc_concepts.get_resource_by_url(coc_url)
             if coc_concept:
                 coc_concept_name = ocldev.oclresourcelist.OclResourceList.get_concept_name_by_type(
@@ -1488,6 +1298,7 @@ def parse_indicator_formula(formula, org_id, source_id, de_concepts, coc_concept
     return parsed_formula
 
 
+@msp_profile.profiled()
 def replace_formula_uids_with_names(formula, org_id, source_id, de_concepts, coc_concepts):
     """
     Return a formula string with UIDs replaced with human-readable codes or names.
@@ -1500,6 +1311,7 @@ def replace_formula_uids_with_names(formula, org_id, source_id, de_concepts, coc
     # regex = r'(#\{(?P<deuid>(?:\S|\d){11})(?:\}|(?:.(?P<cocuid>(?:\S|\d){11}))\}))'
     regex = r'(#\{(?P<deuid>(?:\S|\d){11})(?:\}|(?:.(?P<cocuid>(?:\S|\d){11}))(?:\}|(?:.(?P<mechanismuid>(?:\S|\d){11}))\})))'
     matches = re.findall(regex, formula)
+    url_factory = msp_urls.get_url_factory(org_id, source_id)
     new_formula = formula
     for (full_match, de_uid, coc_uid, mechanism_uid) in matches:
         de_concept_name = ''
@@ -1507,9 +1319,7 @@ def replace_formula_uids_with_names(formula, org_id, source_id, de_concepts, coc
         mechanism_name = ''
 
         # Get the DE name
-        de_url = ocldev.oclconstants.OclConstants.get_resource_url(
-            owner_id=org_id, repository_id=source_id, resource_id=de_uid,
-            include_trailing_slash=True)
+        de_url = url_factory.concept_url(de_uid)
         de_concept = de_concepts.get_resource_by_url(de_url)
         de_concept_name = ''
         if de_concept:
@@ -1523,9 +1333,7 @@ def replace_formula_uids_with_names(formula, org_id, source_id, de_concepts, coc
         # Get the COC name, if present
         if coc_uid:
             coc_concept_name = ''
-            coc_url = ocldev.oclconstants.OclConstants.get_resource_url(
-                owner_id=org_id, repository_id=source_id, resource_id=coc_uid,
-                include_trailing_slash=True)
+            coc_url = url_factory.concept_url(coc_uid)
             coc_concept = coc_concepts.get_resource_by_url(coc_url)
             if coc_concept:
                 coc_concept_name = ocldev.oclresourcelist.OclResourceList.get_concept_name_by_type(
@@ -1554,40 +1362,26 @@ def replace_formula_uids_with_names(formula, org_id, source_id, de_concepts, coc
     return new_formula
 
 
+@msp_profile.profiled()
 def build_concept_from_datim_coc(coc_raw, org_id, source_id):
-    """ Return an OCL-formatted concept for the specified DATIM category option combo """
-    coc_concept = {
-        'type': 'Concept',
-        'id': coc_raw['id'],
-        'concept_class': 'Category Option Combo',
-        'datatype': 'None',
-        'owner': org_id,
-        'owner_type': 'Organization',
-        'source': source_id,
-        'retired': False,
-        'descriptions': None,
-        'external_id': coc_raw['id'],
-        'names': [
-            {
-                'name': coc_raw['name'],
-                'name_type': 'Fully Specified',
-                'locale': 'en',
-                'locale_preferred': True,
-                'external_id': None,
-            }
-        ],
-        '__url': '/orgs/%s/sources/%s/concepts/%s/' % (org_id, source_id, coc_raw['id'])
-    }
+    """ Return a CategoryOptionComboRecord for the specified DATIM category option combo """
+    coc_concept = msp_records.CategoryOptionComboRecord(
+        concept_id=coc_raw['id'],
+        owner=org_id,
+        source=source_id,
+        names=[(coc_raw['name'], 'Fully Specified')],
+        url=msp_urls.get_concept_url(org_id, source_id, coc_raw['id']))
     return coc_concept
 
 
+@msp_profile.profiled()
 def build_concept_from_datim_de(de_raw, org_id, source_id, sorted_ref_indicator_codes,
                                 codelist_collections, ref_indicator_concepts):
-    """ Return an OCL-formatted concept for the specified DATIM data element """
+    """ Return a DataElementRecord for the specified DATIM data element """
 
     # Determine core data element attributes
     de_concept_id = de_raw['id']  # eg sAxSUTFc5tp
-    de_code = de_raw['code'] if 'code' in de_raw else de_raw['shortName']
+    de_code = get_data_element_code(de_raw)
     de_result_or_target = get_data_element_result_or_target(de_code=de_code)
     de_numerator_or_denominator = get_data_element_numerator_or_denominator(de_code=de_code)
     de_version = get_data_element_version(de_code=de_code)  # v2, v3, ...
@@ -1595,62 +1389,22 @@ def build_concept_from_datim_de(de_raw, org_id, source_id, sorted_ref_indicator_
     de_support_type = get_data_element_support_type(de_code=de_code)  # DSD, TA, CS, ...
     de_structured_dataset = get_data_element_structured_dataset(de_code=de_code) # SIMS, MER, ...
 
-    # Build the OCL formatted concept
-    de_concept = {
-        'type': 'Concept',
-        'id': de_concept_id,
-        'concept_class': 'Data Element',
-        'datatype': 'Numeric',
-        'owner': org_id,
-        'owner_type': 'Organization',
-        'source': source_id,
-        'retired': False,
-        'external_id': de_raw['id'],
-        'descriptions': None,
-        'names': [
-            {
-                'name': de_raw['name'],
-                'name_type': 'Fully Specified',
-                'locale': 'en',
-                'locale_preferred': True,
-                'external_id': None,
-            },
-            {
-                'name': de_raw['shortName'],
-                'name_type': 'Short',
-                'locale': 'en',
-                'locale_preferred': False,
-                'external_id': None,
-            }
-        ],
-        'extras': {
+    # Build the OCL formatted concept, including the DE code as a concept synonym (not all DEs
+    # have codes) and the DE description (most DEs do not have descriptions)
+    de_names = [(de_raw['name'], 'Fully Specified'), (de_raw['shortName'], 'Short')]
+    if 'code' in de_raw:
+        de_names.append((de_raw['code'], 'Code'))
+    de_concept = msp_records.DataElementRecord(
+        concept_id=de_concept_id,
+        owner=org_id,
+        source=source_id,
+        names=de_names,
+        description=de_raw.get('description') or None,
+        extras={
             'source': 'DATIM',
             'data_element_root': de_code_root,
-        }
-    }
-
-    # Save DE code as a concept synonym (not all DEs have codes)
-    if 'code' in de_raw:
-        de_concept['names'].append({
-            'name': de_raw['code'],
-            'name_type': 'Code',
-            'locale': 'en',
-            'locale_preferred': False,
-            'external_id': None,
         })
 
-    # Save DE description as a concept description (most DEs do not have descriptions)
-    if 'description' in de_raw and de_raw['description']:
-        de_concept['descriptions'] = [
-            {
-                'description': de_raw['description'],
-                'description_type': 'Description',
-                'locale': 'en',
-                'locale_preferred': True,
-                'external_id': None,
-            }
-        ]
-
     # Generate DE 'codelists' and 'applicable_periods'
     de_codelists = get_codelists_for_data_element(
         de_concept_id, codelist_collections)
@@ -1702,12 +1456,14 @@ def build_concept_from_datim_de(de_raw, org_id, source_id, sorted_ref_indicator_
         de_concept['extras'][ATTR_STRUCTURED_DATASET] = de_structured_dataset
 
     # Add throw-away attributes that are used later in processing
-    de_concept['__url'] = '/orgs/%s/sources/%s/concepts/%s/' % (org_id, source_id, de_concept_id)
-    de_concept['__cocs'] = de_raw['categoryCombo']['categoryOptionCombos']
+    de_concept.url = msp_urls.get_concept_url(org_id, source_id, de_concept_id)
+    de_concept.category_combo_id = de_raw['categoryCombo'].get('id')
+    de_concept.cocs = msp_records.get_category_combo_cocs(de_raw['categoryCombo'])
 
     return de_concept
 
 
+@msp_profile.profiled()
 def get_codelists_for_data_element(de_uid, codelist_collections):
     """
     Returns the codelists that the specified data element is a member of. Example return value:
@@ -1718,18 +1474,49 @@ def get_codelists_for_data_element(de_uid, codelist_collections):
     """
     de_codelists = []
     for codelist in codelist_collections:
-        for row in codelist['extras']['dhis2_codelist']['listGrid']['rows']:
-            if row[DATIM_CODELIST_COLUMN_DATA_ELEMENT_UID] == de_uid:
-                de_codelists.append({
-                    'code': codelist['id'],
-                    'id': codelist['external_id'],
-                    'name': codelist['full_name'],
-                    'shortName': codelist['name'],
-                })
-                break
+        if msp_codelist_store.rows_have_value(
+                get_codelist_rows(codelist), DATIM_CODELIST_COLUMN_DATA_ELEMENT_UID, de_uid):
+            de_codelists.append({
+                'code': codelist['id'],
+                'id': codelist['external_id'],
+                'name': codelist['full_name'],
+                'shortName': codelist['name'],
+            })
     return de_codelists
 
 
+def get_data_element_uids_from_codelist_collections(codelist_collections):
+    """ Returns set of the UIDs of all data elements in the specified codelists """
+    de_uids = set()
+    for codelist in codelist_collections:
+        for (de_uid,) in msp_codelist_store.iter_row_values(
+                get_codelist_rows(codelist), DATIM_CODELIST_COLUMN_DATA_ELEMENT_UID):
+            de_uids.add(de_uid)
+    return de_uids
+
+
+def get_codelist_collections_with_data_elements(codelist_collections, de_concepts):
+    """ Returns list of the codelists that contain at least one of the data element concepts """
+    de_uids = set(de_concept['id'] for de_concept in de_concepts)
+    filtered_codelist_collections = []
+    for codelist in codelist_collections:
+        for (de_uid,) in msp_codelist_store.iter_row_values(
+                get_codelist_rows(codelist), DATIM_CODELIST_COLUMN_DATA_ELEMENT_UID):
+            if de_uid in de_uids:
+                filtered_codelist_collections.append(codelist)
+                break
+    return filtered_codelist_collections
+
+
+def get_codelist_rows(codelist):
+    """
+    Returns the listGrid rows of a codelist collection's DATIM export. Rows are either a list of
+    lists or a msp_codelist_store.CodelistRows view, depending on how the codelist was loaded.
+    """
+    return codelist['extras']['dhis2_codelist']['listGrid']['rows']
+
+
+@msp_profile.profiled()
 def get_de_reporting_frequency(de_name='', de_result_or_target='', de_indicator_code='',
                                de_applicable_periods=None, ref_indicator_concepts=None):
     """
@@ -1757,6 +1544,7 @@ def get_de_reporting_frequency(de_name='', de_result_or_target='', de_indicator_
     return ''
 
 
+@msp_profile.profiled()
 def build_linkages_de_version(de_concepts=None):
     """ Return a dictionary describing DEs that have multiple versions. """
 
@@ -1788,6 +1576,7 @@ def build_linkages_de_version(de_concepts=None):
     return de_filtered_versions
 
 
+@msp_profile.profiled()
 def build_linkages_dde_version(ihub_dde_concepts=None):
     """ Get a dictionary of DDEs that have multiple versions """
 
@@ -1816,6 +1605,7 @@ def build_linkages_dde_version(ihub_dde_concepts=None):
     return de_filtered_versions
 
 
+@msp_profile.profiled()
 def build_maps_from_de_linkages(de_linkages=None):
     """
     Return a dictionary representing data element version linkages, where a data element URL is
@@ -1835,7 +1625,9 @@ def build_maps_from_de_linkages(de_linkages=None):
     return map_de_linkages
 
 
-def build_linkages_source_de(ihub_dde_concepts=None, owner_id='', source_id=''):
+@msp_profile.profiled()
+def build_linkages_source_de(ihub_dde_concepts=None, owner_id='', source_id='',
+                             concept_urls=None):
     """
     Return a dictionary representing linkages between iHUB derived data elements and their
     source data elements. The keys are the derived data element URLs, and values are lists of
@@ -1843,76 +1635,90 @@ def build_linkages_source_de(ihub_dde_concepts=None, owner_id='', source_id=''):
     :param ihub_dde_concepts:
     :param owner_id:
     :param source_id:
+    :param concept_urls: If set, linkages to source data elements that are not in this set of
+        concept URLs are omitted, eg data elements outside the period slice of a build
     :return:
     """
     dde_source_linkages = {}
+    url_factory = msp_urls.get_url_factory(owner_id, source_id)
     for de_concept in ihub_dde_concepts:
         if de_concept['__url'] not in dde_source_linkages:
             dde_source_linkages[de_concept['__url']] = []
         for source_linkage in de_concept['extras']['source_data_elements']:
-            source_de_url = '/orgs/%s/sources/%s/concepts/%s/' % (
-                owner_id, source_id, source_linkage['source_data_element_uid'])
+            source_de_url = url_factory.concept_url(source_linkage['source_data_element_uid'])
+            if concept_urls is not None and source_de_url not in concept_urls:
+                continue
             if source_de_url not in dde_source_linkages[de_concept['__url']]:
                 dde_source_linkages[de_concept['__url']].append(source_de_url)
     return dde_source_linkages
 
 
+@msp_profile.profiled()
 def build_ref_indicator_to_child_resource_maps(child_concepts=None, sorted_ref_indicator_codes=None,
                                                org_id='', source_id=''):
     """
-    Return dictionary with reference indicator URL as key and list of child concept URLs as value.
-    Compatible with DATIM data elements, iHUB derived data elements, DATIM indicators, or any other
-    list of resources with an 'indicator' custom attribute specifying the mapped reference indicator
-    code and a '__url' core attribute. Child resources that with an unrecognized or missing
-    reference indicator code are omitted.
+    Return msp_graph.CsrRelation with reference indicator URL as key and child concept URLs as
+    value. Compatible with DATIM data elements, iHUB derived data elements, DATIM indicators, or
+    any other list of resources with an 'indicator' custom attribute specifying the mapped
+    reference indicator code and a '__url' core attribute. Child resources that with an
+    unrecognized or missing reference indicator code are omitted.
     """
-    map_indicator_to_child_resource = {}
+    map_indicator_to_child_resource = msp_graph.CsrRelationBuilder(
+        registry=msp_graph.get_concept_registry(org_id, source_id))
+    url_factory = msp_urls.get_url_factory(org_id, source_id)
+    ref_indicator_codes = set(sorted_ref_indicator_codes)
     for child_concept in child_concepts:
         if ('indicator' in child_concept['extras'] and
-                child_concept['extras']['indicator'] in sorted_ref_indicator_codes):
+                child_concept['extras']['indicator'] in ref_indicator_codes):
             de_indicator_code = child_concept['extras']['indicator']
-            indicator_concept_url = '/orgs/%s/sources/%s/concepts/%s/' % (
-                org_id, source_id, de_indicator_code)
-            if indicator_concept_url not in map_indicator_to_child_resource:
-                map_indicator_to_child_resource[indicator_concept_url] = []
-            map_indicator_to_child_resource[indicator_concept_url].append(child_concept['__url'])
-    return map_indicator_to_child_resource
+            indicator_concept_url = url_factory.concept_url(de_indicator_code)
+            map_indicator_to_child_resource.add_edge(indicator_concept_url, child_concept['__url'])
+    return map_indicator_to_child_resource.build()
 
 
+@msp_profile.profiled()
 def build_de_to_coc_maps(de_concepts, coc_concepts, org_id, source_id):
-    """ Return dictionary with DE URL as key and list of COC URLs as value """
-    map_de_to_coc = {}
+    """
+    Return msp_graph.SharedTargetRelation with DE URL as key and COC URLs as value. DEs share
+    the COC URL tuple of their categoryCombo, which is resolved and validated once per combo.
+    """
+    map_de_to_coc = msp_graph.SharedTargetRelationBuilder(
+        registry=msp_graph.get_concept_registry(org_id, source_id))
+    url_factory = msp_urls.get_url_factory(org_id, source_id)
+    coc_concept_urls = set(coc_concept['__url'] for coc_concept in coc_concepts)
     for de_concept in de_concepts:
-        if de_concept['__url'] not in map_de_to_coc:
-            map_de_to_coc[de_concept['__url']] = []
-        for coc_raw in de_concept['__cocs']:
-            coc_concept_url = '/orgs/%s/sources/%s/concepts/%s/' % (
-                org_id, source_id, coc_raw['id'])
-            coc_concept = coc_concepts.get_resource_by_url(coc_concept_url)
-            if not coc_concept:
-                raise Exception("Houston, we've got a problem. COC not found: %s" % coc_concept_url)
-            map_de_to_coc[de_concept['__url']].append(coc_concept_url)
-    return map_de_to_coc
-
-
+        # DEs in the same categoryCombo share one COC tuple object, which keys the group
+        de_cocs = de_concept['__cocs']
+        group_key = id(de_cocs)
+        group_index = map_de_to_coc.get_group(group_key)
+        if group_index is None:
+            de_coc_urls = [url_factory.concept_url(coc_raw['id']) for coc_raw in de_cocs]
+            for coc_concept_url in de_coc_urls:
+                if coc_concept_url not in coc_concept_urls:
+                    raise Exception(
+                        "Houston, we've got a problem. COC not found: %s" % coc_concept_url)
+            group_index = map_de_to_coc.add_group(group_key, de_coc_urls)
+        map_de_to_coc.add_source(de_concept['__url'], group_index)
+    return map_de_to_coc.build()
+
+
+@msp_profile.profiled()
 def build_codelist_to_de_map(codelist_collections, de_concepts, org_id, source_id):
     """
-    Returns dictionary with Codelist ID (eg GiqB9vjbdwb) as top-level key, DE URL as 2nd-level key,
-    and list of COC URLs as value.
+    Returns dictionary with Codelist ID (eg GiqB9vjbdwb) as key and msp_graph.CsrRelation as
+    value, where the relation has DE URL as key and COC URLs as value.
     """
     map_codelist_to_de_to_coc = {}
+    url_factory = msp_urls.get_url_factory(org_id, source_id)
+    registry = msp_graph.get_concept_registry(org_id, source_id)
     for codelist in codelist_collections:
-        codelist_id = codelist['external_id']
-        map_codelist_to_de_to_coc[codelist_id] = {}
-        for row in codelist['extras']['dhis2_codelist']['listGrid']['rows']:
-            de_uid = row[DATIM_CODELIST_COLUMN_DATA_ELEMENT_UID]
-            coc_uid = row[DATIM_CODELIST_COLUMN_COC_CODE]
-            de_url = '/orgs/%s/sources/%s/concepts/%s/' % (org_id, source_id, de_uid)
-            coc_url = '/orgs/%s/sources/%s/concepts/%s/' % (org_id, source_id, coc_uid)
-            if de_url not in map_codelist_to_de_to_coc[codelist_id]:
-                map_codelist_to_de_to_coc[codelist_id][de_url] = []
-            if coc_url not in map_codelist_to_de_to_coc[codelist_id][de_url]:
-                map_codelist_to_de_to_coc[codelist_id][de_url].append(coc_url)
+        map_de_to_coc = msp_graph.CsrRelationBuilder(registry=registry)
+        for de_uid, coc_uid in msp_codelist_store.iter_row_values(
+                get_codelist_rows(codelist), DATIM_CODELIST_COLUMN_DATA_ELEMENT_UID,
+                DATIM_CODELIST_COLUMN_COC_CODE):
+            map_de_to_coc.add_edge(
+                url_factory.concept_url(de_uid), url_factory.concept_url(coc_uid))
+        map_codelist_to_de_to_coc[codelist['external_id']] = map_de_to_coc.build()
     return map_codelist_to_de_to_coc
 
 
@@ -1959,17 +1765,21 @@ def get_data_element_name_modifiers(de_name):
     return ''
 
 
+@msp_profile.profiled()
 def build_all_ihub_dde_concepts(ihub_raw, num_run_sequences=3, org_id='', source_id='',
                                 sorted_ref_indicator_codes=None, ref_indicator_concepts=None,
-                                ihub_rule_period_end_year=2020):
+                                ihub_rule_period_end_year=2020, periods=None):
     """
     Returns dictionary with unique DDE URL as key and DDE concept as value.
     Iterates thru iHUB rows once per run sequence. The first run sequence relies
     only on DATIM data elements, whereas subsequent run sequences rely on data
     elements derived in a previous run sequence. Run sequences are defined
-    explicitly in the iHUB source data.
+    explicitly in the iHUB source data. If periods is provided, DDEs whose applicable periods
+    (set by the first row of each DDE) do not include one of the periods are skipped.
     """
     ihub_dde_concepts = {}
+    skipped_dde_concept_urls = set()
+    url_factory = msp_urls.get_url_factory(org_id, source_id)
     for i in range(num_run_sequences):
         current_run_sequence_str = str(i + 1)
         for ihub_row in ihub_raw:
@@ -1979,13 +1789,19 @@ def build_all_ihub_dde_concepts(ihub_raw, num_run_sequences=3, org_id='', source
                 continue
 
             # Build the iHUB derived data element (DDE) concept
-            dde_concept_url = '/orgs/%s/sources/%s/concepts/%s/' % (
-                org_id, source_id, ihub_row[IHUB_COLUMN_DERIVED_DATA_ELEMENT_UID])
+            dde_concept_url = url_factory.concept_url(
+                ihub_row[IHUB_COLUMN_DERIVED_DATA_ELEMENT_UID])
+            if dde_concept_url in skipped_dde_concept_urls:
+                continue
             if dde_concept_url not in ihub_dde_concepts:
-                dde_concept = build_concept_from_ihub_dde(
+                if periods and not is_applicable_to_periods(get_ihub_rule_applicable_periods(
+                        ihub_row, ihub_rule_period_end_year), periods):
+                    skipped_dde_concept_urls.add(dde_concept_url)
+                    continue
+                ihub_dde_concepts[dde_concept_url] = build_concept_from_ihub_dde(
                     ihub_row, org_id, source_id, sorted_ref_indicator_codes,
                     ref_indicator_concepts, ihub_rule_period_end_year)
-                ihub_dde_concepts[dde_concept_url] = dde_concept
+            dde_concept = ihub_dde_concepts[dde_concept_url]
 
             # Set the current source DE/COC to the DDE's custom attribute
             dde_concept['extras']['source_data_elements'].append({
@@ -2000,31 +1816,25 @@ def build_all_ihub_dde_concepts(ihub_raw, num_run_sequences=3, org_id='', source
             })
 
             # Store the COC mapping
-            ihub_derived_coc_url = '/orgs/%s/sources/%s/concepts/%s/' % (
-                org_id, source_id, ihub_row[IHUB_COLUMN_DERIVED_COC_UID])
+            ihub_derived_coc_url = url_factory.concept_url(ihub_row[IHUB_COLUMN_DERIVED_COC_UID])
             if ihub_derived_coc_url not in ihub_dde_concepts[dde_concept_url]['__cocs']:
                 ihub_dde_concepts[dde_concept_url]['__cocs'].append(ihub_derived_coc_url)
 
     return ihub_dde_concepts
 
 
+@msp_profile.profiled()
 def build_concept_from_ihub_dde(ihub_row, org_id, source_id, sorted_ref_indicator_codes,
                                 ref_indicator_concepts, ihub_rule_period_end_year):
-    """ Return an OCL-formatted concept for the specified iHUB derived data element """
+    """ Return a DerivedDataElementRecord for the specified iHUB derived data element """
     de_applicable_periods = get_ihub_rule_applicable_periods(ihub_row, ihub_rule_period_end_year)
     de_result_or_target = ihub_row[IHUB_COLUMN_RESULT_TARGET].lower().capitalize()
-    dde_concept = {
-        'type': 'Concept',
-        'id': ihub_row[IHUB_COLUMN_DERIVED_DATA_ELEMENT_UID],
-        'concept_class': 'Data Element',
-        'datatype': 'Numeric',
-        'owner': org_id,
-        'owner_type': 'Organization',
-        'source': source_id,
-        'retired': False,
-        'external_id': ihub_row[IHUB_COLUMN_DERIVED_DATA_ELEMENT_UID],
-        'descriptions': None,
-        'extras': {
+    dde_concept = msp_records.DerivedDataElementRecord(
+        concept_id=ihub_row[IHUB_COLUMN_DERIVED_DATA_ELEMENT_UID],
+        owner=org_id,
+        source=source_id,
+        names=[(ihub_row[IHUB_COLUMN_DERIVED_DATA_ELEMENT_NAME], 'Fully Specified')],
+        extras={
             'source': 'iHUB',
             ATTR_RESULT_TARGET: de_result_or_target,
             'ihub_indicator_code': ihub_row.get(IHUB_COLUMN_INDICATOR, ''),
@@ -2034,19 +1844,9 @@ def build_concept_from_ihub_dde(ihub_row, org_id, source_id, sorted_ref_indicato
             'ihub_rule_begin_period': ihub_row[IHUB_COLUMN_RULE_BEGIN_PERIOD],
             'ihub_rule_end_period': ihub_row[IHUB_COLUMN_RULE_END_PERIOD],
             ATTR_APPLICABLE_PERIODS: de_applicable_periods,
-            ATTR_STRUCTURED_DATASET: 'MER',
+            ATTR_STRUCTURED_DATASET: IHUB_STRUCTURED_DATASET,
             'source_data_elements': []
-        },
-        'names': [
-            {
-                'name': ihub_row[IHUB_COLUMN_DERIVED_DATA_ELEMENT_NAME],
-                'name_type': 'Fully Specified',
-                'locale': 'en',
-                'locale_preferred': True,
-                'external_id': None,
-            }
-        ]
-    }
+        })
 
     # Determine mapped reference indicator code
     dde_standard_indicator_code = lookup_reference_indicator_code(
@@ -2081,50 +1881,140 @@ def build_concept_from_ihub_dde(ihub_row, org_id, source_id, sorted_ref_indicato
         dde_concept['extras'][ATTR_REPORTING_FREQUENCY] = de_reporting_frequency
 
     # Set throwaway attributes
-    dde_concept['__url'] = '/orgs/%s/sources/%s/concepts/%s/' % (
+    dde_concept.url = msp_urls.get_concept_url(
         org_id, source_id, ihub_row[IHUB_COLUMN_DERIVED_DATA_ELEMENT_UID])
-    dde_concept['__cocs'] = []
+    dde_concept.cocs = []
 
     return dde_concept
 
 
+@msp_profile.profiled()
 def build_ihub_dde_to_coc_maps(ihub_dde_concepts, coc_concepts=None):
     """
-    Return dictionary with DDE URL as key and list of COC URLs as value.
+    Return msp_graph.CsrRelation with DDE URL as key and COC URLs as value.
     If coc_concepts provided, validates that each derived COC is present
     in the coc_concepts list.
     """
-    map_ihub_dde_to_coc = {}
+    map_ihub_dde_to_coc = None
+    coc_concept_urls = None
+    if coc_concepts is not None:
+        coc_concept_urls = set(coc_concept['__url'] for coc_concept in coc_concepts)
     for ihub_dde_concept in ihub_dde_concepts:
-        map_ihub_dde_to_coc[ihub_dde_concept['__url']] = []
+        if map_ihub_dde_to_coc is None:
+            map_ihub_dde_to_coc = msp_graph.CsrRelationBuilder(
+                registry=msp_graph.get_concept_registry(
+                    ihub_dde_concept['owner'], ihub_dde_concept['source']))
+        map_ihub_dde_to_coc.add_source(ihub_dde_concept['__url'])
         for coc_url in ihub_dde_concept['__cocs']:
-            coc_concept = coc_concepts.get_resource_by_url(coc_url)
-            if not coc_concept:
-                err_msg = 'ERROR: COC for derived data element not found:' % coc_url
+            if coc_concept_urls is not None and coc_url not in coc_concept_urls:
+                err_msg = 'ERROR: COC for derived data element not found: %s' % coc_url
                 raise Exception(err_msg)
-            if coc_url not in map_ihub_dde_to_coc[ihub_dde_concept['__url']]:
-                map_ihub_dde_to_coc[ihub_dde_concept['__url']].append(coc_url)
-    return map_ihub_dde_to_coc
+            map_ihub_dde_to_coc.add_edge(ihub_dde_concept['__url'], coc_url)
+    if map_ihub_dde_to_coc is None:
+        return msp_graph.CsrRelationBuilder().build()
+    return map_ihub_dde_to_coc.build()
 
 
 def get_datim_codelist_stats(codelist_datim):
     """
     Returns counts of rows, data elements and category option combos in the DATIM codelist
     """
-    unique_data_element_ids = {}
-    unique_coc_ids = {}
-    for row in codelist_datim['listGrid']['rows']:
-        unique_data_element_ids[row[DATIM_CODELIST_COLUMN_DATA_ELEMENT_UID]] = True
-        unique_coc_ids[row[DATIM_CODELIST_COLUMN_COC_UID]] = True
+    rows = codelist_datim['listGrid']['rows']
     return {
-        'Total Rows': len(codelist_datim['listGrid']['rows']),
-        'Unique Data Element IDs': len(unique_data_element_ids),
-        'Unique COC IDs:': len(unique_coc_ids),
+        'Total Rows': len(rows),
+        'Unique Data Element IDs': msp_codelist_store.count_unique_row_values(
+            rows, DATIM_CODELIST_COLUMN_DATA_ELEMENT_UID),
+        'Unique COC IDs:': msp_codelist_store.count_unique_row_values(
+            rows, DATIM_CODELIST_COLUMN_COC_UID),
     }
 
 
-def diff_codelist(codelist_ocl=None, codelist_datim=None):
-    """ Return a diff evaluated between two codelists, one from OCL and one from DATIM """
+def get_ocl_codelist_stats(codelist_ocl):
+    """
+    Returns the same counts of concepts and mappings as OclExport.get_stats, but looks up the
+    from/to concepts of each mapping in a set of concept URLs instead of scanning the concepts
+    """
+    concepts = codelist_ocl.get_concepts()
+    mappings = codelist_ocl.get_mappings()
+    concept_urls = set(concept['url'] for concept in concepts)
+    stats = {
+        'Concepts': {'Total': len(concepts)},
+        'Mappings': {'Subtotal Internal': 0, 'Subtotal External': 0, 'Total': len(mappings)},
+    }
+    for stat_type, resources, stat_fields in (
+            ('Concepts', concepts, ('source', 'concept_class', 'datatype')),
+            ('Mappings', mappings, ('source', 'map_type', 'from_source_url', 'to_source_url'))):
+        for stat_field in stat_fields:
+            field_counts = stats[stat_type][stat_field] = {}
+            for resource in resources:
+                if stat_field in resource:
+                    field_counts[resource[stat_field]] = field_counts.get(
+                        resource[stat_field], 0) + 1
+    for mapping in mappings:
+        if (mapping.get('from_concept_url') in concept_urls and
+                mapping.get('to_concept_url') in concept_urls):
+            stats['Mappings']['Subtotal Internal'] += 1
+        else:
+            stats['Mappings']['Subtotal External'] += 1
+    return stats
+
+
+def get_codelist_concept_key(concept, match_codes=True):
+    """
+    Return the key matched against the DATIM codelist rows for a data element or COC concept:
+    (ID, external ID) to match the (code, UID) columns, or (external ID,) to match the UID
+    column only if match_codes is False
+    """
+    if match_codes:
+        return (concept.get('id'), concept.get('external_id'))
+    return (concept.get('external_id'),)
+
+
+def index_codelist_ocl(codelist_ocl, match_codes=True):
+    """
+    Index an OCL codelist export for diff_codelist with one pass over its concepts and mappings.
+    Returns a dictionary with:
+    * de_counts, coc_counts: number of data element/COC concepts for each key (see
+      get_codelist_concept_key)
+    * de_urls, coc_urls: URL of the first data element/COC concept for each key
+    * mapping_counts: number of DE-to-COC mappings for each (from URL, to URL) pair
+    * de_concepts: data element concepts in export order
+    * mappings_by_from_url: DE-to-COC mappings by from_concept_url in export order
+    * concepts_by_url: first concept for each URL
+    """
+    index = {
+        'de_counts': {}, 'coc_counts': {}, 'de_urls': {}, 'coc_urls': {}, 'mapping_counts': {},
+        'de_concepts': [], 'mappings_by_from_url': {}, 'concepts_by_url': {},
+    }
+    for concept in codelist_ocl.get_concepts():
+        index['concepts_by_url'].setdefault(concept['url'], concept)
+        if 'external_id' not in concept or (match_codes and 'id' not in concept):
+            continue
+        concept_key = get_codelist_concept_key(concept, match_codes=match_codes)
+        if concept.get('concept_class') == 'Data Element':
+            index['de_concepts'].append(concept)
+            counts, urls = index['de_counts'], index['de_urls']
+        elif concept.get('concept_class') == 'Category Option Combo':
+            counts, urls = index['coc_counts'], index['coc_urls']
+        else:
+            continue
+        counts[concept_key] = counts.get(concept_key, 0) + 1
+        urls.setdefault(concept_key, concept['url'])
+    for mapping in codelist_ocl.get_mappings(map_type=MSP_MAP_TYPE_DE_TO_COC):
+        mapping_key = (mapping['from_concept_url'], mapping['to_concept_url'])
+        index['mapping_counts'][mapping_key] = index['mapping_counts'].get(mapping_key, 0) + 1
+        index['mappings_by_from_url'].setdefault(mapping['from_concept_url'], []).append(mapping)
+    return index
+
+
+def diff_codelist(codelist_ocl=None, codelist_datim=None, match_codes=True):
+    """
+    Return a diff evaluated between two codelists, one from OCL and one from DATIM.
+    Both codelists are indexed once (see index_codelist_ocl), so the diff is linear in the
+    number of DATIM rows plus the number of OCL concepts and mappings. Concepts are matched on
+    their ID and external ID, or only on their external ID (the DATIM UID) if match_codes is
+    False, eg for the concepts built by this repository, whose IDs are UIDs rather than codes.
+    """
     diff = {
         'missing_in_ocl_de': [],
         'missing_in_ocl_coc': [],
@@ -2134,66 +2024,61 @@ def diff_codelist(codelist_ocl=None, codelist_datim=None):
         'too_many_in_ocl_mapping': [],
         'missing_in_datim_codelist': []
     }
-
-    # Iterate thru the DATIM list
-    for row in codelist_datim['listGrid']['rows']:
-        # Find the Data Element
-        de_concepts = codelist_ocl.get_concepts(core_attrs={
-            'id': row[DATIM_CODELIST_COLUMN_DATA_ELEMENT_CODE],
-            'external_id': row[DATIM_CODELIST_COLUMN_DATA_ELEMENT_UID],
-            'concept_class': 'Data Element'
-        })
-        if len(de_concepts) == 0:
+    index = index_codelist_ocl(codelist_ocl, match_codes=match_codes)
+    rows = codelist_datim['listGrid']['rows']
+    if match_codes:
+        key_columns = (DATIM_CODELIST_COLUMN_DATA_ELEMENT_CODE,
+                       DATIM_CODELIST_COLUMN_DATA_ELEMENT_UID,
+                       DATIM_CODELIST_COLUMN_COC_CODE, DATIM_CODELIST_COLUMN_COC_UID)
+    else:
+        key_columns = (DATIM_CODELIST_COLUMN_DATA_ELEMENT_UID, DATIM_CODELIST_COLUMN_COC_UID)
+    row_keys = list(msp_codelist_store.iter_row_values(rows, *key_columns))
+    de_key_length = len(key_columns) // 2
+
+    # Data element and COC keys of the DATIM rows that are missing or duplicated in OCL
+    datim_de_keys = set(row_key[:de_key_length] for row_key in row_keys)
+    datim_coc_keys = set(row_key[de_key_length:] for row_key in row_keys)
+    missing_de_keys = datim_de_keys - set(index['de_counts'])
+    missing_coc_keys = datim_coc_keys - set(index['coc_counts'])
+    too_many_de_keys = set(key for key, count in index['de_counts'].items() if count > 1)
+    too_many_coc_keys = set(key for key, count in index['coc_counts'].items() if count > 1)
+
+    # (DE, COC) keys of the DATIM rows whose mapping is missing or duplicated in OCL
+    missing_mapping_keys = set()
+    too_many_mapping_keys = set()
+    for row_key in set(row_keys):
+        de_url = index['de_urls'].get(row_key[:de_key_length])
+        coc_url = index['coc_urls'].get(row_key[de_key_length:])
+        num_mappings = index['mapping_counts'].get((de_url, coc_url), 0)
+        if de_url is None or coc_url is None or num_mappings == 0:
+            missing_mapping_keys.add(row_key)
+        elif num_mappings > 1:
+            too_many_mapping_keys.add(row_key)
+
+    # Report the DATIM rows in codelist order
+    for row, row_key in zip(rows, row_keys):
+        if row_key[:de_key_length] in missing_de_keys:
             diff['missing_in_ocl_de'].append(row)
-        elif len(de_concepts) > 1:
+        elif row_key[:de_key_length] in too_many_de_keys:
             diff['too_many_in_ocl_de'].append(row)
-
-        # Find the COC
-        coc_concepts = codelist_ocl.get_concepts(core_attrs={
-            'id': row[DATIM_CODELIST_COLUMN_COC_CODE],
-            'external_id': row[DATIM_CODELIST_COLUMN_COC_UID],
-            'concept_class': 'Category Option Combo'
-        })
-        if len(coc_concepts) == 90:
+        if row_key[de_key_length:] in missing_coc_keys:
             diff['missing_in_ocl_coc'].append(row)
-        elif len(coc_concepts) > 1:
+        elif row_key[de_key_length:] in too_many_coc_keys:
             diff['too_many_in_ocl_coc'].append(row)
-
-        # Find the mapping
-        if de_concepts and coc_concepts:
-            de_to_coc_mappings = codelist_ocl.get_mappings(
-                from_concept_uri=de_concepts[0]['url'],
-                to_concept_uri=coc_concepts[0]['url'],
-                map_type=MSP_MAP_TYPE_DE_TO_COC)
-            # print('  from_concept:', de_concepts[0]['url'])
-            # print('  to_concept:', coc_concepts[0]['url'])
-            # print('  result:', de_to_coc_mappings)
-            if len(de_to_coc_mappings) == 0:
-                diff['missing_in_ocl_mapping'].append(row)
-            elif len(de_to_coc_mappings) > 1:
-                diff['too_many_in_ocl_mapping'].append(row)
-        else:
+        if row_key in missing_mapping_keys:
             diff['missing_in_ocl_mapping'].append(row)
-
-    # Now iterate through the OCL collection
-    for de_concept in codelist_ocl.get_concepts(core_attrs={'concept_class': 'Data Element'}):
-        for mapping in codelist_ocl.get_mappings(
-                from_concept_uri=de_concept['url'], map_type=MSP_MAP_TYPE_DE_TO_COC):
-            coc_concept = codelist_ocl.get_concept_by_uri(mapping['to_concept_url'])
-            found_matching_row = False
-            if coc_concept:
-                for row in codelist_datim['listGrid']['rows']:
-                    if (row[DATIM_CODELIST_COLUMN_DATA_ELEMENT_CODE] == de_concept['id'] and
-                            row[DATIM_CODELIST_COLUMN_DATA_ELEMENT_UID] == de_concept[
-                                'external_id'] and
-                            row[DATIM_CODELIST_COLUMN_COC_CODE] == coc_concept['id'] and
-                            row[DATIM_CODELIST_COLUMN_COC_UID] == coc_concept['external_id']):
-                        found_matching_row = True
-                        break
-            if not found_matching_row:
+        elif row_key in too_many_mapping_keys:
+            diff['too_many_in_ocl_mapping'].append(row)
+
+    # Report the OCL DE-to-COC mappings that are not in the DATIM codelist, in export order
+    datim_row_keys = set(row_keys)
+    for de_concept in index['de_concepts']:
+        de_key = get_codelist_concept_key(de_concept, match_codes=match_codes)
+        for mapping in index['mappings_by_from_url'].get(de_concept['url'], []):
+            coc_concept = index['concepts_by_url'].get(mapping['to_concept_url'])
+            if coc_concept is None or de_key + get_codelist_concept_key(
+                    coc_concept, match_codes=match_codes) not in datim_row_keys:
                 diff['missing_in_datim_codelist'].append(mapping)
-                # diff['missing_in_datim_codelist'].append({
-                #     'from_concept': de_concept, 'to_concept': coc_concept, 'mapping': mapping})
 
     # Remove empty diff keys and return
     return {k: v for k, v in diff.items() if v}
@@ -0,0 +1,366 @@
+"""
+Content-addressed store for the import files of successive builds. Most resources of a build
+are byte-identical to those of the previous build, so each serialized resource (one line of an
+import file) is stored once, keyed by the hash of its bytes, and each build only adds a
+manifest listing the hashes of its lines in order. Any stored import file is reconstructed
+byte for byte by streaming through its manifest.
+
+Layout of a store directory:
+* packs/<pack_id>.pack: the new objects of one write, each compressed with zlib and appended
+* packs/<pack_id>.idx: one fixed-size record (digest, offset, length) per object of the pack
+* manifests/<name>.manifest: gzip-compressed JSON header line (name, number of lines, size and
+  SHA-256 of the import file, etc.) followed by the digests of the lines in file order
+Packs, indexes and manifests are written under a temporary name and renamed when complete, so
+an interrupted write leaves the store unchanged.
+
+Example usage:
+  store = msp_artifacts.ArtifactStore('output/artifacts')
+  with msp_artifacts.ManifestWriter(store, 'msp_PEPFAR-MER-FY22_20220131.json') as writer:
+      for line in lines:
+          writer.add(line)
+  msp_artifacts.restore_file(store, 'msp_PEPFAR-MER-FY22_20220131.json', 'output/msp.json')
+"""
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import secrets
+import struct
+import tempfile
+import zlib
+import msp_io
+
+
+# Format and version of manifests, checked when a manifest is read
+MANIFEST_FORMAT = 'msp-artifact-manifest'
+MANIFEST_VERSION = 1
+
+# Object digests: BLAKE2b with a 16 byte digest of the bytes of a line
+DIGEST_SIZE = 16
+
+# Pack index record: digest, offset and compressed length of an object in its pack
+INDEX_RECORD = struct.Struct('>%dsQI' % DIGEST_SIZE)
+
+# zlib compression level of the objects
+COMPRESSION_LEVEL = 6
+
+# Directories and extensions of a store
+PACKS_DIRNAME = 'packs'
+MANIFESTS_DIRNAME = 'manifests'
+PACK_EXTENSION = '.pack'
+INDEX_EXTENSION = '.idx'
+MANIFEST_EXTENSION = '.manifest'
+
+
+def get_digest(data):
+    """ Return the digest (bytes) of the bytes of an object """
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
+
+
+def get_manifest_name(filename):
+    """ Return the manifest name of an import file: its name without compression extension """
+    name = os.path.basename(msp_io.split_zip_member(filename)[0])
+    root, extension = os.path.splitext(name)
+    if extension.lower() in msp_io.COMPRESSION_EXTENSIONS:
+        return root
+    return name
+
+
+def get_file_mode():
+    """ Return the permissions of a new file (mkstemp creates temporary files as 0600) """
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def replace_atomically(filename, write_function, mode='wb'):
+    """ Write a file with write_function(file) under a temporary name and rename it """
+    temp_fd, temp_filename = tempfile.mkstemp(
+        prefix='.tmp-', dir=os.path.dirname(filename) or '.')
+    try:
+        with os.fdopen(temp_fd, mode) as output_file:
+            write_function(output_file)
+        os.chmod(temp_filename, get_file_mode())
+        os.replace(temp_filename, filename)
+    except BaseException:
+        os.remove(temp_filename)
+        raise
+
+
+class ArtifactStore(object):
+    """ Objects by digest in pack files, and the manifests of the stored import files """
+
+    def __init__(self, root):
+        self.root = root
+        self.packs_dir = os.path.join(root, PACKS_DIRNAME)
+        self.manifests_dir = os.path.join(root, MANIFESTS_DIRNAME)
+        for directory in (self.packs_dir, self.manifests_dir):
+            os.makedirs(directory, exist_ok=True)
+        self._objects = {}
+        self._pack_files = {}
+        for filename in sorted(os.listdir(self.packs_dir)):
+            if filename.endswith(INDEX_EXTENSION):
+                self._load_pack_index(filename[:-len(INDEX_EXTENSION)])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __contains__(self, digest):
+        return digest in self._objects
+
+    def close(self):
+        """ Close the open pack files """
+        for pack_file in self._pack_files.values():
+            pack_file.close()
+        self._pack_files = {}
+
+    def get_pack_filename(self, pack_id, extension):
+        """ Return the filename of the pack or pack index with the ID """
+        return os.path.join(self.packs_dir, pack_id + extension)
+
+    def _load_pack_index(self, pack_id):
+        with open(self.get_pack_filename(pack_id, INDEX_EXTENSION), 'rb') as index_file:
+            index_data = index_file.read()
+        for digest, offset, length in INDEX_RECORD.iter_unpack(index_data):
+            self._objects.setdefault(digest, (pack_id, offset, length))
+
+    def get(self, digest):
+        """ Return the bytes of the object with the digest, KeyError if it is not stored """
+        pack_id, offset, length = self._objects[digest]
+        if pack_id not in self._pack_files:
+            self._pack_files[pack_id] = open(
+                self.get_pack_filename(pack_id, PACK_EXTENSION), 'rb')
+        pack_file = self._pack_files[pack_id]
+        pack_file.seek(offset)
+        return zlib.decompress(pack_file.read(length))
+
+    def open_pack(self):
+        """ Return a PackWriter adding new objects to this store """
+        return PackWriter(self)
+
+    def _add_pack_objects(self, pack_id, records):
+        for digest, offset, length in records:
+            self._objects.setdefault(digest, (pack_id, offset, length))
+
+    def get_manifest_filename(self, name):
+        """ Return the filename of the manifest of an import file name """
+        return os.path.join(self.manifests_dir, name + MANIFEST_EXTENSION)
+
+    def list_manifests(self):
+        """ Return the headers of the stored manifests, sorted by name """
+        headers = []
+        for filename in sorted(os.listdir(self.manifests_dir)):
+            if filename.endswith(MANIFEST_EXTENSION):
+                headers.append(read_manifest_header(os.path.join(self.manifests_dir, filename)))
+        return headers
+
+
+class PackWriter(object):
+    """
+    Writes new objects to a temporary pack file as they are added. commit() renames the pack
+    and writes its index, abort() deletes it; a pack without objects is never committed.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.pack_id = '%s-%s' % (datetime.datetime.now().strftime('%Y%m%d%H%M%S'),
+                                  secrets.token_hex(4))
+        self.num_objects = 0
+        self._records = []
+        self._digests = set()
+        self._offset = 0
+        temp_fd, self._temp_filename = tempfile.mkstemp(prefix='.tmp-', dir=store.packs_dir)
+        self._pack_file = os.fdopen(temp_fd, 'wb')
+
+    def __contains__(self, digest):
+        return digest in self._digests
+
+    def add(self, digest, data):
+        """ Compress and append the bytes of an object with the digest """
+        compressed_data = zlib.compress(data, COMPRESSION_LEVEL)
+        self._pack_file.write(compressed_data)
+        self._records.append((digest, self._offset, len(compressed_data)))
+        self._digests.add(digest)
+        self._offset += len(compressed_data)
+        self.num_objects += 1
+
+    def commit(self):
+        """ Add the pack to the store and return its ID, or None if it has no objects """
+        self._pack_file.close()
+        if not self._records:
+            os.remove(self._temp_filename)
+            return None
+
+        # The pack is renamed before its index, so an index always refers to a complete pack
+        os.chmod(self._temp_filename, get_file_mode())
+        os.replace(self._temp_filename, self.store.get_pack_filename(
+            self.pack_id, PACK_EXTENSION))
+
+        def write_index(index_file):
+            for record in self._records:
+                index_file.write(INDEX_RECORD.pack(*record))
+
+        replace_atomically(self.store.get_pack_filename(self.pack_id, INDEX_EXTENSION),
+                           write_index)
+        self.store._add_pack_objects(self.pack_id, self._records)
+        return self.pack_id
+
+    def abort(self):
+        """ Delete the temporary pack """
+        self._pack_file.close()
+        if os.path.exists(self._temp_filename):
+            os.remove(self._temp_filename)
+
+
+class ManifestWriter(object):
+    """
+    Adds the lines of an import file to a store and writes its manifest. Use as a context
+    manager and call add() with the bytes of each line (including the newline) in file order.
+    New objects are written to a new pack as they are added; the pack and the manifest are
+    only committed if no exception was raised.
+    """
+
+    def __init__(self, store, name, metadata=None):
+        self.store = store
+        self.name = name
+        self.metadata = metadata or {}
+        self.header = None
+        self.num_lines = 0
+        self.size = 0
+        self._pack_writer = store.open_pack()
+        self._digests = []
+        self._new_size = 0
+        self._sha256 = hashlib.sha256()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._pack_writer.abort()
+
+    def add(self, line):
+        """ Add the bytes of a line and return its digest """
+        digest = get_digest(line)
+        if digest not in self.store and digest not in self._pack_writer:
+            self._pack_writer.add(digest, line)
+            self._new_size += len(line)
+        self._digests.append(digest)
+        self._sha256.update(line)
+        self.num_lines += 1
+        self.size += len(line)
+        return digest
+
+    def close(self):
+        """ Commit the new objects and write the manifest, return the manifest header """
+        if self.header is not None:
+            return self.header
+        pack_id = self._pack_writer.commit()
+        header = dict(self.metadata)
+        header.update({
+            'format': MANIFEST_FORMAT,
+            'version': MANIFEST_VERSION,
+            'name': self.name,
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'num_lines': self.num_lines,
+            'size': self.size,
+            'sha256': self._sha256.hexdigest(),
+            'num_new_objects': self._pack_writer.num_objects,
+            'new_size': self._new_size,
+            'pack': pack_id,
+        })
+
+        def write_manifest(manifest_file):
+            with gzip.GzipFile(fileobj=manifest_file, mode='wb') as gzip_file:
+                gzip_file.write(json.dumps(header).encode('utf-8') + b'\n')
+                gzip_file.write(b''.join(self._digests))
+
+        replace_atomically(self.store.get_manifest_filename(self.name), write_manifest)
+        self._digests = []
+        self.header = header
+        return header
+
+
+def read_manifest_header(manifest_filename):
+    """ Return the header of a manifest file """
+    with gzip.open(manifest_filename, 'rb') as manifest_file:
+        header = json.loads(manifest_file.readline())
+    if header.get('format') != MANIFEST_FORMAT or header.get('version') != MANIFEST_VERSION:
+        raise ValueError('Not a version %s %s file: %s' % (
+            MANIFEST_VERSION, MANIFEST_FORMAT, manifest_filename))
+    return header
+
+
+def iter_manifest_lines(store, name, verify=True):
+    """
+    Yield the bytes of each line of a stored import file in order, streaming its manifest. If
+    verify is True, the digest of each line and the size and SHA-256 of the file are checked.
+    """
+    manifest_filename = store.get_manifest_filename(name)
+    if not os.path.exists(manifest_filename):
+        raise KeyError('No manifest for %s in %s' % (name, store.root))
+    header = read_manifest_header(manifest_filename)
+    sha256 = hashlib.sha256()
+    size = 0
+    with gzip.open(manifest_filename, 'rb') as manifest_file:
+        manifest_file.readline()
+        while True:
+            digest = manifest_file.read(DIGEST_SIZE)
+            if not digest:
+                break
+            line = store.get(digest)
+            if verify:
+                if get_digest(line) != digest:
+                    raise ValueError('Corrupt object %s in %s' % (digest.hex(), store.root))
+                sha256.update(line)
+                size += len(line)
+            yield line
+    if verify and (size != header['size'] or sha256.hexdigest() != header['sha256']):
+        raise ValueError('Restored %s does not match its manifest' % name)
+
+
+def store_lines(store, name, lines, metadata=None):
+    """ Store an iterable of lines (bytes) as the import file name, return the manifest header """
+    with ManifestWriter(store, name, metadata=metadata) as writer:
+        for line in lines:
+            writer.add(line)
+    return writer.header
+
+
+def store_file(store, filename, name=None):
+    """ Store an import file (compressed based on its extension), return the manifest header """
+    with msp_io.open_file(filename, 'rb') as input_file:
+        return store_lines(store, name or get_manifest_name(filename), input_file,
+                           metadata={'filename': filename})
+
+
+def restore_file(store, name, filename, verify=True):
+    """
+    Reconstruct the stored import file name as filename (compressed based on its extension)
+    and return its manifest header. The file is written under a temporary name and only
+    renamed to filename once it is complete (and verified).
+    """
+    header = read_manifest_header(store.get_manifest_filename(name))
+    temp_fd, temp_filename = tempfile.mkstemp(
+        prefix='.tmp-', suffix='-' + os.path.basename(filename),
+        dir=os.path.dirname(filename) or '.')
+    os.close(temp_fd)
+    try:
+        with msp_io.open_file(temp_filename, 'wb') as output_file:
+            for line in iter_manifest_lines(store, name, verify=verify):
+                output_file.write(line)
+        os.chmod(temp_filename, get_file_mode())
+        os.replace(temp_filename, filename)
+    except BaseException:
+        os.remove(temp_filename)
+        raise
+    return header
@@ -0,0 +1,92 @@
+"""
+Single entry point for the MSP ETL scripts.
+
+Each subcommand is implemented by the main(argv) of one of the scripts, which is imported only
+when that subcommand runs. Starting the CLI therefore imports nothing beyond the standard library,
+offline subcommands (build, spreadsheet) never import the HTTP stack (see msp_datim.py), and
+'python msp_cli.py <subcommand> --help' shows the arguments of the script.
+
+Example usage:
+  python msp_cli.py export
+  python msp_cli.py save-codelists
+  python msp_cli.py diff-snapshots --dates 20210106 20210309
+  python msp_cli.py build --period FY22 > logs/build_pepfar_mer_fy22_20220131.log
+  python msp_cli.py artifacts restore msp_PEPFAR-MER-FY22_20220131.json --output /tmp/msp.json
+  python msp_cli.py check output/msp_PEPFAR-MER-FY22_20220131.json
+  python msp_cli.py check-slices --period FY21 --period FY22
+  python msp_cli.py import output/msp_PEPFAR-MER-FY22_20220131.json
+  python msp_cli.py inspect output/msp_PEPFAR-MER-FY22_20220131.json --type Concept --id TX_CURR
+  python msp_cli.py results <task_id>
+  python msp_cli.py serve --import-file output/msp_PEPFAR-MER-FY22_20220131.json --port 8765
+  python msp_cli.py spreadsheet --output all_datim_codelists_20220413.csv
+  python msp_cli.py sqlite output/msp_PEPFAR-MER-FY22_20220131.json --database output/msp.sqlite
+  python msp_cli.py validate --codelist MER_R_COMMUNITY_BASED
+  python msp_cli.py validate-import output/msp_PEPFAR-MER-FY22_20220131.json
+
+Use benchmark_cli_startup.py to measure the startup time of each subcommand.
+"""
+import argparse
+import importlib
+import sys
+
+
+# Subcommands: name, module implementing main(argv), help
+SUBCOMMANDS = (
+    ('export', 'export_datim_metadata', 'Request the metadata exports from DATIM'),
+    ('save-codelists', 'save_codelists_to_file',
+     'Retrieve the codelists from DATIM and save them to a single JSON file'),
+    ('diff-snapshots', 'diff_snapshots', 'Diff dated DATIM and codelist snapshots'),
+    ('build', 'build_ocl_import', 'Prepare the OCL bulk import file'),
+    ('artifacts', 'manage_artifacts',
+     'Store, list, verify and restore import files in the content-addressed store'),
+    ('check', 'check_import_integrity',
+     'Check the referential integrity of a JSON lines import file'),
+    ('check-slices', 'check_sliced_builds',
+     'Check that period-sliced builds are consistent with the full build'),
+    ('import', 'run_ocl_import', 'Import a JSON lines file into OCL'),
+    ('inspect', 'inspect_import_file',
+     'Fetch resources from a JSON lines file by type, ID or URL using its line index'),
+    ('results', 'get_ocl_bulk_import_results', 'Retrieve OCL bulk import results'),
+    ('serve', 'serve_msp', 'Serve queries over a build as a local HTTP JSON API'),
+    ('spreadsheet', 'generate_full_codelist_spreadsheet',
+     'Export all DATIM codelists to a single CSV'),
+    ('sqlite', 'materialize_sqlite',
+     'Write a JSON lines import file to an indexed SQLite database'),
+    ('validate', 'validate_ocl_codelists', 'Validate OCL codelists against DATIM'),
+    ('validate-import', 'validate_import_file',
+     'Validate a JSON lines import file against the OCL schemas in parallel'),
+)
+
+
+def get_subcommand_module(subcommand):
+    """ Return the name of the module implementing the subcommand """
+    for name, module_name, _ in SUBCOMMANDS:
+        if name == subcommand:
+            return module_name
+    raise KeyError(subcommand)
+
+
+def run_subcommand(subcommand, argv):
+    """ Import the module implementing the subcommand and return the result of its main """
+    module = importlib.import_module(get_subcommand_module(subcommand))
+
+    # The scripts' argument parsers take their usage prog from sys.argv
+    sys.argv = ['%s %s' % (sys.argv[0], subcommand)] + list(argv)
+    return module.main(sys.argv)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='MSP ETL scripts', formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog='subcommands:\n%s' % '\n'.join(
+            '  %-16s%s' % (name, help_text) for name, _, help_text in SUBCOMMANDS))
+    parser.add_argument('subcommand', choices=[name for name, _, _ in SUBCOMMANDS],
+                        metavar='subcommand', help='Subcommand to run (see below)')
+    parser.add_argument('args', nargs=argparse.REMAINDER,
+                        help='Arguments of the subcommand, see: <subcommand> --help')
+    args = parser.parse_args(argv[1:])
+    return run_subcommand(args.subcommand, args.args)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
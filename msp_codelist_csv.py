@@ -0,0 +1,112 @@
+"""
+Streaming export of the DATIM codelists saved by save_codelists_to_file.py to CSV.
+
+The codelists file is read one codelist at a time (msp_io.iter_json_array) and, unless the rows
+are sorted or sharded, each row is written as soon as it is read, so memory use does not depend
+on the size of the file. Options:
+* dedup: keep only the first row of each data element/COC pair across all codelists
+* sort: sort the rows by dataset, data element and COC name (the rows are held in memory)
+* shards: write one CSV per dataset instead of a single CSV; the shards are written by a pool
+  of threads, which overlap the compression of compressed shards
+"""
+import concurrent.futures
+import csv
+import os
+import re
+import msp
+import msp_io
+
+
+# Columns identifying a row for dedup and columns the rows are sorted by
+DEDUP_COLUMNS = (msp.DATIM_CODELIST_COLUMN_DATA_ELEMENT_UID, msp.DATIM_CODELIST_COLUMN_COC_UID)
+SORT_COLUMNS = (msp.DATIM_CODELIST_COLUMN_DATASET, msp.DATIM_CODELIST_COLUMN_DATA_ELEMENT_NAME,
+                msp.DATIM_CODELIST_COLUMN_COC_NAME)
+
+# Default number of threads writing shards
+DEFAULT_SHARD_WORKERS = 4
+
+# Characters replaced in dataset names to build shard filenames
+SHARD_FILENAME_PATTERN = re.compile(r'[^A-Za-z0-9._-]+')
+
+
+def iter_codelist_rows(filename, dedup=False, counts=None):
+    """
+    Yield the rows of every codelist of a codelists with exports file in file order. If dedup
+    is True, only the first row of each data element/COC pair is yielded. If counts is a
+    dictionary, it is updated with the number of codelists, rows and duplicate rows.
+    """
+    if counts is None:
+        counts = {}
+    for key in ('codelists', 'rows', 'duplicate_rows'):
+        counts.setdefault(key, 0)
+    seen_keys = set()
+    for codelist in msp_io.iter_json_array(filename):
+        counts['codelists'] += 1
+        codelist_export = (codelist.get('extras') or {}).get('dhis2_codelist') or {}
+        for row in codelist_export.get('listGrid', {}).get('rows', []):
+            counts['rows'] += 1
+            if dedup:
+                row_key = tuple(row[column] for column in DEDUP_COLUMNS)
+                if row_key in seen_keys:
+                    counts['duplicate_rows'] += 1
+                    continue
+                seen_keys.add(row_key)
+            yield row
+
+
+def get_sort_key(row):
+    """ Return the sort key of a row: dataset, data element name and COC name """
+    return tuple(row[column] or '' for column in SORT_COLUMNS)
+
+
+def write_csv(filename, rows, headers=None):
+    """
+    Write the header and rows to a CSV file, compressed based on its extension (see msp_io).
+    Returns the number of rows written.
+    """
+    num_rows = 0
+    with msp_io.open_file(filename, 'w', encoding='utf-8', newline='') as output_file:
+        writer = csv.writer(output_file, delimiter=',', quotechar='"')
+        writer.writerow(headers or msp.DATIM_CODELIST_COLUMN_NAMES)
+        for row in rows:
+            writer.writerow(row)
+            num_rows += 1
+    return num_rows
+
+
+def get_shard_filenames(datasets, shard_dir, compression=None):
+    """ Return dictionary with dataset as key and a unique shard filename as value """
+    shard_filenames = {}
+    used_names = set()
+    for dataset in datasets:
+        name = SHARD_FILENAME_PATTERN.sub('_', dataset or '').strip('_') or 'no_dataset'
+        unique_name = name
+        suffix = 2
+        while unique_name.lower() in used_names:
+            unique_name = '%s_%s' % (name, suffix)
+            suffix += 1
+        used_names.add(unique_name.lower())
+        shard_filenames[dataset] = msp_io.add_compression_extension(
+            os.path.join(shard_dir, unique_name + '.csv'), compression)
+    return shard_filenames
+
+
+def write_shards(rows, shard_dir, sort=False, compression=None, workers=DEFAULT_SHARD_WORKERS):
+    """
+    Write one CSV per dataset to shard_dir, in parallel. Returns dictionary with dataset as key
+    and (shard filename, number of rows) as value.
+    """
+    rows_by_dataset = {}
+    for row in rows:
+        rows_by_dataset.setdefault(row[msp.DATIM_CODELIST_COLUMN_DATASET], []).append(row)
+    if sort:
+        for dataset_rows in rows_by_dataset.values():
+            dataset_rows.sort(key=get_sort_key)
+    os.makedirs(shard_dir, exist_ok=True)
+    shard_filenames = get_shard_filenames(rows_by_dataset, shard_dir, compression=compression)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = dict((dataset, executor.submit(
+            write_csv, shard_filenames[dataset], dataset_rows))
+            for dataset, dataset_rows in rows_by_dataset.items())
+    return dict((dataset, (shard_filenames[dataset], future.result()))
+                for dataset, future in futures.items())
@@ -0,0 +1,207 @@
+"""
+Compact in-memory storage for the listGrid rows of DATIM codelist exports.
+
+Every codelist export row is a list of nine strings (dataset, DE name, DE short name, DE code,
+DE UID, DE description, COC name, COC code, COC UID) and the same DE and COC values are repeated
+across hundreds of codelists. CodelistRowStore interns each distinct string once and keeps the
+rows as columns of integer string IDs (array module), so a row costs 9 x 4 bytes instead of a
+list of nine string references. Each codelist gets a CodelistRows view over its slice of the
+store, which behaves like the original list of rows (len, iteration, indexing) and adds
+accessors that work directly on the integer columns.
+
+The module-level helpers (rows_have_value, iter_row_values, count_unique_row_values) accept
+either a CodelistRows view or a plain list of rows, so callers work with both DATIM exports
+fetched live and compacted exports loaded from file.
+"""
+import array
+
+
+# Typecode for integer columns -- unsigned int is 4 bytes on all supported platforms
+STRING_ID_TYPECODE = 'I'
+
+
+class CodelistRowStore(object):
+    """ Interned string table plus one integer array per codelist column """
+
+    def __init__(self, num_columns=9):
+        """ Initialize an empty store with the specified number of columns """
+        self.num_columns = num_columns
+        self._strings = []
+        self._string_ids = {}
+        self._columns = [array.array(STRING_ID_TYPECODE) for _ in range(num_columns)]
+        self._views = []
+        self._value_indexes = {}
+
+    def __len__(self):
+        """ Total number of rows across all codelists in the store """
+        return len(self._columns[0]) if self.num_columns else 0
+
+    @property
+    def num_strings(self):
+        """ Number of distinct strings in the string table """
+        return len(self._strings)
+
+    def intern(self, value):
+        """ Return the integer ID for value, adding it to the string table if needed """
+        string_id = self._string_ids.get(value)
+        if string_id is None:
+            string_id = len(self._strings)
+            self._strings.append(value)
+            self._string_ids[value] = string_id
+        return string_id
+
+    def get_string_id(self, value):
+        """ Return the integer ID for value or None if the value is not in the store """
+        return self._string_ids.get(value)
+
+    def get_string(self, string_id):
+        """ Return the string for the specified integer ID """
+        return self._strings[string_id]
+
+    def add_rows(self, rows):
+        """
+        Append a codelist's rows to the store and return a CodelistRows view over them.
+        Each row must have exactly num_columns values. None values are interned like strings.
+        """
+        start = len(self)
+        for row in rows:
+            if len(row) != self.num_columns:
+                raise ValueError('Expected %s columns in codelist row, %s given: %s' % (
+                    self.num_columns, len(row), row))
+            for column_index, value in enumerate(row):
+                self._columns[column_index].append(self.intern(value))
+        view = CodelistRows(self, start, len(self), len(self._views))
+        self._views.append(view)
+        self._value_indexes = {}
+        return view
+
+    def get_row(self, row_index):
+        """ Return the row at the specified store-level index as a tuple of strings """
+        strings = self._strings
+        return tuple(strings[column[row_index]] for column in self._columns)
+
+    def get_column(self, column_index):
+        """ Return the raw integer array for the specified column """
+        return self._columns[column_index]
+
+    def get_view_indexes_with_value(self, column_index, value):
+        """
+        Return the set of view indexes (ie codelists, in the order they were added) that contain
+        value in the specified column. The inverted index for a column is built on first use.
+        """
+        string_id = self._string_ids.get(value)
+        if string_id is None:
+            return frozenset()
+        if column_index not in self._value_indexes:
+            column_index_dict = {}
+            column = self._columns[column_index]
+            for view in self._views:
+                for value_id in set(column[view.start:view.stop]):
+                    if value_id not in column_index_dict:
+                        column_index_dict[value_id] = set()
+                    column_index_dict[value_id].add(view.view_index)
+            self._value_indexes[column_index] = column_index_dict
+        return self._value_indexes[column_index].get(string_id, frozenset())
+
+    def get_memory_usage(self):
+        """ Return approximate number of bytes used by the integer columns """
+        return sum(column.itemsize * len(column) for column in self._columns)
+
+
+class CodelistRows(object):
+    """
+    Read-only sequence view over one codelist's rows in a CodelistRowStore. Rows are returned
+    as tuples of (shared, interned) strings, so existing code that indexes rows with the
+    DATIM_CODELIST_COLUMN_* constants works unchanged.
+    """
+
+    __slots__ = ('store', 'start', 'stop', 'view_index')
+
+    def __init__(self, store, start, stop, view_index):
+        self.store = store
+        self.start = start
+        self.stop = stop
+        self.view_index = view_index
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __bool__(self):
+        return self.stop > self.start
+
+    def __iter__(self):
+        strings = self.store._strings
+        columns = self.store._columns
+        for row_index in range(self.start, self.stop):
+            yield tuple(strings[column[row_index]] for column in columns)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError('codelist row index out of range')
+        return self.store.get_row(self.start + index)
+
+    def __repr__(self):
+        return '<CodelistRows: %s rows>' % len(self)
+
+    def to_list(self):
+        """ Return the rows as a list of lists, ie the original listGrid format """
+        return [list(row) for row in self]
+
+    def has_value(self, column_index, value):
+        """ Return True if any row in this codelist has value in the specified column """
+        return self.view_index in self.store.get_view_indexes_with_value(column_index, value)
+
+    def iter_values(self, *column_indexes):
+        """
+        Yield a tuple of string values for the specified columns of each row, without
+        materializing the other columns of the row.
+        """
+        strings = self.store._strings
+        columns = [self.store._columns[column_index] for column_index in column_indexes]
+        for row_index in range(self.start, self.stop):
+            yield tuple(strings[column[row_index]] for column in columns)
+
+    def count_unique(self, column_index):
+        """ Return the number of distinct values in the specified column """
+        return len(set(self.store._columns[column_index][self.start:self.stop]))
+
+
+def compact_codelist_rows(rows, store):
+    """
+    Return a CodelistRows view for rows stored in store. Rows that are already a view are
+    returned as is.
+    """
+    if isinstance(rows, CodelistRows):
+        return rows
+    return store.add_rows(rows)
+
+
+def rows_have_value(rows, column_index, value):
+    """ Return True if any of the rows (a CodelistRows view or a list) has value in the column """
+    if isinstance(rows, CodelistRows):
+        return rows.has_value(column_index, value)
+    for row in rows:
+        if row[column_index] == value:
+            return True
+    return False
+
+
+def iter_row_values(rows, *column_indexes):
+    """ Yield a tuple of values for the specified columns of each row (view or list) """
+    if isinstance(rows, CodelistRows):
+        for values in rows.iter_values(*column_indexes):
+            yield values
+    else:
+        for row in rows:
+            yield tuple(row[column_index] for column_index in column_indexes)
+
+
+def count_unique_row_values(rows, column_index):
+    """ Return the number of distinct values in the column of the rows (view or list) """
+    if isinstance(rows, CodelistRows):
+        return rows.count_unique(column_index)
+    return len(set(row[column_index] for row in rows))
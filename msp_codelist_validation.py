@@ -0,0 +1,403 @@
+"""
+Concurrent, cached validation of the OCL codelist collections against their DATIM codelists.
+
+Validating a codelist takes three network requests (the latest version of the OCL collection,
+its export and the DATIM codelist) and one diff (msp.diff_codelist). The requests for all
+codelists are made by a pool of threads and each diff runs in a pool of worker processes as
+soon as its codelist has been retrieved.
+
+Every response is cached on disk as gzipped JSON, keyed by the URL it was retrieved from:
+* OCL exports are keyed by the URL of the collection version and never expire, since a released
+  version does not change
+* the latest version of each collection and the DATIM codelists expire after max_age seconds
+So a re-run within max_age of the previous run makes no network requests at all. With
+offline=True the cache is used regardless of its age and a codelist that is not cached is
+reported as an error instead of being retrieved.
+
+validate_import_file_codelists does the same before upload, without any network request: the
+membership of each codelist collection is rebuilt from the references, concepts and mappings of a
+built import file and diffed against the DATIM codelist rows the build was made from.
+
+Example usage:
+  cache = msp_codelist_validation.CodelistCache('output/validation_cache')
+  report = msp_codelist_validation.validate_codelists(codelist_defs, 'PEPFAR-Test4', cache)
+"""
+import concurrent.futures
+import datetime
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+import ocldev.oclexport
+import requests
+import msp
+import msp_datim
+import msp_integrity
+import msp_io
+import msp_urls
+
+
+# Default number of threads retrieving from OCL and DATIM
+DEFAULT_FETCH_WORKERS = 8
+
+# Default age in seconds after which the latest collection versions and DATIM codelists are
+# retrieved again
+DEFAULT_MAX_AGE = 24 * 60 * 60
+
+# Kinds of cached responses and whether they expire
+CACHE_OCL_LATEST_VERSION = 'ocl_latest_version'
+CACHE_OCL_EXPORT = 'ocl_export'
+CACHE_DATIM_CODELIST = 'datim_codelist'
+CACHE_EXPIRES = {
+    CACHE_OCL_LATEST_VERSION: True,
+    CACHE_OCL_EXPORT: False,
+    CACHE_DATIM_CODELIST: True,
+}
+
+# Status of a validated codelist
+STATUS_VALID = 'valid'
+STATUS_DIFFERENT = 'different'
+STATUS_ERROR = 'error'
+STATUSES = (STATUS_VALID, STATUS_DIFFERENT, STATUS_ERROR)
+
+# Collection type of the codelist collections and the fields of their members kept in memory
+# when validating an import file
+CODELIST_COLLECTION_TYPE = 'Code List'
+CODELIST_MEMBER_FIELDS = ('id', 'external_id', 'concept_class', 'datatype', 'source', 'map_type',
+                          'from_concept_url', 'to_concept_url', 'from_source_url', 'to_source_url')
+
+
+class CacheMissError(Exception):
+    """ Raised in offline mode when a response is not in the cache """
+
+
+class CodelistCache(object):
+    """
+    On-disk cache of OCL and DATIM responses, one gzipped JSON file per URL. Safe to use from
+    several threads: each file is written to a temporary file and then renamed.
+    """
+
+    def __init__(self, cache_dir, max_age=DEFAULT_MAX_AGE, offline=False, refresh=False):
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.offline = offline
+        self.refresh = refresh
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_filename(self, kind, key):
+        """ Return the cache filename for a kind of response and its key (URL) """
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, '%s_%s.json.gz' % (kind, digest))
+
+    def is_fresh(self, kind, filename):
+        """ Returns True if the cached file can be used without retrieving it again """
+        if not os.path.exists(filename):
+            return False
+        if self.offline:
+            return True
+        if self.refresh:
+            return False
+        if not CACHE_EXPIRES[kind] or self.max_age is None:
+            return True
+        return time.time() - os.path.getmtime(filename) < self.max_age
+
+    def fetch(self, kind, key, fetch_function):
+        """
+        Return (filename, True) if the response for key is cached, otherwise call
+        fetch_function(), cache its JSON-serializable result and return (filename, False)
+        """
+        filename = self.get_filename(kind, key)
+        if self.is_fresh(kind, filename):
+            return filename, True
+        if self.offline:
+            raise CacheMissError('%s not cached: %s' % (kind, key))
+        content = fetch_function()
+        temp_fd, temp_filename = tempfile.mkstemp(suffix='.json.gz', dir=self.cache_dir)
+        os.close(temp_fd)
+        try:
+            with msp_io.open_file(temp_filename, 'w', encoding='utf-8') as output_file:
+                json.dump({'key': key, 'content': content}, output_file)
+            os.replace(temp_filename, filename)
+        except BaseException:
+            os.remove(temp_filename)
+            raise
+        return filename, False
+
+    def get(self, kind, key, fetch_function):
+        """ Return (content, True if it was cached) for key, retrieving it if needed """
+        filename, is_cached = self.fetch(kind, key, fetch_function)
+        return load_cached_content(filename), is_cached
+
+
+def load_cached_content(filename):
+    """ Return the content of a cache file written by CodelistCache """
+    with msp_io.open_file(filename, encoding='utf-8') as input_file:
+        return json.load(input_file)['content']
+
+
+def get_ocl_collection_url(api_url_root, org_id, codelist_id):
+    """ Return the OCL API URL of a codelist collection """
+    return '%s/orgs/%s/collections/%s/' % (api_url_root.rstrip('/'), org_id, codelist_id)
+
+
+def get_datim_codelist_url(codelist_def):
+    """ Return the URL of the JSON DATIM codelist export of a codelist definition """
+    return '%s&paging=false' % codelist_def['ZenDesk: HTML Link'].replace('.html+css', '.json')
+
+
+def fetch_codelist(cache, codelist_def, org_id, api_url_root, api_token=''):
+    """
+    Retrieve the latest OCL export and the DATIM codelist of a codelist definition through the
+    cache. Returns a dictionary with the URLs, the collection version, the cache filenames of
+    the export and the DATIM codelist and whether each response came from the cache.
+    """
+    ocl_url = get_ocl_collection_url(api_url_root, org_id, codelist_def['id'])
+    datim_url = get_datim_codelist_url(codelist_def)
+    result = {'ocl_url': ocl_url, 'datim_url': datim_url, 'cached': {}}
+    ocl_version, result['cached'][CACHE_OCL_LATEST_VERSION] = cache.get(
+        CACHE_OCL_LATEST_VERSION, ocl_url,
+        lambda: ocldev.oclexport.OclExportFactory.get_latest_version_id(
+            ocl_url, oclapitoken=api_token))
+    ocl_version_url = '%s%s/' % (ocl_url, ocl_version)
+    result['ocl_version'] = ocl_version
+    result['ocl_export_filename'], result['cached'][CACHE_OCL_EXPORT] = cache.fetch(
+        CACHE_OCL_EXPORT, ocl_version_url,
+        lambda: ocldev.oclexport.OclExportFactory.load_export(
+            ocl_version_url, oclapitoken=api_token).get_full_export())
+    result['datim_filename'], result['cached'][CACHE_DATIM_CODELIST] = cache.fetch(
+        CACHE_DATIM_CODELIST, datim_url, lambda: msp_datim.fetch_datim_codelist(datim_url))
+    return result
+
+
+def diff_cached_codelist(ocl_export_filename, datim_filename):
+    """
+    Load a cached OCL export and DATIM codelist and return their stats and diff. Runs in a
+    worker process, so only the filenames are passed in.
+    """
+    codelist_ocl = ocldev.oclexport.OclExport(
+        export_json=load_cached_content(ocl_export_filename))
+    codelist_datim = load_cached_content(datim_filename)
+    return {
+        'ocl_stats': msp.get_ocl_codelist_stats(codelist_ocl),
+        'datim_stats': msp.get_datim_codelist_stats(codelist_datim),
+        'diff': msp.diff_codelist(codelist_ocl=codelist_ocl, codelist_datim=codelist_datim),
+    }
+
+
+def set_diff_status(result):
+    """ Set the status and the diff counts of a codelist result from its diff """
+    result['status'] = STATUS_DIFFERENT if result['diff'] else STATUS_VALID
+    result['diff_counts'] = dict(
+        (diff_key, len(values)) for diff_key, values in result['diff'].items())
+
+
+def count_statuses(codelist_results):
+    """ Return dictionary with status as key and number of codelist results as value """
+    return dict((status, sum(1 for result in codelist_results if result['status'] == status))
+                for status in STATUSES)
+
+
+def _get_error_message(error):
+    """ Return a one-line description of an error raised while validating a codelist """
+    if isinstance(error, ocldev.oclexport.OclUnknownResourceError):
+        return 'Collection not found in OCL: %s' % error
+    if isinstance(error, ocldev.oclexport.OclExportNotAvailableError):
+        return 'OCL export not available: %s' % error
+    return '%s: %s' % (type(error).__name__, error)
+
+
+def iter_codelist_results(codelist_defs, org_id, cache, api_url_root, api_token='',
+                          workers=None, fetch_workers=DEFAULT_FETCH_WORKERS):
+    """
+    Validate each codelist definition and yield its result (see validate_codelists) in the order
+    of the definitions. Retrieval runs in fetch_workers threads and diffs in a pool of worker
+    processes (os.cpu_count() by default) or, if workers is 1, in this process.
+    """
+    workers = workers or os.cpu_count() or 1
+    diff_executor = None
+    if workers > 1:
+        # Worker processes are started while the fetch threads are running, so they are spawned
+        # rather than forked from a process that holds thread locks
+        diff_executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=fetch_workers) as fetch_executor:
+            fetch_futures = dict((fetch_executor.submit(
+                fetch_codelist, cache, codelist_def, org_id, api_url_root, api_token), position)
+                for position, codelist_def in enumerate(codelist_defs))
+
+            # Submit each diff as soon as its codelist has been retrieved
+            results = [None] * len(codelist_defs)
+            diff_futures = {}
+            for fetch_future in concurrent.futures.as_completed(fetch_futures):
+                position = fetch_futures[fetch_future]
+                codelist_def = codelist_defs[position]
+                result = {'id': codelist_def['id'], 'external_id': codelist_def.get('external_id')}
+                results[position] = result
+                try:
+                    result.update(fetch_future.result())
+                except (requests.exceptions.RequestException, ocldev.oclexport.OclError,
+                        CacheMissError, ValueError) as e:
+                    result.update({'status': STATUS_ERROR, 'error': _get_error_message(e)})
+                    continue
+                filenames = (result.pop('ocl_export_filename'), result.pop('datim_filename'))
+                if diff_executor is None:
+                    diff_futures[position] = filenames
+                else:
+                    diff_futures[position] = diff_executor.submit(diff_cached_codelist, *filenames)
+
+        # Collect the diffs in the order of the definitions
+        for position, result in enumerate(results):
+            if position in diff_futures:
+                if diff_executor is None:
+                    result.update(diff_cached_codelist(*diff_futures[position]))
+                else:
+                    result.update(diff_futures[position].result())
+                set_diff_status(result)
+            yield result
+    finally:
+        if diff_executor is not None:
+            diff_executor.shutdown()
+
+
+def validate_codelists(codelist_defs, org_id, cache, api_url_root, api_token='', workers=None,
+                       fetch_workers=DEFAULT_FETCH_WORKERS):
+    """
+    Validate the codelist definitions and return the consolidated report: number of codelists
+    by status, number of responses retrieved and taken from the cache, and the result of each
+    codelist (URLs, collection version, status, error, stats, diff counts and diff)
+    """
+    start_time = time.time()
+    codelist_results = list(iter_codelist_results(
+        codelist_defs, org_id, cache, api_url_root, api_token=api_token, workers=workers,
+        fetch_workers=fetch_workers))
+    cache_counts = {'cached': 0, 'retrieved': 0}
+    for result in codelist_results:
+        for is_cached in result.get('cached', {}).values():
+            cache_counts['cached' if is_cached else 'retrieved'] += 1
+    return {
+        'date': datetime.datetime.now().isoformat(),
+        'org_id': org_id,
+        'api_url_root': api_url_root,
+        'offline': cache.offline,
+        'elapsed_seconds': round(time.time() - start_time, 3),
+        'num_codelists': len(codelist_results),
+        'counts': count_statuses(codelist_results),
+        'cache': cache_counts,
+        'codelists': codelist_results,
+    }
+
+
+def get_minimal_resource(resource):
+    """ Return the fields of a concept or mapping used by the diff and the stats, plus its URL """
+    minimal_resource = dict((field, resource[field]) for field in CODELIST_MEMBER_FIELDS
+                            if field in resource)
+    minimal_resource['url'] = msp_urls.get_resource_url(resource)
+    return minimal_resource
+
+
+def load_import_file_codelists(filename, collection_ids=None):
+    """
+    Read an import file once and return dictionary with the ID of each code list collection as
+    key and (OclExport of the concepts and mappings referenced by the collection, list of the
+    reference expressions that are not defined in the file) as value
+    """
+    codelist_ids = []
+    members_by_url = {}
+    expressions_by_collection = {}
+    for _, resource in msp_integrity.iter_import_file(filename):
+        resource_type = resource.get('type')
+        if resource_type in ('Concept', 'Mapping'):
+            minimal_resource = get_minimal_resource(resource)
+            members_by_url.setdefault(minimal_resource['url'], minimal_resource)
+        elif (resource_type == 'Collection' and
+              resource.get('collection_type') == CODELIST_COLLECTION_TYPE):
+            if collection_ids is None or resource['id'] in collection_ids:
+                codelist_ids.append(resource['id'])
+        elif resource_type == 'Reference':
+            expressions = expressions_by_collection.setdefault(resource.get('collection'), {})
+            for expression in (resource.get('data') or {}).get('expressions', []):
+                expressions[msp_integrity.normalize_expression(expression)] = True
+
+    import_file_codelists = {}
+    for codelist_id in codelist_ids:
+        export_json = {'concepts': [], 'mappings': []}
+        unresolved_expressions = []
+        for expression in expressions_by_collection.get(codelist_id, {}):
+            member = members_by_url.get(expression)
+            if member is None:
+                unresolved_expressions.append(expression)
+            elif 'map_type' in member:
+                export_json['mappings'].append(member)
+            else:
+                export_json['concepts'].append(member)
+        import_file_codelists[codelist_id] = (
+            ocldev.oclexport.OclExport(export_json=export_json), unresolved_expressions)
+    return import_file_codelists
+
+
+def validate_import_file_codelists(import_filename, codelist_collections, collection_ids=None):
+    """
+    Validate the code list collections of a built import file against the DATIM codelists in
+    codelist_collections (see msp.load_codelist_collections_with_exports_from_file) and return
+    a report in the same format as validate_codelists. Concepts are matched on their UIDs,
+    since the IDs of the data element concepts built by this repository are UIDs.
+    """
+    start_time = time.time()
+    import_file_codelists = load_import_file_codelists(
+        import_filename, collection_ids=collection_ids)
+    datim_codelists = dict((codelist['id'], codelist) for codelist in codelist_collections)
+    codelist_results = []
+    for codelist_id, (codelist_ocl, unresolved_expressions) in import_file_codelists.items():
+        result = {'id': codelist_id, 'unresolved_expressions': unresolved_expressions}
+        codelist_results.append(result)
+        datim_codelist = datim_codelists.get(codelist_id)
+        if datim_codelist is None or 'dhis2_codelist' not in datim_codelist.get('extras', {}):
+            result.update({'status': STATUS_ERROR, 'error': 'No DATIM codelist export'})
+            continue
+        codelist_datim = datim_codelist['extras']['dhis2_codelist']
+        result.update({
+            'external_id': datim_codelist.get('external_id'),
+            'ocl_stats': msp.get_ocl_codelist_stats(codelist_ocl),
+            'datim_stats': msp.get_datim_codelist_stats(codelist_datim),
+            'diff': msp.diff_codelist(
+                codelist_ocl=codelist_ocl, codelist_datim=codelist_datim, match_codes=False),
+        })
+        set_diff_status(result)
+    return {
+        'date': datetime.datetime.now().isoformat(),
+        'import_filename': import_filename,
+        'elapsed_seconds': round(time.time() - start_time, 3),
+        'num_codelists': len(codelist_results),
+        'counts': count_statuses(codelist_results),
+        'not_in_import_file': sorted(
+            codelist_id for codelist_id in datim_codelists
+            if codelist_id not in import_file_codelists and
+            (collection_ids is None or codelist_id in collection_ids)),
+        'codelists': codelist_results,
+    }
+
+
+def display_report(report, verbosity=1):
+    """ Print one line per codelist with differences or errors, followed by the totals """
+    for result in report['codelists']:
+        if result['status'] == STATUS_ERROR:
+            print('%s: ERROR %s' % (result['id'], result['error']))
+        elif result['status'] == STATUS_DIFFERENT or verbosity > 1:
+            version = ' (%s)' % result['ocl_version'] if result.get('ocl_version') else ''
+            print('%s%s: %s %s' % (
+                result['id'], version, result['status'],
+                ', '.join('%s=%s' % item for item in sorted(result['diff_counts'].items()))))
+        if result.get('unresolved_expressions'):
+            print('  %s unresolved reference expressions, eg %s' % (
+                len(result['unresolved_expressions']), result['unresolved_expressions'][0]))
+    cache_summary = ''
+    if 'cache' in report:
+        cache_summary = ' (%s responses retrieved, %s cached)' % (
+            report['cache']['retrieved'], report['cache']['cached'])
+    print('%s codelists: %s valid, %s different, %s errors%s in %.1fs' % (
+        report['num_codelists'], report['counts'][STATUS_VALID],
+        report['counts'][STATUS_DIFFERENT], report['counts'][STATUS_ERROR], cache_summary,
+        report['elapsed_seconds']))
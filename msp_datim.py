@@ -0,0 +1,120 @@
+"""
+Network helpers that retrieve metadata from DATIM (DHIS2) for the MSP ETL scripts.
+
+These are kept out of msp.py so that offline tools (the build, the spreadsheet export, the
+benchmarks) do not pay for importing the HTTP stack. Only export_datim_metadata.py,
+save_codelists_to_file.py and the validation scripts need this module.
+"""
+import csv
+import datetime
+import requests
+import ocldev.oclresourcelist
+import msp_io
+import msp_profile
+
+
+# DATIM DHIS2 export queries
+# NOTE: comment out to omit; key must match the standard resource name from DHIS2
+DATIM_EXPORTS = {
+    'indicators': {
+        'fileType': 'json',
+        'url': ('https://dev-de.datim.org/api/indicators.json?fields=*,dataSets[id,name],'
+                'indicatorType[id,name],indicatorGroups[id,name]&paging=false')
+    },
+    'dataElements': {
+        'fileType': 'json',
+        'url': ('https://dev-de.datim.org/api/dataElements.json?fields=id,code,name,shortName,'
+                'aggregationType,domainType,description,valueType,categoryCombo[id,code,name,'
+                'categoryOptionCombos[id,code,name]],dataElementGroups[id,name],attributeValues,'
+                'dataSetElements[dataSet[id,name,shortName,code]]&paging=false'),
+    },
+    'categoryOptionCombos': {
+        'fileType': 'json',
+        'url': ('https://dev-de.datim.org/api/categoryOptionCombos.json?fields=id,code,name,'
+                'shortName,categoryCombo[id,name,dataDimensionType],categoryOptions[id,code,name]'
+                '&paging=false'),
+    },
+    'dataSets': {
+        'fileType': 'csv',
+        'url': ('https://dev-de.datim.org/api/dataSets.csv?fields=id,href,shortName,name,code,'
+                'description,periodType&paging=false'),
+    }
+}
+
+# Filename format for DATIM exports: export key, date, file type
+DATIM_EXPORT_FILENAME_FORMAT = 'data/datim_%s_%s.%s'
+
+
+def export_datim_metadata(username='', password='', exports=None,
+                          filename_format=DATIM_EXPORT_FILENAME_FORMAT, verbosity=1):
+    """
+    Request each of the DATIM DHIS2 exports (DATIM_EXPORTS by default) and save the content
+    to file. Returns a dictionary with export key as key and the saved filename as value.
+    """
+    if exports is None:
+        exports = DATIM_EXPORTS
+    today = datetime.datetime.today().strftime('%Y%m%d')
+    export_filenames = {}
+    for export_key in exports:
+        export_filename = filename_format % (export_key, today, exports[export_key]['fileType'])
+        if verbosity:
+            print('\n****', export_key, '\n', exports[export_key]['url'])
+        r = requests.get(exports[export_key]['url'], auth=(username, password))
+        r.raise_for_status()
+        if '.json?' in exports[export_key]['url'] and verbosity:
+            results = r.json()
+            print('%s resources successfully retrieved from DATIM:' % str(
+                len(results[export_key])))
+        with open(export_filename, mode='wb') as localfile:
+            localfile.write(r.content)
+        if verbosity:
+            print('Content saved to %s' % export_filename)
+        export_filenames[export_key] = export_filename
+    return export_filenames
+
+
+def fetch_datim_codelist(url):
+    """ Retrieve a DATIM codelist export (JSON with a listGrid) from the specified URL """
+    dhis2_codelist_response = requests.get(url)
+    dhis2_codelist_response.raise_for_status()
+    return dhis2_codelist_response.json()
+
+
+@msp_profile.profiled()
+def load_codelist_collections(filename='', org_id='', canonical_url='', verbosity=0):
+    """
+    Load and return codelist_collections as OCL-formatted JSON collections.
+    This method retrieves all of the full codelist from DATIM directly, which takes
+    a long time to process.
+    """
+
+    # Load the codelist definitions into a resource list
+    csv_codelists = []
+    with msp_io.open_file(filename) as ifile:
+        reader = csv.DictReader(ifile)
+        for row in reader:
+            # Skip rows that are not set to be imported
+            if not row['resource_type']:
+                continue
+            if verbosity:
+                print('Retrieving codelist: %s' % row['id'])
+            row['owner_id'] = org_id
+            dhis2_codelist_url = row.pop('ZenDesk: JSON Link')
+            dhis2_codelist_url += '&paging=false'
+            if verbosity:
+                print('  DHIS2 URL: %s' % dhis2_codelist_url)
+                print('  Canonical URL:', "%s/ValueSet/%s" % (canonical_url, row['id']))
+            row['attr:dhis2_codelist_url'] = dhis2_codelist_url
+
+            # Fetch the codelist from DHSI2
+            row['attr:dhis2_codelist'] = fetch_datim_codelist(dhis2_codelist_url)
+            csv_codelists.append(row)
+
+    codelist_csv_resource_list = ocldev.oclresourcelist.OclCsvResourceList(resources=csv_codelists)
+    codelist_json_resource_list = codelist_csv_resource_list.convert_to_ocl_formatted_json()
+
+    # Fields not supported in the CSV format get added here
+    for codelist in codelist_json_resource_list:
+        codelist['canonical_url'] = "%s/ValueSet/%s" % (canonical_url, codelist['id'])
+
+    return codelist_json_resource_list
@@ -0,0 +1,373 @@
+"""
+Integer-ID graph storage for the concept relations built by msp.py (DE->COC, iHUB DDE->COC,
+codelist->DE->COC and reference indicator->child concept maps).
+
+Each concept URL is assigned a dense integer ID by a ConceptRegistry (one shared registry per
+owner/source, see get_concept_registry). A relation is built with a CsrRelationBuilder, which
+de-duplicates edges with a set as they are added, and is then frozen into compressed sparse row
+(CSR) form: an array of source IDs in insertion order, an array of row offsets and one flat array
+of target IDs. Memory per edge is a 4 byte integer instead of a list slot plus a URL string.
+
+CsrRelation is a read-only mapping view of a relation that renders back to URLs, so the existing
+reference and mapping builders can keep using map_dict[from_url], 'from_url in map_dict',
+iteration over keys and len() unchanged. Use has_edge() for O(1) membership checks.
+
+SharedTargetRelation is a CsrRelation whose rows are shared target groups (eg the COCs of a DATIM
+categoryCombo) that many sources point to, so the targets of a group are stored, rendered and
+indexed once no matter how many sources (eg data elements) reference the group.
+"""
+import array
+import bisect
+import collections.abc
+
+
+# Typecode for concept IDs and row offsets -- unsigned int is 4 bytes on all supported platforms
+CONCEPT_ID_TYPECODE = 'I'
+
+# Shared registries, keyed by (owner_id, source_id)
+_CONCEPT_REGISTRIES = {}
+
+# Marks the keys of groups created by SharedTargetRelationBuilder to merge two groups
+_MERGED_GROUP = object()
+
+
+class ConceptRegistry(object):
+    """ Assigns dense integer IDs to concept URLs """
+
+    def __init__(self):
+        self._urls = []
+        self._ids = {}
+
+    def __len__(self):
+        return len(self._urls)
+
+    def __contains__(self, url):
+        return url in self._ids
+
+    def get_or_add_id(self, url):
+        """ Return the integer ID for url, registering the URL if needed """
+        concept_id = self._ids.get(url)
+        if concept_id is None:
+            concept_id = len(self._urls)
+            self._urls.append(url)
+            self._ids[url] = concept_id
+        return concept_id
+
+    def get_id(self, url):
+        """ Return the integer ID for url or None if the URL is not registered """
+        return self._ids.get(url)
+
+    def get_url(self, concept_id):
+        """ Return the URL for the specified integer ID """
+        return self._urls[concept_id]
+
+    def get_urls(self, concept_ids):
+        """ Return a tuple of URLs for an iterable of integer IDs """
+        urls = self._urls
+        return tuple(urls[concept_id] for concept_id in concept_ids)
+
+
+class CsrRelationBuilder(object):
+    """
+    Accumulates de-duplicated edges between concept URLs and freezes them into a CsrRelation.
+    Source order and per-source target order follow insertion order.
+    """
+
+    def __init__(self, registry=None):
+        self.registry = registry if registry is not None else ConceptRegistry()
+        self._source_ids = []
+        self._source_positions = {}
+        self._targets_by_position = []
+        self._edge_keys = set()
+
+    def add_source(self, from_url):
+        """ Register from_url as a source (key) of the relation, even if it has no edges """
+        from_id = self.registry.get_or_add_id(from_url)
+        position = self._source_positions.get(from_id)
+        if position is None:
+            position = len(self._source_ids)
+            self._source_ids.append(from_id)
+            self._source_positions[from_id] = position
+            self._targets_by_position.append([])
+        return position
+
+    def add_edge(self, from_url, to_url):
+        """ Add an edge unless it already exists. Returns True if the edge was added. """
+        position = self.add_source(from_url)
+        to_id = self.registry.get_or_add_id(to_url)
+        edge_key = (position, to_id)
+        if edge_key in self._edge_keys:
+            return False
+        self._edge_keys.add(edge_key)
+        self._targets_by_position[position].append(to_id)
+        return True
+
+    def add_edges(self, from_url, to_urls):
+        """ Add an edge from from_url to each URL in to_urls """
+        self.add_source(from_url)
+        for to_url in to_urls:
+            self.add_edge(from_url, to_url)
+
+    def build(self):
+        """ Return the frozen CsrRelation and release the builder's working memory """
+        offsets = array.array(CONCEPT_ID_TYPECODE, [0])
+        targets = array.array(CONCEPT_ID_TYPECODE)
+        for target_ids in self._targets_by_position:
+            targets.extend(target_ids)
+            offsets.append(len(targets))
+        relation = CsrRelation(
+            self.registry, array.array(CONCEPT_ID_TYPECODE, self._source_ids), offsets, targets)
+        self._source_ids = []
+        self._source_positions = {}
+        self._targets_by_position = []
+        self._edge_keys = set()
+        return relation
+
+
+class CsrRelation(collections.abc.Mapping):
+    """
+    Read-only CSR adjacency for one relation. As a mapping, keys are source concept URLs in
+    insertion order and values are tuples of target concept URLs.
+    """
+
+    def __init__(self, registry, source_ids, offsets, targets):
+        self.registry = registry
+        self.source_ids = source_ids
+        self.offsets = offsets
+        self.targets = targets
+        sorted_positions = sorted(range(len(source_ids)), key=source_ids.__getitem__)
+        self._sorted_source_ids = array.array(
+            CONCEPT_ID_TYPECODE, [source_ids[position] for position in sorted_positions])
+        self._sorted_positions = array.array(CONCEPT_ID_TYPECODE, sorted_positions)
+        self._edge_sets = {}
+
+    def _get_row(self, position):
+        """ Return the CSR row that holds the targets of the source at position """
+        return position
+
+    def _get_position(self, from_url):
+        """ Return the row position of from_url or None if it is not a source """
+        from_id = self.registry.get_id(from_url)
+        if from_id is None:
+            return None
+        index = bisect.bisect_left(self._sorted_source_ids, from_id)
+        if index < len(self._sorted_source_ids) and self._sorted_source_ids[index] == from_id:
+            return self._sorted_positions[index]
+        return None
+
+    def __getitem__(self, from_url):
+        position = self._get_position(from_url)
+        if position is None:
+            raise KeyError(from_url)
+        return self._get_row_urls(self._get_row(position))
+
+    def _get_row_urls(self, row):
+        """ Return tuple of target URLs for the specified CSR row """
+        return self.registry.get_urls(self.targets[self.offsets[row]:self.offsets[row + 1]])
+
+    def __contains__(self, from_url):
+        return self._get_position(from_url) is not None
+
+    def __iter__(self):
+        registry = self.registry
+        for from_id in self.source_ids:
+            yield registry.get_url(from_id)
+
+    def __len__(self):
+        return len(self.source_ids)
+
+    def __repr__(self):
+        return '<CsrRelation: %s sources, %s edges>' % (len(self), self.num_edges)
+
+    @property
+    def num_edges(self):
+        """ Total number of edges in the relation """
+        return len(self.targets)
+
+    def get_target_ids(self, from_url):
+        """ Return the array slice of target IDs for from_url (empty if not a source) """
+        position = self._get_position(from_url)
+        if position is None:
+            return array.array(CONCEPT_ID_TYPECODE)
+        row = self._get_row(position)
+        return self.targets[self.offsets[row]:self.offsets[row + 1]]
+
+    def count_targets(self, from_url):
+        """ Return the number of targets for from_url without rendering their URLs """
+        position = self._get_position(from_url)
+        if position is None:
+            return 0
+        row = self._get_row(position)
+        return self.offsets[row + 1] - self.offsets[row]
+
+    def has_edge(self, from_url, to_url):
+        """ Return True if the relation has an edge from from_url to to_url """
+        position = self._get_position(from_url)
+        to_id = self.registry.get_id(to_url)
+        if position is None or to_id is None:
+            return False
+        row = self._get_row(position)
+        if row not in self._edge_sets:
+            self._edge_sets[row] = frozenset(self.targets[self.offsets[row]:self.offsets[row + 1]])
+        return to_id in self._edge_sets[row]
+
+    def items(self):
+        """ Iterate (from_url, tuple of to_urls) in insertion order """
+        registry = self.registry
+        for position, from_id in enumerate(self.source_ids):
+            yield registry.get_url(from_id), self._get_row_urls(self._get_row(position))
+
+    def to_dict(self):
+        """ Return the relation as a plain dictionary with URL keys and lists of URLs """
+        return {from_url: list(to_urls) for from_url, to_urls in self.items()}
+
+    def copy(self):
+        """ Return a plain dictionary copy, ie compatible with dict.copy() on the original maps """
+        return self.to_dict()
+
+
+class SharedTargetRelationBuilder(object):
+    """
+    Accumulates a relation in which each source points to one shared group of targets and
+    freezes it into a SharedTargetRelation. Groups are identified by a caller-defined key (eg a
+    categoryCombo UID), so the targets of a group only need to be resolved once.
+    """
+
+    def __init__(self, registry=None):
+        self.registry = registry if registry is not None else ConceptRegistry()
+        self._source_ids = []
+        self._source_groups = []
+        self._source_positions = {}
+        self._group_indexes = {}
+        self._group_target_ids = []
+
+    def get_group(self, group_key):
+        """ Return the index of the group with the specified key or None if not yet added """
+        return self._group_indexes.get(group_key)
+
+    def add_group(self, group_key, to_urls):
+        """ Add a group of (de-duplicated) target URLs and return its index """
+        group_index = self._group_indexes.get(group_key)
+        if group_index is None:
+            target_ids = []
+            for to_url in to_urls:
+                to_id = self.registry.get_or_add_id(to_url)
+                if to_id not in target_ids:
+                    target_ids.append(to_id)
+            group_index = len(self._group_target_ids)
+            self._group_target_ids.append(target_ids)
+            self._group_indexes[group_key] = group_index
+        return group_index
+
+    def add_source(self, from_url, group_index):
+        """
+        Point from_url at the group with the specified index. If from_url was already added
+        with a different group, it is pointed at a group with the union of both groups' targets.
+        """
+        from_id = self.registry.get_or_add_id(from_url)
+        position = self._source_positions.get(from_id)
+        if position is None:
+            self._source_positions[from_id] = len(self._source_ids)
+            self._source_ids.append(from_id)
+            self._source_groups.append(group_index)
+        elif self._source_groups[position] != group_index:
+            current_group_index = self._source_groups[position]
+            merged_group_key = (_MERGED_GROUP, current_group_index, group_index)
+            merged_group_index = self._group_indexes.get(merged_group_key)
+            if merged_group_index is None:
+                merged_target_ids = list(self._group_target_ids[current_group_index])
+                for to_id in self._group_target_ids[group_index]:
+                    if to_id not in merged_target_ids:
+                        merged_target_ids.append(to_id)
+                merged_group_index = len(self._group_target_ids)
+                self._group_target_ids.append(merged_target_ids)
+                self._group_indexes[merged_group_key] = merged_group_index
+            self._source_groups[position] = merged_group_index
+
+    def build(self):
+        """ Return the frozen SharedTargetRelation and release the builder's working memory """
+        offsets = array.array(CONCEPT_ID_TYPECODE, [0])
+        targets = array.array(CONCEPT_ID_TYPECODE)
+        for target_ids in self._group_target_ids:
+            targets.extend(target_ids)
+            offsets.append(len(targets))
+        relation = SharedTargetRelation(
+            self.registry, array.array(CONCEPT_ID_TYPECODE, self._source_ids),
+            array.array(CONCEPT_ID_TYPECODE, self._source_groups), offsets, targets)
+        self._source_ids = []
+        self._source_groups = []
+        self._source_positions = {}
+        self._group_indexes = {}
+        self._group_target_ids = []
+        return relation
+
+
+class SharedTargetRelation(CsrRelation):
+    """
+    CsrRelation in which CSR rows are shared target groups and each source references one group
+    by index. Lookups return the group's cached tuple of target URLs, so sources in the same group
+    share one tuple object. Iteration and items() still expand the targets per source.
+    """
+
+    def __init__(self, registry, source_ids, source_groups, offsets, targets):
+        CsrRelation.__init__(self, registry, source_ids, offsets, targets)
+        self.source_groups = source_groups
+        self._group_urls = {}
+
+    def _get_row(self, position):
+        return self.source_groups[position]
+
+    def _get_row_urls(self, row):
+        urls = self._group_urls.get(row)
+        if urls is None:
+            urls = CsrRelation._get_row_urls(self, row)
+            self._group_urls[row] = urls
+        return urls
+
+    def __repr__(self):
+        return '<SharedTargetRelation: %s sources, %s groups, %s edges>' % (
+            len(self), self.num_groups, self.num_edges)
+
+    @property
+    def num_groups(self):
+        """ Number of shared target groups """
+        return len(self.offsets) - 1
+
+    @property
+    def num_edges(self):
+        """ Total number of edges in the relation, ie expanded per source """
+        offsets = self.offsets
+        return sum(offsets[row + 1] - offsets[row] for row in self.source_groups)
+
+
+def get_concept_registry(owner_id='', source_id=''):
+    """ Return the shared ConceptRegistry for the specified owner and source """
+    key = (owner_id, source_id)
+    registry = _CONCEPT_REGISTRIES.get(key)
+    if registry is None:
+        registry = ConceptRegistry()
+        _CONCEPT_REGISTRIES[key] = registry
+    return registry
+
+
+def build_relation(edges_by_source, registry=None):
+    """
+    Return a CsrRelation from an iterable of (from_url, iterable of to_urls) pairs. Sources with
+    no targets are kept as keys with an empty tuple of targets.
+    """
+    builder = CsrRelationBuilder(registry=registry)
+    for from_url, to_urls in edges_by_source:
+        builder.add_edges(from_url, to_urls)
+    return builder.build()
+
+
+def get_relation_child_counts(relation):
+    """ Return (number of sources, number of edges) for a CsrRelation or a dict of lists """
+    if isinstance(relation, CsrRelation):
+        return len(relation), relation.num_edges
+    return len(relation), sum(len(to_urls) for to_urls in relation.values())
+
+
+def clear_concept_registries():
+    """ Release all shared registries """
+    _CONCEPT_REGISTRIES.clear()
@@ -0,0 +1,180 @@
+"""
+Org and source identity of the resources of an import list, applied when the list is written.
+
+The msp.py loaders bake the org and source IDs of the configuration into every resource (owner,
+source, concept URLs, mapping URLs and reference expressions). To write import files for several
+orgs (eg PEPFAR-MER-FY22, a test org and a staging org) from one build, the import list is built
+once with the configured identity and each resource is rewritten to the identity of a build
+target as it is serialized (see MspPipeline.write_import_list). Rewritten resources are copies:
+the import list, and so the products of the build shared by the targets, are never modified.
+The rewrite replaces URL prefixes consistently, so a rewritten import list has the same
+referential integrity as the import list it was written from.
+
+A build target is an org ID, optionally with a source ID and a period slice, eg:
+
+    PEPFAR-Test4
+    PEPFAR-Staging/MER:FY21,FY22
+
+See MSP_BUILD_TARGETS in settings.py and the --target option of build_ocl_import.py.
+"""
+import msp_records
+
+
+# Separators of the build target syntax ORG_ID[/SOURCE_ID][:PERIOD,PERIOD...]
+TARGET_SOURCE_SEPARATOR = '/'
+TARGET_PERIODS_SEPARATOR = ':'
+TARGET_PERIOD_SEPARATOR = ','
+
+# Resource attributes holding a URL, and a list of URLs, that may be owned by the build org.
+# "__cocs" of DATIM data elements is a list of raw DATIM COCs instead, which is left as is.
+URL_KEYS = ('__url', 'url', 'from_concept_url', 'to_concept_url', 'from_source_url',
+            'to_source_url')
+URL_LIST_KEYS = ('__cocs',)
+
+
+class BuildTarget(object):
+    """
+    Org and source identity, period slice and canonical URL of one import file. periods and
+    canonical_url of None use those of the build configuration.
+    """
+
+    def __init__(self, org_id, source_id, periods=None, canonical_url=None):
+        self.org_id = org_id
+        self.source_id = source_id
+        self.periods = list(periods) if periods else None
+        self.canonical_url = canonical_url
+
+    def __repr__(self):
+        target = '%s%s%s' % (self.org_id, TARGET_SOURCE_SEPARATOR, self.source_id)
+        if self.periods:
+            target += TARGET_PERIODS_SEPARATOR + TARGET_PERIOD_SEPARATOR.join(self.periods)
+        return target
+
+    def get_slice_key(self):
+        """ Returns hashable key of the period slice, equal for targets sharing one build """
+        return tuple(self.periods or ())
+
+
+class IdentityRewriter(object):
+    """
+    Rewrites OCL-formatted resources built with one org and source identity to another. Only
+    the attributes carrying the identity are rewritten, eg the "MER" structured dataset of a data
+    element is left as is even if the source ID is "MER".
+    """
+
+    def __init__(self, from_org_id, from_source_id, to_org_id, to_source_id,
+                 from_canonical_url='', to_canonical_url=''):
+        self.from_org_id = from_org_id
+        self.from_source_id = from_source_id
+        self.to_org_id = to_org_id
+        self.to_source_id = to_source_id
+        self.from_canonical_url = from_canonical_url
+        self.to_canonical_url = to_canonical_url
+        self.from_org_prefix = '/orgs/%s/' % from_org_id
+        self.to_org_prefix = '/orgs/%s/' % to_org_id
+        self.from_source_prefix = '%ssources/%s/' % (self.from_org_prefix, from_source_id)
+        self.to_source_prefix = '%ssources/%s/' % (self.to_org_prefix, to_source_id)
+
+    def is_identity(self):
+        """ Returns True if resources are unchanged by the rewrite """
+        return (self.from_org_id == self.to_org_id and
+                self.from_source_id == self.to_source_id and
+                self.from_canonical_url == self.to_canonical_url)
+
+    def rewrite_url(self, url):
+        """ Returns the URL with its org and source prefix rewritten """
+        if url.startswith(self.from_source_prefix):
+            return self.to_source_prefix + url[len(self.from_source_prefix):]
+        if url.startswith(self.from_org_prefix):
+            return self.to_org_prefix + url[len(self.from_org_prefix):]
+        return url
+
+    def rewrite_canonical_url(self, canonical_url):
+        """ Returns the canonical URL with its base URL rewritten """
+        if (self.from_canonical_url and
+                canonical_url.startswith(self.from_canonical_url + '/')):
+            return self.to_canonical_url + canonical_url[len(self.from_canonical_url):]
+        return canonical_url
+
+    def rewrite(self, resource):
+        """ Returns a rewritten copy of an OCL-formatted resource dict or record """
+        resource = msp_records.to_ocl_json(resource)
+        rewritten = dict(resource)
+        is_owned = resource.get('owner') == self.from_org_id
+        if is_owned:
+            rewritten['owner'] = self.to_org_id
+            if resource.get('source') == self.from_source_id:
+                rewritten['source'] = self.to_source_id
+        resource_type = resource.get('type')
+        if resource_type == 'Organization' and resource.get('id') == self.from_org_id:
+            rewritten['id'] = self.to_org_id
+        elif (resource_type == 'Source' and is_owned and
+              resource.get('id') == self.from_source_id):
+            rewritten['id'] = self.to_source_id
+            if resource.get('short_code') == self.from_source_id:
+                rewritten['short_code'] = self.to_source_id
+        if resource.get('canonical_url'):
+            rewritten['canonical_url'] = self.rewrite_canonical_url(resource['canonical_url'])
+        for key in URL_KEYS:
+            if resource.get(key):
+                rewritten[key] = self.rewrite_url(resource[key])
+        for key in URL_LIST_KEYS:
+            if resource.get(key):
+                rewritten[key] = [self.rewrite_url(url) if isinstance(url, str) else url
+                                  for url in resource[key]]
+        if isinstance(resource.get('data'), dict) and 'expressions' in resource['data']:
+            rewritten['data'] = dict(resource['data'])
+            rewritten['data']['expressions'] = [
+                self.rewrite_url(expression) for expression in resource['data']['expressions']]
+        return rewritten
+
+
+def parse_build_target(text, default_source_id, default_periods=None):
+    """ Returns BuildTarget of a string formatted as ORG_ID[/SOURCE_ID][:PERIOD,PERIOD...] """
+    identity, _, periods = text.partition(TARGET_PERIODS_SEPARATOR)
+    org_id, _, source_id = identity.partition(TARGET_SOURCE_SEPARATOR)
+    if not org_id.strip():
+        raise ValueError('Invalid build target, the org ID is missing: %s' % text)
+    periods = [period.strip() for period in periods.split(TARGET_PERIOD_SEPARATOR)
+               if period.strip()]
+    return BuildTarget(org_id.strip(), source_id.strip() or default_source_id,
+                       periods=periods or default_periods)
+
+
+def get_build_targets(config, target_strings=None, periods=None):
+    """
+    Returns list of BuildTargets: those parsed from target_strings, else those of the
+    MSP_BUILD_TARGETS setting, else the single target of MSP_ORG_ID and MSP_SOURCE_ID. periods is
+    the period slice of targets without one. Raises ValueError if two targets have the same org
+    ID, as they would be written to the same import file.
+    """
+    if target_strings:
+        targets = [parse_build_target(text, config.MSP_SOURCE_ID, default_periods=periods)
+                   for text in target_strings]
+    elif getattr(config, 'MSP_BUILD_TARGETS', None):
+        targets = [BuildTarget(
+            target['org_id'], target.get('source_id') or config.MSP_SOURCE_ID,
+            periods=target.get('periods') or periods, canonical_url=target.get('canonical_url'))
+            for target in config.MSP_BUILD_TARGETS]
+    else:
+        targets = [BuildTarget(config.MSP_ORG_ID, config.MSP_SOURCE_ID, periods=periods)]
+    org_ids = set()
+    for target in targets:
+        if target.org_id in org_ids:
+            raise ValueError('Duplicate build target org ID: %s' % target.org_id)
+        org_ids.add(target.org_id)
+    return targets
+
+
+def get_identity_rewriter(config, target):
+    """
+    Returns IdentityRewriter from the identity of config (the identity the build is run with)
+    to that of target, or None if they are the same
+    """
+    rewriter = IdentityRewriter(
+        config.MSP_ORG_ID, config.MSP_SOURCE_ID, target.org_id, target.source_id,
+        from_canonical_url=config.CANONICAL_URL,
+        to_canonical_url=target.canonical_url or config.CANONICAL_URL)
+    if rewriter.is_identity():
+        return None
+    return rewriter
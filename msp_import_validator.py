@@ -0,0 +1,148 @@
+"""
+Streaming, parallel validation of OCL-formatted JSON lines import files.
+
+The file is read in chunks of lines (compressed files are decompressed as a stream, see
+msp_io.py) and each chunk is validated in a worker process against the ocldev JSON schema for
+the type of each resource. Only a bounded number of chunks is in flight at any time, so memory
+use does not grow with the size of the file, and errors are reported in file order as soon as
+their chunk is validated, before the rest of the file has been read.
+
+Each worker compiles the schema of each resource type once (jsonschema.validate checks the
+schema itself on every call, which is most of the cost of OclJsonResourceList.validate) and
+reports the most relevant error of each invalid resource, as jsonschema.validate would raise.
+
+Example usage:
+  for error in msp_import_validator.iter_validation_errors('output/msp_import.json'):
+      print('line %(line)s: %(type)s %(resource)s: %(message)s' % error)
+"""
+import concurrent.futures
+import itertools
+import json
+import os
+import jsonschema
+import ocldev.oclvalidator
+import msp_io
+import msp_urls
+
+
+# Number of lines validated per task and number of tasks in flight per worker
+DEFAULT_CHUNK_SIZE = 2000
+CHUNKS_IN_FLIGHT_PER_WORKER = 2
+
+# Compiled schema validators of a worker process, keyed by resource type
+_SCHEMA_VALIDATORS = {}
+
+
+def get_schema_validator(resource_type):
+    """ Return the compiled validator for the schema of resource_type, or None if unknown """
+    if resource_type not in _SCHEMA_VALIDATORS:
+        schema = ocldev.oclvalidator.OclJsonValidator.VALIDATION_SCHEMAS.get(resource_type)
+        schema_validator = None
+        if schema is not None:
+            validator_class = jsonschema.validators.validator_for(schema)
+            validator_class.check_schema(schema)
+            schema_validator = validator_class(schema)
+        _SCHEMA_VALIDATORS[resource_type] = schema_validator
+    return _SCHEMA_VALIDATORS[resource_type]
+
+
+def get_resource_label(resource):
+    """ Return the URL of a resource for error messages, or its ID or collection """
+    if not isinstance(resource, dict):
+        return None
+    return (msp_urls.get_resource_url(resource) or resource.get('id') or
+            msp_urls.get_repo_id(resource))
+
+
+def validate_resource(resource):
+    """ Return the validation error message of a parsed resource, or None if it is valid """
+    if not isinstance(resource, dict):
+        return 'Expected a JSON object, got %s' % type(resource).__name__
+    resource_type = resource.get('type')
+    if not resource_type:
+        return "Must provide 'type' as a resource attribute"
+    schema_validator = get_schema_validator(resource_type)
+    if schema_validator is None:
+        return "Unrecognized resource type '%s'" % resource_type
+    error = jsonschema.exceptions.best_match(schema_validator.iter_errors(resource))
+    return None if error is None else error.message
+
+
+def validate_lines(chunk):
+    """
+    Validate a chunk of (line number, line) pairs. Returns (number of resources by type,
+    list of error dictionaries) for the chunk.
+    """
+    counts = {}
+    errors = []
+    for line_number, line in chunk:
+        try:
+            resource = json.loads(line)
+        except ValueError as e:
+            errors.append({'line': line_number, 'type': None, 'resource': None,
+                           'message': 'Invalid JSON: %s' % e})
+            continue
+        resource_type = resource.get('type') if isinstance(resource, dict) else None
+        counts[resource_type] = counts.get(resource_type, 0) + 1
+        message = validate_resource(resource)
+        if message is not None:
+            errors.append({'line': line_number, 'type': resource_type,
+                           'resource': get_resource_label(resource), 'message': message})
+    return counts, errors
+
+
+def iter_line_chunks(filename, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Yield lists of (line number, line) pairs of the non-blank lines of a JSON lines file """
+    with msp_io.open_file(filename, encoding='utf-8') as input_file:
+        numbered_lines = ((line_number, line) for line_number, line in enumerate(input_file, 1)
+                          if line.strip())
+        while True:
+            chunk = list(itertools.islice(numbered_lines, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+
+def iter_chunk_results(filename, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield the (counts, errors) result of each chunk of the file in file order. Chunks are
+    validated by a pool of worker processes (os.cpu_count() by default) or, if workers is 1,
+    in this process.
+    """
+    chunks = iter_line_chunks(filename, chunk_size=chunk_size)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for chunk in chunks:
+            yield validate_lines(chunk)
+        return
+    max_in_flight = workers * CHUNKS_IN_FLIGHT_PER_WORKER
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(validate_lines, chunk)
+                   for chunk in itertools.islice(chunks, max_in_flight)]
+        while futures:
+            result = futures.pop(0).result()
+            for chunk in itertools.islice(chunks, 1):
+                futures.append(executor.submit(validate_lines, chunk))
+            yield result
+
+
+def iter_validation_errors(filename, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, counts=None):
+    """
+    Yield a dictionary (line, type, resource, message) for each invalid resource of the file in
+    file order. If counts is a dictionary, it is updated with the number of resources by type.
+    """
+    for chunk_counts, chunk_errors in iter_chunk_results(
+            filename, workers=workers, chunk_size=chunk_size):
+        if counts is not None:
+            for resource_type, count in chunk_counts.items():
+                counts[resource_type] = counts.get(resource_type, 0) + count
+        for error in chunk_errors:
+            yield error
+
+
+def format_error(error):
+    """ Return a one-line description of a validation error """
+    label = ' '.join(str(value) for value in (error['type'], error['resource']) if value)
+    if not label:
+        return 'line %s: %s' % (error['line'], error['message'])
+    return 'line %s: %s: %s' % (error['line'], label, error['message'])
@@ -0,0 +1,341 @@
+"""
+Sidecar line index and random-access reader for OCL-formatted JSON lines files, eg the import
+files written by build_ocl_import.py (output/msp_*.json).
+
+The index maps the identity of each resource (type, owner type, owner, repository and ID; the
+URL is derived from these with msp_urls.get_resource_url) to the byte offset and length of its
+line. It is saved next to the file as '<filename>.idx' together with the size and modification
+time of the file, so a stale index is detected and rebuilt. The build writes the index while it
+writes the import file (see MspPipeline.write_import_list), otherwise it is built with one pass
+over the file.
+
+JsonLinesReader memory-maps the file and parses only the lines that are asked for, so fetching a
+resource by ID or URL, or all resources of one type, does not parse the rest of the file.
+Compressed files (see msp_io.py) cannot be memory-mapped and are not supported.
+
+Example usage:
+  with msp_index.JsonLinesReader('output/msp_PEPFAR-MER-FY22_20220131.json') as reader:
+      concept = reader.get('Concept', 'TX_CURR')
+      mapping = reader.get_by_url('/orgs/PEPFAR-MER-FY22/sources/MER/mappings/MAP_1/')
+      for collection_version in reader.iter_type('Collection Version'):
+          print(collection_version['collection'])
+"""
+import array
+import json
+import mmap
+import os
+import msp_io
+import msp_urls
+
+
+# Sidecar index filename suffix and format
+INDEX_SUFFIX = '.idx'
+INDEX_FORMAT = 'msp-jsonl-index'
+INDEX_VERSION = 1
+
+# Identity fields of each indexed line, in the order they are stored
+IDENTITY_FIELDS = ('type', 'owner_type', 'owner', 'repo', 'id')
+
+# Typecode for byte offsets and line lengths -- unsigned long long is 8 bytes
+OFFSET_TYPECODE = 'Q'
+
+
+def get_index_filename(filename):
+    """ Return the sidecar index filename for a JSON lines file """
+    return filename + INDEX_SUFFIX
+
+
+def get_resource_identity(resource):
+    """ Return the identity tuple (see IDENTITY_FIELDS) of an OCL-formatted resource """
+    if not isinstance(resource, dict):
+        return (None, None, None, None, None)
+    return (resource.get('type'), resource.get('owner_type'), resource.get('owner'),
+            msp_urls.get_repo_id(resource), resource.get('id'))
+
+
+def _get_file_stat(filename):
+    """ Return (size, mtime_ns) used to detect a stale index """
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _check_uncompressed(filename):
+    """ Raise ValueError if filename is compressed, since it cannot be memory-mapped """
+    if msp_io.get_compression(filename):
+        raise ValueError('Cannot index compressed file "%s", decompress it first' % filename)
+
+
+class JsonLinesIndex(object):
+    """
+    Identity, byte offset and byte length of each line of a JSON lines file. Blank lines are
+    skipped; line numbers are 1-based line numbers in the file.
+    """
+
+    def __init__(self):
+        self.identities = []
+        self.offsets = array.array(OFFSET_TYPECODE)
+        self.lengths = array.array(OFFSET_TYPECODE)
+        self.line_numbers = array.array(OFFSET_TYPECODE)
+        self.size = 0
+        self.mtime_ns = 0
+        self._positions_by_type = None
+        self._positions_by_id = None
+        self._positions_by_url = None
+
+    def __len__(self):
+        """ Number of indexed resources """
+        return len(self.identities)
+
+    def add(self, resource, offset, length, line_number):
+        """ Add the resource at offset (length bytes, including the newline) to the index """
+        self.identities.append(get_resource_identity(resource))
+        self.offsets.append(offset)
+        self.lengths.append(length)
+        self.line_numbers.append(line_number)
+        self._positions_by_type = self._positions_by_id = self._positions_by_url = None
+
+    def get_positions_by_type(self):
+        """ Return dictionary with resource type as key and list of positions as value """
+        if self._positions_by_type is None:
+            self._positions_by_type = {}
+            for position, identity in enumerate(self.identities):
+                self._positions_by_type.setdefault(identity[0], []).append(position)
+        return self._positions_by_type
+
+    def get_positions_by_id(self):
+        """ Return dictionary with (type, id) as key and list of positions as value """
+        if self._positions_by_id is None:
+            self._positions_by_id = {}
+            for position, identity in enumerate(self.identities):
+                if identity[4] is not None:
+                    self._positions_by_id.setdefault(
+                        (identity[0], identity[4]), []).append(position)
+        return self._positions_by_id
+
+    def get_positions_by_url(self):
+        """ Return dictionary with resource URL as key and first position as value """
+        if self._positions_by_url is None:
+            self._positions_by_url = {}
+            for position, identity in enumerate(self.identities):
+                url = self.get_url(position)
+                if url is not None:
+                    self._positions_by_url.setdefault(url, position)
+        return self._positions_by_url
+
+    def get_identity(self, position):
+        """ Return the identity of the indexed resource as a dictionary """
+        return dict(zip(IDENTITY_FIELDS, self.identities[position]))
+
+    def get_url(self, position):
+        """ Return the relative OCL URL of the indexed resource, or None (eg references) """
+        identity = self.get_identity(position)
+        if identity['repo'] is not None:
+            identity[msp_urls.REPO_RESOURCE_TYPES[identity['type']][0].lower()] = identity['repo']
+        if identity['owner_type'] is None:
+            del identity['owner_type']
+        return msp_urls.get_resource_url(identity)
+
+    def find(self, resource_type=None, resource_id=None, owner=None, repo=None):
+        """ Return positions of the resources matching all of the specified identity fields """
+        if resource_type is not None and resource_id is not None:
+            positions = self.get_positions_by_id().get((resource_type, resource_id), [])
+        elif resource_type is not None:
+            positions = self.get_positions_by_type().get(resource_type, [])
+        else:
+            positions = range(len(self.identities))
+        return [position for position in positions if (
+            (resource_id is None or self.identities[position][4] == resource_id) and
+            (owner is None or self.identities[position][2] == owner) and
+            (repo is None or self.identities[position][3] == repo))]
+
+    def count_by_type(self):
+        """ Return dictionary with resource type as key and number of resources as value """
+        return {resource_type: len(positions)
+                for resource_type, positions in self.get_positions_by_type().items()}
+
+    def is_current(self, filename):
+        """ Returns True if the index matches the current size and mtime of filename """
+        return (self.size, self.mtime_ns) == _get_file_stat(filename)
+
+    def to_dict(self):
+        """ Return the index as a JSON-serializable dictionary """
+        return {
+            'format': INDEX_FORMAT,
+            'version': INDEX_VERSION,
+            'size': self.size,
+            'mtime_ns': self.mtime_ns,
+            'fields': list(IDENTITY_FIELDS) + ['offset', 'length', 'line'],
+            'entries': [list(identity) + [offset, length, line_number]
+                        for identity, offset, length, line_number in zip(
+                            self.identities, self.offsets, self.lengths, self.line_numbers)],
+        }
+
+    def dump(self, index_filename):
+        """ Write the index to index_filename """
+        with open(index_filename, 'w') as output_file:
+            json.dump(self.to_dict(), output_file, separators=(',', ':'))
+
+    @staticmethod
+    def load(index_filename):
+        """ Load an index written by JsonLinesIndex.dump """
+        with open(index_filename) as input_file:
+            index_dict = json.load(input_file)
+        if index_dict.get('format') != INDEX_FORMAT or index_dict.get('version') != INDEX_VERSION:
+            raise ValueError('Unsupported index file "%s"' % index_filename)
+        index = JsonLinesIndex()
+        index.size = index_dict['size']
+        index.mtime_ns = index_dict['mtime_ns']
+        num_identity_fields = len(IDENTITY_FIELDS)
+        for entry in index_dict['entries']:
+            index.identities.append(tuple(entry[:num_identity_fields]))
+            index.offsets.append(entry[num_identity_fields])
+            index.lengths.append(entry[num_identity_fields + 1])
+            index.line_numbers.append(entry[num_identity_fields + 2])
+        return index
+
+    @staticmethod
+    def build(filename):
+        """ Build the index of a JSON lines file with one pass over the file """
+        _check_uncompressed(filename)
+        index = JsonLinesIndex()
+        index.size, index.mtime_ns = _get_file_stat(filename)
+        offset = 0
+        with open(filename, 'rb') as input_file:
+            for line_number, line in enumerate(input_file, 1):
+                if line.strip():
+                    index.add(json.loads(line), offset, len(line), line_number)
+                offset += len(line)
+        return index
+
+
+class JsonLinesIndexWriter(object):
+    """
+    Writes resources to a JSON lines file and builds its index at the same time, so that the
+    index does not need a second pass over the file. Use as a context manager; the index is
+    written when the writer is closed.
+    """
+
+    def __init__(self, filename, write_index=True):
+        self.filename = filename
+        self.index = JsonLinesIndex() if write_index else None
+        if write_index:
+            _check_uncompressed(filename)
+        self._output_file = msp_io.open_file(filename, 'wb')
+        self._offset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(write_index=exc_type is None)
+
+    def write(self, resource):
+        """ Write the resource (dict) as one line of JSON and return the bytes of the line """
+        line = json.dumps(resource).encode('utf-8') + b'\n'
+        self._output_file.write(line)
+        if self.index is not None:
+            self.index.add(resource, self._offset, len(line), len(self.index) + 1)
+        self._offset += len(line)
+        return line
+
+    def close(self, write_index=True):
+        """ Close the file and write the index """
+        self._output_file.close()
+        if self.index is not None and write_index:
+            self.index.size, self.index.mtime_ns = _get_file_stat(self.filename)
+            self.index.dump(get_index_filename(self.filename))
+
+
+def load_or_build_index(filename, write_index=True):
+    """
+    Return the index of a JSON lines file from its sidecar index file, or build it if the
+    sidecar is missing or stale and, if write_index is True, save it as the new sidecar
+    """
+    index_filename = get_index_filename(filename)
+    if os.path.exists(index_filename):
+        try:
+            index = JsonLinesIndex.load(index_filename)
+        except ValueError:
+            index = None
+        if index is not None and index.is_current(filename):
+            return index
+    index = JsonLinesIndex.build(filename)
+    if write_index:
+        try:
+            index.dump(index_filename)
+        except OSError:
+            pass
+    return index
+
+
+class JsonLinesReader(object):
+    """
+    Random-access reader over a memory-mapped JSON lines file using its line index. Only the
+    requested lines are parsed. Use as a context manager or call close().
+    """
+
+    def __init__(self, filename, index=None, write_index=True):
+        _check_uncompressed(filename)
+        self.filename = filename
+        self.index = index or load_or_build_index(filename, write_index=write_index)
+        self._file = open(filename, 'rb')
+        self._mmap = None
+        if self.index.size:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        """ Number of resources in the file """
+        return len(self.index)
+
+    def close(self):
+        """ Release the memory map and the file """
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def get_line(self, position):
+        """ Return the raw bytes of the indexed resource at position, without the newline """
+        offset = self.index.offsets[position]
+        return self._mmap[offset:offset + self.index.lengths[position]].rstrip(b'\r\n')
+
+    def get_resource(self, position):
+        """ Return the parsed resource at position """
+        return json.loads(self.get_line(position))
+
+    def get_line_number(self, position):
+        """ Return the 1-based line number in the file of the resource at position """
+        return self.index.line_numbers[position]
+
+    def get(self, resource_type, resource_id, owner=None, repo=None):
+        """ Return the first resource with the specified type and ID, or None """
+        positions = self.index.find(
+            resource_type=resource_type, resource_id=resource_id, owner=owner, repo=repo)
+        return self.get_resource(positions[0]) if positions else None
+
+    def get_by_url(self, url):
+        """ Return the resource with the specified relative OCL URL, or None """
+        position = self.index.get_positions_by_url().get(url)
+        return None if position is None else self.get_resource(position)
+
+    def find(self, resource_type=None, resource_id=None, owner=None, repo=None):
+        """ Return list of all resources matching the specified identity fields """
+        return [self.get_resource(position) for position in self.index.find(
+            resource_type=resource_type, resource_id=resource_id, owner=owner, repo=repo)]
+
+    def iter_type(self, resource_type, start=0, stop=None):
+        """ Yield resources of the specified type in file order, optionally a slice of them """
+        positions = self.index.get_positions_by_type().get(resource_type, [])
+        for position in positions[start:stop]:
+            yield self.get_resource(position)
+
+    def iter_resources(self):
+        """ Yield (line number, resource) for every resource in file order """
+        for position in range(len(self.index)):
+            yield self.get_line_number(position), self.get_resource(position)
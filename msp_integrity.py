@@ -0,0 +1,205 @@
+"""
+Referential integrity check of an OCL import list, run before the upload instead of finding the
+400 errors (eg "from_concept_url : Concept matching query does not exist") in the bulk import
+results an hour later.
+
+The check makes a single pass over the resources in file order. Every owner, repository,
+concept and mapping URL is added to a set of defined URLs as its resource is seen, and every
+URL a resource depends on is checked against that set:
+* owner of each repository and repository-owned resource
+* repository (source or collection) of each concept, mapping, reference and version
+* from_concept_url and to_concept_url of each mapping
+* each reference expression (versioned expressions are resolved to the resource they refer to)
+A URL that is defined later in the file is reported as defined after use; a URL that is never
+defined is reported as unresolved. A reference added to a collection after a version of that
+collection was created is also reported, since the version will not include it.
+
+Resources can be dicts or msp_records records, so the check runs on the import list of a build
+(MspPipeline.import_list) as well as on an import file (iter_import_file).
+"""
+import json
+import re
+import msp_io
+import msp_urls
+
+
+# Kinds of dependencies checked
+DEPENDENCY_OWNER = 'owner'
+DEPENDENCY_REPO = 'repo'
+DEPENDENCY_FROM_CONCEPT = 'from_concept_url'
+DEPENDENCY_TO_CONCEPT = 'to_concept_url'
+DEPENDENCY_REFERENCE = 'reference_expression'
+DEPENDENCIES = (DEPENDENCY_OWNER, DEPENDENCY_REPO, DEPENDENCY_FROM_CONCEPT, DEPENDENCY_TO_CONCEPT,
+                DEPENDENCY_REFERENCE)
+
+# Report categories: 'unresolved_<dependency>' (never defined), '<dependency>_defined_after_use'
+# and references added to a collection after one of its versions
+CATEGORY_REFERENCE_AFTER_VERSION = 'reference_after_collection_version'
+CATEGORIES = tuple(
+    ['unresolved_%s' % dependency for dependency in DEPENDENCIES] +
+    ['%s_defined_after_use' % dependency for dependency in DEPENDENCIES] +
+    [CATEGORY_REFERENCE_AFTER_VERSION])
+
+# Maximum number of issues kept per category (all issues are counted)
+DEFAULT_MAX_ISSUES_PER_CATEGORY = 1000
+
+# Relative URL of a repository-owned resource with optional repository and resource versions,
+# eg '/orgs/PEPFAR/sources/MER/v1.0/concepts/TX_CURR/123/'
+RESOURCE_EXPRESSION_PATTERN = re.compile(
+    r'^(/(?:orgs|users)/[^/]+/(?:sources|collections)/[^/]+/)(?:[^/]+/)?'
+    r'((?:concepts|mappings)/[^/]+/)(?:[^/]+/)?$')
+
+
+def normalize_expression(expression):
+    """ Return the unversioned URL of the resource a reference expression refers to """
+    if not expression.endswith('/'):
+        expression += '/'
+    match = RESOURCE_EXPRESSION_PATTERN.match(expression)
+    if match is None:
+        return expression
+    return match.group(1) + match.group(2)
+
+
+def get_dependencies(resource):
+    """ Return list of (dependency kind, URL) that must be defined before the resource """
+    resource_type = resource.get('type')
+    owner_id = resource.get('owner')
+    owner_type = resource.get('owner_type', 'Organization')
+    dependencies = []
+    if owner_id and resource_type not in msp_urls.OWNER_URL_SEGMENTS:
+        dependencies.append((DEPENDENCY_OWNER, msp_urls.get_owner_url(owner_type, owner_id)))
+    if resource_type in msp_urls.REPO_RESOURCE_TYPES:
+        repo_type = msp_urls.REPO_RESOURCE_TYPES[resource_type][0]
+        dependencies.append((DEPENDENCY_REPO, msp_urls.get_repo_url(
+            owner_type, owner_id, repo_type, msp_urls.get_repo_id(resource))))
+    if resource_type == 'Mapping':
+        for dependency in (DEPENDENCY_FROM_CONCEPT, DEPENDENCY_TO_CONCEPT):
+            if resource.get(dependency):
+                dependencies.append((dependency, resource.get(dependency)))
+    elif resource_type == 'Reference':
+        for expression in (resource.get('data') or {}).get('expressions', []):
+            dependencies.append((DEPENDENCY_REFERENCE, normalize_expression(expression)))
+    return dependencies
+
+
+class IntegrityChecker(object):
+    """
+    Single-pass referential integrity checker. Call check(line_number, resource) for each
+    resource in file order and then get_report(). URLs starting with one of external_prefixes
+    are assumed to exist already, eg ['/orgs/CIEL/'] for mappings to another organization.
+    """
+
+    def __init__(self, external_prefixes=(),
+                 max_issues_per_category=DEFAULT_MAX_ISSUES_PER_CATEGORY):
+        self.external_prefixes = tuple(external_prefixes)
+        self.max_issues_per_category = max_issues_per_category
+        self.num_resources = 0
+        self._defined_urls = {}
+        self._pending = {}
+        self._versioned_collections = {}
+        self._counts = dict((category, 0) for category in CATEGORIES)
+        self._issues = dict((category, []) for category in CATEGORIES)
+
+    def _add_issue(self, category, issue):
+        self._counts[category] += 1
+        if len(self._issues[category]) < self.max_issues_per_category:
+            self._issues[category].append(issue)
+
+    def check(self, line_number, resource):
+        """ Check the dependencies of a resource and add its URL to the defined URLs """
+        self.num_resources += 1
+        for dependency, url in get_dependencies(resource):
+            if url in self._defined_urls or url.startswith(self.external_prefixes):
+                continue
+            self._pending.setdefault(url, []).append({
+                'line': line_number, 'type': resource.get('type'), 'dependency': dependency,
+                'resource': msp_urls.get_resource_url(resource) or msp_urls.get_repo_id(resource),
+                'url': url})
+
+        resource_type = resource.get('type')
+        if resource_type == 'Reference':
+            collection_url = msp_urls.get_repo_url(
+                resource.get('owner_type', 'Organization'), resource.get('owner'), 'Collection',
+                resource.get('collection'))
+            if collection_url in self._versioned_collections:
+                self._add_issue(CATEGORY_REFERENCE_AFTER_VERSION, {
+                    'line': line_number, 'type': resource_type, 'dependency': None,
+                    'resource': resource.get('collection'), 'url': collection_url,
+                    'version_line': self._versioned_collections[collection_url]})
+        elif resource_type == 'Collection Version':
+            collection_url = msp_urls.get_repo_url(
+                resource.get('owner_type', 'Organization'), resource.get('owner'), 'Collection',
+                resource.get('collection'))
+            self._versioned_collections.setdefault(collection_url, line_number)
+
+        url = msp_urls.get_resource_url(resource)
+        if url is not None and url not in self._defined_urls:
+            self._defined_urls[url] = line_number
+            for issue in self._pending.pop(url, []):
+                issue['defined_line'] = line_number
+                self._add_issue('%s_defined_after_use' % issue['dependency'], issue)
+
+    def get_report(self):
+        """
+        Return the report: number of resources and of defined URLs, number of issues by
+        category and the issues (up to max_issues_per_category) by category
+        """
+        counts = dict(self._counts)
+        issues = dict((category, list(category_issues))
+                      for category, category_issues in self._issues.items())
+        for url_issues in self._pending.values():
+            for issue in url_issues:
+                category = 'unresolved_%s' % issue['dependency']
+                counts[category] += 1
+                if len(issues[category]) < self.max_issues_per_category:
+                    issues[category].append(issue)
+        for category_issues in issues.values():
+            category_issues.sort(key=lambda issue: issue['line'])
+        return {
+            'num_resources': self.num_resources,
+            'num_defined_urls': len(self._defined_urls),
+            'num_issues': sum(counts.values()),
+            'counts': dict((category, count) for category, count in counts.items() if count),
+            'issues': dict((category, category_issues)
+                           for category, category_issues in issues.items() if category_issues),
+        }
+
+
+def check_integrity(numbered_resources, external_prefixes=(),
+                    max_issues_per_category=DEFAULT_MAX_ISSUES_PER_CATEGORY):
+    """
+    Check an iterable of (line number, resource) pairs in file order, eg
+    enumerate(import_list, 1) or iter_import_file(filename), and return the report (see
+    IntegrityChecker.get_report)
+    """
+    checker = IntegrityChecker(
+        external_prefixes=external_prefixes, max_issues_per_category=max_issues_per_category)
+    for line_number, resource in numbered_resources:
+        checker.check(line_number, resource)
+    return checker.get_report()
+
+
+def iter_import_file(filename):
+    """ Yield (line number, resource) for each resource of an import file, streaming it """
+    with msp_io.open_file(filename, encoding='utf-8') as input_file:
+        for line_number, line in enumerate(input_file, 1):
+            if line.strip():
+                yield line_number, json.loads(line)
+
+
+def display_report(report, max_issues=10):
+    """ Print the number of issues by category and the first issues of each category """
+    print('Referential integrity: %s resources, %s URLs defined, %s issues' % (
+        report['num_resources'], report['num_defined_urls'], report['num_issues']))
+    for category in CATEGORIES:
+        if category not in report['counts']:
+            continue
+        print('  %s: %s' % (category, report['counts'][category]))
+        for issue in report['issues'][category][:max_issues]:
+            extra = ''
+            if 'defined_line' in issue:
+                extra = ' (defined on line %s)' % issue['defined_line']
+            elif 'version_line' in issue:
+                extra = ' (version created on line %s)' % issue['version_line']
+            print('    line %s: %s %s -> %s%s' % (
+                issue['line'], issue['type'], issue['resource'], issue['url'], extra))
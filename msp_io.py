@@ -0,0 +1,217 @@
+"""
+Transparent compressed file I/O for the MSP ETL scripts.
+
+open_file is a drop-in replacement for open that picks the compression from the filename
+extension: '.gz' (gzip), '.xz' (lzma), '.bz2' (bz2) and '.zip'. Any other filename is opened
+uncompressed. Data is decompressed and compressed as a stream, so a compressed input is never
+unpacked to disk or held in memory as a whole.
+
+Zip files are read and written one member at a time. A member is selected with
+'archive.zip!member.csv'; without a member name, reading requires an archive with a single
+member (eg output/all_datim_codelists_20210324.csv.zip) and writing creates a member named after
+the archive without '.zip'.
+
+Example usage:
+  with msp_io.open_file('data/datim_dataElements_20220128.json.gz', 'rb') as input_file:
+      raw_datim_de_all = json.load(input_file)
+"""
+import bz2
+import gzip
+import io
+import json
+import lzma
+import os
+import re
+import zipfile
+
+
+# Compression by filename extension
+COMPRESSION_GZIP = 'gzip'
+COMPRESSION_XZ = 'xz'
+COMPRESSION_BZ2 = 'bz2'
+COMPRESSION_ZIP = 'zip'
+COMPRESSION_EXTENSIONS = {
+    '.gz': COMPRESSION_GZIP,
+    '.xz': COMPRESSION_XZ,
+    '.bz2': COMPRESSION_BZ2,
+    '.zip': COMPRESSION_ZIP,
+}
+
+# Openers for the single-stream compression formats (zip is handled separately)
+STREAM_OPENERS = {
+    COMPRESSION_GZIP: gzip.open,
+    COMPRESSION_XZ: lzma.open,
+    COMPRESSION_BZ2: bz2.open,
+}
+
+# gzip level used when writing, as for the gzip command line tool (gzip.open defaults to 9,
+# which is several times slower for output that is only slightly smaller)
+GZIP_COMPRESSLEVEL = 6
+
+# Separates a zip archive filename from the name of a member, eg 'codelists.zip!codelists.csv'
+ZIP_MEMBER_SEPARATOR = '!'
+
+# Number of characters read at a time by iter_json_array
+JSON_ARRAY_CHUNK_SIZE = 1 << 20
+
+# Whitespace between the items of a JSON array
+JSON_WHITESPACE_PATTERN = re.compile(r'[ \t\n\r]*')
+
+
+def split_zip_member(filename):
+    """
+    Return (archive filename, member name) if filename refers to a zip archive, where member
+    name is None if not specified, or (filename, None) otherwise
+    """
+    if ZIP_MEMBER_SEPARATOR in filename:
+        archive_filename, member_name = filename.split(ZIP_MEMBER_SEPARATOR, 1)
+        if archive_filename.lower().endswith('.zip'):
+            return archive_filename, member_name or None
+    return filename, None
+
+
+def get_compression(filename):
+    """ Return the compression of filename (eg 'gzip') based on its extension, or None """
+    archive_filename, _ = split_zip_member(filename)
+    return COMPRESSION_EXTENSIONS.get(os.path.splitext(archive_filename)[1].lower())
+
+
+def add_compression_extension(filename, compression):
+    """ Return filename with the extension of compression appended, unless already present """
+    if not compression or get_compression(filename) == compression:
+        return filename
+    for extension, extension_compression in COMPRESSION_EXTENSIONS.items():
+        if extension_compression == compression:
+            return filename + extension
+    raise ValueError('Unknown compression "%s", expected one of: %s' % (
+        compression, ', '.join(sorted(COMPRESSION_EXTENSIONS.values()))))
+
+
+def open_file(filename, mode='r', encoding=None, newline=None):
+    """
+    Open filename like open(filename, mode), decompressing or compressing it based on its
+    extension. mode is one of 'r', 'rt', 'rb', 'w', 'wt' or 'wb'.
+    """
+    if mode not in ('r', 'rt', 'rb', 'w', 'wt', 'wb'):
+        raise ValueError('Unsupported mode "%s"' % mode)
+    binary = 'b' in mode
+    compression = get_compression(filename)
+    if compression is None:
+        if binary:
+            return open(filename, mode)
+        return open(filename, mode, encoding=encoding, newline=newline)
+    if compression == COMPRESSION_ZIP:
+        member_file = _open_zip_member(filename, mode[0])
+    elif compression == COMPRESSION_GZIP and mode[0] == 'w':
+        member_file = gzip.open(filename, 'wb', compresslevel=GZIP_COMPRESSLEVEL)
+    else:
+        member_file = STREAM_OPENERS[compression](filename, mode[0] + 'b')
+    if binary:
+        return member_file
+    return io.TextIOWrapper(member_file, encoding=encoding, newline=newline)
+
+
+def _open_zip_member(filename, mode):
+    """ Return a binary stream to read ('r') or write ('w') a single member of a zip archive """
+    archive_filename, member_name = split_zip_member(filename)
+    if mode == 'r':
+        archive = zipfile.ZipFile(archive_filename)
+        try:
+            if member_name is None:
+                member_names = [name for name in archive.namelist() if not name.endswith('/')]
+                if len(member_names) != 1:
+                    raise ValueError(
+                        'Zip archive "%s" has %s members, specify one as "%s%s<member>": %s' % (
+                            archive_filename, len(member_names), archive_filename,
+                            ZIP_MEMBER_SEPARATOR, ', '.join(member_names)))
+                member_name = member_names[0]
+            # The member keeps the archive file open until the member is closed
+            return archive.open(member_name)
+        finally:
+            archive.close()
+    if member_name is None:
+        member_name = os.path.basename(archive_filename)[:-len('.zip')]
+    archive = zipfile.ZipFile(archive_filename, 'w', compression=zipfile.ZIP_DEFLATED)
+    return io.BufferedWriter(_ZipMemberWriter(
+        archive, archive.open(member_name, 'w', force_zip64=True)))
+
+
+def iter_json_array(filename, chunk_size=JSON_ARRAY_CHUNK_SIZE):
+    """
+    Yield the items of a file that contains a single JSON array (eg the codelists saved by
+    save_codelists_to_file.py) one at a time. The file is read chunk_size characters at a time,
+    so only the current item is held in memory rather than the whole parsed array.
+    """
+    decoder = json.JSONDecoder()
+    with open_file(filename, encoding='utf-8') as input_file:
+        buffer = ''
+        position = 0
+        is_eof = False
+        expected = '['
+        while True:
+            position = JSON_WHITESPACE_PATTERN.match(buffer, position).end()
+            if position == len(buffer):
+                chunk = input_file.read(chunk_size)
+                if not chunk:
+                    raise ValueError('Expected a JSON array in "%s"' % filename
+                                     if expected == '[' else
+                                     'Unterminated JSON array in "%s"' % filename)
+                buffer = chunk
+                position = 0
+                continue
+            character = buffer[position]
+            if expected == '[':
+                if character != '[':
+                    raise ValueError('Expected a JSON array in "%s"' % filename)
+                position += 1
+                expected = 'item or ]'
+            elif expected == 'item or ]' and character == ']':
+                return
+            elif expected in ('item', 'item or ]'):
+                try:
+                    item, position_after_item = decoder.raw_decode(buffer, position)
+                except ValueError:
+                    position_after_item = None
+                if position_after_item is None or (
+                        position_after_item == len(buffer) and not is_eof):
+                    # The item continues in the next chunk (a number may have been cut short).
+                    # The buffer at least doubles, so a large item is parsed O(log n) times.
+                    if is_eof:
+                        raise ValueError('Invalid JSON array item in "%s"' % filename)
+                    chunk = input_file.read(max(chunk_size, len(buffer) - position))
+                    is_eof = not chunk
+                    buffer = buffer[position:] + chunk
+                    position = 0
+                    continue
+                yield item
+                position = position_after_item
+                expected = ', or ]'
+            elif character == ']':
+                return
+            elif character == ',':
+                position += 1
+                expected = 'item'
+            else:
+                raise ValueError('Expected "," or "]" after a JSON array item in "%s"' % filename)
+
+
+class _ZipMemberWriter(io.RawIOBase):
+    """ Writable raw stream for a zip archive member that closes the archive when closed """
+
+    def __init__(self, archive, member_file):
+        self._archive = archive
+        self._member_file = member_file
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self._member_file.write(data)
+
+    def close(self):
+        if not self.closed:
+            try:
+                self._member_file.close()
+                self._archive.close()
+            finally:
+                super(_ZipMemberWriter, self).close()
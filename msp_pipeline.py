@@ -0,0 +1,529 @@
+"""
+Library API for the MSP build: the msp.py loaders and builders wrapped as lazily evaluated,
+memoized stages.
+
+Each stage produces one named product of the build (eg 'de_concepts' or 'codelist_references').
+Asking for a product computes only the stages it depends on, and each stage runs at most once
+per pipeline, eg:
+
+    pipeline = msp_pipeline.MspPipeline(settings)
+    codelist_references = pipeline.get('codelist_references')
+
+loads the reference indicators, codelists and data elements, but not the COCs, DATIM indicators
+or iHUB derived data elements. Products are also available as attributes (pipeline.de_concepts).
+
+A build can be sliced by period (eg only FY22) and by structured dataset (eg only MER). The
+filters are pushed down into the loaders and builders, so DATIM data elements, DATIM indicators
+and iHUB derived data elements outside the slice are skipped before their concepts are built,
+and references are only built for the requested periods. Reference indicators and codelists
+for all periods are still loaded, because the attributes of the data elements (eg applicable
+periods, reporting frequency) are derived from them and must match those of a full build.
+Only the codelists in the slice are included in the import list. Mappings are only written
+between concepts in the import list: reference indicator mappings only from the reference
+indicators of the output periods, and iHUB source linkages only to the data elements in the
+slice. The data elements of reference indicators of other periods are still cascaded into the
+MER_FY## collections of the slice, as in a full build. DATIM indicator formulas that refer to
+data elements outside the slice keep the data element UID instead of its name.
+
+Several import files can be written from one build: the pipeline is run with the org and source
+IDs of the configuration, and write_import_list rewrites each resource to the identity of a build
+target (see msp_identity.py). get_target_pipelines runs one pipeline per period slice of the
+targets, and the products that do not depend on the slice are loaded once for all of them.
+
+The configuration is any object with the same attributes as settings.py (MSP_ORG_ID, FILENAME_*,
+etc.), eg the settings module itself. build_ocl_import.py is a thin CLI on top of this class.
+"""
+import ocldev.oclconstants
+import ocldev.oclresourcelist
+import msp
+import msp_artifacts
+import msp_index
+import msp_integrity
+import msp_profile
+import msp_records
+import msp_sqlite
+import msp_summary
+
+
+# Products of the pipeline, in build_ocl_import.py order
+STAGES = (
+    'ref_indicator_concepts',
+    'sorted_ref_indicator_codes',
+    'output_ref_indicator_urls',
+    'coc_concepts',
+    'all_codelist_collections',
+    'codelist_collections',
+    'de_concepts',
+    'datim_indicator_concepts',
+    'ihub_dde_concepts',
+    'map_ref_indicator_to_de',
+    'map_ref_indicator_to_ihub_dde',
+    'map_ref_indicator_to_datim_indicator',
+    'map_de_to_coc',
+    'map_ihub_dde_to_coc',
+    'map_codelist_to_de_to_coc',
+    'de_version_linkages',
+    'map_de_version_linkages',
+    'map_dde_source_linkages',
+    'ref_indicator_references',
+    'codelist_references',
+    'fiscal_year_references',
+    'input_metadata_summary',
+    'import_list',
+    'import_list_dedup',
+    'import_list_summary',
+    'integrity_report',
+)
+
+# Products that do not depend on the period and structured dataset slice, which the pipelines
+# of a multi-target build share (see get_target_pipelines)
+SHARED_STAGES = (
+    'ref_indicator_concepts',
+    'sorted_ref_indicator_codes',
+    'coc_concepts',
+)
+
+
+class MspPipeline(object):
+    """
+    Lazily evaluated, memoized stages of the MSP build for one configuration. periods and
+    structured_datasets default to the MSP_BUILD_PERIODS and MSP_BUILD_STRUCTURED_DATASETS
+    settings; None builds all periods or structured datasets. shared_products is a dictionary of
+    SHARED_STAGES products, filled by and reused between the pipelines it is passed to.
+    """
+
+    def __init__(self, config, periods=None, structured_datasets=None, shared_products=None):
+        self.config = config
+        self.org_id = config.MSP_ORG_ID
+        self.source_id = config.MSP_SOURCE_ID
+        self.periods = periods or getattr(config, 'MSP_BUILD_PERIODS', None) or None
+        self.structured_datasets = (
+            structured_datasets or getattr(config, 'MSP_BUILD_STRUCTURED_DATASETS', None) or None)
+        self.input_periods = self._filter_periods(config.MSP_INPUT_PERIODS)
+        self.output_periods = self._filter_periods(config.OUTPUT_PERIODS)
+        self._products = {}
+        self._shared_products = shared_products
+
+    def __getattr__(self, name):
+        if name in STAGES:
+            return self.get(name)
+        raise AttributeError("'%s' object has no attribute '%s'" % (
+            self.__class__.__name__, name))
+
+    def _filter_periods(self, periods):
+        """ Returns the periods that are in the period slice of this pipeline """
+        if not self.periods:
+            return periods
+        return [period for period in periods if period in self.periods]
+
+    def get(self, name):
+        """ Return the named product, computing it and its dependencies if needed """
+        if name not in self._products:
+            if name not in STAGES:
+                raise ValueError('Unknown MSP pipeline stage: %s' % name)
+            if self._shared_products is not None and name in self._shared_products:
+                self._products[name] = self._shared_products[name]
+                return self._products[name]
+            with msp_profile.profile_block('msp_pipeline.%s' % name):
+                self._products[name] = getattr(self, '_build_%s' % name)()
+            if self._shared_products is not None and name in SHARED_STAGES:
+                self._shared_products[name] = self._products[name]
+        return self._products[name]
+
+    def is_built(self, name):
+        """ Returns True if the named product has already been computed """
+        return name in self._products
+
+    def get_built_stages(self):
+        """ Returns names of the products computed so far, in build order """
+        return [name for name in STAGES if name in self._products]
+
+    def iter_import_list(self, rewriter=None):
+        """
+        Yield the OCL-formatted dicts of the import list, rewritten to another org and source
+        identity if rewriter is set (an msp_identity.IdentityRewriter)
+        """
+        if rewriter is None:
+            for resource in self.get('import_list'):
+                yield msp_records.to_ocl_json(resource)
+        else:
+            for resource in self.get('import_list'):
+                yield rewriter.rewrite(resource)
+
+    def write_import_list(self, filename, write_index=False, artifact_store=None, rewriter=None):
+        """
+        Write the import list as OCL-formatted JSON lines and return number of resources.
+        The file is compressed if filename ends with .gz, .xz, .bz2 or .zip (see msp_io.py).
+        If write_index is True, the sidecar line index of the file is written as well (see
+        msp_index.py); this is not supported for compressed files. If artifact_store is set
+        (an msp_artifacts.ArtifactStore), the lines are also added to the store with a manifest
+        named after the file. If rewriter is set, resources are written with the org and source
+        identity of a build target (see msp_identity.py).
+        """
+        import_list = self.get('import_list')
+        with msp_profile.profile_block('msp_pipeline.write_import_list'):
+            with msp_index.JsonLinesIndexWriter(filename, write_index=write_index) as writer:
+                if artifact_store is None:
+                    for resource in self.iter_import_list(rewriter=rewriter):
+                        writer.write(resource)
+                else:
+                    with msp_artifacts.ManifestWriter(
+                            artifact_store, msp_artifacts.get_manifest_name(filename),
+                            metadata={'filename': filename}) as manifest_writer:
+                        for resource in self.iter_import_list(rewriter=rewriter):
+                            manifest_writer.add(writer.write(resource))
+        return len(import_list)
+
+    def write_sqlite(self, filename, label=None, prune_rows=False, rewriter=None):
+        """
+        Write the import list to the SQLite database filename, upserting rows by identity, and
+        return the summary of the load (see msp_sqlite.materialize)
+        """
+        with msp_profile.profile_block('msp_pipeline.write_sqlite'):
+            return msp_sqlite.materialize(
+                self.iter_import_list(rewriter=rewriter), filename, label=label,
+                prune_rows=prune_rows)
+
+    # LOAD METADATA SOURCES
+    def _build_ref_indicator_concepts(self):
+        return msp.load_ref_indicator_concepts(
+            filenames=self.config.FILENAME_MER_REFERENCE_INDICATORS, org_id=self.org_id,
+            source_id=self.source_id)
+
+    def _build_sorted_ref_indicator_codes(self):
+        return msp.get_sorted_unique_indicator_codes(
+            ref_indicator_concepts=self.get('ref_indicator_concepts'))
+
+    def _build_output_ref_indicator_urls(self):
+        # URLs of the reference indicators in the import list, ie those of the output periods
+        output_periods = set(self.output_periods)
+        return set(ref_indicator_concept['__url']
+                   for ref_indicator_concept in self.get('ref_indicator_concepts')
+                   if ref_indicator_concept['extras'].get(msp.ATTR_PERIOD) in output_periods)
+
+    def _build_coc_concepts(self):
+        return msp.load_datim_coc_concepts(
+            filename=self.config.FILENAME_DATIM_COCS, org_id=self.org_id,
+            source_id=self.source_id)
+
+    def _build_all_codelist_collections(self):
+        # Loaded from file instead of DATIM -- use save_codelists_to_file.py to refresh
+        return msp.load_codelist_collections_with_exports_from_file(
+            filename=self.config.FILENAME_DATIM_CODELISTS_WITH_EXPORT, org_id=self.org_id)
+
+    def _build_codelist_collections(self):
+        # Codelists in the period and structured dataset slice
+        codelist_collections = self.get('all_codelist_collections')
+        if self.periods:
+            codelist_collections = msp.get_filtered_codelist_collections(
+                codelist_collections, period=list(self.periods))
+        if self.structured_datasets:
+            codelist_collections = msp.get_codelist_collections_with_data_elements(
+                codelist_collections, self.get('de_concepts'))
+        if codelist_collections is self.get('all_codelist_collections'):
+            return codelist_collections
+        return ocldev.oclresourcelist.OclJsonResourceList(codelist_collections)
+
+    def _build_de_concepts(self):
+        return msp.load_datim_data_elements(
+            filename=self.config.FILENAME_DATIM_DATA_ELEMENTS, org_id=self.org_id,
+            source_id=self.source_id,
+            sorted_ref_indicator_codes=self.get('sorted_ref_indicator_codes'),
+            codelist_collections=self.get('all_codelist_collections'),
+            ref_indicator_concepts=self.get('ref_indicator_concepts'),
+            periods=self.periods, structured_datasets=self.structured_datasets)
+
+    def _build_datim_indicator_concepts(self):
+        return msp.load_datim_indicators(
+            filename=self.config.FILENAME_DATIM_INDICATORS, org_id=self.org_id,
+            source_id=self.source_id, de_concepts=self.get('de_concepts'),
+            coc_concepts=self.get('coc_concepts'),
+            sorted_ref_indicator_codes=self.get('sorted_ref_indicator_codes'),
+            ref_indicator_concepts=self.get('ref_indicator_concepts'), periods=self.periods)
+
+    def _build_ihub_dde_concepts(self):
+        return msp.load_ihub_dde_concepts(
+            filename=self.config.FILENAME_IHUB,
+            num_run_sequences=self.config.IHUB_NUM_RUN_SEQUENCES,
+            org_id=self.org_id, source_id=self.source_id,
+            sorted_ref_indicator_codes=self.get('sorted_ref_indicator_codes'),
+            ref_indicator_concepts=self.get('ref_indicator_concepts'),
+            ihub_rule_period_end_year=self.config.IHUB_RULE_PERIOD_END_YEAR,
+            periods=self.periods, structured_datasets=self.structured_datasets)
+
+    # GENERATE MAPPINGS & LINKAGES
+    def _build_ref_indicator_map(self, child_concepts_name):
+        return msp.build_ref_indicator_to_child_resource_maps(
+            child_concepts=self.get(child_concepts_name),
+            sorted_ref_indicator_codes=self.get('sorted_ref_indicator_codes'),
+            org_id=self.org_id, source_id=self.source_id)
+
+    def _build_map_ref_indicator_to_de(self):
+        return self._build_ref_indicator_map('de_concepts')
+
+    def _build_map_ref_indicator_to_ihub_dde(self):
+        return self._build_ref_indicator_map('ihub_dde_concepts')
+
+    def _build_map_ref_indicator_to_datim_indicator(self):
+        return self._build_ref_indicator_map('datim_indicator_concepts')
+
+    def _build_map_de_to_coc(self):
+        return msp.build_de_to_coc_maps(
+            de_concepts=self.get('de_concepts'), coc_concepts=self.get('coc_concepts'),
+            org_id=self.org_id, source_id=self.source_id)
+
+    def _build_map_ihub_dde_to_coc(self):
+        return msp.build_ihub_dde_to_coc_maps(
+            ihub_dde_concepts=self.get('ihub_dde_concepts'),
+            coc_concepts=self.get('coc_concepts'))
+
+    def _build_map_codelist_to_de_to_coc(self):
+        return msp.build_codelist_to_de_map(
+            codelist_collections=self.get('codelist_collections'),
+            de_concepts=self.get('de_concepts'), org_id=self.org_id, source_id=self.source_id)
+
+    def _build_de_version_linkages(self):
+        de_version_linkages = msp.build_linkages_de_version(de_concepts=self.get('de_concepts'))
+        de_version_linkages.update(msp.build_linkages_dde_version(
+            ihub_dde_concepts=self.get('ihub_dde_concepts')))
+        return de_version_linkages
+
+    def _build_map_de_version_linkages(self):
+        return msp.build_maps_from_de_linkages(de_linkages=self.get('de_version_linkages'))
+
+    def _build_map_dde_source_linkages(self):
+        # Source data elements outside the slice are not in the import list of a sliced build.
+        # The full build keeps the linkages to all source data elements, as before.
+        concept_urls = None
+        if self.periods or self.structured_datasets:
+            concept_urls = set(concept['__url'] for name in ('de_concepts', 'ihub_dde_concepts')
+                               for concept in self.get(name))
+        return msp.build_linkages_source_de(
+            ihub_dde_concepts=self.get('ihub_dde_concepts'), owner_id=self.org_id,
+            source_id=self.source_id, concept_urls=concept_urls)
+
+    # GENERATE VALUE SET REFERENCES
+    def _build_ref_indicator_references(self):
+        return msp.build_ref_indicator_references(
+            ref_indicator_concepts=self.get('ref_indicator_concepts'), org_id=self.org_id,
+            periods=self.periods)
+
+    def _build_codelist_references(self):
+        return msp.build_codelist_references(
+            map_codelist_to_de_to_coc=self.get('map_codelist_to_de_to_coc'),
+            org_id=self.org_id, source_id=self.source_id,
+            codelist_collections=self.get('codelist_collections'))
+
+    def _build_fiscal_year_references(self):
+        return msp.build_fiscal_year_references(
+            ref_indicator_concepts=self.get('ref_indicator_concepts'),
+            datim_indicator_concepts=self.get('datim_indicator_concepts'),
+            de_concepts=self.get('de_concepts'), ihub_dde_concepts=self.get('ihub_dde_concepts'),
+            coc_concepts=self.get('coc_concepts'),
+            map_ref_indicator_to_de=self.get('map_ref_indicator_to_de'),
+            map_ref_indicator_to_ihub_dde=self.get('map_ref_indicator_to_ihub_dde'),
+            map_ref_indicator_to_datim_indicator=self.get(
+                'map_ref_indicator_to_datim_indicator'),
+            map_de_to_coc=self.get('map_de_to_coc'),
+            map_ihub_dde_to_coc=self.get('map_ihub_dde_to_coc'),
+            org_id=self.org_id, source_id=self.source_id, periods=self.periods,
+            ref_indicator_urls=self._get_mapped_ref_indicator_urls())
+
+    def _get_mapped_ref_indicator_urls(self):
+        """
+        Returns URLs of the reference indicators whose mappings are written, or None for all. A
+        period-sliced build only has the reference indicators of its output periods.
+        """
+        if not self.periods:
+            return None
+        return self.get('output_ref_indicator_urls')
+
+    # SUMMARIES
+    def _build_input_metadata_summary(self):
+        return msp_summary.summarize_input_metadata(
+            input_periods=self.input_periods,
+            ref_indicator_concepts=self.get('ref_indicator_concepts'),
+            sorted_ref_indicator_codes=self.get('sorted_ref_indicator_codes'),
+            coc_concepts=self.get('coc_concepts'),
+            codelist_collections=self.get('codelist_collections'),
+            de_concepts=self.get('de_concepts'),
+            map_codelist_to_de_to_coc=self.get('map_codelist_to_de_to_coc'),
+            datim_indicator_concepts=self.get('datim_indicator_concepts'),
+            ihub_dde_concepts=self.get('ihub_dde_concepts'),
+            map_ref_indicator_to_de=self.get('map_ref_indicator_to_de'),
+            map_ref_indicator_to_ihub_dde=self.get('map_ref_indicator_to_ihub_dde'),
+            map_ref_indicator_to_datim_indicator=self.get(
+                'map_ref_indicator_to_datim_indicator'),
+            map_de_to_coc=self.get('map_de_to_coc'),
+            map_ihub_dde_to_coc=self.get('map_ihub_dde_to_coc'),
+            de_version_linkages=self.get('de_version_linkages'),
+            map_de_version_linkages=self.get('map_de_version_linkages'),
+            map_dde_source_linkages=self.get('map_dde_source_linkages'))
+
+    def _build_import_list_summary(self):
+        return msp_summary.summarize_import_list(self.get('import_list'))
+
+    def _build_integrity_report(self):
+        return msp_integrity.check_integrity(
+            enumerate(self.get('import_list'), 1),
+            external_prefixes=getattr(self.config, 'MSP_INTEGRITY_EXTERNAL_PREFIXES', ()))
+
+    # OCL-FORMATTED JSON
+    def _build_import_list(self):
+        """
+        Assemble the OCL import list:
+         1. Org, Source and Codelist Collections
+             a. Primary Org and Source (eg /orgs/PEPFAR/sources/MER/)
+             b. Codelist collections
+         2. Reference Indicators by period...
+             a. Reference indicator collections for each period (eg MER_Reference_Indicators_FY18)
+             b. Reference indicator concepts for primary source for current period
+             c. Reference indicator period references for current period
+             d. Reference Indicator Collection Versions by period
+         3. RESOURCES FOR PRIMARY SOURCE
+             a. DATIM/iHUB data elements, DATIM COCs, and DATIM indicators
+             b. Mappings
+         4. CODELIST REFERENCES
+         5. LINKAGES: Version Replacement and Source/Derivation Linkages Mappings
+         6. Source and Codelist Collection Versions
+             a. Primary Source Version
+             b. Codelist Collection Versions
+        """
+        # Compute all dependencies first: assembling the import list removes the
+        # "dhis2_codelist" custom attribute from the codelists, which the codelist maps need
+        for name in STAGES[:STAGES.index('fiscal_year_references') + 1]:
+            self.get(name)
+        config = self.config
+        org_id = self.org_id
+        source_id = self.source_id
+        collection_type = ocldev.oclconstants.OclConstants.RESOURCE_TYPE_COLLECTION
+        codelist_collections = self.get('codelist_collections')
+        ref_indicator_concepts = self.get('ref_indicator_concepts')
+        ref_indicator_references = self.get('ref_indicator_references')
+        import_list = msp_records.MspResourceList()
+
+        # 1. Org, Source and Codelist Collections
+        # 1.a. Primary Org and Source (eg /orgs/PEPFAR/sources/MER/)
+        import_list.append(msp.get_new_org_json(org_id=org_id))
+        import_list.append(msp.get_primary_source(
+            org_id=org_id, source_id=source_id, canonical_url=config.CANONICAL_URL))
+
+        # 1.b Codelist collections - but 1st remove "dhis2_codelist" custom attr used for processing
+        for codelist in codelist_collections:
+            if 'extras' in codelist and 'dhis2_codelist' in codelist['extras']:
+                del codelist['extras']['dhis2_codelist']
+            import_list += codelist
+
+        # 2. Period-based collections:
+        #    - MER_REFERENCE_INDICATORS_FY##: Reference indicators only
+        #    - MER_FY##: Reference indicators, data elements, DATIM indicators, & disags
+        period_collection_versions = []
+        for period in self.output_periods:
+            # 2.a. Generate the collection definitions
+            id_mer_reference_indicator_collection = (
+                msp.COLLECTION_NAME_MER_REFERENCE_INDICATORS % period)
+            id_mer_full_collection = msp.COLLECTION_NAME_MER_FULL % period
+            for collection_id in [id_mer_reference_indicator_collection, id_mer_full_collection]:
+                import_list.append(msp.get_new_repo_json(
+                    owner_id=org_id, repo_type=collection_type, repo_id=collection_id,
+                    name=collection_id, full_name=collection_id,
+                    canonical_url='%s/ValueSet/%s' % (config.CANONICAL_URL, collection_id)))
+
+            # 2.b. Reference indicator concept definitions by period in the MER source (needed
+            #      only 1x). These must be processed sequentially according to period.
+            import_list += ref_indicator_concepts.get_resources(
+                custom_attrs={msp.ATTR_PERIOD: period})
+
+            # 2.c. Add period-specific references to ref indicator concepts -- These must be
+            #      processed sequentially by period.
+            if period in ref_indicator_references:
+                import_list.append(ref_indicator_references[period])
+                period_references_copy = ref_indicator_references[period].copy()
+                period_references_copy['collection'] = id_mer_full_collection
+                import_list.append(period_references_copy)
+
+            # 2.d. Define Collection Versions by period (but don't yet add to the import_list)
+            for collection_id in [id_mer_reference_indicator_collection, id_mer_full_collection]:
+                period_collection_versions.append(msp.get_repo_version_json(
+                    owner_id=org_id, repo_type=collection_type, repo_id=collection_id,
+                    version_id='v1.0', description='Auto-generated release'))
+
+        # 3. RESOURCES FOR PRIMARY SOURCE
+        # 3.a. DATIM/iHUB data elements, DATIM COCs, and DATIM indicators
+        import_list.append(self.get('de_concepts'))
+        import_list.append(self.get('ihub_dde_concepts'))
+        import_list.append(self.get('coc_concepts'))
+        import_list.append(self.get('datim_indicator_concepts'))
+
+        # 3.b. Mappings -- reference indicator mappings only from the reference indicators in
+        #      the import list
+        mapped_ref_indicator_urls = self._get_mapped_ref_indicator_urls()
+        for (map_name, map_type, id_format) in [
+                ('map_ref_indicator_to_de', msp.MSP_MAP_TYPE_REF_INDICATOR_TO_DE,
+                 msp.MSP_MAP_ID_FORMAT_REFIND_DE),
+                ('map_ref_indicator_to_ihub_dde', msp.MSP_MAP_TYPE_REF_INDICATOR_TO_DE,
+                 msp.MSP_MAP_ID_FORMAT_REFIND_DE),
+                ('map_ref_indicator_to_datim_indicator',
+                 msp.MSP_MAP_TYPE_REF_INDICATOR_TO_DATIM_INDICATOR,
+                 msp.MSP_MAP_ID_FORMAT_REFIND_IND),
+                ('map_de_to_coc', msp.MSP_MAP_TYPE_DE_TO_COC, msp.MSP_MAP_ID_FORMAT_DE_COC),
+                ('map_ihub_dde_to_coc', msp.MSP_MAP_TYPE_DE_TO_COC,
+                 msp.MSP_MAP_ID_FORMAT_DE_COC)]:
+            import_list.append(msp.build_ocl_mappings(
+                map_dict=self.get(map_name), map_type=map_type, owner_id=org_id,
+                source_id=source_id, do_generate_mapping_id=True, id_format=id_format,
+                filtered_from_concepts=(mapped_ref_indicator_urls
+                                        if map_name.startswith('map_ref_indicator_') else None)))
+
+        # 4. CODELIST AND MER_FY## REFERENCES
+        import_list += self.get('codelist_references')
+        fiscal_year_references = self.get('fiscal_year_references')
+        for period in fiscal_year_references.keys():
+            import_list.append(fiscal_year_references[period])
+
+        # 5. LINKAGES: Version Replacement and Source/Derivation Linkages Mappings
+        import_list += msp.build_ocl_mappings(
+            map_dict=self.get('map_de_version_linkages'), map_type=msp.MSP_MAP_TYPE_REPLACES,
+            owner_id=org_id, source_id=source_id)
+        import_list += msp.build_ocl_mappings(
+            map_dict=self.get('map_dde_source_linkages'), map_type=msp.MSP_MAP_TYPE_DERIVED_FROM,
+            owner_id=org_id, source_id=source_id)
+
+        # 6. Source and Codelist Collection Versions
+        # 6.a. Primary Source Version
+        import_list.append(msp.get_repo_version_json(
+            owner_id=org_id, repo_type=ocldev.oclconstants.OclConstants.RESOURCE_TYPE_SOURCE,
+            repo_id=source_id, version_id='v1.0', description='Auto-generated release'))
+
+        # 6.b. Codelist Collection Versions
+        for codelist in codelist_collections:
+            import_list.append(msp.get_repo_version_json(
+                owner_id=org_id, repo_type=collection_type, repo_id=codelist['id'],
+                version_id='v1.0', description='Auto-generated release'))
+
+        # 6.c. Period-specific collection versions
+        import_list += period_collection_versions
+        return import_list
+
+    def _build_import_list_dedup(self):
+        # CLEANUP: De-duplicate import list without changing order & leaving 1st occurrence
+        return msp.dedup_list_of_dicts(self.get('import_list')._resources)
+
+
+def get_target_pipelines(config, targets, structured_datasets=None):
+    """
+    Returns list of (target, pipeline) of a list of msp_identity.BuildTargets. Targets with the
+    same period slice share one pipeline, run with the org and source IDs of config, and all
+    pipelines share the products of SHARED_STAGES.
+    """
+    shared_products = {}
+    pipelines = {}
+    target_pipelines = []
+    for target in targets:
+        slice_key = target.get_slice_key()
+        if slice_key not in pipelines:
+            pipelines[slice_key] = MspPipeline(
+                config, periods=target.periods, structured_datasets=structured_datasets,
+                shared_products=shared_products)
+        target_pipelines.append((target, pipelines[slice_key]))
+    return target_pipelines
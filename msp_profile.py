@@ -0,0 +1,210 @@
+"""
+Lightweight instrumentation for the MSP build: call counts, cumulative time and tracemalloc deltas
+for the hot functions in msp.py.
+
+Functions are instrumented with the @profiled decorator and arbitrary blocks of code with the
+profile_block context manager. Both do nothing but check a module-level flag until profiling is
+switched on with enable() (build_ocl_import.py does this when settings.MSP_PROFILE is True), so
+the instrumentation can stay in place in production code. Memory deltas are only recorded if
+enable(trace_memory=True) was called, since tracemalloc slows the build down considerably.
+
+Times and memory deltas are inclusive, ie they include the nested calls of other instrumented
+functions. max_traced_kb is the highest traced memory reached during any call, including memory
+allocated and freed within the call: the tracemalloc peak is reset when a call starts, and the
+peak reached so far by the enclosing calls is carried over to them when a nested call starts and
+ends. Use dump() to write the profile as JSON at the end of a run.
+"""
+import datetime
+import functools
+import json
+import time
+import tracemalloc
+
+
+# Module-level switch checked by every instrumented call
+_ENABLED = False
+_TRACE_MEMORY = False
+_STARTED_TRACEMALLOC = False
+_ENABLED_AT = None
+
+# Counters, keyed by instrumented name
+_STATS = {}
+
+# Traced memory peak reached so far by each open call, innermost last, and the highest peak of
+# the run: the tracemalloc peak only covers the time since the innermost call started
+_PEAK_STACK = []
+_MAX_PEAK = 0
+
+
+class ProfileStats(object):
+    """ Counters for one instrumented function or block """
+
+    __slots__ = ('calls', 'seconds', 'max_seconds', 'memory_delta_bytes', 'max_memory_bytes')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.memory_delta_bytes = 0
+        self.max_memory_bytes = 0
+
+    def add(self, seconds, memory_delta_bytes=0, memory_bytes=0):
+        self.calls += 1
+        self.seconds += seconds
+        if seconds > self.max_seconds:
+            self.max_seconds = seconds
+        self.memory_delta_bytes += memory_delta_bytes
+        if memory_bytes > self.max_memory_bytes:
+            self.max_memory_bytes = memory_bytes
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'seconds': round(self.seconds, 6),
+            'mean_seconds': round(self.seconds / self.calls, 9) if self.calls else 0,
+            'max_seconds': round(self.max_seconds, 6),
+            'memory_delta_kb': self.memory_delta_bytes // 1024,
+            'max_traced_kb': self.max_memory_bytes // 1024,
+        }
+
+
+def enable(trace_memory=False):
+    """ Switch profiling on. If trace_memory is True, tracemalloc deltas are recorded too. """
+    global _ENABLED, _TRACE_MEMORY, _STARTED_TRACEMALLOC, _ENABLED_AT
+    _TRACE_MEMORY = trace_memory
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _STARTED_TRACEMALLOC = True
+    _ENABLED_AT = time.perf_counter()
+    _ENABLED = True
+
+
+def disable():
+    """ Switch profiling off. Collected counters are kept until reset() is called. """
+    global _ENABLED, _TRACE_MEMORY, _STARTED_TRACEMALLOC
+    _ENABLED = False
+    _TRACE_MEMORY = False
+    if _STARTED_TRACEMALLOC:
+        tracemalloc.stop()
+        _STARTED_TRACEMALLOC = False
+
+
+def is_enabled():
+    return _ENABLED
+
+
+def reset():
+    """ Clear all collected counters """
+    global _MAX_PEAK
+    _STATS.clear()
+    _MAX_PEAK = 0
+
+
+def _start_memory():
+    """ Return the traced memory at the start of a call and reset the tracemalloc peak """
+    global _MAX_PEAK
+    current_memory, peak_memory = tracemalloc.get_traced_memory()
+    if _PEAK_STACK:
+        _PEAK_STACK[-1] = max(_PEAK_STACK[-1], peak_memory)
+    _MAX_PEAK = max(_MAX_PEAK, peak_memory)
+    tracemalloc.reset_peak()
+    _PEAK_STACK.append(current_memory)
+    return current_memory
+
+
+def _record(name, start_time, start_memory):
+    """ Add the measurements for one call that started at start_time to the counters of name """
+    seconds = time.perf_counter() - start_time
+    stats = _STATS.get(name)
+    if stats is None:
+        stats = _STATS[name] = ProfileStats()
+    if start_memory is None:
+        stats.add(seconds)
+    else:
+        current_memory, peak_memory = tracemalloc.get_traced_memory()
+        peak_memory = max(_PEAK_STACK.pop(), peak_memory) if _PEAK_STACK else peak_memory
+        if _PEAK_STACK:
+            _PEAK_STACK[-1] = max(_PEAK_STACK[-1], peak_memory)
+        stats.add(seconds, current_memory - start_memory, peak_memory)
+
+
+def profiled(name=None):
+    """
+    Decorator that records calls of the decorated function under name (defaults to the
+    function's module-qualified name, eg 'msp.lookup_reference_indicator_code').
+    """
+    def decorator(func):
+        profile_name = name or '%s.%s' % (func.__module__, func.__qualname__)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _ENABLED:
+                return func(*args, **kwargs)
+            start_memory = _start_memory() if _TRACE_MEMORY else None
+            start_time = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _record(profile_name, start_time, start_memory)
+        return wrapper
+    return decorator
+
+
+class profile_block(object):
+    """ Context manager that records a block of code under the specified name """
+
+    __slots__ = ('name', 'start_time', 'start_memory')
+
+    def __init__(self, name):
+        self.name = name
+        self.start_time = None
+        self.start_memory = None
+
+    def __enter__(self):
+        if _ENABLED:
+            self.start_memory = _start_memory() if _TRACE_MEMORY else None
+            self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.start_time is not None:
+            _record(self.name, self.start_time, self.start_memory)
+            self.start_time = None
+        return False
+
+
+def get_profile():
+    """ Return the collected profile as a dictionary, with entries sorted by cumulative time """
+    profile = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'trace_memory': _TRACE_MEMORY,
+        'elapsed_seconds': round(time.perf_counter() - _ENABLED_AT, 3) if _ENABLED_AT else 0,
+        'functions': {},
+    }
+    if _TRACE_MEMORY:
+        profile['traced_peak_kb'] = max(_MAX_PEAK, tracemalloc.get_traced_memory()[1]) // 1024
+    for profile_name, stats in sorted(_STATS.items(), key=lambda item: -item[1].seconds):
+        profile['functions'][profile_name] = stats.to_dict()
+    return profile
+
+
+def dump(filename):
+    """ Write the collected profile as JSON to filename and return the profile dictionary """
+    profile = get_profile()
+    with open(filename, 'w') as output_file:
+        json.dump(profile, output_file, indent=2)
+        output_file.write('\n')
+    return profile
+
+
+def display_profile(profile=None, limit=25):
+    """ Print the slowest instrumented functions of a profile (defaults to the current one) """
+    if profile is None:
+        profile = get_profile()
+    print('\nPROFILE (%s seconds elapsed, times are inclusive):' % profile['elapsed_seconds'])
+    print('  %-55s %10s %10s %12s %14s' % (
+        'function', 'calls', 'seconds', 'max_seconds', 'memory_delta_kb'))
+    for profile_name, stats in list(profile['functions'].items())[:limit]:
+        print('  %-55s %10s %10.3f %12.4f %14s' % (
+            profile_name, stats['calls'], stats['seconds'], stats['max_seconds'],
+            stats['memory_delta_kb'] if profile['trace_memory'] else ''))
@@ -0,0 +1,380 @@
+"""
+In-memory query index over a built MSP import list, answering questions such as "which COCs
+does data element X have in FY22", "which codelists contain data element Y" or "what are the
+MER_FY21 members of TX_CURR" with dictionary lookups instead of a scan of the import file.
+
+The index is built in one pass over the OCL-formatted resources of a build, either streamed from
+an import file (see load_import_file) or taken from MspPipeline.import_list. The maps built by
+msp.py are all encoded in the import list, so the index is rebuilt from it:
+* map_ref_indicator_to_de and map_ref_indicator_to_datim_indicator: 'Has Data Element' and
+  'Has DATIM Indicator' mappings
+* map_de_to_coc: 'Has Option' mappings
+* the DE version and DDE source linkages: 'Replaces' and 'Derived From' mappings
+* map_codelist_to_de_to_coc and the fiscal year collections: references of each collection
+Mappings are indexed in both directions by map type. The members of each collection are kept
+as a set of URLs (reference expressions resolved to unversioned URLs), with the inverse index
+from each URL to the collections it is a member of, so the period of a mapping is the
+membership of its URL in the MER_<period> collection.
+
+The index can be saved to and loaded from a JSON file (compressed based on its extension, see
+msp_io.py), so a service restarts without reading the import file again.
+
+Example usage:
+  query_index = msp_query.load_import_file('output/msp_PEPFAR-MER-FY22_20220131.json')
+  query_index.get_data_element_cocs('owIr2CJUbwq', period='FY21')
+  query_index.get_reference_indicator_members('TX_CURR', period='FY21')
+"""
+import json
+import msp
+import msp_integrity
+import msp_io
+import msp_records
+import msp_urls
+
+
+# Format and version of saved indexes, checked when an index is loaded
+INDEX_FORMAT = 'msp-query-index'
+INDEX_VERSION = 1
+
+# Concept classes and collection type used by the queries
+CONCEPT_CLASS_REF_INDICATOR = 'Reference Indicator'
+CONCEPT_CLASS_DATA_ELEMENT = 'Data Element'
+CODELIST_COLLECTION_TYPE = 'Code List'
+
+# Map types of the linkages between versions of data elements and derived data elements
+LINKAGE_MAP_TYPES = (msp.MSP_MAP_TYPE_REPLACES, msp.MSP_MAP_TYPE_DERIVED_FROM)
+
+# Fields of a concept and of a collection kept in the index
+CONCEPT_FIELDS = ('id', 'concept_class', 'datatype', 'external_id', 'retired')
+COLLECTION_FIELDS = ('id', 'name', 'full_name', 'collection_type', 'external_id')
+
+
+class QueryIndex(object):
+    """
+    Concepts, mappings and collection members of a build, indexed for lookups. Call add() for
+    each OCL-formatted resource of the build or use build_index().
+    """
+
+    def __init__(self):
+        self.num_resources = 0
+        self.concepts = {}
+        self.collections = {}
+        self._concept_urls_by_key = {}
+        self._targets = {}
+        self._sources = {}
+        self._members = {}
+        self._collections_by_member = {}
+        self._stats = None
+
+    def add(self, resource):
+        """ Add an OCL-formatted resource to the index """
+        self.num_resources += 1
+        self._stats = None
+        resource_type = resource.get('type')
+        if resource_type == 'Concept':
+            self._add_concept(resource)
+        elif resource_type == 'Mapping':
+            self._add_mapping(resource)
+        elif resource_type == 'Collection':
+            self._add_collection(resource)
+        elif resource_type == 'Reference':
+            self._add_reference(resource)
+
+    def _add_concept(self, resource):
+        url = msp_urls.get_resource_url(resource)
+        concept = self.concepts.get(url)
+        if concept is None:
+            concept = dict((field, resource.get(field)) for field in CONCEPT_FIELDS)
+            concept['url'] = url
+            concept['name'] = concept['code'] = None
+            for name in resource.get('names') or []:
+                if name.get('name_type') == 'Fully Specified' and concept['name'] is None:
+                    concept['name'] = name.get('name')
+                elif name.get('name_type') == 'Code' and concept['code'] is None:
+                    concept['code'] = name.get('name')
+            concept['periods'] = []
+            self._add_concept_keys(concept)
+
+        # Reference indicators are repeated for each period with the same URL
+        period = (resource.get('extras') or {}).get(msp.ATTR_PERIOD)
+        if period and period not in concept['periods']:
+            concept['periods'].append(period)
+
+    def _add_concept_keys(self, concept):
+        url = concept['url']
+        self.concepts[url] = concept
+        for key in (concept['id'], concept['code'], concept['external_id']):
+            if key:
+                urls = self._concept_urls_by_key.setdefault(key, [])
+                if url not in urls:
+                    urls.append(url)
+
+    def _add_mapping(self, resource):
+        self._add_mapping_edge(
+            resource.get('map_type'), resource.get('from_concept_url'),
+            resource.get('to_concept_url'), msp_urls.get_resource_url(resource))
+
+    def _add_mapping_edge(self, map_type, from_url, to_url, mapping_url):
+        self._targets.setdefault(map_type, {}).setdefault(from_url, []).append(
+            (to_url, mapping_url))
+        self._sources.setdefault(map_type, {}).setdefault(to_url, []).append(
+            (from_url, mapping_url))
+
+    def _add_collection(self, resource):
+        collection = dict((field, resource.get(field)) for field in COLLECTION_FIELDS)
+        collection['url'] = msp_urls.get_resource_url(resource)
+        periods = (resource.get('extras') or {}).get(msp.ATTR_APPLICABLE_PERIODS) or ''
+        collection['periods'] = [period.strip() for period in periods.split(',')
+                                 if period.strip()]
+        self.collections[collection['id']] = collection
+        self._members.setdefault(collection['id'], set())
+
+    def _add_reference(self, resource):
+        collection_id = resource.get('collection')
+        members = self._members.setdefault(collection_id, set())
+        for expression in (resource.get('data') or {}).get('expressions', []):
+            url = msp_integrity.normalize_expression(expression)
+            if url not in members:
+                members.add(url)
+                self._collections_by_member.setdefault(url, []).append(collection_id)
+
+    # SAVED INDEXES
+    def to_dict(self):
+        """ Return the index as a JSON-serializable dictionary """
+        return {
+            'format': INDEX_FORMAT,
+            'version': INDEX_VERSION,
+            'num_resources': self.num_resources,
+            'concepts': list(self.concepts.values()),
+            'collections': list(self.collections.values()),
+            'mappings': [
+                [map_type, from_url, to_url, mapping_url]
+                for map_type, targets in self._targets.items()
+                for from_url, mapping_targets in targets.items()
+                for to_url, mapping_url in mapping_targets],
+            'members': dict((collection_id, sorted(members))
+                            for collection_id, members in self._members.items()),
+        }
+
+    @staticmethod
+    def from_dict(index_dict):
+        """ Return the QueryIndex of a dictionary returned by to_dict """
+        if (index_dict.get('format') != INDEX_FORMAT or
+                index_dict.get('version') != INDEX_VERSION):
+            raise ValueError('Not a version %s %s file' % (INDEX_VERSION, INDEX_FORMAT))
+        query_index = QueryIndex()
+        query_index.num_resources = index_dict['num_resources']
+        for concept in index_dict['concepts']:
+            query_index._add_concept_keys(concept)
+        for collection in index_dict['collections']:
+            query_index.collections[collection['id']] = collection
+        for map_type, from_url, to_url, mapping_url in index_dict['mappings']:
+            query_index._add_mapping_edge(map_type, from_url, to_url, mapping_url)
+        for collection_id, members in index_dict['members'].items():
+            query_index._add_reference({
+                'type': 'Reference', 'collection': collection_id,
+                'data': {'expressions': members}})
+        return query_index
+
+    def dump(self, filename):
+        """ Save the index as JSON to filename """
+        with msp_io.open_file(filename, 'w', encoding='utf-8') as output_file:
+            json.dump(self.to_dict(), output_file)
+
+    @staticmethod
+    def load(filename):
+        """ Load an index saved with dump """
+        with msp_io.open_file(filename, encoding='utf-8') as input_file:
+            return QueryIndex.from_dict(json.load(input_file))
+
+    # LOOKUPS
+    def resolve_concept(self, key):
+        """
+        Return the concept with the URL, ID, code or external ID key, or None if there is none.
+        If several concepts have the key, the first one added is returned.
+        """
+        if key in self.concepts:
+            return self.concepts[key]
+        urls = self._concept_urls_by_key.get(key)
+        return self.concepts[urls[0]] if urls else None
+
+    def get_concept_summary(self, url):
+        """ Return the ID, URL, class, name and code of a concept, or only its URL if unknown """
+        concept = self.concepts.get(url)
+        if concept is None:
+            return {'url': url}
+        return {'id': concept['id'], 'url': url, 'concept_class': concept['concept_class'],
+                'name': concept['name'], 'code': concept['code']}
+
+    def is_member(self, collection_id, url):
+        """ Returns True if the URL is a member of the collection """
+        return url in self._members.get(collection_id, ())
+
+    def get_targets(self, map_type, from_url):
+        """ Return list of (to_concept_url, mapping URL) of the mappings of a concept """
+        return self._targets.get(map_type, {}).get(from_url, [])
+
+    def get_sources(self, map_type, to_url):
+        """ Return list of (from_concept_url, mapping URL) of the mappings to a concept """
+        return self._sources.get(map_type, {}).get(to_url, [])
+
+    def get_member_collections(self, url):
+        """ Return the IDs of the collections that the URL is a member of """
+        return self._collections_by_member.get(url, [])
+
+    def _get_mapped_concepts(self, map_type, from_url, collection_ids=()):
+        """ Return the concepts mapped from a concept, limited to mappings in collection_ids """
+        return [self.get_concept_summary(to_url)
+                for to_url, mapping_url in self.get_targets(map_type, from_url)
+                if all(self.is_member(collection_id, mapping_url)
+                       for collection_id in collection_ids)]
+
+    # QUERIES -- each returns None if the concept or collection is not in the index
+    def get_concept(self, key):
+        """ Return a concept with its periods, collections and number of mappings by map type """
+        concept = self.resolve_concept(key)
+        if concept is None:
+            return None
+        url = concept['url']
+        result = dict(concept)
+        result['collections'] = list(self.get_member_collections(url))
+        result['mappings_from'] = dict(
+            (map_type, len(targets[url])) for map_type, targets in self._targets.items()
+            if url in targets)
+        result['mappings_to'] = dict(
+            (map_type, len(sources[url])) for map_type, sources in self._sources.items()
+            if url in sources)
+        return result
+
+    def get_data_element_cocs(self, key, period=None, codelist=None):
+        """
+        Return the COCs of a data element ('Has Option' mappings), limited to the mappings in
+        MER_<period> if period is set and to the mappings in the codelist collection if
+        codelist is set
+        """
+        concept = self.resolve_concept(key)
+        if concept is None or (codelist and codelist not in self.collections):
+            return None
+        collection_ids = []
+        if period:
+            collection_ids.append(msp.COLLECTION_NAME_MER_FULL % period)
+        if codelist:
+            collection_ids.append(codelist)
+        cocs = self._get_mapped_concepts(
+            msp.MSP_MAP_TYPE_DE_TO_COC, concept['url'], collection_ids)
+        return {'data_element': self.get_concept_summary(concept['url']), 'period': period,
+                'codelist': codelist, 'num_cocs': len(cocs), 'cocs': cocs}
+
+    def get_concept_codelists(self, key, period=None):
+        """
+        Return the codelist collections that a concept (eg a data element) is a member of,
+        limited to the codelists applicable to period if it is set
+        """
+        concept = self.resolve_concept(key)
+        if concept is None:
+            return None
+        codelists = []
+        for collection_id in self.get_member_collections(concept['url']):
+            collection = self.collections.get(collection_id)
+            if (collection is None or
+                    collection['collection_type'] != CODELIST_COLLECTION_TYPE or
+                    (period and period not in collection['periods'])):
+                continue
+            codelists.append(collection)
+        return {'concept': self.get_concept_summary(concept['url']), 'period': period,
+                'num_codelists': len(codelists), 'codelists': codelists}
+
+    def get_reference_indicator_members(self, key, period=None):
+        """
+        Return the data elements and DATIM indicators of a reference indicator, limited to the
+        mappings in MER_<period> if period is set
+        """
+        concept = self.resolve_concept(key)
+        if concept is None:
+            return None
+        collection_ids = [msp.COLLECTION_NAME_MER_FULL % period] if period else []
+        data_elements = self._get_mapped_concepts(
+            msp.MSP_MAP_TYPE_REF_INDICATOR_TO_DE, concept['url'], collection_ids)
+        indicators = self._get_mapped_concepts(
+            msp.MSP_MAP_TYPE_REF_INDICATOR_TO_DATIM_INDICATOR, concept['url'], collection_ids)
+        return {'reference_indicator': self.get_concept_summary(concept['url']),
+                'period': period, 'periods': concept['periods'],
+                'num_data_elements': len(data_elements), 'data_elements': data_elements,
+                'num_indicators': len(indicators), 'indicators': indicators}
+
+    def get_concept_linkages(self, key):
+        """
+        Return the concepts linked to a concept by 'Replaces' and 'Derived From' mappings from
+        the concept and to the concept
+        """
+        concept = self.resolve_concept(key)
+        if concept is None:
+            return None
+        url = concept['url']
+        linkages = {}
+        for map_type in LINKAGE_MAP_TYPES:
+            linkages[map_type] = {
+                'mappings_from': [self.get_concept_summary(to_url)
+                                  for to_url, _ in self.get_targets(map_type, url)],
+                'mappings_to': [self.get_concept_summary(from_url)
+                                for from_url, _ in self.get_sources(map_type, url)],
+            }
+        return {'concept': self.get_concept_summary(url), 'linkages': linkages}
+
+    def get_collection(self, collection_id, concept_class=None):
+        """
+        Return a collection with its number of members by type and concept class, and its
+        concept members (limited to concept_class if it is set)
+        """
+        if collection_id not in self.collections:
+            return None
+        counts = {}
+        concepts = []
+        for url in self._members[collection_id]:
+            concept = self.concepts.get(url)
+            if concept is None:
+                counts['Mapping'] = counts.get('Mapping', 0) + 1
+                continue
+            counts[concept['concept_class']] = counts.get(concept['concept_class'], 0) + 1
+            if not concept_class or concept['concept_class'] == concept_class:
+                concepts.append(self.get_concept_summary(url))
+        concepts.sort(key=lambda concept_summary: concept_summary['url'])
+        result = dict(self.collections[collection_id])
+        result.update({'member_counts': counts, 'num_concepts': len(concepts),
+                       'concepts': concepts})
+        return result
+
+    def get_stats(self):
+        """ Return the number of resources, concepts, mappings and collections indexed """
+        if self._stats is None:
+            self._stats = self._count_resources()
+        return self._stats
+
+    def _count_resources(self):
+        concept_counts = {}
+        for concept in self.concepts.values():
+            concept_class = concept['concept_class']
+            concept_counts[concept_class] = concept_counts.get(concept_class, 0) + 1
+        return {
+            'num_resources': self.num_resources,
+            'num_concepts': len(self.concepts),
+            'concepts_by_class': concept_counts,
+            'mappings_by_type': dict(
+                (map_type, sum(len(mapping_targets) for mapping_targets in targets.values()))
+                for map_type, targets in self._targets.items()),
+            'num_collections': len(self.collections),
+            'num_collection_members': sum(len(members) for members in self._members.values()),
+        }
+
+
+def build_index(resources):
+    """ Return the QueryIndex of an iterable of OCL-formatted dicts or msp_records records """
+    query_index = QueryIndex()
+    for resource in resources:
+        query_index.add(msp_records.to_ocl_json(resource))
+    return query_index
+
+
+def load_import_file(filename):
+    """ Return the QueryIndex of an import file, streaming it """
+    return build_index(resource for _, resource in msp_integrity.iter_import_file(filename))
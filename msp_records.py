@@ -0,0 +1,372 @@
+"""
+Slot-based record types for the concepts built from DATIM and iHUB metadata (data elements,
+iHUB derived data elements, category option combos and DATIM indicators).
+
+The build keeps every one of these concepts alive from load until output, but most of an
+OCL-formatted concept dict is boilerplate (type, owner_type, retired, locale...) or is only needed
+when the import file is written (the names and descriptions lists of dicts). A record stores just
+the fields the pipeline queries -- id, owner, source, names, description, extras, URL and COCs --
+and renders the full OCL-formatted dict with to_ocl_json() when the output stage streams it.
+
+Records support read-only dict-style access to every OCL key (concept['id'],
+concept['extras'][...], concept['names'][0]['name'], 'extras' in concept, concept.get(...)) as
+well as assignment to the throwaway '__url' and '__cocs' keys, so code written against the dicts
+keeps working during the migration. MspResourceList is an OclJsonResourceList that accepts records
+and indexes resources by URL.
+"""
+import json
+import ocldev.oclresourcelist
+import msp_profile
+
+
+# Default values shared by all concept records
+CONCEPT_OWNER_TYPE = 'Organization'
+CONCEPT_NAME_LOCALE = 'en'
+PROCESSING_ATTRS = ('__url', '__cocs')
+
+# Shared COC tuples, keyed by DATIM categoryCombo UID
+_CATEGORY_COMBO_COCS = {}
+
+
+class ConceptRecord(object):
+    """
+    Base class for compact concept records. Subclasses set CONCEPT_CLASS, DATATYPE and
+    OCL_KEYS, which is the ordered list of keys rendered by to_ocl_json().
+    """
+
+    __slots__ = ('id', 'owner', 'source', 'names', 'description', 'extras', 'url', 'cocs',
+                 '_more')
+
+    CONCEPT_CLASS = ''
+    DATATYPE = 'None'
+    OCL_KEYS = ()
+
+    def __init__(self, concept_id='', owner='', source='', names=(), description=None,
+                 extras=None, url=None, cocs=None):
+        """
+        names is a sequence of (name, name_type) pairs, first name is the preferred name.
+        description is a string or None.
+        """
+        self.id = concept_id
+        self.owner = owner
+        self.source = source
+        self.names = tuple(names)
+        self.description = description
+        self.extras = extras
+        self.url = url
+        self.cocs = cocs
+        self._more = None
+
+    @property
+    def datatype(self):
+        return self.DATATYPE
+
+    @property
+    def name(self):
+        """ Preferred (ie first) name of the concept """
+        return self.names[0][0] if self.names else None
+
+    def get_name_by_type(self, name_type):
+        """ Return the first name of the specified name_type (or list of name types) or None """
+        if isinstance(name_type, str):
+            name_type = [name_type]
+        for current_name_type in name_type:
+            for name, concept_name_type in self.names:
+                if concept_name_type == current_name_type:
+                    return name
+        return None
+
+    def _render_names(self):
+        return [{
+            'name': name,
+            'name_type': name_type,
+            'locale': CONCEPT_NAME_LOCALE,
+            'locale_preferred': index == 0,
+            'external_id': None,
+        } for index, (name, name_type) in enumerate(self.names)]
+
+    def _render_descriptions(self):
+        if not self.description:
+            return None
+        return [{
+            'description': self.description,
+            'description_type': 'Description',
+            'locale': CONCEPT_NAME_LOCALE,
+            'locale_preferred': True,
+            'external_id': None,
+        }]
+
+    def _get_value(self, key):
+        """ Return the value for an OCL key. Raises KeyError for keys not in OCL_KEYS. """
+        if key == 'type':
+            return 'Concept'
+        elif key == 'id' or key == 'external_id':
+            return self.id
+        elif key == 'concept_class':
+            return self.CONCEPT_CLASS
+        elif key == 'datatype':
+            return self.datatype
+        elif key == 'owner':
+            return self.owner
+        elif key == 'owner_type':
+            return CONCEPT_OWNER_TYPE
+        elif key == 'source':
+            return self.source
+        elif key == 'retired':
+            return False
+        elif key == 'descriptions':
+            return self._render_descriptions()
+        elif key == 'names':
+            return self._render_names()
+        elif key == 'extras':
+            return self.extras
+        elif key == '__url':
+            return self.url
+        elif key == '__cocs':
+            return self.cocs
+        raise KeyError(key)
+
+    def __getitem__(self, key):
+        if key in self.OCL_KEYS:
+            return self._get_value(key)
+        if self._more and key in self._more:
+            return self._more[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key == '__url':
+            self.url = value
+        elif key == '__cocs':
+            self.cocs = value
+        elif key == 'extras' and 'extras' in self.OCL_KEYS:
+            self.extras = value
+        elif key in self.OCL_KEYS:
+            raise KeyError('Cannot assign computed concept attribute "%s"' % key)
+        else:
+            if self._more is None:
+                self._more = {}
+            self._more[key] = value
+
+    def __contains__(self, key):
+        return key in self.OCL_KEYS or bool(self._more and key in self._more)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, ConceptRecord):
+            return self.to_ocl_json() == other.to_ocl_json()
+        if isinstance(other, dict):
+            return self.to_ocl_json() == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = object.__hash__
+
+    def __repr__(self):
+        return '<%s: %s>' % (self.__class__.__name__, self.url or self.id)
+
+    def keys(self):
+        """ Return the list of keys rendered by to_ocl_json() """
+        if self._more:
+            return list(self.OCL_KEYS) + list(self._more.keys())
+        return list(self.OCL_KEYS)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def items(self):
+        return self.to_ocl_json().items()
+
+    def copy(self):
+        """ Return the OCL-formatted dict, ie what dict.copy() returned for dict concepts """
+        return self.to_ocl_json()
+
+    def to_ocl_json(self, include_processing_attrs=True):
+        """
+        Return the full OCL-formatted concept dict. If include_processing_attrs is False, the
+        throw-away '__url' and '__cocs' attributes are omitted.
+        """
+        ocl_json = {}
+        for key in self.OCL_KEYS:
+            if not include_processing_attrs and key in PROCESSING_ATTRS:
+                continue
+            ocl_json[key] = self._get_value(key)
+        if self._more:
+            ocl_json.update(self._more)
+        return ocl_json
+
+
+class DataElementRecord(ConceptRecord):
+    """
+    DATIM data element. cocs is the shared tuple of raw COCs of the DE's categoryCombo (see
+    get_category_combo_cocs) and category_combo_id identifies that categoryCombo.
+    """
+    __slots__ = ('category_combo_id',)
+    CONCEPT_CLASS = 'Data Element'
+    DATATYPE = 'Numeric'
+    OCL_KEYS = ('type', 'id', 'concept_class', 'datatype', 'owner', 'owner_type', 'source',
+                'retired', 'external_id', 'descriptions', 'names', 'extras', '__url', '__cocs')
+
+    def __init__(self, category_combo_id=None, **kwargs):
+        ConceptRecord.__init__(self, **kwargs)
+        self.category_combo_id = category_combo_id
+
+
+class DerivedDataElementRecord(ConceptRecord):
+    """ iHUB derived data element """
+    __slots__ = ()
+    CONCEPT_CLASS = 'Data Element'
+    DATATYPE = 'Numeric'
+    OCL_KEYS = ('type', 'id', 'concept_class', 'datatype', 'owner', 'owner_type', 'source',
+                'retired', 'external_id', 'descriptions', 'extras', 'names', '__url', '__cocs')
+
+
+class CategoryOptionComboRecord(ConceptRecord):
+    """ DATIM category option combo """
+    __slots__ = ()
+    CONCEPT_CLASS = 'Category Option Combo'
+    DATATYPE = 'None'
+    OCL_KEYS = ('type', 'id', 'concept_class', 'datatype', 'owner', 'owner_type', 'source',
+                'retired', 'descriptions', 'external_id', 'names', '__url')
+
+
+class DatimIndicatorRecord(ConceptRecord):
+    """ DATIM indicator -- datatype is the DHIS2 indicator type, set per indicator """
+    __slots__ = ('indicator_type',)
+    CONCEPT_CLASS = 'Indicator'
+    OCL_KEYS = ('type', 'id', 'owner', 'owner_type', 'source', 'concept_class', 'datatype',
+                'names', 'extras', '__url')
+
+    def __init__(self, indicator_type='', **kwargs):
+        ConceptRecord.__init__(self, **kwargs)
+        self.indicator_type = indicator_type
+
+    @property
+    def datatype(self):
+        return self.indicator_type
+
+
+def get_category_combo_cocs(category_combo):
+    """
+    Return the shared tuple of raw COCs for a raw DHIS2 categoryCombo, eg
+    ({'id': 'BepIh8WFKdy', 'name': '25-29, Female'}, ...). Data elements in the same
+    categoryCombo get the same tuple object. If a categoryCombo is seen again with different
+    COCs, its own tuple is returned instead.
+    """
+    category_combo_cocs = tuple(category_combo.get('categoryOptionCombos', ()))
+    category_combo_id = category_combo.get('id')
+    if category_combo_id is None:
+        return category_combo_cocs
+    shared_cocs = _CATEGORY_COMBO_COCS.get(category_combo_id)
+    if shared_cocs is None:
+        _CATEGORY_COMBO_COCS[category_combo_id] = category_combo_cocs
+        return category_combo_cocs
+    if shared_cocs == category_combo_cocs:
+        return shared_cocs
+    return category_combo_cocs
+
+
+def clear_category_combo_cocs():
+    """ Release the shared categoryCombo COC tuples """
+    _CATEGORY_COMBO_COCS.clear()
+
+
+def to_ocl_json(resource):
+    """ Return the OCL-formatted dict for a record, or the resource itself if it is a dict """
+    if isinstance(resource, ConceptRecord):
+        return resource.to_ocl_json()
+    return resource
+
+
+def dumps(resource, **kwargs):
+    """ json.dumps a dict or record resource """
+    return json.dumps(to_ocl_json(resource), **kwargs)
+
+
+class MspResourceList(ocldev.oclresourcelist.OclJsonResourceList):
+    """
+    OclJsonResourceList that also accepts ConceptRecord resources and keeps a URL index, so that
+    get_resource_by_url is a dictionary lookup instead of a scan of the URL list.
+    """
+
+    def __init__(self, resources=None):
+        self._url_index = {}
+        ocldev.oclresourcelist.OclJsonResourceList.__init__(self, resources=resources)
+
+    def append(self, resources):
+        """
+        Add one resource or a list of resources to this object
+        :param resources: <dict>, <ConceptRecord>, <list>, <OclResourceList>
+        """
+        if isinstance(resources, (dict, ConceptRecord)):
+            resources = [resources]
+        if not isinstance(resources, (list, ocldev.oclresourcelist.OclResourceList)):
+            raise TypeError("Cannot append resource of type '%s'" % type(resources))
+        for resource in resources:
+            if isinstance(resource, ConceptRecord) and resource.url:
+                resource_url = resource.url
+            elif isinstance(resource, (dict, ConceptRecord)):
+                resource_url = ocldev.oclresourcelist.OclResourceList.get_resource_url(resource)
+            else:
+                raise TypeError("Cannot append resource of type '%s'" % type(resource))
+            if resource_url not in self._url_index:
+                self._url_index[resource_url] = len(self._resources)
+            self._urls.append(resource_url)
+            self._resources.append(resource)
+
+    def refresh_index(self):
+        ocldev.oclresourcelist.OclJsonResourceList.refresh_index(self)
+        self._url_index = {}
+        for index, resource_url in enumerate(self._urls):
+            if resource_url not in self._url_index:
+                self._url_index[resource_url] = index
+
+    def pop(self, resource_index):
+        resource = ocldev.oclresourcelist.OclJsonResourceList.pop(self, resource_index)
+        self.refresh_index()
+        return resource
+
+    @msp_profile.profiled()
+    def get_resource_by_url(self, url):
+        """ Return the first resource that matches the specified URL. """
+        if isinstance(url, str) and url:
+            url_needle = url.strip()
+        else:
+            return None
+        if url_needle[-1] != '/':
+            url_needle += '/'
+        index = self._url_index.get(url_needle)
+        if index is None:
+            return None
+        return self._resources[index]
+
+    def get_resources(self, core_attrs=None, custom_attrs=None):
+        """
+        Get list of resources matching all of the specified attributes.  Any core or custom
+        attribute may be passed using the core_attrs and custom_attrs dictionaries.
+        """
+        result = self._get_resources(core_attrs=core_attrs, custom_attrs=custom_attrs)
+        if result:
+            return MspResourceList(result)
+        return None
+
+    def __add__(self, new_resources):
+        """ Add two resource lists together """
+        _output_resources = list(self._resources)
+        for resource in new_resources:
+            _output_resources.append(resource.copy())
+        return MspResourceList(_output_resources)
+
+    def to_ocl_json(self):
+        """ Return all resources as a list of OCL-formatted dicts """
+        return [to_ocl_json(resource) for resource in self._resources]
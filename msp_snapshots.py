@@ -0,0 +1,298 @@
+"""
+Diff of dated DATIM and codelist snapshots, eg data/datim_dataSets_20210106.csv and
+data/datim_dataSets_20210309.csv.
+
+Each snapshot is read once and every item in it is reduced to a fingerprint: a hash of each of
+its fields, keyed by the UID of the item. Comparing the fingerprints of the old and new
+snapshot gives the added, removed and modified items (and the modified fields) of each item
+type in linear time. Only the fingerprints are kept once a snapshot has been read.
+
+Item types by snapshot kind (the kind is taken from the start of the filename):
+* codelist_collections_with_exports: codelist (collection, without its rows), codelist_row
+  (keyed by codelist UID/DE UID/COC UID), data_element and coc (as they appear in the rows)
+* datim_dataElements: data_element
+* datim_categoryOptionCombos: coc
+* datim_indicators: indicator
+* datim_dataSets: dataset
+
+get_change_set also lists the codelists, data elements, COCs, indicators and datasets that
+changed across all compared snapshots, and the applicable periods of the changed codelists, so a
+rebuild can be limited with build_ocl_import.py --period.
+
+Example usage:
+  diff = msp_snapshots.diff_snapshot_files(
+      'data/datim_dataSets_20210106.csv', 'data/datim_dataSets_20210309.csv')
+  change_set = msp_snapshots.get_change_set([diff])
+"""
+import csv
+import hashlib
+import json
+import os
+import msp
+import msp_io
+
+
+# Item types
+ITEM_CODELIST = 'codelist'
+ITEM_CODELIST_ROW = 'codelist_row'
+ITEM_DATA_ELEMENT = 'data_element'
+ITEM_COC = 'coc'
+ITEM_INDICATOR = 'indicator'
+ITEM_DATASET = 'dataset'
+ITEM_TYPES = (ITEM_CODELIST, ITEM_CODELIST_ROW, ITEM_DATA_ELEMENT, ITEM_COC, ITEM_INDICATOR,
+              ITEM_DATASET)
+
+# Fields that change without the metadata changing, eg the DATIM server in URLs
+IGNORED_FIELDS = ('lastUpdated', 'lastUpdatedBy', 'href', 'access')
+
+# Separator of the UIDs in codelist row keys
+ROW_KEY_SEPARATOR = '/'
+
+# Format of the change set written by diff_snapshots.py
+CHANGE_SET_FORMAT = 'msp-snapshot-changes'
+CHANGE_SET_VERSION = 1
+
+
+def get_fingerprint(content):
+    """ Return a tuple of (field, hash of the field value) for the fields of an item """
+    return tuple(
+        (field, hashlib.sha1(json.dumps(value, sort_keys=True).encode('utf-8')).hexdigest()[:16])
+        for field, value in sorted(content.items()) if field not in IGNORED_FIELDS)
+
+
+def get_row_key(codelist_uid, de_uid, coc_uid):
+    """ Return the key of a codelist row """
+    return ROW_KEY_SEPARATOR.join((codelist_uid, de_uid, coc_uid))
+
+
+def iter_codelist_items(filename):
+    """ Yield (item type, key, content) for the items of a codelists with exports snapshot """
+    for codelist in msp_io.iter_json_array(filename):
+        codelist_uid = codelist['external_id']
+        extras = dict(codelist.get('extras') or {})
+        rows = extras.pop('dhis2_codelist', {}).get('listGrid', {}).get('rows', [])
+        content = dict(codelist)
+        content['extras'] = extras
+        yield ITEM_CODELIST, codelist_uid, content
+        for row in rows:
+            de_uid = row[msp.DATIM_CODELIST_COLUMN_DATA_ELEMENT_UID]
+            coc_uid = row[msp.DATIM_CODELIST_COLUMN_COC_UID]
+            yield (ITEM_CODELIST_ROW, get_row_key(codelist_uid, de_uid, coc_uid),
+                   dict(zip(msp.DATIM_CODELIST_COLUMN_NAMES, row)))
+            yield ITEM_DATA_ELEMENT, de_uid, {
+                'name': row[msp.DATIM_CODELIST_COLUMN_DATA_ELEMENT_NAME],
+                'shortName': row[msp.DATIM_CODELIST_COLUMN_DATA_ELEMENT_SHORT_NAME],
+                'code': row[msp.DATIM_CODELIST_COLUMN_DATA_ELEMENT_CODE],
+                'description': row[msp.DATIM_CODELIST_COLUMN_DATA_ELEMENT_DESCRIPTION],
+            }
+            yield ITEM_COC, coc_uid, {
+                'name': row[msp.DATIM_CODELIST_COLUMN_COC_NAME],
+                'code': row[msp.DATIM_CODELIST_COLUMN_COC_CODE],
+            }
+
+
+def _iter_dhis2_json_items(filename, resource_name, item_type):
+    """ Yield (item type, key, content) for the resources of a DHIS2 JSON export """
+    with msp_io.open_file(filename, encoding='utf-8') as input_file:
+        resources = json.load(input_file)[resource_name]
+    for resource in resources:
+        yield item_type, resource['id'], resource
+
+
+def iter_data_element_items(filename):
+    """ Yield (item type, key, content) for the items of a DATIM data elements snapshot """
+    return _iter_dhis2_json_items(filename, 'dataElements', ITEM_DATA_ELEMENT)
+
+
+def iter_coc_items(filename):
+    """ Yield (item type, key, content) for the items of a DATIM COCs snapshot """
+    return _iter_dhis2_json_items(filename, 'categoryOptionCombos', ITEM_COC)
+
+
+def iter_indicator_items(filename):
+    """ Yield (item type, key, content) for the items of a DATIM indicators snapshot """
+    return _iter_dhis2_json_items(filename, 'indicators', ITEM_INDICATOR)
+
+
+def iter_dataset_items(filename):
+    """ Yield (item type, key, content) for the items of a DATIM datasets CSV snapshot """
+    with msp_io.open_file(filename, encoding='utf-8', newline='') as input_file:
+        for row in csv.DictReader(input_file):
+            yield ITEM_DATASET, row['id'], row
+
+
+# Snapshot kinds: filename prefix and item iterator
+SNAPSHOT_KINDS = (
+    ('codelist_collections_with_exports', iter_codelist_items),
+    ('datim_dataElements', iter_data_element_items),
+    ('datim_categoryOptionCombos', iter_coc_items),
+    ('datim_indicators', iter_indicator_items),
+    ('datim_dataSets', iter_dataset_items),
+)
+
+
+def get_snapshot_kind(filename):
+    """ Return the snapshot kind (filename prefix) of filename, or None if unknown """
+    basename = os.path.basename(filename)
+    for kind, _ in SNAPSHOT_KINDS:
+        if basename.startswith(kind):
+            return kind
+    return None
+
+
+class Snapshot(object):
+    """ Fingerprints of the items of a snapshot by item type and key """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.kind = get_snapshot_kind(filename)
+        if self.kind is None:
+            raise ValueError('Unknown snapshot "%s", expected a filename starting with: %s' % (
+                filename, ', '.join(kind for kind, _ in SNAPSHOT_KINDS)))
+        self.fingerprints = {}
+        self.codelist_periods = {}
+
+    def load(self):
+        """ Read the snapshot file and fingerprint its items. Returns self. """
+        iter_items = dict(SNAPSHOT_KINDS)[self.kind]
+        for item_type, key, content in iter_items(self.filename):
+            item_fingerprints = self.fingerprints.setdefault(item_type, {})
+            if key in item_fingerprints:
+                # Data elements and COCs repeat across codelist rows, the first one is kept
+                continue
+            item_fingerprints[key] = get_fingerprint(content)
+            if item_type == ITEM_CODELIST:
+                periods = (content.get('extras') or {}).get('Applicable Periods') or ''
+                self.codelist_periods[key] = [
+                    period.strip() for period in periods.split(',') if period.strip()]
+        return self
+
+
+def diff_fingerprints(old_fingerprints, new_fingerprints):
+    """
+    Return dictionary with the added and removed keys and the modified items (key and modified
+    fields) between two dictionaries of fingerprints
+    """
+    old_keys = set(old_fingerprints)
+    new_keys = set(new_fingerprints)
+    modified = []
+    for key in sorted(old_keys & new_keys):
+        if old_fingerprints[key] != new_fingerprints[key]:
+            fields = set(old_fingerprints[key]) ^ set(new_fingerprints[key])
+            modified.append({'key': key, 'fields': sorted(set(field for field, _ in fields))})
+    return {
+        'added': sorted(new_keys - old_keys),
+        'removed': sorted(old_keys - new_keys),
+        'modified': modified,
+        'unchanged': len(old_keys & new_keys) - len(modified),
+    }
+
+
+def diff_snapshots(old_snapshot, new_snapshot):
+    """ Return the diff of two loaded snapshots of the same kind by item type """
+    if old_snapshot.kind != new_snapshot.kind:
+        raise ValueError('Cannot compare a %s snapshot with a %s snapshot' % (
+            old_snapshot.kind, new_snapshot.kind))
+    changes = {}
+    for item_type in ITEM_TYPES:
+        if item_type in old_snapshot.fingerprints or item_type in new_snapshot.fingerprints:
+            changes[item_type] = diff_fingerprints(
+                old_snapshot.fingerprints.get(item_type, {}),
+                new_snapshot.fingerprints.get(item_type, {}))
+    codelist_periods = dict(old_snapshot.codelist_periods)
+    for codelist_uid, periods in new_snapshot.codelist_periods.items():
+        codelist_periods[codelist_uid] = sorted(
+            set(codelist_periods.get(codelist_uid, [])) | set(periods))
+    return {
+        'kind': old_snapshot.kind,
+        'old': old_snapshot.filename,
+        'new': new_snapshot.filename,
+        'counts': dict((item_type, {
+            'added': len(item_changes['added']),
+            'removed': len(item_changes['removed']),
+            'modified': len(item_changes['modified']),
+            'unchanged': item_changes['unchanged'],
+        }) for item_type, item_changes in changes.items()),
+        'changes': changes,
+        'codelist_periods': codelist_periods,
+    }
+
+
+def diff_snapshot_files(old_filename, new_filename):
+    """ Load two snapshot files and return their diff (see diff_snapshots) """
+    return diff_snapshots(Snapshot(old_filename).load(), Snapshot(new_filename).load())
+
+
+def get_changed_keys(item_changes):
+    """ Return the set of the added, removed and modified keys of an item type """
+    return (set(item_changes['added']) | set(item_changes['removed']) |
+            set(item['key'] for item in item_changes['modified']))
+
+
+def get_change_set(snapshot_diffs):
+    """
+    Return the machine-readable change set of a list of snapshot diffs: the diffs and the UIDs
+    of the changed codelists, data elements, COCs, indicators and datasets. A changed codelist
+    row marks its codelist, data element and COC as changed. 'periods' lists the applicable
+    periods of the changed codelists; 'full_rebuild' is True if anything else changed, since
+    those changes cannot be narrowed down to periods.
+    """
+    affected = dict((item_type, set()) for item_type in (
+        ITEM_CODELIST, ITEM_DATA_ELEMENT, ITEM_COC, ITEM_INDICATOR, ITEM_DATASET))
+    codelist_periods = {}
+    row_uids = set()
+    for snapshot_diff in snapshot_diffs:
+        codelist_periods.update(snapshot_diff['codelist_periods'])
+        for item_type, item_changes in snapshot_diff['changes'].items():
+            changed_keys = get_changed_keys(item_changes)
+            if item_type == ITEM_CODELIST_ROW:
+                for row_key in changed_keys:
+                    codelist_uid, de_uid, coc_uid = row_key.split(ROW_KEY_SEPARATOR)
+                    affected[ITEM_CODELIST].add(codelist_uid)
+                    affected[ITEM_DATA_ELEMENT].add(de_uid)
+                    affected[ITEM_COC].add(coc_uid)
+                    row_uids.update((de_uid, coc_uid))
+            else:
+                affected[item_type] |= changed_keys
+
+    # Changed data elements and COCs that are all in changed codelist rows are covered by the
+    # periods of their codelists, anything else needs a full build
+    periods = set()
+    full_rebuild = bool(affected[ITEM_INDICATOR] or affected[ITEM_DATASET] or (
+        (affected[ITEM_DATA_ELEMENT] | affected[ITEM_COC]) - row_uids))
+    for codelist_uid in affected[ITEM_CODELIST]:
+        if not codelist_periods.get(codelist_uid):
+            full_rebuild = True
+        periods.update(codelist_periods.get(codelist_uid, []))
+    return {
+        'format': CHANGE_SET_FORMAT,
+        'version': CHANGE_SET_VERSION,
+        'snapshots': snapshot_diffs,
+        'affected': dict((item_type, sorted(keys)) for item_type, keys in affected.items()),
+        'periods': sorted(periods),
+        'full_rebuild': full_rebuild,
+    }
+
+
+def display_change_set(change_set, max_items=10):
+    """ Print the counts by item type of each snapshot diff and the first changed items """
+    for snapshot_diff in change_set['snapshots']:
+        print('%s -> %s' % (snapshot_diff['old'], snapshot_diff['new']))
+        for item_type, counts in snapshot_diff['counts'].items():
+            print('  %s: %s added, %s removed, %s modified, %s unchanged' % (
+                item_type, counts['added'], counts['removed'], counts['modified'],
+                counts['unchanged']))
+            item_changes = snapshot_diff['changes'][item_type]
+            for change in ('added', 'removed'):
+                for key in item_changes[change][:max_items]:
+                    print('    %s %s' % (change, key))
+            for item in item_changes['modified'][:max_items]:
+                print('    modified %s: %s' % (item['key'], ', '.join(item['fields'])))
+    print('Affected: %s' % ', '.join(
+        '%s %s' % (len(keys), item_type) for item_type, keys in change_set['affected'].items()))
+    if change_set['full_rebuild']:
+        print('Rebuild: full build')
+    elif change_set['periods']:
+        print('Rebuild: %s' % ' '.join('--period %s' % period for period in change_set['periods']))
+    else:
+        print('Rebuild: nothing changed')
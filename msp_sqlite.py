@@ -0,0 +1,379 @@
+"""
+Materializes the concepts, mappings, collections and reference expressions of a build into an
+indexed SQLite database, so analytics and cross-FY comparisons can query relationally instead
+of re-parsing the import file.
+
+Tables (the identity of each row is its primary key):
+* builds: one row per load (build_id, label, created, num_resources)
+* concepts (url): ID, class, datatype, external ID, retired, fully specified name, short name,
+  code and description of each concept
+* concept_extras (concept_url, name) and collection_extras (collection_url, name): one row per
+  extra attribute; lists and dictionaries are stored as JSON
+* resource_periods (resource_url, period): the Period of each concept version and the
+  Applicable Periods of each concept and collection
+* mappings (owner, source, map_type, from_concept_url, to_concept_url): the ID and URL of
+  mappings that have one ('Derived From' mappings do not)
+* collections (url): ID, name, collection type and external ID of each collection
+* reference_expressions (collection_url, expression): each reference expression of each
+  collection with the unversioned URL of the resource it refers to
+* linkages: view of the 'Replaces' and 'Derived From' mappings
+Concepts, mappings, collections and reference expressions record the build_id of the load that
+last wrote them.
+
+A load runs in a single transaction and writes the rows in batches with executemany. Rows are
+upserted by identity, so loading a later build into the same database updates the rows in
+place; a concept repeated in the import list (eg a reference indicator for each period) keeps
+its last version, with the periods of all its versions. With prune, rows that the load did not
+write are deleted, leaving exactly the loaded build. The secondary indexes are created after the
+rows are written.
+
+Example usage:
+  msp_sqlite.materialize(msp_integrity.iter_import_file(filename), 'output/msp.sqlite')
+  SELECT c.id, c.name FROM mappings m JOIN concepts c ON c.url = m.to_concept_url
+    WHERE m.from_concept_url = '/orgs/PEPFAR-MER-FY22/sources/MER/concepts/TX_CURR/'
+"""
+import datetime
+import json
+import sqlite3
+import msp
+import msp_integrity
+import msp_records
+import msp_urls
+
+
+# Number of resources buffered before each batch of executemany calls
+DEFAULT_BATCH_SIZE = 5000
+
+# Version of the schema, stored with PRAGMA user_version
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS builds (
+    build_id INTEGER PRIMARY KEY,
+    label TEXT,
+    created TEXT,
+    num_resources INTEGER
+);
+CREATE TABLE IF NOT EXISTS concepts (
+    url TEXT PRIMARY KEY,
+    owner TEXT,
+    source TEXT,
+    id TEXT,
+    concept_class TEXT,
+    datatype TEXT,
+    external_id TEXT,
+    retired INTEGER,
+    name TEXT,
+    short_name TEXT,
+    code TEXT,
+    description TEXT,
+    build_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS concept_extras (
+    concept_url TEXT,
+    name TEXT,
+    value,
+    PRIMARY KEY (concept_url, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS resource_periods (
+    resource_url TEXT,
+    period TEXT,
+    PRIMARY KEY (resource_url, period)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS mappings (
+    owner TEXT,
+    source TEXT,
+    map_type TEXT,
+    from_concept_url TEXT,
+    to_concept_url TEXT,
+    id TEXT,
+    url TEXT,
+    build_id INTEGER,
+    PRIMARY KEY (owner, source, map_type, from_concept_url, to_concept_url)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS collections (
+    url TEXT PRIMARY KEY,
+    owner TEXT,
+    id TEXT,
+    name TEXT,
+    full_name TEXT,
+    collection_type TEXT,
+    external_id TEXT,
+    build_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS collection_extras (
+    collection_url TEXT,
+    name TEXT,
+    value,
+    PRIMARY KEY (collection_url, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS reference_expressions (
+    collection_url TEXT,
+    expression TEXT,
+    resource_url TEXT,
+    build_id INTEGER,
+    PRIMARY KEY (collection_url, expression)
+) WITHOUT ROWID;
+CREATE VIEW IF NOT EXISTS linkages AS
+    SELECT map_type, from_concept_url, to_concept_url, owner, source, build_id FROM mappings
+    WHERE map_type IN ('%s', '%s');
+""" % (msp.MSP_MAP_TYPE_REPLACES, msp.MSP_MAP_TYPE_DERIVED_FROM)
+
+# Secondary indexes, created after the rows of a load are written
+INDEXES = """
+CREATE INDEX IF NOT EXISTS concepts_id ON concepts (id);
+CREATE INDEX IF NOT EXISTS concepts_code ON concepts (code);
+CREATE INDEX IF NOT EXISTS concepts_class ON concepts (concept_class);
+CREATE INDEX IF NOT EXISTS resource_periods_period ON resource_periods (period);
+CREATE INDEX IF NOT EXISTS mappings_from ON mappings (from_concept_url, map_type);
+CREATE INDEX IF NOT EXISTS mappings_to ON mappings (to_concept_url, map_type);
+CREATE INDEX IF NOT EXISTS mappings_url ON mappings (url);
+CREATE INDEX IF NOT EXISTS reference_expressions_resource
+    ON reference_expressions (resource_url, collection_url);
+"""
+
+# Columns of the upserted tables, identity columns first
+CONCEPT_COLUMNS = ('url', 'owner', 'source', 'id', 'concept_class', 'datatype', 'external_id',
+                   'retired', 'name', 'short_name', 'code', 'description', 'build_id')
+MAPPING_COLUMNS = ('owner', 'source', 'map_type', 'from_concept_url', 'to_concept_url', 'id',
+                   'url', 'build_id')
+COLLECTION_COLUMNS = ('url', 'owner', 'id', 'name', 'full_name', 'collection_type',
+                      'external_id', 'build_id')
+REFERENCE_COLUMNS = ('collection_url', 'expression', 'resource_url', 'build_id')
+
+# Names of a concept stored in the concepts table, by name type
+CONCEPT_NAME_COLUMNS = {'Fully Specified': 'name', 'Short': 'short_name', 'Code': 'code'}
+
+# Tables whose rows record the build_id of the load that last wrote them
+BUILD_TABLES = ('concepts', 'mappings', 'collections', 'reference_expressions')
+
+
+def get_upsert_sql(table, columns, num_identity_columns):
+    """ Return the INSERT statement of a table that updates the row if its identity exists """
+    return 'INSERT INTO %s (%s) VALUES (%s) ON CONFLICT (%s) DO UPDATE SET %s' % (
+        table, ', '.join(columns), ', '.join('?' * len(columns)),
+        ', '.join(columns[:num_identity_columns]),
+        ', '.join('%s = excluded.%s' % (column, column)
+                  for column in columns[num_identity_columns:]))
+
+
+def get_sql_value(value):
+    """ Return an extra attribute value as a SQLite value, lists and dicts as JSON """
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, sort_keys=True)
+    return value
+
+
+def get_periods(extras):
+    """
+    Return the Period and Applicable Periods of a resource's extras. Applicable Periods is a
+    list for concepts and a comma-separated string for collections.
+    """
+    periods = []
+    if extras.get(msp.ATTR_PERIOD):
+        periods.append(extras[msp.ATTR_PERIOD])
+    applicable_periods = extras.get(msp.ATTR_APPLICABLE_PERIODS) or []
+    if not isinstance(applicable_periods, list):
+        applicable_periods = applicable_periods.split(',')
+    for period in applicable_periods:
+        if period.strip() and period.strip() not in periods:
+            periods.append(period.strip())
+    return periods
+
+
+class SqliteWriter(object):
+    """
+    Buffers the rows of OCL-formatted resources and writes them to an open connection in
+    batches. Call add() for each resource and flush() at the end, inside a transaction.
+    """
+
+    def __init__(self, connection, build_id, batch_size=DEFAULT_BATCH_SIZE):
+        self.connection = connection
+        self.build_id = build_id
+        self.batch_size = batch_size
+        self.num_resources = 0
+        self.counts = dict((table, 0) for table in (
+            'concepts', 'concept_extras', 'resource_periods', 'mappings', 'collections',
+            'collection_extras', 'reference_expressions'))
+        self._written_urls = set()
+        self._concepts = {}
+        self._collections = {}
+        self._periods = []
+        self._mappings = []
+        self._references = []
+        self._num_buffered = 0
+
+    def add(self, resource):
+        """ Buffer the rows of an OCL-formatted resource, writing a batch when it is full """
+        self.num_resources += 1
+        resource_type = resource.get('type')
+        if resource_type == 'Concept':
+            self._add_concept(resource)
+        elif resource_type == 'Mapping':
+            self._mappings.append((
+                resource.get('owner'), resource.get('source'), resource.get('map_type'),
+                resource.get('from_concept_url'), resource.get('to_concept_url'),
+                resource.get('id'), msp_urls.get_resource_url(resource), self.build_id))
+        elif resource_type == 'Collection':
+            url = msp_urls.get_resource_url(resource)
+            self._collections[url] = resource
+            self._add_periods(url, resource)
+        elif resource_type == 'Reference':
+            collection_url = msp_urls.get_repo_url(
+                resource.get('owner_type', 'Organization'), resource.get('owner'),
+                'Collection', resource.get('collection'))
+            for expression in (resource.get('data') or {}).get('expressions', []):
+                self._references.append((
+                    collection_url, expression, msp_integrity.normalize_expression(expression),
+                    self.build_id))
+        else:
+            return
+        self._num_buffered += 1
+        if self._num_buffered >= self.batch_size:
+            self.flush()
+
+    def _add_concept(self, resource):
+        url = msp_urls.get_resource_url(resource)
+        self._concepts[url] = resource
+        self._add_periods(url, resource)
+
+    def _add_periods(self, url, resource):
+        for period in get_periods(resource.get('extras') or {}):
+            self._periods.append((url, period))
+
+    def _get_concept_row(self, url, resource):
+        names = dict((column, None) for column in CONCEPT_NAME_COLUMNS.values())
+        for name in resource.get('names') or []:
+            column = CONCEPT_NAME_COLUMNS.get(name.get('name_type'))
+            if column and names[column] is None:
+                names[column] = name.get('name')
+        descriptions = resource.get('descriptions') or []
+        retired = resource.get('retired')
+        return (url, resource.get('owner'), resource.get('source'), resource.get('id'),
+                resource.get('concept_class'), resource.get('datatype'),
+                resource.get('external_id'), None if retired is None else int(bool(retired)),
+                names['name'], names['short_name'], names['code'],
+                descriptions[0].get('description') if descriptions else None, self.build_id)
+
+    def _get_collection_row(self, url, resource):
+        return (url, resource.get('owner'), resource.get('id'), resource.get('name'),
+                resource.get('full_name'), resource.get('collection_type'),
+                resource.get('external_id'), self.build_id)
+
+    def _write_extras(self, table, url_column, resources_by_url):
+        """ Replace the extras of the resources by URL """
+        self.connection.executemany('DELETE FROM %s WHERE %s = ?' % (table, url_column),
+                                    [(url,) for url in resources_by_url])
+        rows = [(url, name, get_sql_value(value))
+                for url, resource in resources_by_url.items()
+                for name, value in (resource.get('extras') or {}).items()]
+        self.connection.executemany(
+            'INSERT INTO %s (%s, name, value) VALUES (?, ?, ?)' % (table, url_column), rows)
+        self.counts[table] += len(rows)
+
+    def flush(self):
+        """ Write the buffered rows """
+        # Periods of a resource are replaced the first time it is written by this load
+        new_urls = [url for url in list(self._concepts) + list(self._collections)
+                    if url not in self._written_urls]
+        self.connection.executemany('DELETE FROM resource_periods WHERE resource_url = ?',
+                                    [(url,) for url in new_urls])
+        self._written_urls.update(new_urls)
+        self.connection.executemany(
+            'INSERT OR IGNORE INTO resource_periods (resource_url, period) VALUES (?, ?)',
+            self._periods)
+        self.counts['resource_periods'] += len(self._periods)
+
+        self.connection.executemany(get_upsert_sql('concepts', CONCEPT_COLUMNS, 1), [
+            self._get_concept_row(url, resource) for url, resource in self._concepts.items()])
+        self._write_extras('concept_extras', 'concept_url', self._concepts)
+        self.connection.executemany(get_upsert_sql('mappings', MAPPING_COLUMNS, 5), self._mappings)
+        self.connection.executemany(get_upsert_sql('collections', COLLECTION_COLUMNS, 1), [
+            self._get_collection_row(url, resource)
+            for url, resource in self._collections.items()])
+        self._write_extras('collection_extras', 'collection_url', self._collections)
+        self.connection.executemany(
+            get_upsert_sql('reference_expressions', REFERENCE_COLUMNS, 2), self._references)
+
+        self.counts['concepts'] += len(self._concepts)
+        self.counts['mappings'] += len(self._mappings)
+        self.counts['collections'] += len(self._collections)
+        self.counts['reference_expressions'] += len(self._references)
+        self._concepts = {}
+        self._collections = {}
+        self._periods = []
+        self._mappings = []
+        self._references = []
+        self._num_buffered = 0
+
+
+def execute_statements(connection, script):
+    """
+    Execute the statements of a script one by one (executescript would commit the transaction
+    of the load)
+    """
+    for statement in script.split(';'):
+        if statement.strip():
+            connection.execute(statement)
+
+
+def create_schema(connection):
+    """ Create the tables and view if they do not exist and check the schema version """
+    version = connection.execute('PRAGMA user_version').fetchone()[0]
+    if version not in (0, SCHEMA_VERSION):
+        raise ValueError('Unsupported MSP SQLite schema version %s (expected %s)' % (
+            version, SCHEMA_VERSION))
+    execute_statements(connection, SCHEMA)
+    connection.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+
+
+def prune(connection, build_id):
+    """ Delete the rows not written by build_id, return number of rows deleted by table """
+    deleted = {}
+    for table in BUILD_TABLES:
+        deleted[table] = connection.execute(
+            'DELETE FROM %s WHERE build_id != ?' % table, (build_id,)).rowcount
+    for table, url_column, parent_table in (
+            ('concept_extras', 'concept_url', 'concepts'),
+            ('collection_extras', 'collection_url', 'collections')):
+        deleted[table] = connection.execute(
+            'DELETE FROM %s WHERE %s NOT IN (SELECT url FROM %s)' % (
+                table, url_column, parent_table)).rowcount
+    deleted['resource_periods'] = connection.execute(
+        'DELETE FROM resource_periods WHERE resource_url NOT IN (SELECT url FROM concepts) '
+        'AND resource_url NOT IN (SELECT url FROM collections)').rowcount
+    return deleted
+
+
+def materialize(resources, filename, label=None, prune_rows=False,
+                batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Write an iterable of OCL-formatted dicts or msp_records records to the SQLite database
+    filename in a single transaction, upserting rows by identity. If prune_rows is True, rows
+    not written by this load are deleted. Returns a summary dictionary with the build_id,
+    number of resources and number of rows written (and deleted) by table.
+    """
+    connection = sqlite3.connect(filename, isolation_level=None)
+    try:
+        connection.execute('BEGIN')
+        try:
+            create_schema(connection)
+            created = datetime.datetime.now().isoformat(timespec='seconds')
+            build_id = connection.execute(
+                'INSERT INTO builds (label, created) VALUES (?, ?)', (label, created)).lastrowid
+            writer = SqliteWriter(connection, build_id, batch_size=batch_size)
+            for resource in resources:
+                writer.add(msp_records.to_ocl_json(resource))
+            writer.flush()
+            connection.execute('UPDATE builds SET num_resources = ? WHERE build_id = ?',
+                               (writer.num_resources, build_id))
+            deleted = prune(connection, build_id) if prune_rows else {}
+            execute_statements(connection, INDEXES)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+    finally:
+        connection.close()
+    return {'build_id': build_id, 'label': label, 'created': created,
+            'num_resources': writer.num_resources, 'rows': writer.counts, 'deleted': deleted}
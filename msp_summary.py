@@ -0,0 +1,458 @@
+"""
+Summary reports for the MSP build: the metadata loaded from the input sources and the final OCL
+import list.
+
+Each resource list is scanned exactly once. All breakdowns for a list (periods, result/target,
+support type, etc.) are collected in the same pass into a plain summary dictionary, which can
+then be rendered as the text report printed by build_ocl_import.py or written as JSON with dump().
+Keys of the breakdown dictionaries are the raw attribute values, eg None for resources without
+the attribute, in order of first occurrence.
+"""
+import datetime
+import json
+import msp
+import msp_profile
+
+
+# Custom attributes broken down for each type of input concept: (attribute key, title)
+DE_BREAKDOWNS = [
+    (msp.ATTR_RESULT_TARGET, 'Result/Target'),
+    (msp.ATTR_DOMAIN_TYPE, 'Domain Type'),
+    (msp.ATTR_NUMERATOR_DENOMINATOR_TYPE, 'Numerator/Denominator'),
+    (msp.ATTR_PEPFAR_SUPPORT_TYPE, 'PEPFAR Support Type'),
+    (msp.ATTR_REPORTING_FREQUENCY, 'Reporting Frequency'),
+]
+IHUB_DDE_BREAKDOWNS = [
+    (msp.ATTR_RESULT_TARGET, 'Result/Target'),
+    ('standardized_disaggregate', 'Standardized Disaggregate'),
+    (msp.ATTR_NUMERATOR_DENOMINATOR_TYPE, 'Numerator/Denominator'),
+    (msp.ATTR_PEPFAR_SUPPORT_TYPE, 'PEPFAR Support Type'),
+    (msp.ATTR_REPORTING_FREQUENCY, 'Reporting Frequency'),
+]
+DATIM_INDICATOR_BREAKDOWNS = [
+    (msp.ATTR_RESULT_TARGET, 'Result/Target'),
+    ('annualized', 'Annualized'),
+    ('dimensionItemType', 'dimensionItemType'),
+]
+CODELIST_RESULT_TARGET_TYPES = ['Result', 'Target']
+
+
+def _increment(counts, key):
+    """ Add one to counts[key], keeping keys in order of first occurrence """
+    if key in counts:
+        counts[key] += 1
+    else:
+        counts[key] = 1
+
+
+def _get_child_counts(relation):
+    """ Returns (number of keys, number of children) for a dict of lists or a CsrRelation """
+    if relation is None:
+        return 0, 0
+    return msp.get_dict_child_counts(relation)
+
+
+def _get_mapped_count(relation, from_url):
+    """ Returns number of targets mapped from from_url, or None if from_url has no mappings """
+    if relation is not None and from_url in relation:
+        return len(relation[from_url])
+    return None
+
+
+@msp_profile.profiled()
+def summarize_concepts(resource_list, breakdowns):
+    """
+    Summarize a list of input concepts in a single pass. Returns a dictionary with the total
+    count, the counts per applicable period and a breakdown for each (attribute key, title)
+    in breakdowns, keyed by title.
+    """
+    period_counts = {}
+    attr_counts = [{} for _ in breakdowns]
+    attr_keys = [attr_key for (attr_key, _) in breakdowns]
+    count = 0
+    for resource in resource_list:
+        count += 1
+        extras = resource['extras'] or {}
+        if msp.ATTR_APPLICABLE_PERIODS in extras:
+            for period in extras[msp.ATTR_APPLICABLE_PERIODS]:
+                _increment(period_counts, period)
+        else:
+            _increment(period_counts, None)
+        for (attr_key, counts) in zip(attr_keys, attr_counts):
+            _increment(counts, extras.get(attr_key))
+    return {
+        'count': count,
+        'periods': period_counts,
+        'breakdowns': dict(
+            (title, counts) for ((_, title), counts) in zip(breakdowns, attr_counts)),
+    }
+
+
+@msp_profile.profiled()
+def summarize_reference_indicators(ref_indicator_concepts, sorted_ref_indicator_codes,
+                                   map_ref_indicator_to_de=None,
+                                   map_ref_indicator_to_ihub_dde=None,
+                                   map_ref_indicator_to_datim_indicator=None):
+    """ Summarize reference indicator definitions by code and by period in a single pass """
+    code_periods = {}
+    code_urls = {}
+    period_counts = {}
+    for ref_indicator in ref_indicator_concepts:
+        ref_indicator_code = ref_indicator.get('id')
+        period = (ref_indicator.get('extras') or {}).get(msp.ATTR_PERIOD)
+        _increment(period_counts, period)
+        if ref_indicator_code not in code_periods:
+            code_periods[ref_indicator_code] = {}
+        code_periods[ref_indicator_code][period] = True
+        if ref_indicator_code not in code_urls and ref_indicator.get('type') == 'Concept':
+            code_urls[ref_indicator_code] = ref_indicator['__url']
+    codes = []
+    for ref_indicator_code in sorted(sorted_ref_indicator_codes):
+        ref_indicator_url = code_urls.get(ref_indicator_code)
+        code_summary = {
+            'code': ref_indicator_code,
+            'periods': list(code_periods.get(ref_indicator_code, {})),
+            'url': ref_indicator_url,
+            'data_elements': None,
+            'ihub_derived_data_elements': None,
+            'datim_indicators': None,
+        }
+        if ref_indicator_url:
+            code_summary['data_elements'] = _get_mapped_count(
+                map_ref_indicator_to_de, ref_indicator_url)
+            code_summary['ihub_derived_data_elements'] = _get_mapped_count(
+                map_ref_indicator_to_ihub_dde, ref_indicator_url)
+            code_summary['datim_indicators'] = _get_mapped_count(
+                map_ref_indicator_to_datim_indicator, ref_indicator_url)
+        codes.append(code_summary)
+    return {
+        'count': len(ref_indicator_concepts),
+        'num_codes': len(sorted_ref_indicator_codes),
+        'codes': codes,
+        'periods': period_counts,
+        'mappings': {
+            'data_elements': _get_child_counts(map_ref_indicator_to_de),
+            'ihub_derived_data_elements': _get_child_counts(map_ref_indicator_to_ihub_dde),
+            'datim_indicators': _get_child_counts(map_ref_indicator_to_datim_indicator),
+        },
+    }
+
+
+@msp_profile.profiled()
+def summarize_codelists(codelist_collections, input_periods, map_codelist_to_de_to_coc=None):
+    """ Summarize codelists by period and result/target type in a single pass """
+    periods = dict((period, {
+        'count': 0,
+        'codelists': dict((result_target, []) for result_target in CODELIST_RESULT_TARGET_TYPES),
+    }) for period in input_periods or [])
+    count = 0
+    for codelist in codelist_collections:
+        count += 1
+        extras = codelist['extras'] or {}
+        result_target = extras.get(msp.ATTR_RESULT_TARGET)
+        codelist_summary = None
+        applicable_periods = extras.get(msp.ATTR_APPLICABLE_PERIODS) or []
+        for period in periods:
+            if period not in applicable_periods:
+                continue
+            periods[period]['count'] += 1
+            if result_target not in periods[period]['codelists']:
+                continue
+            if codelist_summary is None:
+                codelist_summary = {
+                    'name': codelist['name'],
+                    'external_id': codelist['external_id'],
+                    'data_elements': None,
+                }
+                if (map_codelist_to_de_to_coc is not None and
+                        codelist['external_id'] in map_codelist_to_de_to_coc):
+                    codelist_summary['data_elements'] = len(
+                        map_codelist_to_de_to_coc[codelist['external_id']])
+            periods[period]['codelists'][result_target].append(codelist_summary)
+    return {'count': count, 'periods': periods}
+
+
+@msp_profile.profiled()
+def summarize_overlapping_data_elements(de_concepts, ihub_dde_concepts):
+    """
+    Returns list of data elements that are defined by both DATIM and iHUB, determined by
+    intersecting the sets of IDs. Each entry pairs the first DATIM data element with the last
+    iHUB derived data element with that ID, in order of the iHUB derived data elements.
+    """
+    dde_concepts_by_id = {}
+    for dde_concept in ihub_dde_concepts:
+        dde_concepts_by_id[dde_concept['id']] = dde_concept
+    de_concepts_by_id = {}
+    for de_concept in de_concepts or []:
+        if de_concept['id'] in dde_concepts_by_id and de_concept['id'] not in de_concepts_by_id:
+            de_concepts_by_id[de_concept['id']] = de_concept
+    overlapping_de_concepts = []
+    for (concept_id, dde_concept) in dde_concepts_by_id.items():
+        if concept_id not in de_concepts_by_id:
+            continue
+        de_concept = de_concepts_by_id[concept_id]
+        overlapping_de_concepts.append({
+            'id': concept_id,
+            'datim_name': de_concept['names'][0]['name'],
+            'datim_periods': de_concept['extras'].get(msp.ATTR_APPLICABLE_PERIODS),
+            'ihub_name': dde_concept['names'][0]['name'],
+            'ihub_periods': dde_concept['extras'].get(msp.ATTR_APPLICABLE_PERIODS),
+        })
+    return overlapping_de_concepts
+
+
+@msp_profile.profiled()
+def summarize_input_metadata(input_periods=None, ref_indicator_concepts=None,
+                             sorted_ref_indicator_codes=None, coc_concepts=None,
+                             codelist_collections=None, de_concepts=None,
+                             map_codelist_to_de_to_coc=None, datim_indicator_concepts=None,
+                             ihub_dde_concepts=None, map_ref_indicator_to_de=None,
+                             map_ref_indicator_to_ihub_dde=None,
+                             map_ref_indicator_to_datim_indicator=None,
+                             map_de_to_coc=None, map_ihub_dde_to_coc=None,
+                             de_version_linkages=None, map_de_version_linkages=None,
+                             map_dde_source_linkages=None, **kwargs):
+    """
+    Returns a dictionary summarizing the loaded metadata. Sections for input lists that are
+    empty or not provided are set to None. Accepts the same arguments as
+    display_input_metadata_summary; unused arguments are ignored.
+    """
+    summary = {
+        'created': datetime.datetime.now().strftime("%Y-%m-%d"),
+        'input_periods': input_periods,
+        'reference_indicators': None,
+        'codelists': None,
+        'data_elements': None,
+        'ihub_derived_data_elements': None,
+        'de_version_linkages': {
+            'counts': _get_child_counts(map_de_version_linkages),
+            'linkages': de_version_linkages or {},
+        },
+        'dde_source_linkages': _get_child_counts(map_dde_source_linkages),
+        'cocs': None,
+        'datim_indicators': None,
+        'overlapping_data_elements': None,
+    }
+    if ref_indicator_concepts and sorted_ref_indicator_codes:
+        summary['reference_indicators'] = summarize_reference_indicators(
+            ref_indicator_concepts, sorted_ref_indicator_codes,
+            map_ref_indicator_to_de=map_ref_indicator_to_de,
+            map_ref_indicator_to_ihub_dde=map_ref_indicator_to_ihub_dde,
+            map_ref_indicator_to_datim_indicator=map_ref_indicator_to_datim_indicator)
+    if codelist_collections:
+        summary['codelists'] = summarize_codelists(
+            codelist_collections, input_periods,
+            map_codelist_to_de_to_coc=map_codelist_to_de_to_coc)
+    if de_concepts:
+        summary['data_elements'] = summarize_concepts(de_concepts, DE_BREAKDOWNS)
+    if ihub_dde_concepts:
+        summary['ihub_derived_data_elements'] = summarize_concepts(
+            ihub_dde_concepts, IHUB_DDE_BREAKDOWNS)
+        summary['overlapping_data_elements'] = summarize_overlapping_data_elements(
+            de_concepts, ihub_dde_concepts)
+    if coc_concepts:
+        summary['cocs'] = {
+            'count': len(coc_concepts),
+            'data_element_maps': _get_child_counts(map_de_to_coc) if map_de_to_coc else None,
+            'ihub_dde_maps': (
+                _get_child_counts(map_ihub_dde_to_coc) if map_ihub_dde_to_coc else None),
+        }
+    if datim_indicator_concepts:
+        summary['datim_indicators'] = summarize_concepts(
+            datim_indicator_concepts, DATIM_INDICATOR_BREAKDOWNS)
+    return summary
+
+
+def _display_counts(counts, indent):
+    """ Print each key and count of a breakdown dictionary """
+    for (key, count) in counts.items():
+        print('%s%s: %s' % (indent, key, count))
+
+
+def _display_concepts_summary(concepts_summary):
+    """ Print the period breakdown and the custom attribute breakdowns of an input concept list """
+    _display_counts(concepts_summary['periods'], '      ')
+    for (title, counts) in concepts_summary['breakdowns'].items():
+        print('    Breakdown by %s:' % title)
+        _display_counts(counts, '      ')
+
+
+def display_input_metadata_summary(summary, verbosity=1):
+    """ Print the text report of a summary returned by summarize_input_metadata """
+    print('MSP Metadata Statistics %s\n' % summary['created'])
+    print('METADATA SOURCES:')
+
+    # Input periods
+    print('  Input Periods:', summary['input_periods'])
+
+    # Reference Indicators
+    ref_indicators_summary = summary['reference_indicators']
+    if ref_indicators_summary:
+        print('  MER Reference Indicators (FY16-20):')
+        print('%s unique reference indicator codes, %s total definitions' % (
+            ref_indicators_summary['count'], ref_indicators_summary['num_codes']))
+        print('    Breakdown by Indicator Code:')
+        for code_summary in ref_indicators_summary['codes']:
+            print('      %s: ' % code_summary['code'])
+            print('        Periods:', ', '.join(code_summary['periods']))
+            if code_summary['data_elements'] is not None:
+                print('        Mapped DATIM data elements: %s' % code_summary['data_elements'])
+            if code_summary['ihub_derived_data_elements'] is not None:
+                print('        Mapped iHUB derived data elements: %s' % (
+                    code_summary['ihub_derived_data_elements']))
+            if code_summary['datim_indicators'] is not None:
+                print('        Mapped DATIM indicators: %s' % code_summary['datim_indicators'])
+        print('    Breakdown by Period:')
+        _display_counts(ref_indicators_summary['periods'], '      ')
+        mappings = ref_indicators_summary['mappings']
+        print('    Summary of Reference Indicator Mappings:')
+        print('      Mappings to DATIM Data Elements (DE): ')
+        print('%s reference indicators with %s unique DE mappings' % tuple(
+            mappings['data_elements']))
+        print('      Mappings to iHUB Derived Data Elements (DDE): ')
+        print('%s reference indicators with %s unique DDE mappings' % tuple(
+            mappings['ihub_derived_data_elements']))
+        print('      Mappings to DATIM Indicators: ')
+        print('%s reference indicators with %s unique DATIM indicator mappings\n' % tuple(
+            mappings['datim_indicators']))
+
+    # Codelist collections
+    codelists_summary = summary['codelists']
+    if codelists_summary:
+        print('  DATIM Code Lists (FY16-20):', codelists_summary['count'])
+        print('    Breakdown by Period: (Note some codelists span multiple periods)')
+        for (period, period_summary) in codelists_summary['periods'].items():
+            print('      %s Code Lists: %s' % (period, period_summary['count']))
+            if verbosity < 2:
+                continue
+            for (result_target, codelists) in period_summary['codelists'].items():
+                print('        %s: %s' % (result_target, len(codelists) if codelists else None))
+                for codelist_summary in codelists:
+                    if codelist_summary['data_elements'] is not None:
+                        print('          %s: %s data elements' % (
+                            codelist_summary['name'], codelist_summary['data_elements']))
+                    else:
+                        print('          %s' % codelist_summary['name'])
+
+    # DATIM data element concepts
+    if summary['data_elements']:
+        print('  DATIM Data Elements (All):', summary['data_elements']['count'])
+        print('    Breakdown by period (via codelists):')
+        _display_concepts_summary(summary['data_elements'])
+
+    # iHUB derived data element concepts
+    if summary['ihub_derived_data_elements']:
+        print('  iHUB Derived Data Element (All):',
+              summary['ihub_derived_data_elements']['count'])
+        print('    Breakdown by period (via derivation rules):')
+        _display_concepts_summary(summary['ihub_derived_data_elements'])
+
+    # Summary for DE version linkages
+    print('\nRESULTS OF GENERATING LINKAGES BETWEEN DATA ELEMENTS:')
+    print('  Data Element Version Links (DATIM and iHUB):')
+    print('    %s DEs replaced %s DEs' % tuple(summary['de_version_linkages']['counts']))
+    if verbosity >= 2:
+        de_version_linkages = summary['de_version_linkages']['linkages']
+        for de_code in de_version_linkages:
+            print('      %s' % de_code)
+            for de_version in de_version_linkages[de_code]:
+                print('        %s: %s (%s)' % (
+                    de_version['sort_order'], de_version['code'], de_version['url']))
+
+    # Summary for DE source-derivation linkages
+    print('\n  iHUB Data Element Source-Derivation Linkages:')
+    print('    %s derived data elements linked to %s source data elements' % tuple(
+        summary['dde_source_linkages']))
+    print('    NOTE: Source-derivation linkages are defined between data elements only, not COCs')
+
+    # COC concepts
+    cocs_summary = summary['cocs']
+    if cocs_summary:
+        print('  DATIM COC concepts (All):', cocs_summary['count'])
+        if cocs_summary['data_element_maps']:
+            print('    %s DATIM data elements with %s unique COC maps' % tuple(
+                cocs_summary['data_element_maps']))
+        if cocs_summary['ihub_dde_maps']:
+            print('    %s iHUB DDEs with %s unique COC maps' % tuple(
+                cocs_summary['ihub_dde_maps']))
+
+    # DATIM indicator concepts
+    if summary['datim_indicators']:
+        print('  DATIM Indicators (All):', summary['datim_indicators']['count'])
+        print('    Breakdown by period (via keywords in indicator names):')
+        _display_concepts_summary(summary['datim_indicators'])
+
+    # Display list of overlapping IDs between iHUB and DATIM data elements
+    if summary['overlapping_data_elements']:
+        print('  Overlapping DATIM/iHUB Data Elements: %s' % len(
+            summary['overlapping_data_elements']))
+        for overlapping_concept in summary['overlapping_data_elements']:
+            print('    [%s]\n      DATIM: %s -- %s\n      iHUB: %s -- %s' % (
+                overlapping_concept['id'],
+                overlapping_concept['datim_name'], overlapping_concept['datim_periods'],
+                overlapping_concept['ihub_name'], overlapping_concept['ihub_periods']))
+
+
+@msp_profile.profiled()
+def summarize_import_list(import_list):
+    """
+    Returns a dictionary summarizing the final import list in a single pass: counts by resource
+    type, concept class (with data elements by source and reference indicators by period), map
+    type, and the list of collection IDs.
+    """
+    type_counts = {}
+    concept_class_counts = {}
+    de_source_counts = {}
+    ref_indicator_period_counts = {}
+    map_type_counts = {}
+    collection_ids = []
+    for resource in import_list:
+        resource_type = resource.get('type')
+        _increment(type_counts, resource_type)
+        if resource_type == 'Concept':
+            concept_class = resource.get('concept_class')
+            _increment(concept_class_counts, concept_class)
+            if concept_class == 'Data Element':
+                _increment(de_source_counts, (resource.get('extras') or {}).get('source'))
+            elif concept_class == 'Reference Indicator':
+                _increment(ref_indicator_period_counts,
+                           (resource.get('extras') or {}).get(msp.ATTR_PERIOD))
+        elif resource_type == 'Mapping':
+            _increment(map_type_counts, resource.get('map_type'))
+        elif resource_type == 'Collection':
+            collection_ids.append(resource['id'])
+    return {
+        'types': type_counts,
+        'concept_classes': concept_class_counts,
+        'data_element_sources': de_source_counts,
+        'reference_indicator_periods': ref_indicator_period_counts,
+        'map_types': map_type_counts,
+        'collections': collection_ids,
+    }
+
+
+def display_import_list_summary(summary):
+    """ Print the text report of a summary returned by summarize_import_list """
+    print('\nSUMMARY OF FINAL IMPORT LIST:')
+    print('  Breakdown by resource type:')
+    for (key, count) in summary['types'].items():
+        print('    %s: %s' % (key, count))
+        if key == 'Concept':
+            for (concept_class, concept_class_count) in summary['concept_classes'].items():
+                print('      %s: %s' % (concept_class, concept_class_count))
+                if concept_class == 'Data Element':
+                    _display_counts(summary['data_element_sources'], '        ')
+                elif concept_class == 'Reference Indicator':
+                    _display_counts(summary['reference_indicator_periods'], '        ')
+        elif key == 'Mapping':
+            _display_counts(summary['map_types'], '      ')
+        elif key == 'Collection':
+            for collection_id in summary['collections']:
+                print('      %s' % collection_id)
+
+
+def dump(summary, filename):
+    """ Write one or more summaries as JSON to filename """
+    with open(filename, 'w') as output_file:
+        json.dump(summary, output_file, indent=2, default=str)
+        output_file.write('\n')
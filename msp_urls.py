@@ -0,0 +1,178 @@
+"""
+Central factory for the relative OCL URLs of concepts and mappings used throughout the MSP build.
+
+The same concept and mapping URLs (eg '/orgs/PEPFAR-MER-FY22/sources/MER/concepts/sAxSUTFc5tp/')
+are needed by concept builders, DE/COC maps, codelist maps, linkages and every period of the
+fiscal year references. OclUrlFactory builds each URL once per (owner, source), interns it and
+hands the same string object back on every later request. The reverse lookup (URL to resource
+ID) is cached as well, which replaces slicing IDs back out of URLs with rfind.
+
+Use get_url_factory(owner_id, source_id) to get the shared factory for a repository.
+"""
+import sys
+
+
+# URL formats for resources owned by an organization's source
+CONCEPT_URL_FORMAT = '/orgs/%s/sources/%s/concepts/%s/'
+MAPPING_URL_FORMAT = '/orgs/%s/sources/%s/mappings/%s/'
+
+# URL path segments of owner and repository types
+OWNER_URL_SEGMENTS = {'Organization': 'orgs', 'User': 'users'}
+REPO_URL_SEGMENTS = {'Source': 'sources', 'Collection': 'collections'}
+
+# OCL-formatted resource types owned by a repository: resource type as key, repository type and
+# URL path segment of the resource as value (versions have no segment: '/sources/MER/v1.0/')
+REPO_RESOURCE_TYPES = {
+    'Concept': ('Source', 'concepts'),
+    'Mapping': ('Source', 'mappings'),
+    'Source Version': ('Source', ''),
+    'Reference': ('Collection', 'references'),
+    'Collection Version': ('Collection', ''),
+}
+
+# Shared factories, keyed by (owner_id, source_id)
+_URL_FACTORIES = {}
+
+# Reverse lookup of URL to resource ID, shared by all factories
+_RESOURCE_IDS_BY_URL = {}
+
+
+class OclUrlFactory(object):
+    """ Builds, interns and caches concept and mapping URLs for one owner/source """
+
+    def __init__(self, owner_id='', source_id=''):
+        self.owner_id = owner_id
+        self.source_id = source_id
+        self._concept_urls = {}
+        self._mapping_urls = {}
+        self._mapping_urls_by_concepts = {}
+
+    def __len__(self):
+        """ Number of distinct URLs cached by this factory """
+        return len(self._concept_urls) + len(self._mapping_urls)
+
+    def concept_url(self, concept_id):
+        """ Return the interned URL for the specified concept ID """
+        url = self._concept_urls.get(concept_id)
+        if url is None:
+            url = sys.intern(CONCEPT_URL_FORMAT % (self.owner_id, self.source_id, concept_id))
+            self._concept_urls[concept_id] = url
+            if isinstance(concept_id, str):
+                _RESOURCE_IDS_BY_URL[url] = sys.intern(concept_id)
+        return url
+
+    def mapping_url(self, mapping_id):
+        """ Return the interned URL for the specified mapping ID """
+        url = self._mapping_urls.get(mapping_id)
+        if url is None:
+            url = sys.intern(MAPPING_URL_FORMAT % (self.owner_id, self.source_id, mapping_id))
+            self._mapping_urls[mapping_id] = url
+            if isinstance(mapping_id, str):
+                _RESOURCE_IDS_BY_URL[url] = sys.intern(mapping_id)
+        return url
+
+    def mapping_url_for_concepts(self, id_format, from_concept_url, to_concept_url):
+        """
+        Return the interned URL of the mapping between the two concept URLs, where the mapping
+        ID is generated from the concept IDs using id_format (eg 'MAP_DE_COC_%s_%s').
+        """
+        key = (id_format, from_concept_url, to_concept_url)
+        url = self._mapping_urls_by_concepts.get(key)
+        if url is None:
+            url = self.mapping_url(id_format % (
+                get_resource_id_from_url(from_concept_url),
+                get_resource_id_from_url(to_concept_url)))
+            self._mapping_urls_by_concepts[key] = url
+        return url
+
+    def clear(self):
+        """ Release all cached URLs for this factory """
+        for url in self._concept_urls.values():
+            _RESOURCE_IDS_BY_URL.pop(url, None)
+        for url in self._mapping_urls.values():
+            _RESOURCE_IDS_BY_URL.pop(url, None)
+        self._concept_urls = {}
+        self._mapping_urls = {}
+        self._mapping_urls_by_concepts = {}
+
+
+def get_url_factory(owner_id='', source_id=''):
+    """ Return the shared OclUrlFactory for the specified owner and source """
+    key = (owner_id, source_id)
+    url_factory = _URL_FACTORIES.get(key)
+    if url_factory is None:
+        url_factory = OclUrlFactory(owner_id=owner_id, source_id=source_id)
+        _URL_FACTORIES[key] = url_factory
+    return url_factory
+
+
+def get_concept_url(owner_id='', source_id='', concept_id=''):
+    """ Shortcut for get_url_factory(owner_id, source_id).concept_url(concept_id) """
+    return get_url_factory(owner_id, source_id).concept_url(concept_id)
+
+
+def get_resource_id_from_url(url):
+    """
+    Return the resource ID (the last path segment) of a relative OCL URL with a trailing slash,
+    eg 'sAxSUTFc5tp' for '/orgs/PEPFAR/sources/MER/concepts/sAxSUTFc5tp/'. URLs created by a
+    factory are resolved from the cache without parsing.
+    """
+    resource_id = _RESOURCE_IDS_BY_URL.get(url)
+    if resource_id is None:
+        resource_id = url[url[:-1].rfind('/') + 1:-1]
+    return resource_id
+
+
+def get_owner_url(owner_type='Organization', owner_id=''):
+    """ Return the relative URL of an owner, eg '/orgs/PEPFAR/' """
+    return '/%s/%s/' % (OWNER_URL_SEGMENTS.get(owner_type, 'orgs'), owner_id)
+
+
+def get_repo_url(owner_type='Organization', owner_id='', repo_type='Source', repo_id=''):
+    """ Return the relative URL of a repository, eg '/orgs/PEPFAR/sources/MER/' """
+    return '%s%s/%s/' % (
+        get_owner_url(owner_type, owner_id), REPO_URL_SEGMENTS.get(repo_type, 'sources'), repo_id)
+
+
+def get_repo_id(resource):
+    """
+    Return the ID of the repository that owns an OCL-formatted resource (eg the source of a
+    concept or the collection of a reference), or None if it is not owned by a repository
+    """
+    resource_type = resource.get('type')
+    if resource_type not in REPO_RESOURCE_TYPES:
+        return None
+    return resource.get(REPO_RESOURCE_TYPES[resource_type][0].lower())
+
+
+def get_resource_url(resource):
+    """
+    Return the relative URL of an OCL-formatted resource (dict), eg
+    '/orgs/PEPFAR/sources/MER/concepts/TX_CURR/', or None if the resource has no URL of its own
+    (eg a reference) or is of an unknown type
+    """
+    resource_type = resource.get('type')
+    resource_id = resource.get('id')
+    if not resource_id:
+        return None
+    if resource_type in OWNER_URL_SEGMENTS:
+        return get_owner_url(resource_type, resource_id)
+    owner_type = resource.get('owner_type', 'Organization')
+    owner_id = resource.get('owner', '')
+    if resource_type in REPO_URL_SEGMENTS:
+        return get_repo_url(owner_type, owner_id, resource_type, resource_id)
+    if resource_type not in REPO_RESOURCE_TYPES or resource_type == 'Reference':
+        return None
+    repo_type, url_segment = REPO_RESOURCE_TYPES[resource_type]
+    repo_url = get_repo_url(owner_type, owner_id, repo_type, get_repo_id(resource))
+    if url_segment:
+        return '%s%s/%s/' % (repo_url, url_segment, resource_id)
+    return '%s%s/' % (repo_url, resource_id)
+
+
+def clear_url_factories():
+    """ Release all shared factories and their cached URLs """
+    for url_factory in _URL_FACTORIES.values():
+        url_factory.clear()
+    _URL_FACTORIES.clear()
+    _RESOURCE_IDS_BY_URL.clear()
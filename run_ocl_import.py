@@ -1,38 +1,104 @@
 """
 Imports a JSON lines file into OCL
+
+Example usage:
+  python run_ocl_import.py output/msp_PEPFAR-MER-FY22_20220131.json
+  python msp_cli.py import output/msp_PEPFAR-MER-FY22_20220131.json --local --test-mode
 """
+import argparse
+import json
+import sys
 import ocldev.oclfleximporter
 import ocldev.oclresourcelist
+import msp_import_validator
+import msp_integrity
+import msp_io
 import settings
 
 
 # settings
-json_filename = 'output/msp_pepfar_test8_20200617.json'
-api_url_root = 'https://api.staging.openconceptlab.org'
-ocl_api_token = settings.OCL_API_TOKEN
-do_local_import = False  # Instead of bulk import
-
-# Local import settings -- only used if do_local_import == True
-test_mode = False
-limit = 0  # Set to 0 to import all records
-reference_batch_size = 25
-
-# Validate
-print 'Validating import file "%s"...' % json_filename
-import_list = ocldev.oclresourcelist.OclJsonResourceList.load_from_file(json_filename)
-import_list.validate()
-
-# Process the import
-if do_local_import:
-    importer = ocldev.oclfleximporter.OclFlexImporter(
-        file_path=json_filename, api_url_root=api_url_root, api_token=ocl_api_token,
-        test_mode=test_mode, verbosity=2, do_update_if_exists=True, limit=limit,
-        reference_batch_size=reference_batch_size)
-    importer.process()
-else:  # Do bulk import
-    import_request = ocldev.oclfleximporter.OclBulkImporter.post(
-        file_path=json_filename, api_url_root=api_url_root, api_token=ocl_api_token)
-    import_request.raise_for_status()
-    import_response = import_request.json()
-    task_id = import_response['task']
-    print '\nImport Filename: %s\nBulk Import Task ID:\n%s\n' % (json_filename, task_id)
+JSON_FILENAME = 'output/msp_pepfar_test8_20200617.json'
+API_URL_ROOT = 'https://api.staging.openconceptlab.org'
+
+# Maximum number of validation errors displayed
+MAX_DISPLAYED_ERRORS = 50
+
+# Local import settings -- only used for a local import (instead of bulk import)
+REFERENCE_BATCH_SIZE = 25
+
+
+def load_import_list(filename):
+    """ Load an OCL-formatted JSON lines file, optionally compressed (see msp_io.py) """
+    with msp_io.open_file(filename, encoding='utf-8') as input_file:
+        return ocldev.oclresourcelist.OclJsonResourceList(
+            resources=[json.loads(line) for line in input_file if line.strip()])
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Import a JSON lines file into OCL')
+    parser.add_argument('json_filename', nargs='?', default=JSON_FILENAME,
+                        help='OCL-formatted JSON lines file (default: %s)' % JSON_FILENAME)
+    parser.add_argument('--api-url-root', default=API_URL_ROOT,
+                        help='OCL API URL root (default: %s)' % API_URL_ROOT)
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Number of validation worker processes (default: number of CPUs)')
+    parser.add_argument('--skip-integrity-check', action='store_true',
+                        help='Do not check the referential integrity of the file before import')
+    parser.add_argument('--local', action='store_true',
+                        help='Import resource by resource instead of as a bulk import')
+    parser.add_argument('--test-mode', action='store_true',
+                        help='Local import only: do not write to OCL')
+    parser.add_argument('--limit', type=int, default=0,
+                        help='Local import only: number of records to import (default: all)')
+    parser.add_argument('--reference-batch-size', type=int, default=REFERENCE_BATCH_SIZE,
+                        help='Local import only: references per batch')
+    args = parser.parse_args(argv[1:])
+
+    # Validate
+    print('Validating import file "%s"...' % args.json_filename)
+    num_errors = 0
+    for error in msp_import_validator.iter_validation_errors(
+            args.json_filename, workers=args.workers or None):
+        num_errors += 1
+        if num_errors <= MAX_DISPLAYED_ERRORS:
+            print('  %s' % msp_import_validator.format_error(error))
+    if num_errors:
+        print('%s invalid resources, import cancelled' % num_errors)
+        return 1
+
+    # Check that everything the resources refer to is defined before it is used
+    if not args.skip_integrity_check:
+        report = msp_integrity.check_integrity(
+            msp_integrity.iter_import_file(args.json_filename),
+            external_prefixes=getattr(settings, 'MSP_INTEGRITY_EXTERNAL_PREFIXES', ()))
+        msp_integrity.display_report(report)
+        if report['num_issues']:
+            print('Referential integrity issues, import cancelled')
+            return 1
+
+    # Compressed import files are imported from the loaded list instead of the file
+    import_filename, input_list = args.json_filename, None
+    if msp_io.get_compression(import_filename):
+        import_filename, input_list = '', load_import_list(import_filename)
+
+    # Process the import
+    if args.local:
+        importer = ocldev.oclfleximporter.OclFlexImporter(
+            file_path=import_filename, input_list=input_list, api_url_root=args.api_url_root,
+            api_token=settings.OCL_API_TOKEN, test_mode=args.test_mode, verbosity=2,
+            do_update_if_exists=True, limit=args.limit,
+            reference_batch_size=args.reference_batch_size)
+        importer.process()
+    else:  # Do bulk import
+        import_request = ocldev.oclfleximporter.OclBulkImporter.post(
+            file_path=import_filename, input_list=input_list, api_url_root=args.api_url_root,
+            api_token=settings.OCL_API_TOKEN)
+        import_request.raise_for_status()
+        import_response = import_request.json()
+        task_id = import_response['task']
+        print('\nImport Filename: %s\nBulk Import Task ID:\n%s\n' % (args.json_filename, task_id))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -3,19 +3,37 @@ Saves codelist exports retreived from DHIS2 to a single large OCL-formatted JSON
 containing all of the codelists. The input into this is a spreadsheet in the format of 
 /data/codelists_RT_FY21_22_20220131.csv.
 """
+import argparse
 import json
+import sys
 import settings
-import msp
+import msp_datim
 
 
-# Load codelists from CSV and download/add the exports from ZenDesk exports to each
-print('Loading codelists...')
-codelist_collections = msp.load_codelist_collections(
-    filename=settings.FILENAME_DATIM_CODELISTS, org_id=settings.MSP_ORG_ID,
-    canonical_url=settings.CANONICAL_URL, verbosity=2)
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Retrieve the codelists from DATIM and save them to a single JSON file')
+    parser.add_argument('--codelists-file', default=settings.FILENAME_DATIM_CODELISTS,
+                        help='Codelist definitions CSV (default: %s)' % (
+                            settings.FILENAME_DATIM_CODELISTS))
+    parser.add_argument('--output', default=settings.FILENAME_DATIM_CODELISTS_WITH_EXPORT,
+                        help='JSON filename to write (default: %s)' % (
+                            settings.FILENAME_DATIM_CODELISTS_WITH_EXPORT))
+    args = parser.parse_args(argv[1:])
 
-# Save codelists with their exports to file
-with open(settings.FILENAME_DATIM_CODELISTS_WITH_EXPORT, 'w') as output_file:
-    output_file.write(json.dumps(codelist_collections.to_list()))
-print('%s collections with their exports saved to "%s"' % (
-    len(codelist_collections), settings.FILENAME_DATIM_CODELISTS_WITH_EXPORT))
+    # Load codelists from CSV and download/add the exports from ZenDesk exports to each
+    print('Loading codelists...')
+    codelist_collections = msp_datim.load_codelist_collections(
+        filename=args.codelists_file, org_id=settings.MSP_ORG_ID,
+        canonical_url=settings.CANONICAL_URL, verbosity=2)
+
+    # Save codelists with their exports to file
+    with open(args.output, 'w') as output_file:
+        output_file.write(json.dumps(codelist_collections.to_list()))
+    print('%s collections with their exports saved to "%s"' % (
+        len(codelist_collections), args.output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
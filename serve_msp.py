@@ -0,0 +1,170 @@
+"""
+Local read-only HTTP JSON service over the in-memory query index of a build (see msp_query.py).
+
+The index is loaded once at startup from an import file, from an index saved with --save-index
+or by running the build in this process (--build), and every request is answered from it
+without reading the import file again. Responses are JSON; an unknown concept or collection is
+a 404 with an 'error' message.
+
+Endpoints (<key> is a concept ID, code, external ID or URL; period is eg FY21):
+  GET /stats
+  GET /concepts/<key>
+  GET /concepts/<key>/codelists[?period=]      codelists that the concept is a member of
+  GET /concepts/<key>/linkages                 'Replaces' and 'Derived From' linkages
+  GET /data-elements/<key>/cocs[?period=&codelist=]
+  GET /reference-indicators/<key>/members[?period=]
+  GET /collections/<collection_id>[?concept_class=]
+
+Example usage:
+  python msp_cli.py serve --import-file output/msp_PEPFAR-MER-FY22_20220131.json \\
+      --save-index output/msp_PEPFAR-MER-FY22_20220131.index.json.gz
+  python msp_cli.py serve --index output/msp_PEPFAR-MER-FY22_20220131.index.json.gz
+  python msp_cli.py serve --build --period FY21 --period FY22
+  curl 'http://127.0.0.1:8765/reference-indicators/TX_CURR/members?period=FY21'
+
+Use benchmark_query_service.py to load-test the service.
+"""
+import argparse
+import http.server
+import json
+import re
+import sys
+import time
+import urllib.parse
+import msp_query
+
+
+# Default address of the service
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# Routes: path pattern, QueryIndex method, query parameters passed to the method
+ROUTES = (
+    (re.compile(r'^/stats$'), 'get_stats', ()),
+    (re.compile(r'^/concepts/(?P<key>.+)/codelists$'), 'get_concept_codelists', ('period',)),
+    (re.compile(r'^/concepts/(?P<key>.+)/linkages$'), 'get_concept_linkages', ()),
+    (re.compile(r'^/concepts/(?P<key>.+)$'), 'get_concept', ()),
+    (re.compile(r'^/data-elements/(?P<key>.+)/cocs$'), 'get_data_element_cocs',
+     ('period', 'codelist')),
+    (re.compile(r'^/reference-indicators/(?P<key>.+)/members$'),
+     'get_reference_indicator_members', ('period',)),
+    (re.compile(r'^/collections/(?P<collection_id>[^/]+)/?$'), 'get_collection',
+     ('concept_class',)),
+)
+
+
+def route_request(query_index, path):
+    """
+    Return (HTTP status, response dictionary) of a request path with optional query string,
+    eg '/data-elements/owIr2CJUbwq/cocs?period=FY21'
+    """
+    url = urllib.parse.urlsplit(path)
+    request_path = urllib.parse.unquote(url.path)
+    params = dict(urllib.parse.parse_qsl(url.query))
+    for pattern, method_name, param_names in ROUTES:
+        match = pattern.match(request_path)
+        if match is None:
+            continue
+        kwargs = match.groupdict()
+        for param_name in param_names:
+            if params.get(param_name):
+                kwargs[param_name] = params[param_name]
+        result = getattr(query_index, method_name)(**kwargs)
+        if result is None:
+            return 404, {'error': 'Not found: %s' % request_path}
+        return 200, result
+    return 404, {'error': 'Unknown endpoint: %s' % request_path}
+
+
+class QueryRequestHandler(http.server.BaseHTTPRequestHandler):
+    """ Answers GET requests from the query index of the server """
+
+    # Keep connections open between requests (every response has a Content-Length) and send
+    # the body without waiting for the ACK of the headers
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        status, result = route_request(self.server.query_index, self.path)
+        body = json.dumps(result).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            http.server.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+def make_server(query_index, host=DEFAULT_HOST, port=DEFAULT_PORT, verbose=False):
+    """ Return a threading HTTP server answering queries from query_index """
+    server = http.server.ThreadingHTTPServer((host, port), QueryRequestHandler)
+    server.daemon_threads = True
+    server.query_index = query_index
+    server.verbose = verbose
+    return server
+
+
+def load_query_index(args):
+    """ Return the query index of the import file, saved index or build set in args """
+    if args.index:
+        return msp_query.QueryIndex.load(args.index)
+    if args.import_file:
+        return msp_query.load_import_file(args.import_file)
+
+    # Build in this process, only importing the build when it is used
+    import msp_pipeline
+    import settings
+    pipeline = msp_pipeline.MspPipeline(
+        settings, periods=args.periods, structured_datasets=args.structured_datasets)
+    return msp_query.build_index(pipeline.get('import_list'))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Serve queries over a built MSP import list as a local HTTP JSON API')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--import-file', help='OCL-formatted JSON lines import file')
+    source.add_argument('--index', help='Query index saved with --save-index')
+    source.add_argument('--build', action='store_true',
+                        help='Run the build in this process (see build_ocl_import.py)')
+    parser.add_argument('--period', action='append', dest='periods',
+                        help='With --build, only build resources for this period (repeatable)')
+    parser.add_argument('--structured-dataset', action='append', dest='structured_datasets',
+                        help='With --build, only build this iHUB structured dataset '
+                             '(repeatable)')
+    parser.add_argument('--save-index',
+                        help='Save the query index to this file, eg <import file>.index.json.gz')
+    parser.add_argument('--host', default=DEFAULT_HOST,
+                        help='Address to listen on (default: %(default)s)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help='Port to listen on (default: %(default)s)')
+    parser.add_argument('--verbose', action='store_true', help='Log each request')
+    args = parser.parse_args(argv[1:])
+
+    start_time = time.time()
+    query_index = load_query_index(args)
+    stats = query_index.get_stats()
+    print('Loaded %s concepts, %s mappings and %s collections in %.2f seconds' % (
+        stats['num_concepts'], sum(stats['mappings_by_type'].values()),
+        stats['num_collections'], time.time() - start_time))
+    if args.save_index:
+        query_index.dump(args.save_index)
+        print('Query index saved to: %s' % args.save_index)
+
+    server = make_server(query_index, host=args.host, port=args.port, verbose=args.verbose)
+    print('Serving on http://%s:%s/ (Ctrl-C to stop)' % server.server_address[:2])
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
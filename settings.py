@@ -19,6 +19,55 @@ VERBOSITY = 4
 # Output filename: "%s"s are replaced with MSP_ORG_ID, YYYYMMDD, and filenum
 OUTPUT_FILENAME = 'output/msp_%s_%s.json'
 OUTPUT_OCL_FORMATTED_JSON = True  # Creates the OCL import JSON
+# Compress the OCL import JSON: None, 'gzip', 'xz', 'bz2' or 'zip'. The extension is appended to
+# OUTPUT_FILENAME. Can also be set with the --compress option of build_ocl_import.py.
+# Input filenames below may also end with .gz, .xz, .bz2 or .zip (see msp_io.py).
+OUTPUT_COMPRESSION = None
+# Write a sidecar line index of the OCL import JSON ('<OUTPUT_FILENAME>.idx', see msp_index.py)
+# for random access by resource ID, URL or type. Skipped for compressed output.
+OUTPUT_INDEX = True
+# Also write the import list to an indexed SQLite database (see msp_sqlite.py). "%s" is replaced
+# with MSP_ORG_ID. Rows are upserted, so each build updates the same database. Set to '' to skip.
+# Can also be set with the --sqlite option of build_ocl_import.py.
+OUTPUT_SQLITE_FILENAME = ''
+# Also store each line of the OCL import JSON once by content hash in this directory, with a
+# manifest per build from which the import file can be reconstructed (see msp_artifacts.py and
+# manage_artifacts.py). Set to '' to skip. Can also be set with --artifact-store.
+OUTPUT_ARTIFACT_STORE = ''
+
+# Summary report of the loaded metadata and the final import list, written as JSON. "%s"s are
+# replaced with MSP_ORG_ID and YYYYMMDD. Set to '' to skip.
+MSP_SUMMARY_FILENAME = 'output/msp_summary_%s_%s.json'
+
+# REFERENTIAL INTEGRITY: Check that every owner, repository, mapping concept URL and reference
+# expression in the import list is defined earlier in the list (see msp_integrity.py). The build
+# exits with status 1 if not. URLs starting with one of the external prefixes (eg '/orgs/CIEL/')
+# are assumed to exist in OCL already.
+MSP_CHECK_INTEGRITY = True
+MSP_INTEGRITY_EXTERNAL_PREFIXES = ()
+
+# PROFILING: Record call counts and cumulative time of the hot msp.py functions and write them as
+# JSON at the end of the build. "%s"s are replaced with MSP_ORG_ID and YYYYMMDD.
+# MSP_PROFILE_MEMORY also records tracemalloc deltas, which slows down the build considerably.
+MSP_PROFILE = False
+MSP_PROFILE_MEMORY = False
+MSP_PROFILE_FILENAME = 'output/msp_profile_%s_%s.json'
+
+# Period and structured dataset slices, eg ['FY22'] and ['MER']: data elements, DATIM indicators,
+# iHUB derived data elements, codelists, references and mappings outside the slice are skipped.
+# Mappings from reference indicators of other periods are skipped too. Set to None to build
+# everything. Can also be set with the --period and --structured-dataset options of
+# build_ocl_import.py.
+MSP_BUILD_PERIODS = None
+MSP_BUILD_STRUCTURED_DATASETS = None
+
+# Build targets: write an import file for each (org, source, periods) target from one build
+# instead of a single import file for MSP_ORG_ID, eg [{'org_id': 'PEPFAR-MER-FY22'},
+# {'org_id': 'PEPFAR-Test4'}, {'org_id': 'PEPFAR-Staging', 'periods': ['FY22']}]. source_id
+# defaults to MSP_SOURCE_ID, periods to MSP_BUILD_PERIODS and canonical_url to CANONICAL_URL.
+# Targets with the same periods share one build (see msp_identity.py). Set to None to build
+# MSP_ORG_ID only. Can also be set with the --target option of build_ocl_import.py.
+MSP_BUILD_TARGETS = None
 
 # Set org/source ID, input/output periods
 MSP_ORG_ID = 'PEPFAR-MER-FY22'
@@ -0,0 +1,51 @@
+"""
+Validates an OCL-formatted JSON lines import file (eg written by build_ocl_import.py) against
+the OCL JSON schema of each resource type, streaming the file in chunks across a pool of worker
+processes (see msp_import_validator.py). Errors are printed with their line numbers as soon as
+they are found. The exit code is 1 if any resource is invalid.
+
+Example usage:
+  python validate_import_file.py output/msp_PEPFAR-MER-FY22_20220131.json
+  python msp_cli.py validate-import output/msp_PEPFAR-MER-FY22_20220131.json.gz --workers 4
+"""
+import argparse
+import json
+import sys
+import time
+import msp_import_validator
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Validate an OCL-formatted JSON lines file')
+    parser.add_argument('filename', help='OCL-formatted JSON lines file, optionally compressed')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Number of worker processes (default: number of CPUs)')
+    parser.add_argument('--chunk-size', type=int,
+                        default=msp_import_validator.DEFAULT_CHUNK_SIZE,
+                        help='Lines validated per task (default: %(default)s)')
+    parser.add_argument('--max-errors', type=int, default=0,
+                        help='Stop after this many errors (default: no limit)')
+    parser.add_argument('--json', action='store_true',
+                        help='Print each error as a JSON object')
+    args = parser.parse_args(argv[1:])
+
+    start_time = time.time()
+    counts = {}
+    num_errors = 0
+    for error in msp_import_validator.iter_validation_errors(
+            args.filename, workers=args.workers or None, chunk_size=args.chunk_size,
+            counts=counts):
+        num_errors += 1
+        print(json.dumps(error) if args.json else msp_import_validator.format_error(error))
+        sys.stdout.flush()
+        if args.max_errors and num_errors >= args.max_errors:
+            print('Stopped after %s errors' % num_errors, file=sys.stderr)
+            return 1
+    print('%s resources validated in %.2f seconds, %s invalid: %s' % (
+        sum(counts.values()), time.time() - start_time, num_errors,
+        json.dumps(counts)), file=sys.stderr)
+    return 1 if num_errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
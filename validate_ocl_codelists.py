@@ -1,43 +1,121 @@
+"""
+Validates the codelist collections in OCL against their DATIM codelists. For each codelist
+definition, the latest OCL export of the collection and the codelist from DATIM are retrieved
+concurrently, cached on disk and diffed with msp.diff_codelist in a pool of worker processes
+(see msp_codelist_validation.py). The results are written as one JSON report.
+
+A re-run within --max-age hours of the previous run uses the cache only; --offline uses the
+cache regardless of its age and never connects to OCL or DATIM.
+
+With --import-file, the codelist collections of a built import file are validated before upload
+instead: their membership is rebuilt from the references in the file and diffed against the
+DATIM codelists the build was made from (settings.FILENAME_DATIM_CODELISTS_WITH_EXPORT).
+
+Example usage:
+  python validate_ocl_codelists.py --org-id PEPFAR-Test4
+  python msp_cli.py validate --codelist MER_R_COMMUNITY_BASED
+  python msp_cli.py validate --offline --output output/codelist_validation.json
+  python msp_cli.py validate --import-file output/msp_PEPFAR-MER-FY22_20220131.json
+"""
+import argparse
+import csv
+import datetime
 import json
-import requests
+import sys
 import msp
+import msp_codelist_validation
+import msp_io
 import settings
-import pprint
-import ocldev.oclexport
 
 
 # Settings
-api_url_root = 'https://api.staging.openconceptlab.org'
-ocl_api_token = settings.OCL_API_TOKEN
-org_id = 'PEPFAR-Test4'
-source_id = 'MER-Test4'
-periods = ['FY16', 'FY17', 'FY18', 'FY19', 'FY20']
-
-# Metadata source files
-filename_datim_codelists = 'data/codelists_RT_FY16_20_20200107.csv'
-
-# Load codelists definitions from local JSON file
-codelist_defs = msp.load_codelists(filename=filename_datim_codelists, org_id=org_id)
-# codelists_dict = msp.build_codelists_dict(codelists=codelist_defs)
-
-for codelist_def in codelist_defs:
-    # Load code list from OCL and DATIM
-    url_datim = '%s&paging=false' % codelist_def['ZenDesk: HTML Link'].replace('.html+css', '.json')
-    url_ocl = '%s/orgs/%s/collections/%s/' % (api_url_root, org_id, codelist_def['id'])
-    print '\n\n******** %s (%s)' % (codelist_def['id'], codelist_def['external_id'])
-    print 'URLS:\n  ', url_ocl, '\n  ', url_datim
-    print 'Code List Definition:'
-    pprint.pprint(codelist_def)
-
-    try:
-        codelist_ocl = ocldev.oclexport.OclExportFactory.load_latest_export(url_ocl, oclapitoken=ocl_api_token)
-        codelist_datim = msp.fetch_datim_codelist(url_datim)
-        print '** OCL Code List Stats:'
-        pprint.pprint(codelist_ocl.get_stats())
-        print '** DATIM Code List Stats:'
-        pprint.pprint(msp.get_datim_codelist_stats(codelist_datim))
-        diff_result = msp.diff_codelist(codelist_ocl=codelist_ocl, codelist_datim=codelist_datim)
-        print '** DIFF:'
-        pprint.pprint(diff_result)
-    except ocldev.oclexport.OclUnknownResourceError as e:
-        print '\nCould not retrieve export for: %s' % url_ocl
+API_URL_ROOT = 'https://api.staging.openconceptlab.org'
+CACHE_DIR = 'output/validation_cache'
+REPORT_FILENAME = 'output/codelist_validation_%s_%s.json'
+
+
+def load_codelist_definitions(filename, codelist_ids=None):
+    """ Return the codelist definitions set to be imported from the codelists CSV """
+    codelist_defs = []
+    with msp_io.open_file(filename) as ifile:
+        for row in csv.DictReader(ifile):
+            if not row['resource_type']:
+                continue
+            if codelist_ids and row['id'] not in codelist_ids:
+                continue
+            codelist_defs.append(row)
+    return codelist_defs
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Validate OCL codelists against DATIM')
+    parser.add_argument('--codelists-file', default=settings.FILENAME_DATIM_CODELISTS,
+                        help='Codelist definitions CSV (default: %s)' % (
+                            settings.FILENAME_DATIM_CODELISTS))
+    parser.add_argument('--codelist', action='append', dest='codelist_ids',
+                        help='Only validate this codelist ID (repeatable)')
+    parser.add_argument('--org-id', default=settings.MSP_ORG_ID,
+                        help='OCL organization ID (default: %s)' % settings.MSP_ORG_ID)
+    parser.add_argument('--api-url-root', default=API_URL_ROOT,
+                        help='OCL API URL root (default: %s)' % API_URL_ROOT)
+    parser.add_argument('--output',
+                        help='JSON report filename (default: %s)' % (
+                            REPORT_FILENAME % ('<org-id>', 'YYYYMMDD')))
+    parser.add_argument('--cache-dir', default=CACHE_DIR,
+                        help='Cache directory for OCL and DATIM responses (default: %s)' % (
+                            CACHE_DIR))
+    parser.add_argument('--max-age', type=float,
+                        default=msp_codelist_validation.DEFAULT_MAX_AGE / 3600.0,
+                        help='Hours after which cached collection versions and DATIM codelists '
+                             'are retrieved again (default: %(default)s)')
+    parser.add_argument('--offline', action='store_true',
+                        help='Only use the cache, do not connect to OCL or DATIM')
+    parser.add_argument('--refresh', action='store_true',
+                        help='Retrieve collection versions and DATIM codelists even if cached')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of worker processes for the diffs (default: number of CPUs)')
+    parser.add_argument('--fetch-workers', type=int,
+                        default=msp_codelist_validation.DEFAULT_FETCH_WORKERS,
+                        help='Number of concurrent requests to OCL and DATIM '
+                             '(default: %(default)s)')
+    parser.add_argument('--import-file',
+                        help='Validate the codelist collections of this import file instead of '
+                             'the collections in OCL')
+    parser.add_argument('--codelists-with-exports-file',
+                        default=settings.FILENAME_DATIM_CODELISTS_WITH_EXPORT,
+                        help='DATIM codelists for --import-file (default: %s)' % (
+                            settings.FILENAME_DATIM_CODELISTS_WITH_EXPORT))
+    parser.add_argument('--verbose', action='store_true',
+                        help='Also list the codelists without differences')
+    args = parser.parse_args(argv[1:])
+    if args.offline and args.refresh:
+        parser.error('--offline and --refresh cannot be combined')
+
+    if args.import_file:
+        codelist_collections = msp.load_codelist_collections_with_exports_from_file(
+            filename=args.codelists_with_exports_file, org_id=args.org_id)
+        report = msp_codelist_validation.validate_import_file_codelists(
+            args.import_file, codelist_collections, collection_ids=args.codelist_ids)
+    else:
+        codelist_defs = load_codelist_definitions(args.codelists_file, args.codelist_ids)
+        cache = msp_codelist_validation.CodelistCache(
+            args.cache_dir, max_age=args.max_age * 3600, offline=args.offline,
+            refresh=args.refresh)
+        report = msp_codelist_validation.validate_codelists(
+            codelist_defs, args.org_id, cache, args.api_url_root,
+            api_token=settings.OCL_API_TOKEN, workers=args.workers,
+            fetch_workers=args.fetch_workers)
+    msp_codelist_validation.display_report(report, verbosity=2 if args.verbose else 1)
+
+    output_filename = args.output or REPORT_FILENAME % (
+        args.org_id, datetime.datetime.today().strftime('%Y%m%d'))
+    with msp_io.open_file(output_filename, 'w', encoding='utf-8') as output_file:
+        json.dump(report, output_file, indent=2)
+    print('Report written to: %s' % output_filename)
+    if report['counts'][msp_codelist_validation.STATUS_VALID] != report['num_codelists']:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))